@@ -20,11 +20,14 @@
   This module contains the authentication functions for the bid2x application.
 """
 
-from googleapiclient import discovery
-from oauth2client.service_account import ServiceAccountCredentials
-
+from typing import Sequence
 
-build = discovery.build
+from auth import bid2x_credentials
+from auth import bid2x_discovery
+import bid2x_var
+from google.oauth2 import service_account
+from googleapiclient import discovery
+import gspread
 
 
 class Bid2xAuth:
@@ -35,11 +38,19 @@ class Bid2xAuth:
       _service (Resource):
       _api_name (str): The breed of the dog.
       _api_version (str): The age of the dog in years.
+      discovery_cache_dir (str): Optional directory discovery documents
+          not bundled with bid2x are cached in once fetched.
 
   Methods:
       auth_service_creds(self,
                           path_to_service_account_json_file):
           Authenticates the service account.
+      auth_service_http(self,
+                        path_to_service_account_json_file,
+                        impersonation_email):
+          Returns the shared authorized transport for API clients.
+      gspread_client(self, path_to_service_account_json_file):
+          Returns a gspread client sharing the same token and connections.
       auth_gtm_service(self,
                         path_to_service_account_json_file,
                         impersonation_email):
@@ -65,19 +76,24 @@ class Bid2xAuth:
   _service = None
   _api_name: str
   _api_version: str
+  discovery_cache_dir: str | None
 
   def __init__(self, scopes: str, api_name: str, api_version: str):
     self._scopes = scopes
     self._api_name = api_name
     self._api_version = api_version
     self._service = None
+    self.discovery_cache_dir = bid2x_var.DISCOVERY_CACHE_DIR
 
   def auth_service_creds(
       self,
       path_to_service_account_json_file: str,
       impersonation_email: str = None,
-  ) -> ServiceAccountCredentials:
-    """Authorizes an httplib2.Http instance using service account credentials.
+  ) -> service_account.Credentials:
+    """Returns the shared service account credentials for this object's scopes.
+
+    The key file is only read once per process and credentials are shared
+    by every client using the same scopes and impersonation email.
 
     Args:
       path_to_service_account_json_file: file downloaded from GCP
@@ -86,16 +102,55 @@ class Bid2xAuth:
     Returns:
       Returns service account credentials.
     """
+    manager = bid2x_credentials.get_credential_manager(
+        path_to_service_account_json_file
+    )
+
+    return manager.credentials(self._scopes, impersonation_email)
+
+  def auth_service_http(
+      self,
+      path_to_service_account_json_file: str,
+      impersonation_email: str = None,
+  ) -> bid2x_credentials.SharedAuthorizedHttp:
+    """Returns the shared keep-alive transport for API clients.
+
+    Args:
+      path_to_service_account_json_file: file downloaded from GCP
+      impersonation_email: service account email address.
 
-    # Load the service account credentials from the specified JSON keyfile.
-    credentials = ServiceAccountCredentials.from_json_keyfile_name(
-        path_to_service_account_json_file, scopes=self._scopes
+    Returns:
+      An authorized transport to build discovery services on.
+    """
+    manager = bid2x_credentials.get_credential_manager(
+        path_to_service_account_json_file
     )
-    # Configure impersonation (if applicable).
-    if impersonation_email:
-      credentials = credentials.create_delegated(impersonation_email)
 
-    return credentials
+    return manager.http(self._scopes, impersonation_email)
+
+  def gspread_client(
+      self,
+      path_to_service_account_json_file: str,
+      scopes: Sequence[str] | None = None,
+  ) -> gspread.Client:
+    """Returns a gspread client sharing credentials and pooled connections.
+
+    Like gspread.service_account() the client uses the service account
+    itself, without impersonation.
+
+    Args:
+      path_to_service_account_json_file: file downloaded from GCP
+      scopes: OAuth scopes including the Sheets scope, this object's
+          scopes by default.
+
+    Returns:
+      A gspread Client.
+    """
+    manager = bid2x_credentials.get_credential_manager(
+        path_to_service_account_json_file
+    )
+
+    return manager.gspread_client(scopes or self._scopes)
 
   def auth_gtm_service(
       self,
@@ -114,15 +169,18 @@ class Bid2xAuth:
       within this class, otherwise it returns False.
     """
 
-    # Load the service account credentials from the specified JSON keyfile.
-    service_credentials = self.auth_service_creds(
+    # Get the shared transport authorized with the service account.
+    service_http = self.auth_service_http(
         path_to_service_account_json_file, impersonation_email
     )
 
     # Build the GTM service object.
-    if service_credentials:
-      self._service = discovery.build(
-          self._api_name, self._api_version, credentials=service_credentials
+    if service_http:
+      self._service = bid2x_discovery.build_service(
+          self._api_name,
+          self._api_version,
+          cache_dir=self.discovery_cache_dir,
+          http=service_http,
       )
 
       return self._service
@@ -147,8 +205,11 @@ class Bid2xAuth:
 
     # Build a service object for interacting with the API.
     if dv_http_service:
-      self._service = discovery.build(
-          self._api_name, self._api_version, http=dv_http_service
+      self._service = bid2x_discovery.build_service(
+          self._api_name,
+          self._api_version,
+          cache_dir=self.discovery_cache_dir,
+          http=dv_http_service,
       )
     else:
       raise ValueError('Error authenticating using provided JSON information')
@@ -170,22 +231,19 @@ class Bid2xAuth:
       Returns http object.
     """
 
-    # Load the service account credentials from the specified JSON keyfile.
-    service_credentials = self.auth_service_creds(
+    # Get the shared transport authorized with the service account.
+    service_http = self.auth_service_http(
         path_to_service_account_json_file, impersonation_email
     )
 
-    discovery_url = (
-        'https://displayvideo.googleapis.com/$discovery'
-        f'/rest?version={self._api_version}'
-    )
-
-    if service_credentials:
-      self._service = discovery.build(
+    # The discovery document is read from bid2x's cache and only fetched
+    # from displayvideo.googleapis.com when no usable copy is held.
+    if service_http:
+      self._service = bid2x_discovery.build_service(
           self._api_name,
           self._api_version,
-          credentials=service_credentials,
-          discoveryServiceUrl=discovery_url,
+          cache_dir=self.discovery_cache_dir,
+          http=service_http,
       )
 
     return self._service
@@ -232,9 +290,12 @@ class Bid2xAuth:
       Returns http object.
     """
 
-    # Authorizes an httplib2.Http instance using service account credentials.
-    creds = self.auth_service_creds(path_to_service_account_json_file,
-                                    impersonation_email)
-    service = build('sheets', 'v4', credentials=creds)
+    # Share the transport, and so the token, of the other API clients.
+    service_http = self.auth_service_http(
+        path_to_service_account_json_file, impersonation_email
+    )
+    service = bid2x_discovery.build_service(
+        'sheets', 'v4', cache_dir=self.discovery_cache_dir, http=service_http
+    )
 
     return service
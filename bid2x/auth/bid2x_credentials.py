@@ -0,0 +1,403 @@
+"""BidToX - Shared service account credentials and HTTP transports.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  One CredentialManager is kept per service account key file.  It reads
+  the key once and hands out credentials cached per (scopes, subject), so
+  the DV360 or GTM client, the Sheets client and gspread all share a single
+  access token.  Tokens are refreshed ahead of expiry rather than on the
+  request that finds them expired.
+
+  All clients built from a manager share its keep-alive HTTP connections:
+  googleapiclient services through SharedAuthorizedHttp, which keeps one
+  httplib2 connection cache per thread as httplib2 is not thread safe, and
+  gspread through a pooled requests session.
+
+  With an API endpoint override set (see bid2x_discovery.api_endpoint)
+  tokens are requested from '<endpoint>/token' and gspread's calls are
+  redirected to the endpoint along with the googleapiclient services'.
+
+  Every HTTP request made through either transport is counted and timed
+  in bid2x_metrics, and recorded to or replayed from a cassette if one is
+  set (see bid2x_cassette).  With tracing on (see bid2x_trace) it, and
+  every token refresh, is also timed as a span.
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Any, Sequence
+
+from auth import bid2x_discovery
+import bid2x_cassette
+import bid2x_metrics
+import bid2x_trace
+import bid2x_var
+from google.auth.transport import requests as google_auth_requests
+from google.oauth2 import service_account
+import google_auth_httplib2
+import gspread
+import httplib2
+import requests
+
+AuthorizedSession = google_auth_requests.AuthorizedSession
+
+# Credential managers keyed by the real path of their key file.
+_managers: dict[str, 'CredentialManager'] = {}
+_managers_lock = threading.Lock()
+
+
+def http_span(
+    method: str, url: str, body: Any
+) -> bid2x_trace.Span | bid2x_trace.NoopSpan:
+  """Returns a span timing an HTTP request to a Google API."""
+  return bid2x_trace.span(
+      f'http.{bid2x_discovery.url_api_name(url)}',
+      method=method,
+      path=url.split('?', 1)[0],
+      bytes_sent=len(body) if isinstance(body, (bytes, str)) else 0,
+  )
+
+
+def get_credential_manager(key_file: str) -> 'CredentialManager':
+  """Returns the process wide credential manager for a key file.
+
+  Args:
+    key_file: path to a service account JSON key file.
+
+  Returns:
+    The CredentialManager for the key file, created on first use.
+  """
+  key = os.path.realpath(key_file)
+  with _managers_lock:
+    manager = _managers.get(key)
+    if manager is None:
+      manager = CredentialManager(key_file)
+      _managers[key] = manager
+
+  return manager
+
+
+class SharedAuthorizedHttp:
+  """An authorized httplib2 style transport usable from several threads.
+
+  googleapiclient only needs request() and the credentials attribute.  Each
+  thread gets its own keep-alive httplib2.Http, reused by every service
+  built on this transport.
+
+  Attributes:
+    credentials: the credentials requests are authorized with.
+    timeout: socket timeout in seconds of the underlying connections.
+  """
+
+  credentials: service_account.Credentials
+  timeout: float
+
+  def __init__(
+      self,
+      manager: 'CredentialManager',
+      credentials: service_account.Credentials,
+      timeout: float,
+  ):
+    self.credentials = credentials
+    self.timeout = timeout
+    self._manager = manager
+    self._local = threading.local()
+
+  def thread_http(self) -> google_auth_httplib2.AuthorizedHttp:
+    """Returns this thread's authorized connection cache."""
+    http = getattr(self._local, 'http', None)
+    if http is None:
+      http = google_auth_httplib2.AuthorizedHttp(
+          self.credentials, http=httplib2.Http(timeout=self.timeout)
+      )
+      self._local.http = http
+
+    return http
+
+  def request(self, uri: str, method: str = 'GET', **kwargs: Any) -> Any:
+    """Makes an authorized request, see httplib2.Http.request."""
+    player = bid2x_cassette.player()
+    if player is None:
+      self._manager.ensure_fresh(self.credentials)
+    span = bid2x_trace.NOOP_SPAN
+    if bid2x_trace.enabled():
+      span = http_span(method, uri, kwargs.get('body'))
+
+    status = 'error'
+    start = time.perf_counter()
+    try:
+      with span:
+        if player is not None:
+          response, content = player.play(method, uri).httplib2_response()
+        else:
+          response, content = self.thread_http().request(
+              uri, method, **kwargs
+          )
+        status = response.status
+        span.set(status=status)
+        span.add('bytes_received', len(content or b''))
+    finally:
+      seconds = time.perf_counter() - start
+      bid2x_metrics.record_http(
+          bid2x_discovery.url_api_name(uri), status, seconds
+      )
+
+    recorder = bid2x_cassette.recorder()
+    if recorder is not None:
+      recorder.record(
+          bid2x_cassette.Interaction.from_response(
+              method, uri, response.status, response, content, seconds
+          )
+      )
+
+    return response, content
+
+  def close(self) -> None:
+    """Closes this thread's connections."""
+    http = getattr(self._local, 'http', None)
+    if http is not None:
+      http.close()
+
+
+class SharedAuthorizedSession(AuthorizedSession):
+  """A pooled requests session refreshing its token ahead of expiry."""
+
+  def __init__(
+      self,
+      manager: 'CredentialManager',
+      credentials: service_account.Credentials,
+  ):
+    super().__init__(credentials)
+    self._manager = manager
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=bid2x_var.HTTP_POOL_SIZE,
+        pool_maxsize=bid2x_var.HTTP_POOL_SIZE,
+    )
+    self.mount('https://', adapter)
+
+  def request(self, method: str, url: str, *args: Any, **kwargs: Any) -> Any:
+    player = bid2x_cassette.player()
+    if player is None:
+      self._manager.ensure_fresh(self.credentials)
+    # gspread's URLs are fixed, redirect them here.
+    url = bid2x_discovery.redirect_url(url)
+    span = bid2x_trace.NOOP_SPAN
+    if bid2x_trace.enabled():
+      body = kwargs.get('data')
+      if body is None and kwargs.get('json') is not None:
+        body = json.dumps(kwargs['json'])
+      span = http_span(method, url, body)
+
+    status = 'error'
+    start = time.perf_counter()
+    try:
+      with span:
+        if player is not None:
+          response = player.play(method, url).requests_response(url)
+        else:
+          response = super().request(method, url, *args, **kwargs)
+        status = response.status_code
+        span.set(status=status)
+        if not kwargs.get('stream'):
+          span.add('bytes_received', len(response.content))
+    finally:
+      seconds = time.perf_counter() - start
+      bid2x_metrics.record_http(
+          bid2x_discovery.url_api_name(url), status, seconds
+      )
+
+    recorder = bid2x_cassette.recorder()
+    if recorder is not None:
+      recorder.record(
+          bid2x_cassette.Interaction.from_response(
+              method, url, response.status_code, response.headers,
+              response.content, seconds,
+          )
+      )
+
+    return response
+
+
+class CredentialManager:
+  """Loads a service account key once and shares credentials built from it.
+
+  Attributes:
+    key_file: path to the service account JSON key file.
+    client_email: the service account's own email address.
+    refresh_margin: tokens expiring within this many seconds are refreshed
+        before the next request is made.
+  """
+
+  key_file: str
+  client_email: str
+  refresh_margin: float
+
+  def __init__(self, key_file: str):
+    self.key_file = key_file
+    self.refresh_margin = bid2x_var.TOKEN_REFRESH_MARGIN
+    with open(key_file, 'r') as f:
+      key_info = json.load(f)
+    endpoint = bid2x_discovery.api_endpoint()
+    if endpoint:
+      key_info['token_uri'] = f'{endpoint}/token'
+    self._base_credentials = (
+        service_account.Credentials.from_service_account_info(key_info)
+    )
+    self.client_email = self._base_credentials.service_account_email
+    self._lock = threading.Lock()
+    self._refresh_lock = threading.Lock()
+    self._credentials = {}
+    self._https = {}
+    self._sessions = {}
+    # Plain session used for token refreshes, keeping the token endpoint
+    # connection alive between refreshes.
+    self._token_request = google_auth_requests.Request(requests.Session())
+
+  def __str__(self) -> str:
+    return (
+        f'key_file: {self.key_file}\n'
+        f'client_email: {self.client_email}\n'
+        f'cached credentials: {len(self._credentials)}\n'
+    )
+
+  def credentials_key(
+      self, scopes: Sequence[str], subject: str | None
+  ) -> tuple[tuple[str, ...], str | None]:
+    """Returns the cache key of credentials for some scopes and subject.
+
+    A subject equal to the service account's own email needs no
+    delegation, so it shares the credentials of no subject.
+    """
+    if subject == self.client_email:
+      subject = None
+
+    return (tuple(sorted(set(scopes))), subject)
+
+  def credentials(
+      self, scopes: Sequence[str], subject: str | None = None
+  ) -> service_account.Credentials:
+    """Returns shared credentials for some scopes and delegated subject.
+
+    Args:
+      scopes: the OAuth scopes the credentials are for.
+      subject: optional email address to impersonate.
+
+    Returns:
+      google-auth service account credentials.  No token is fetched until
+      the credentials are first used.
+    """
+    key = self.credentials_key(scopes, subject)
+    with self._lock:
+      credentials = self._credentials.get(key)
+      if credentials is None:
+        credentials = self._base_credentials.with_scopes(list(key[0]))
+        if key[1]:
+          credentials = credentials.with_subject(key[1])
+        self._credentials[key] = credentials
+
+    return credentials
+
+  def ensure_fresh(self, credentials: service_account.Credentials) -> None:
+    """Refreshes credentials that are invalid or about to expire.
+
+    Args:
+      credentials: credentials previously returned by this manager.
+    """
+    if self.is_fresh(credentials):
+      return
+
+    with self._refresh_lock:
+      # Another thread may have refreshed while this one waited.
+      if not self.is_fresh(credentials):
+        with bid2x_trace.span('auth.refresh_token'):
+          credentials.refresh(self._token_request)
+
+  def is_fresh(self, credentials: service_account.Credentials) -> bool:
+    """Returns True if the token stays valid for at least refresh_margin."""
+    if not credentials.valid or credentials.expiry is None:
+      return credentials.valid
+
+    # google-auth expiries are naive UTC datetimes.
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return (credentials.expiry - now).total_seconds() > self.refresh_margin
+
+  def http(
+      self, scopes: Sequence[str], subject: str | None = None
+  ) -> SharedAuthorizedHttp:
+    """Returns the shared transport for googleapiclient services.
+
+    Args:
+      scopes: the OAuth scopes the services need.
+      subject: optional email address to impersonate.
+
+    Returns:
+      A SharedAuthorizedHttp to pass to discovery builds as 'http'.
+    """
+    key = self.credentials_key(scopes, subject)
+    credentials = self.credentials(scopes, subject)
+    with self._lock:
+      http = self._https.get(key)
+      if http is None:
+        http = SharedAuthorizedHttp(
+            self, credentials, bid2x_var.HTTP_TIMEOUT
+        )
+        self._https[key] = http
+
+    return http
+
+  def session(
+      self, scopes: Sequence[str], subject: str | None = None
+  ) -> SharedAuthorizedSession:
+    """Returns the shared pooled requests session.
+
+    Args:
+      scopes: the OAuth scopes the session needs.
+      subject: optional email address to impersonate.
+
+    Returns:
+      A SharedAuthorizedSession.
+    """
+    key = self.credentials_key(scopes, subject)
+    credentials = self.credentials(scopes, subject)
+    with self._lock:
+      session = self._sessions.get(key)
+      if session is None:
+        session = SharedAuthorizedSession(self, credentials)
+        self._sessions[key] = session
+
+    return session
+
+  def gspread_client(
+      self, scopes: Sequence[str], subject: str | None = None
+  ) -> gspread.Client:
+    """Returns a gspread client on the shared credentials and session.
+
+    Args:
+      scopes: the OAuth scopes, which must include the Sheets scope.
+      subject: optional email address to impersonate.
+
+    Returns:
+      A gspread Client.
+    """
+    return gspread.Client(
+        auth=self.credentials(scopes, subject),
+        session=self.session(scopes, subject),
+    )
@@ -0,0 +1,379 @@
+"""BidToX - Discovery document cache for Google API clients.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  Building an API client needs the API's discovery document, a large JSON
+  file that discovery.build() would otherwise parse on every call and, for
+  APIs not shipped with google-api-python-client (e.g. displayvideo v3),
+  download on every call.
+
+  This module looks discovery documents up, in order, in:
+    1. an in-process cache of parsed documents,
+    2. the 'discovery' directory shipped with bid2x,
+    3. the static documents shipped with google-api-python-client,
+    4. an optional on-disk cache directory,
+  and only then fetches them from the discovery endpoint, saving the result
+  in the on-disk cache.  An expired on-disk copy is still used if the fetch
+  fails.
+
+  With an API endpoint override set (API_ENDPOINT or the BID2X_API_ENDPOINT
+  environment variable, e.g. the local fake APIs of bid2x_fake_api) services
+  are built to call '<endpoint>/<api>/' and documents found nowhere else
+  are fetched from the endpoint, bypassing the on-disk cache.  Fetches are
+  recorded to or replayed from a cassette like API calls (see
+  bid2x_cassette).
+
+  To bundle a document with bid2x run (from the bid2x directory):
+      python -m auth.bid2x_discovery displayvideo v3
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any
+
+import bid2x_var
+from googleapiclient import discovery
+from googleapiclient import discovery_cache
+import httplib2
+
+# Discovery documents shipped with bid2x, named '<api>.<version>.json'.
+BUNDLED_DOC_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'discovery'
+)
+
+# Parsed discovery documents keyed by (api_name, api_version, endpoint), the
+# endpoint being api_endpoint() (None when API calls aren't redirected).
+_documents: dict[tuple[str, str, str | None], dict[str, Any]] = {}
+# One lock per key, held while its document is loaded, so that fetching one
+# document doesn't hold up threads that want another.  _documents_lock only
+# guards the two dicts.
+_document_locks: dict[tuple[str, str, str | None], threading.Lock] = {}
+_documents_lock = threading.Lock()
+
+# Matches the root URL of a Google API, capturing the API name.
+GOOGLE_API_ROOT_PATTERN = re.compile(r'^https://([a-z0-9-]+)\.googleapis\.com/')
+
+
+def api_endpoint() -> str | None:
+  """Returns the endpoint API calls are redirected to, None if not set."""
+  endpoint = bid2x_var.API_ENDPOINT or os.getenv(bid2x_var.API_ENDPOINT_ENV_VAR)
+  return endpoint.rstrip('/') if endpoint else None
+
+
+def api_root_url(api_name: str) -> str:
+  """Returns the root URL an API is called at, ending with '/'.
+
+  Args:
+    api_name: the name of the API, e.g. 'displayvideo'.
+
+  Returns:
+    https://<api_name>.googleapis.com/ or, with an endpoint override set,
+    <endpoint>/<api_name>/.
+  """
+  endpoint = api_endpoint()
+  if endpoint:
+    return f'{endpoint}/{api_name}/'
+
+  return f'https://{api_name}.googleapis.com/'
+
+
+def redirect_url(url: str) -> str:
+  """Returns a Google API URL rewritten to the endpoint override, if set."""
+  if not api_endpoint():
+    return url
+
+  return GOOGLE_API_ROOT_PATTERN.sub(
+      lambda match: api_root_url(match.group(1)), url, count=1
+  )
+
+
+def url_api_name(url: str) -> str:
+  """Returns the name of the API a URL calls, e.g. 'sheets', else its host.
+
+  Args:
+    url: a Google API URL, or one rewritten to the endpoint override.
+
+  Returns:
+    The API name, taken from the googleapis.com host or, for the endpoint
+    override, the first part of the path.
+  """
+  match = GOOGLE_API_ROOT_PATTERN.match(url)
+  if match:
+    return match.group(1)
+
+  endpoint = api_endpoint()
+  if endpoint and url.startswith(endpoint + '/'):
+    return url[len(endpoint) + 1:].split('/', 1)[0]
+
+  return url.split('://', 1)[-1].split('/', 1)[0]
+
+
+def url_api_path(url: str) -> str:
+  """Returns the part of a URL after its API's root URL.
+
+  Args:
+    url: a Google API URL, or one rewritten to the endpoint override.
+
+  Returns:
+    The path and query after https://<api>.googleapis.com/ or
+    <endpoint>/<api>/, e.g. 'v4/spreadsheets/1?alt=json', else after the
+    host.
+  """
+  match = GOOGLE_API_ROOT_PATTERN.match(url)
+  if match:
+    return url[match.end():]
+
+  endpoint = api_endpoint()
+  if endpoint and url.startswith(endpoint + '/'):
+    return url[len(endpoint) + 1:].partition('/')[2]
+
+  return url.split('://', 1)[-1].partition('/')[2]
+
+
+def discovery_doc_name(api_name: str, api_version: str) -> str:
+  """Returns the file name a discovery document is stored under."""
+  return f'{api_name}.{api_version}.json'
+
+
+def discovery_url(api_name: str, api_version: str) -> str:
+  """Returns the URL of an API's discovery document.
+
+  Args:
+    api_name: the name of the API, e.g. 'displayvideo'.
+    api_version: the version of the API, e.g. 'v3'.
+
+  Returns:
+    The discovery URL served by the API itself.
+  """
+  return f'{api_root_url(api_name)}$discovery/rest?version={api_version}'
+
+
+def read_doc_file(path: str) -> str | None:
+  """Returns the content of a discovery document file or None if missing."""
+  try:
+    with open(path, 'r') as f:
+      return f.read()
+  except FileNotFoundError:
+    return None
+
+
+def fetch_discovery_document(api_name: str, api_version: str) -> str:
+  """Downloads a discovery document from the API's discovery endpoint.
+
+  Args:
+    api_name: the name of the API.
+    api_version: the version of the API.
+
+  Returns:
+    The discovery document as a JSON string.
+
+  Raises:
+    discovery.HttpError: If the endpoint returns an error.
+  """
+  # bid2x_cassette imports this module.
+  # pylint: disable-next=g-import-not-at-top
+  import bid2x_cassette
+
+  url = discovery_url(api_name, api_version)
+  player = bid2x_cassette.player()
+  if player is not None:
+    resp, content = player.play('GET', url).httplib2_response()
+  else:
+    http = httplib2.Http(timeout=bid2x_var.DISCOVERY_FETCH_TIMEOUT)
+    start = time.perf_counter()
+    resp, content = http.request(url)
+    recorder = bid2x_cassette.recorder()
+    if recorder is not None:
+      recorder.record(
+          bid2x_cassette.Interaction.from_response(
+              'GET', url, resp.status, resp, content,
+              time.perf_counter() - start,
+          )
+      )
+  if resp.status >= 400:
+    raise discovery.HttpError(resp, content, uri=url)
+
+  return content.decode('utf-8')
+
+
+def write_doc_file(path: str, content: str) -> None:
+  """Writes a discovery document, atomically replacing any earlier copy."""
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+  with open(tmp_path, 'w') as f:
+    f.write(content)
+  os.replace(tmp_path, path)
+
+
+def load_discovery_document(
+    api_name: str, api_version: str, cache_dir: str | None = None
+) -> str:
+  """Finds a discovery document without using the in-process cache.
+
+  Args:
+    api_name: the name of the API.
+    api_version: the version of the API.
+    cache_dir: optional directory documents are cached in once fetched.
+
+  Returns:
+    The discovery document as a JSON string.
+
+  Raises:
+    discovery.HttpError, httplib2.HttpLib2Error, OSError: If the document
+        has to be fetched and the fetch fails with no cached copy to fall
+        back on.
+  """
+  doc_name = discovery_doc_name(api_name, api_version)
+
+  content = read_doc_file(os.path.join(BUNDLED_DOC_DIR, doc_name))
+  if content:
+    return content
+
+  content = discovery_cache.get_static_doc(api_name, api_version)
+  if content:
+    return content
+
+  cached_content = None
+  if api_endpoint():
+    # Documents served by an endpoint override aren't the real ones.
+    cache_dir = None
+  if cache_dir:
+    cache_path = os.path.join(cache_dir, doc_name)
+    cached_content = read_doc_file(cache_path)
+    if cached_content:
+      age = time.time() - os.path.getmtime(cache_path)
+      if age < bid2x_var.DISCOVERY_CACHE_MAX_AGE:
+        return cached_content
+
+  print(f'Fetching discovery document for {api_name} {api_version}')
+  try:
+    content = fetch_discovery_document(api_name, api_version)
+  except (discovery.HttpError, httplib2.HttpLib2Error, OSError) as e:
+    if cached_content:
+      print(
+          f'Unable to refresh discovery document for {api_name} '
+          f'{api_version}, using the cached copy: {e}'
+      )
+      return cached_content
+    raise
+
+  if cache_dir:
+    try:
+      write_doc_file(os.path.join(cache_dir, doc_name), content)
+    except OSError as e:
+      print(f'Unable to cache discovery document in {cache_dir}: {e}')
+
+  return content
+
+
+def get_discovery_document(
+    api_name: str, api_version: str, cache_dir: str | None = None
+) -> dict[str, Any]:
+  """Returns the parsed discovery document of an API, parsing it only once.
+
+  Args:
+    api_name: the name of the API.
+    api_version: the version of the API.
+    cache_dir: optional directory documents are cached in once fetched.
+
+  Returns:
+    The discovery document as a dict.  It is shared, do not modify it.
+  """
+  key = (api_name, api_version, api_endpoint())
+  with _documents_lock:
+    document = _documents.get(key)
+    if document is not None:
+      return document
+    key_lock = _document_locks.setdefault(key, threading.Lock())
+
+  # The document may be fetched over the network, so it is loaded holding
+  # only this key's lock and checked again once that is held.
+  with key_lock:
+    with _documents_lock:
+      document = _documents.get(key)
+    if document is None:
+      document = json.loads(
+          load_discovery_document(api_name, api_version, cache_dir)
+      )
+      with _documents_lock:
+        _documents[key] = document
+
+  return document
+
+
+def build_service(
+    api_name: str,
+    api_version: str,
+    cache_dir: str | None = None,
+    **kwargs: Any,
+) -> discovery.Resource:
+  """Builds an API client from a cached discovery document.
+
+  Args:
+    api_name: the name of the API.
+    api_version: the version of the API.
+    cache_dir: optional directory documents are cached in once fetched.
+    **kwargs: passed to discovery.build_from_document(), e.g. credentials.
+
+  Returns:
+    A Resource object for the API.
+  """
+  document = get_discovery_document(api_name, api_version, cache_dir)
+  if api_endpoint():
+    root_url = api_root_url(api_name)
+    document = dict(
+        document,
+        rootUrl=root_url,
+        mtlsRootUrl=root_url,
+        baseUrl=root_url + document.get('servicePath', ''),
+    )
+
+  return discovery.build_from_document(document, **kwargs)
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(
+      description='Download a discovery document to bundle with bid2x.'
+  )
+  parser.add_argument('api_name', help='API name, e.g. displayvideo.')
+  parser.add_argument('api_version', help='API version, e.g. v3.')
+  parser.add_argument(
+      '-o', '--output_dir', default=BUNDLED_DOC_DIR,
+      help='Directory to write to (default: %(default)s).'
+  )
+  args = parser.parse_args()
+
+  content = fetch_discovery_document(args.api_name, args.api_version)
+  json.loads(content)  # Refuse to save anything that isn't JSON.
+
+  path = os.path.join(
+      args.output_dir, discovery_doc_name(args.api_name, args.api_version)
+  )
+  write_doc_file(path, content)
+  print(f'Wrote {path}')
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,550 @@
+"""BidToX - end to end benchmark.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  Times bid2x's hot paths on synthetic workloads, against the local fake
+  APIs (see bid2x_fake_api) so that no real account is touched and the
+  numbers don't depend on Google's latency.
+
+  A DV360 config of N zones, each with M line items and scripts counting
+  F floodlights, and a GTM config of N zones, each with an index table
+  keyed on D dimensions and F floodlights, are generated and seeded into
+  an in-process fake.  The cases timed are:
+
+    dv.generate_cb_script  generate_cb_script_max_of_conversion_counts()
+                           for every zone, reading the zones' tabs.
+    dv.read_dv_line_items  read_dv_line_items() for all zones.
+    dv.main                main.main() updating every zone's script.
+    gtm.write_javascript   write_javascript_function() for every zone, on
+                           index tables already read.
+    gtm.main               main.main() updating every zone's variable.
+
+  Each case runs once to warm up (authentication, discovery documents,
+  spreadsheet metadata) and then a number of times.  The median and
+  minimum seconds are reported, along with the API calls made per run.
+
+  Results can be saved as a baseline and later runs compared to it: a case
+  whose median is more than the tolerance slower than the baseline's, or
+  that makes more API calls, is a regression and the benchmark exits with
+  status 1.  Baselines are only comparable on the same machine and with
+  the same workload options.
+
+  Example usage (from the bid2x directory):
+      python benchmarks/end_to_end.py --save_baseline baseline.json
+      python benchmarks/end_to_end.py --baseline baseline.json
+      python benchmarks/end_to_end.py -z 20 -l 1000 -f 4 -d 3 -c dv.main
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable
+
+# The bid2x directory; modules are imported from here as main.py does.
+BID2X_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BID2X_DIR)
+
+# pylint: disable=g-import-not-at-top,g-bad-import-order
+import bid2x_fake_api
+import bid2x_var
+import main as bid2x_main
+# pylint: enable=g-import-not-at-top,g-bad-import-order
+
+CASES = [
+    'dv.generate_cb_script',
+    'dv.read_dv_line_items',
+    'dv.main',
+    'gtm.write_javascript',
+    'gtm.main',
+]
+
+# Medians faster than this many seconds are too noisy to flag as
+# regressions, whatever their relative change.
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def dv_config(
+    zones: int, floodlights: int, key_file: str, directory: str
+) -> dict[str, Any]:
+  """Returns a synthetic DV360 config.
+
+  Args:
+    zones: the number of zones.
+    floodlights: the number of floodlights counted by the zones' scripts.
+    key_file: the service account key file to authenticate with.
+    directory: where the scripts uploaded are written.
+
+  Returns:
+    A config as loaded from a JSON file.
+  """
+  zone_array = [
+      {
+          'name': f'Z{index}',
+          'campaign_id': 10000000 + index,
+          'advertiser_id': 2000000 + index,
+          'algorithm_id': 3000000 + index,
+          'cb_algorithm': '',
+          'debug': False,
+          'update_row': 3 + index,
+          'update_col': bid2x_var.DEFAULT_CB_SCRIPT_COL_UPDATE,
+          'test_row': 3 + index,
+          'test_col': bid2x_var.DEFAULT_CB_SCRIPT_COL_TEST,
+      }
+      for index in range(zones)
+  ]
+  return {
+      'scopes': bid2x_var.API_SCOPES,
+      'api_name': bid2x_var.API_NAME,
+      'api_version': bid2x_var.API_VERSION,
+      'platform_type': bid2x_var.PlatformType.DV.value,
+      'sheet': {
+          'sheet_id': 'benchmark-dv',
+          'sheet_url': (
+              'https://docs.google.com/spreadsheets/d/benchmark-dv/edit'
+          ),
+          'json_auth_file': key_file,
+          'column_status': bid2x_var.COLUMN_STATUS,
+          'column_lineitem_id': bid2x_var.COLUMN_LINEITEMID,
+          'column_lineitem_name': bid2x_var.COLUMN_LINEITEMNAME,
+          'column_lineitem_type': bid2x_var.COLUMN_LINEITEMTYPE,
+          'column_campaign_id': bid2x_var.COLUMN_CAMPAIGNID,
+          'column_advertiser_id': bid2x_var.COLUMN_ADVERTISERID,
+          'column_custom_bidding': bid2x_var.COLUMN_CUSTOMBIDDING,
+          'debug': False,
+          'clear_onoff': False,
+      },
+      'zone_array': zone_array,
+      'action_list_algos': False,
+      'action_list_scripts': False,
+      'action_create_algorithm': False,
+      'action_update_spreadsheet': False,
+      'action_remove_algorithm': False,
+      'action_update_scripts': True,
+      'action_test': False,
+      'debug': False,
+      'trace': False,
+      'clear_onoff': False,
+      'defer_pattern': False,
+      'alternate_algorithm': False,
+      'new_algo_name': bid2x_var.NEW_ALGO_NAME,
+      'new_algo_display_name': bid2x_var.NEW_ALGO_DISPLAY_NAME,
+      'line_item_name_pattern': bid2x_var.LINE_ITEM_NAME_PATTERN,
+      'json_auth_file': key_file,
+      'cb_tmp_file_prefix': os.path.join(directory, 'cb_script'),
+      'cb_last_update_file_prefix': bid2x_var.CB_LAST_UPDATE_FILE_PREFIX,
+      'partner_id': bid2x_var.PARTNER_ID,
+      'advertiser_id': bid2x_var.ADVERTISER_ID,
+      'cb_algo_id': bid2x_var.CB_ALGO_ID,
+      'service_account_email': bid2x_var.SERVICE_ACCOUNT_EMAIL,
+      'zones_to_process': ','.join(zone['name'] for zone in zone_array),
+      'floodlight_id_list': [
+          1000000 + index for index in range(floodlights)
+      ],
+      'attr_model_id': 0,
+      'bidding_factor_high': bid2x_var.BIDDING_FACTOR_HIGH,
+      'bidding_factor_low': bid2x_var.BIDDING_FACTOR_LOW,
+  }
+
+
+def gtm_config(
+    zones: int, floodlights: int, dimensions: int, key_file: str
+) -> dict[str, Any]:
+  """Returns a synthetic GTM config.
+
+  Args:
+    zones: the number of zones, each its own container.
+    floodlights: the number of floodlights in the generated functions.
+    dimensions: the number of columns the zones' index tables are keyed on.
+    key_file: the service account key file to authenticate with.
+
+  Returns:
+    A config as loaded from a JSON file.
+  """
+  lookup = '#'.join(
+      ['lookup'] + [f'dim{index}' for index in range(dimensions)]
+  )
+  zone_array = [
+      {
+          'name': f'G{index}',
+          'account_id': 6000000,
+          'container_id': 7000000 + index,
+          'workspace_id': 1,
+          'variable_id': 100 + index,
+          'debug': False,
+          'update_row': 3 + index,
+          'update_col': bid2x_var.DEFAULT_CB_SCRIPT_COL_UPDATE,
+          'test_row': 3 + index,
+          'test_col': bid2x_var.DEFAULT_CB_SCRIPT_COL_TEST,
+      }
+      for index in range(zones)
+  ]
+  return {
+      'scopes': bid2x_var.GTM_API_SCOPES,
+      'api_name': bid2x_var.GTM_API_NAME,
+      'api_version': bid2x_var.GTM_API_VERSION,
+      'platform_type': bid2x_var.PlatformType.GTM.value,
+      'sheet': {
+          'sheet_id': 'benchmark-gtm',
+          'sheet_url': (
+              'https://docs.google.com/spreadsheets/d/benchmark-gtm/edit'
+          ),
+          'json_auth_file': key_file,
+      },
+      'zone_array': zone_array,
+      'debug': False,
+      'trace': False,
+      'json_auth_file': key_file,
+      'service_account_email': bid2x_var.SERVICE_ACCOUNT_EMAIL,
+      'gtm_account_id': 6000000,
+      'gtm_container_id': 7000000,
+      'gtm_workspace_id': 1,
+      'gtm_variable_id': 100,
+      'gtm_preprocessing_script': 'var event = {{Event}};',
+      'gtm_postprocessing_script': '',
+      'gtm_floodlight_list': [
+          {
+              'floodlight_name': f'Floodlight {index}',
+              'floodlight_condition': f"event === 'conversion_{index}'",
+              'per_row_condition': lookup,
+              'total_var': f'Revenue {index}',
+          }
+          for index in range(floodlights)
+      ],
+      'value_adjustment_column_name': 'Index',
+      'zones_to_process': ','.join(zone['name'] for zone in zone_array),
+      'action_update_scripts': True,
+      'action_test': False,
+  }
+
+
+def build_app(config: dict[str, Any], directory: str) -> Any:
+  """Writes a config to a file and builds its app, as main.py does."""
+  config_file = os.path.join(directory, f'{config["sheet"]["sheet_id"]}.json')
+  with open(config_file, 'w') as f:
+    json.dump(config, f)
+
+  app = bid2x_main.create_objects_from_json_file(config_file)
+  if not app or not app.service:
+    raise RuntimeError(f'Unable to build the app for {config_file}')
+
+  return app
+
+
+def run_main(app: Any) -> None:
+  """Runs main.main() on an app."""
+  bid2x_main.app = app
+  if bid2x_main.main(['end_to_end.py']):
+    raise RuntimeError('main.main() failed')
+
+
+def time_case(
+    name: str,
+    run: Callable[[], None],
+    api: bid2x_fake_api.FakeApi,
+    repeat: int,
+    verbose: bool,
+) -> dict[str, Any]:
+  """Times a case.
+
+  Args:
+    name: the name of the case.
+    run: runs the case once.
+    api: the fake APIs the case calls.
+    repeat: the number of timed runs, after one to warm up.
+    verbose: show the output of the runs instead of discarding it.
+
+  Returns:
+    A dict of results for the case.
+  """
+  times = []
+  calls_before = api.stats()['total_calls']
+  for attempt in range(repeat + 1):
+    if attempt == 1:
+      calls_before = api.stats()['total_calls']
+    output = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if verbose else output):
+      start = time.perf_counter()
+      run()
+      seconds = time.perf_counter() - start
+    if attempt:
+      times.append(seconds)
+
+  return {
+      'case': name,
+      'repeat': repeat,
+      'median_seconds': statistics.median(times),
+      'min_seconds': min(times),
+      'api_calls_per_run': (
+          (api.stats()['total_calls'] - calls_before) / repeat
+      ),
+  }
+
+
+def benchmark_dv(
+    args: argparse.Namespace, cases: list[str], directory: str
+) -> list[dict[str, Any]]:
+  """Runs the DV360 cases against a fake seeded with a synthetic config."""
+  results = []
+  api = bid2x_fake_api.FakeApi(
+      bid2x_fake_api.FakeApiConfig(
+          latency=args.latency, page_size=args.page_size, seed=args.seed
+      )
+  )
+  with bid2x_fake_api.FakeApiServer(api) as fake:
+    bid2x_var.API_ENDPOINT = fake.url
+    key_file = os.path.join(directory, 'dv_key.json')
+    bid2x_fake_api.write_service_account_key(key_file, fake.url)
+    config = dv_config(args.zones, args.floodlights, key_file, directory)
+    api.seed_from_config(config, line_items=args.line_items)
+    with contextlib.redirect_stdout(io.StringIO()):
+      app = build_app(config, directory)
+    dv = app.platform_object
+
+    def generate_cb_script():
+      for zone in app.zone_array:
+        dv.generate_cb_script_max_of_conversion_counts(zone.name)
+
+    def read_dv_line_items():
+      if not dv.sheet.read_dv_line_items(
+          app.service, dv.line_item_name_pattern, app.zone_array,
+          dv.defer_pattern
+      ):
+        raise RuntimeError('read_dv_line_items() failed')
+
+    runs = {
+        'dv.generate_cb_script': generate_cb_script,
+        'dv.read_dv_line_items': read_dv_line_items,
+        'dv.main': lambda: run_main(app),
+    }
+    for name, run in runs.items():
+      if name in cases:
+        results.append(time_case(name, run, api, args.repeat, args.verbose))
+
+  return results
+
+
+def benchmark_gtm(
+    args: argparse.Namespace, cases: list[str], directory: str
+) -> list[dict[str, Any]]:
+  """Runs the GTM cases against a fake seeded with a synthetic config."""
+  results = []
+  api = bid2x_fake_api.FakeApi(
+      bid2x_fake_api.FakeApiConfig(
+          latency=args.latency, page_size=args.page_size, seed=args.seed
+      )
+  )
+  with bid2x_fake_api.FakeApiServer(api) as fake:
+    bid2x_var.API_ENDPOINT = fake.url
+    key_file = os.path.join(directory, 'gtm_key.json')
+    bid2x_fake_api.write_service_account_key(key_file, fake.url)
+    config = gtm_config(
+        args.zones, args.floodlights, args.dimensions, key_file
+    )
+    api.seed_from_config(config, index_rows=args.index_rows)
+    with contextlib.redirect_stdout(io.StringIO()):
+      app = build_app(config, directory)
+      gtm = app.platform_object
+      index_dfs = [gtm.read_sheets_data(zone) for zone in app.zone_array]
+
+    def write_javascript():
+      for index_df in index_dfs:
+        gtm.write_javascript_function(index_df)
+
+    runs = {
+        'gtm.write_javascript': write_javascript,
+        'gtm.main': lambda: run_main(app),
+    }
+    for name, run in runs.items():
+      if name in cases:
+        results.append(time_case(name, run, api, args.repeat, args.verbose))
+
+  return results
+
+
+def compare(
+    results: list[dict[str, Any]],
+    workload: dict[str, Any],
+    baseline: dict[str, Any],
+    tolerance: float,
+) -> list[str]:
+  """Compares results to a baseline.
+
+  Args:
+    results: the results of this run.
+    workload: the workload options of this run.
+    baseline: the saved results of an earlier run.
+    tolerance: the fraction a case's median may be slower than baseline.
+
+  Returns:
+    A description of each regression, empty if there are none.
+  """
+  if baseline.get('workload') != workload:
+    print('Warning: the baseline was recorded with a different workload.')
+
+  baseline_results = {
+      result['case']: result for result in baseline.get('results', [])
+  }
+  regressions = []
+  for result in results:
+    before = baseline_results.get(result['case'])
+    if not before:
+      continue
+
+    limit = before['median_seconds'] * (1 + tolerance)
+    if (
+        result['median_seconds'] > limit
+        and result['median_seconds'] > MIN_REGRESSION_SECONDS
+    ):
+      regressions.append(
+          f'{result["case"]}: median {result["median_seconds"]:.3f}s, '
+          f'baseline {before["median_seconds"]:.3f}s (limit {limit:.3f}s)'
+      )
+    if result['api_calls_per_run'] > before['api_calls_per_run']:
+      regressions.append(
+          f'{result["case"]}: {result["api_calls_per_run"]:g} API calls '
+          f'per run, baseline {before["api_calls_per_run"]:g}'
+      )
+
+  return regressions
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument(
+      '-z', '--zones', type=int, default=5,
+      help='Zones per config (default: %(default)s).'
+  )
+  parser.add_argument(
+      '-l', '--line_items', type=int, default=200,
+      help='DV360 line items per zone (default: %(default)s).'
+  )
+  parser.add_argument(
+      '-f', '--floodlights', type=int, default=4,
+      help='Floodlights per config (default: %(default)s).'
+  )
+  parser.add_argument(
+      '-d', '--dimensions', type=int, default=2,
+      help='Dimensions of the GTM index tables (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--index_rows', type=int, default=200,
+      help='GTM index table rows per zone (default: %(default)s).'
+  )
+  parser.add_argument(
+      '-c', '--cases', nargs='+', choices=CASES, default=CASES,
+      help='Cases to run (default: all).'
+  )
+  parser.add_argument(
+      '-r', '--repeat', type=int, default=5,
+      help='Timed runs per case (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--latency', type=float, default=0.0,
+      help='Seconds the fake APIs add to each call (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--page_size', type=int, default=bid2x_var.FAKE_API_PAGE_SIZE,
+      help='Largest page the fake APIs list (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--seed', type=int, default=0,
+      help='Seed of the synthetic data (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--json', dest='json_file',
+      help='Also write the results as JSON to this file.'
+  )
+  parser.add_argument(
+      '--baseline',
+      help='Compare the results to those saved in this JSON file.'
+  )
+  parser.add_argument(
+      '--save_baseline',
+      help='Save the results as a baseline to this JSON file.'
+  )
+  parser.add_argument(
+      '--tolerance', type=float, default=0.25,
+      help='Fraction a median may exceed its baseline (default: '
+      '%(default)s).'
+  )
+  parser.add_argument(
+      '-v', '--verbose', action='store_true',
+      help='Show the output of the runs.'
+  )
+  args = parser.parse_args()
+
+  workload = {
+      'zones': args.zones,
+      'line_items': args.line_items,
+      'floodlights': args.floodlights,
+      'dimensions': args.dimensions,
+      'index_rows': args.index_rows,
+      'latency': args.latency,
+      'page_size': args.page_size,
+  }
+
+  endpoint = bid2x_var.API_ENDPOINT
+  try:
+    with tempfile.TemporaryDirectory() as directory:
+      results = []
+      if any(case.startswith('dv.') for case in args.cases):
+        results += benchmark_dv(args, args.cases, directory)
+      if any(case.startswith('gtm.') for case in args.cases):
+        results += benchmark_gtm(args, args.cases, directory)
+  finally:
+    bid2x_var.API_ENDPOINT = endpoint
+
+  for result in results:
+    print(
+        f'{result["case"]:<24} {result["median_seconds"] * 1000:9.1f} ms'
+        f'  (min {result["min_seconds"] * 1000:.1f} ms, '
+        f'{result["api_calls_per_run"]:g} API calls per run)'
+    )
+
+  output = {
+      'python': sys.version.split()[0],
+      'workload': workload,
+      'results': results,
+  }
+  for filename in (args.json_file, args.save_baseline):
+    if filename:
+      with open(filename, 'w') as f:
+        json.dump(output, f, indent=2)
+
+  if args.baseline:
+    with open(args.baseline, 'r') as f:
+      regressions = compare(
+          results, workload, json.load(f), args.tolerance
+      )
+    for regression in regressions:
+      print(f'Regression: {regression}')
+    if regressions:
+      return 1
+    print(f'No regressions against {args.baseline}.')
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,183 @@
+"""BidToX - import time benchmark.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  Measures how long importing bid2x modules takes in a fresh interpreter,
+  which is what a Cloud Functions cold start pays before hello_pubsub() runs.
+
+  Each module is imported in a new Python process with '-X importtime' a
+  number of times and the median cumulative import time is reported, along
+  with the slowest dependencies pulled in.
+
+  Example usage (from the bid2x directory):
+      python benchmarks/import_time.py
+      python benchmarks/import_time.py -m main bid2x_gtm -r 9 --json out.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any
+
+# The bid2x directory; modules are imported from here as main.py does.
+BID2X_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = ['main', 'bid2x_application', 'bid2x_gtm', 'bid2x_dv']
+
+
+def parse_importtime(stderr: str) -> dict[str, int]:
+  """Parses '-X importtime' output into cumulative microseconds per module.
+
+  Args:
+    stderr: the stderr of a Python process run with '-X importtime'.
+
+  Returns:
+    A dict of module name to its cumulative import time in microseconds.
+  """
+  cumulative = {}
+  for line in stderr.splitlines():
+    if not line.startswith('import time:'):
+      continue
+    fields = line[len('import time:'):].split('|')
+    if len(fields) != 3 or not fields[1].strip().isdigit():
+      continue  # The header line.
+    cumulative[fields[2].strip()] = int(fields[1])
+
+  return cumulative
+
+
+def time_import(module: str) -> tuple[float, dict[str, int]]:
+  """Imports a module in a fresh interpreter.
+
+  Args:
+    module: the name of the module to import.
+
+  Returns:
+    A tuple of the wall clock seconds the process took and the cumulative
+    import times reported by '-X importtime'.
+  """
+  start = time.perf_counter()
+  result = subprocess.run(
+      [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+      cwd=BID2X_DIR,
+      capture_output=True,
+      text=True,
+      check=False,
+  )
+  wall_time = time.perf_counter() - start
+
+  if result.returncode:
+    raise RuntimeError(f'Importing {module} failed:\n{result.stderr}')
+
+  return wall_time, parse_importtime(result.stderr)
+
+
+def benchmark_module(module: str, repeat: int, top: int) -> dict[str, Any]:
+  """Benchmarks the import of a single module.
+
+  Args:
+    module: the name of the module to import.
+    repeat: the number of fresh interpreters to import it in.
+    top: the number of slowest dependencies to report.
+
+  Returns:
+    A dict of results for the module.
+  """
+  wall_times = []
+  import_times = []
+  dependency_times = {}
+  for _ in range(repeat):
+    wall_time, cumulative = time_import(module)
+    wall_times.append(wall_time)
+    import_times.append(cumulative.get(module, 0))
+    for name, micros in cumulative.items():
+      dependency_times.setdefault(name, []).append(micros)
+
+  slowest = sorted(
+      (
+          (name, statistics.median(times))
+          for name, times in dependency_times.items()
+          if name != module and '.' not in name
+      ),
+      key=lambda item: item[1],
+      reverse=True,
+  )[:top]
+
+  return {
+      'module': module,
+      'repeat': repeat,
+      'median_import_ms': statistics.median(import_times) / 1000,
+      'min_import_ms': min(import_times) / 1000,
+      'median_process_ms': statistics.median(wall_times) * 1000,
+      'modules_imported': len(dependency_times),
+      'slowest_dependencies_ms': {
+          name: micros / 1000 for name, micros in slowest
+      },
+  }
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument(
+      '-m', '--modules', nargs='+', default=DEFAULT_MODULES,
+      help='Modules to import (default: %(default)s).'
+  )
+  parser.add_argument(
+      '-r', '--repeat', type=int, default=5,
+      help='Fresh interpreters per module (default: %(default)s).'
+  )
+  parser.add_argument(
+      '-t', '--top', type=int, default=5,
+      help='Slowest top level dependencies to list (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--json', dest='json_file',
+      help='Also write the results as JSON to this file.'
+  )
+  args = parser.parse_args()
+
+  results = [
+      benchmark_module(module, args.repeat, args.top)
+      for module in args.modules
+  ]
+
+  for result in results:
+    print(
+        f'{result["module"]:<20} import {result["median_import_ms"]:8.1f} ms'
+        f'  (min {result["min_import_ms"]:.1f} ms, process '
+        f'{result["median_process_ms"]:.1f} ms, '
+        f'{result["modules_imported"]} modules)'
+    )
+    for name, millis in result['slowest_dependencies_ms'].items():
+      print(f'    {name:<30} {millis:8.1f} ms')
+
+  if args.json_file:
+    with open(args.json_file, 'w') as f:
+      json.dump(
+          {'python': sys.version.split()[0], 'results': results}, f, indent=2
+      )
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,199 @@
+"""BidToX - shared gs:// run journal check.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  Several tasks of a Cloud Run job share one gs:// run journal (see
+  bid2x_journal.GcsJournal).  Each writes the object against the generation
+  it last read and, when another task has written since, reads it again
+  and lays its own unwritten entries over it.  This checks that no task's
+  entries are lost that way, against the Cloud Storage objects of the
+  local fake APIs (see bid2x_fake_api).
+
+  Every writer opens the journal before any of them writes, and records
+  every entry straight away (JOURNAL_GCS_WRITE_INTERVAL is 0), so nearly
+  every write conflicts.  The writers first take turns entry by entry,
+  then record from threads at the same time.  Each also records every
+  one of its entries twice, as a retried task does.  The journal is then
+  read back and every writer's latest entries must be in it.
+
+  The exit status is 1 if any entry is missing or out of date.
+
+  Example usage (from the bid2x directory):
+      python benchmarks/journal_merge.py
+      python benchmarks/journal_merge.py -w 8 -e 50 --latency 0.01
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Any
+
+# The bid2x directory; modules are imported from here as main.py does.
+BID2X_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BID2X_DIR)
+
+# pylint: disable=g-import-not-at-top,g-bad-import-order
+import bid2x_fake_api
+import bid2x_journal
+import bid2x_var
+# pylint: enable=g-import-not-at-top,g-bad-import-order
+
+JOURNAL_PATH = 'gs://bid2x-fake/journal.json'
+SCOPE = 'journal-merge'
+STORAGE_SCOPES = ['https://www.googleapis.com/auth/devstorage.read_write']
+
+
+def storage_client(url: str, key_file: str) -> Any:
+  """Returns a Cloud Storage client for the fake APIs at a URL."""
+  # pylint: disable=g-import-not-at-top
+  from google.cloud import storage
+  from google.oauth2 import service_account
+  # pylint: enable=g-import-not-at-top
+
+  credentials = service_account.Credentials.from_service_account_file(
+      key_file, scopes=STORAGE_SCOPES
+  )
+  return storage.Client(
+      project='bid2x-fake',
+      credentials=credentials,
+      client_options={'api_endpoint': url},
+  )
+
+
+def zone_name(writer: int, phase: str, index: int) -> str:
+  """Returns the zone a writer records an entry for."""
+  return f'{phase}-task{writer}-zone{index}'
+
+
+def record(
+    journal: bid2x_journal.RunJournal,
+    writer: int,
+    phase: str,
+    index: int,
+) -> None:
+  """Records a writer's entry twice, the second as a retry would."""
+  for attempt in range(2):
+    journal.record(
+        SCOPE,
+        zone_name(writer, phase, index),
+        bid2x_journal.JournalEntry(
+            'report', f'{writer}:{index}:{attempt}', time.time(), 0.0,
+            index, 'journal-merge',
+        ),
+    )
+
+
+def missing_entries(
+    journal: bid2x_journal.RunJournal, writers: int, entries: int
+) -> list[str]:
+  """Returns the entries that are missing from the journal or stale."""
+  missing = []
+  for phase in ('interleaved', 'concurrent'):
+    for writer in range(writers):
+      for index in range(entries):
+        zone = zone_name(writer, phase, index)
+        entry = journal.completed(SCOPE, zone).get('report')
+        expected = f'{writer}:{index}:1'
+        if entry is None or entry.fingerprint != expected:
+          missing.append(
+              f'{zone}: {entry.fingerprint if entry else None}, '
+              f'expected {expected}'
+          )
+  return missing
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument(
+      '-w', '--writers', type=int, default=4,
+      help='Journals writing the object (default: %(default)s).'
+  )
+  parser.add_argument(
+      '-e', '--entries', type=int, default=20,
+      help='Entries each writer records per phase (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--latency', type=float, default=0.0,
+      help='Seconds every fake API call takes (default: %(default)s).'
+  )
+  args = parser.parse_args()
+
+  bid2x_var.JOURNAL_GCS_WRITE_INTERVAL = 0.0
+  fake_config = bid2x_fake_api.FakeApiConfig(latency=args.latency)
+  start = time.monotonic()
+  with tempfile.TemporaryDirectory() as directory, \
+      bid2x_fake_api.FakeApiServer(
+          bid2x_fake_api.FakeApi(fake_config)) as fake:
+    key_file = os.path.join(directory, 'key.json')
+    bid2x_fake_api.write_service_account_key(key_file, fake.url)
+
+    journals = [
+        bid2x_journal.GcsJournal(
+            JOURNAL_PATH, storage_client(fake.url, key_file)
+        )
+        for _ in range(args.writers)
+    ]
+
+    for index in range(args.entries):
+      for writer, journal in enumerate(journals):
+        record(journal, writer, 'interleaved', index)
+
+    def write_all(writer: int) -> None:
+      for index in range(args.entries):
+        record(journals[writer], writer, 'concurrent', index)
+
+    threads = [
+        threading.Thread(target=write_all, args=(writer,))
+        for writer in range(args.writers)
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    for journal in journals:
+      journal.close()
+
+    reader = bid2x_journal.GcsJournal(
+        JOURNAL_PATH, storage_client(fake.url, key_file)
+    )
+    missing = missing_entries(reader, args.writers, args.entries)
+    stats = fake.api.stats()['calls']
+
+  expected = args.writers * args.entries * 2
+  writes = stats.get('storage.objects.insert', 0)
+  print(
+      f'{args.writers} writers, {expected} entries, {writes} writes '
+      f'({writes - expected * 2} retried after a conflict), '
+      f'{stats.get("storage.objects.get", 0)} reads, '
+      f'{time.monotonic() - start:.1f}s'
+  )
+  if missing:
+    print(f'{len(missing)} of {expected} entries lost:')
+    for line in missing[:20]:
+      print(f'  {line}')
+    return 1
+
+  print('No entries lost.')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,171 @@
+"""BidToX - run journal crash-resume check.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  Once a zone's script is uploaded the live script matches the new one, so
+  a restarted run only binds the zone's line items if the run journal (see
+  bid2x_journal) shows bid2x uploaded it.  This checks that the upload
+  entry survives a run killed straight after the upload, against the local
+  fake APIs (see bid2x_fake_api) with the journal in their Cloud Storage.
+
+  A DV360 run updating every zone's script is started in a child process
+  that is killed, without closing the journal, the moment it starts
+  binding line items.  A second run is then started and every zone's line
+  items must end up bound to the zone's algorithm.
+
+  The exit status is 1 if any line item is left unbound.
+
+  Example usage (from the bid2x directory):
+      python benchmarks/journal_resume.py
+      python benchmarks/journal_resume.py -z 4 -l 50
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Any
+
+# The bid2x directory; modules are imported from here as main.py does.
+BID2X_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BID2X_DIR)
+
+# pylint: disable=g-import-not-at-top,g-bad-import-order
+import bid2x_fake_api
+import bid2x_var
+import end_to_end
+# pylint: enable=g-import-not-at-top,g-bad-import-order
+
+JOURNAL_PATH = 'gs://bid2x-fake/journal-resume.json'
+# The exit status of a child killed on binding line items.
+KILLED_STATUS = 75
+
+
+def run_child(config_file: str, kill: bool) -> None:
+  """Runs main.main() on a config, killed on binding line items if asked."""
+  # pylint: disable=g-import-not-at-top
+  import bid2x_model
+  import main as bid2x_main
+  # pylint: enable=g-import-not-at-top
+
+  if kill:
+    def killed(*args, **kwargs) -> None:
+      del args, kwargs  # Unused.
+      os._exit(KILLED_STATUS)  # pylint: disable=protected-access
+
+    bid2x_model.Bid2xModel.bind_line_items = killed
+
+  bid2x_main.app = bid2x_main.create_objects_from_json_file(config_file)
+  sys.exit(bid2x_main.main(['journal_resume.py']))
+
+
+def start_run(config_file: str, env: dict[str, str], kill: bool) -> int:
+  """Runs a child process on a config and returns its exit status."""
+  command = [sys.executable, os.path.abspath(__file__), '--child', config_file]
+  if kill:
+    command.append('--kill')
+  process = subprocess.run(
+      command, env=env, cwd=BID2X_DIR, capture_output=True, text=True,
+      check=False,
+  )
+  if process.returncode not in (0, KILLED_STATUS):
+    print(process.stdout[-2000:])
+    print(process.stderr[-2000:])
+
+  return process.returncode
+
+
+def unbound_line_items(
+    fake: bid2x_fake_api.FakeApi, config: dict[str, Any]
+) -> list[str]:
+  """Returns the zones' line items not bound to their zone's algorithm."""
+  unbound = []
+  for zone in config['zone_array']:
+    for line_item in fake.line_items(zone['advertiser_id']):
+      bid_strategy = line_item.get('bidStrategy', {})
+      algorithm_id = bid_strategy.get('maximizeSpendAutoBid', {}).get(
+          'customBiddingAlgorithmId'
+      )
+      if str(algorithm_id) != str(zone['algorithm_id']):
+        unbound.append(f'{zone["name"]}: {line_item["lineItemId"]}')
+
+  return unbound
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument(
+      '-z', '--zones', type=int, default=2,
+      help='Zones in the config (default: %(default)s).'
+  )
+  parser.add_argument(
+      '-l', '--line_items', type=int, default=20,
+      help='Line items per zone (default: %(default)s).'
+  )
+  parser.add_argument('--child', help=argparse.SUPPRESS)
+  parser.add_argument('--kill', action='store_true', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.child:
+    run_child(args.child, args.kill)
+
+  with tempfile.TemporaryDirectory() as directory, \
+      bid2x_fake_api.FakeApiServer(bid2x_fake_api.FakeApi()) as fake:
+    key_file = os.path.join(directory, 'key.json')
+    bid2x_fake_api.write_service_account_key(key_file, fake.url)
+
+    config = end_to_end.dv_config(args.zones, 2, key_file, directory)
+    config['journal_path'] = JOURNAL_PATH
+    fake.api.seed_from_config(config, line_items=args.line_items)
+    config_file = os.path.join(directory, 'config.json')
+    with open(config_file, 'w') as f:
+      json.dump(config, f)
+
+    env = dict(
+        os.environ,
+        GOOGLE_APPLICATION_CREDENTIALS=key_file,
+        **{bid2x_var.API_ENDPOINT_ENV_VAR: fake.url},
+    )
+    env['BID2X_RUN_ID'] = 'killed'
+    killed = start_run(config_file, env, kill=True)
+    env['BID2X_RUN_ID'] = 'resumed'
+    resumed = start_run(config_file, env, kill=False)
+    unbound = unbound_line_items(fake.api, config)
+
+  total = args.zones * args.line_items
+  print(
+      f'{args.zones} zones, {total} line items; first run exited '
+      f'{killed}, resumed run exited {resumed}'
+  )
+  if killed != KILLED_STATUS:
+    print('The first run was not killed on binding line items.')
+    return 1
+  if resumed or unbound:
+    print(f'{len(unbound)} of {total} line items left unbound:')
+    for line in unbound[:20]:
+      print(f'  {line}')
+    return 1
+
+  print('Every line item bound after the restart.')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,403 @@
+"""BidToX - cassette replay benchmark.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  Replays a cassette of recorded API traffic (see bid2x_cassette) through
+  bid2x's hot paths, so that they can be checked and timed without a
+  network, an account or a fake API server.
+
+  With --record, the synthetic DV360 and GTM configs of end_to_end.py are
+  seeded into an in-process fake and the cases below run against it while
+  their traffic is recorded to a cassette.  The workload and the API calls
+  each case made per run are written in the cassette's header.
+
+    dv.read_dv_line_items  read_dv_line_items() for all zones.
+    dv.main                main.main() updating every zone's script.
+    gtm.main               main.main() updating every zone's variable.
+
+  Otherwise the cassette given is replayed: the same configs are generated
+  from its header and the cases run in the same order with every request
+  answered from the cassette.  With --replay_latency zero (the default)
+  this times bid2x's own work; with original, the time the recorded
+  requests took is added back.
+
+  A case that makes a request the cassette has no response for, or makes a
+  different number of requests than when recorded, is a regression, as
+  are requests recorded but never made.  Timings can be saved as a
+  baseline and compared as in end_to_end.py.
+
+  Example usage (from the bid2x directory):
+      python benchmarks/replay.py --record /tmp/bid2x.cassette -z 10
+      python benchmarks/replay.py /tmp/bid2x.cassette
+      python benchmarks/replay.py /tmp/bid2x.cassette --save_baseline b.json
+      python benchmarks/replay.py /tmp/bid2x.cassette --baseline b.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable
+
+import end_to_end
+
+# pylint: disable=g-import-not-at-top,g-bad-import-order
+import bid2x_cassette
+import bid2x_fake_api
+import bid2x_var
+# pylint: enable=g-import-not-at-top,g-bad-import-order
+
+CASES = [
+    'dv.read_dv_line_items',
+    'dv.main',
+    'gtm.main',
+]
+
+
+def configs(
+    workload: dict[str, Any], directory: str, endpoint: str
+) -> dict[str, dict[str, Any]]:
+  """Returns the synthetic configs of a workload.
+
+  Args:
+    workload: the workload options, as written in a cassette's header.
+    directory: where the key and scripts are written.
+    endpoint: the URL the service account key's token URI points at.
+
+  Returns:
+    The DV360 and GTM configs, keyed 'dv' and 'gtm'.
+  """
+  key_file = os.path.join(directory, 'key.json')
+  bid2x_fake_api.write_service_account_key(key_file, endpoint)
+  return {
+      'dv': end_to_end.dv_config(
+          workload['zones'], workload['floodlights'], key_file, directory
+      ),
+      'gtm': end_to_end.gtm_config(
+          workload['zones'], workload['floodlights'],
+          workload['dimensions'], key_file
+      ),
+  }
+
+
+def build_apps(
+    platform_configs: dict[str, dict[str, Any]], directory: str
+) -> dict[str, Any]:
+  """Returns the apps of the configs returned by configs(), by platform."""
+  with contextlib.redirect_stdout(io.StringIO()):
+    return {
+        platform: end_to_end.build_app(config, directory)
+        for platform, config in platform_configs.items()
+    }
+
+
+def case_runs(apps: dict[str, Any]) -> dict[str, Callable[[], None]]:
+  """Returns a function running each case once, by case name."""
+  dv_app = apps['dv']
+  dv = dv_app.platform_object
+
+  def read_dv_line_items():
+    if not dv.sheet.read_dv_line_items(
+        dv_app.service, dv.line_item_name_pattern, dv_app.zone_array,
+        dv.defer_pattern
+    ):
+      raise RuntimeError('read_dv_line_items() failed')
+
+  return {
+      'dv.read_dv_line_items': read_dv_line_items,
+      'dv.main': lambda: end_to_end.run_main(dv_app),
+      'gtm.main': lambda: end_to_end.run_main(apps['gtm']),
+  }
+
+
+def run_cases(
+    apps: dict[str, Any],
+    cases: list[str],
+    repeat: int,
+    calls: Callable[[], int],
+    verbose: bool,
+) -> list[dict[str, Any]]:
+  """Runs and times cases.
+
+  Args:
+    apps: the apps returned by build_apps().
+    cases: the cases to run, in order.
+    repeat: the number of runs of each case.
+    calls: returns the requests made or replayed so far.
+    verbose: show the output of the runs instead of discarding it.
+
+  Returns:
+    A dict of results for each case.
+
+  Raises:
+    CassetteMissError: a request was made the cassette has no response for.
+  """
+  results = []
+  runs = case_runs(apps)
+  for name in cases:
+    times = []
+    calls_before = calls()
+    for _ in range(repeat):
+      output = io.StringIO()
+      with contextlib.redirect_stdout(sys.stdout if verbose else output):
+        start = time.perf_counter()
+        runs[name]()
+        times.append(time.perf_counter() - start)
+    api_calls_per_run = (calls() - calls_before) / repeat
+    median_seconds = statistics.median(times)
+    results.append({
+        'case': name,
+        'repeat': repeat,
+        'median_seconds': median_seconds,
+        'min_seconds': min(times),
+        'api_calls_per_run': api_calls_per_run,
+        'requests_per_second': (
+            api_calls_per_run / median_seconds if median_seconds else 0.0
+        ),
+    })
+
+  return results
+
+
+def record(args: argparse.Namespace, directory: str) -> int:
+  """Records the cases against a seeded fake to a cassette."""
+  workload = {
+      'zones': args.zones,
+      'line_items': args.line_items,
+      'floodlights': args.floodlights,
+      'dimensions': args.dimensions,
+      'index_rows': args.index_rows,
+      'latency': args.latency,
+      'page_size': args.page_size,
+      'seed': args.seed,
+  }
+  api = bid2x_fake_api.FakeApi(
+      bid2x_fake_api.FakeApiConfig(
+          latency=args.latency, page_size=args.page_size, seed=args.seed
+      )
+  )
+  with bid2x_fake_api.FakeApiServer(api) as fake:
+    bid2x_var.API_ENDPOINT = fake.url
+    platform_configs = configs(workload, directory, fake.url)
+    api.seed_from_config(platform_configs['dv'], line_items=args.line_items)
+    api.seed_from_config(
+        platform_configs['gtm'], index_rows=args.index_rows
+    )
+    # Recording starts before the apps are built so that the discovery
+    # documents they fetch are in the cassette.
+    bid2x_cassette.configure(
+        record=args.record,
+        metadata={
+            'workload': workload,
+            'cases': args.cases,
+            'repeat': args.repeat,
+        },
+    )
+    recorder = bid2x_cassette.recorder()
+    apps = build_apps(platform_configs, directory)
+    results = run_cases(
+        apps, args.cases, args.repeat, lambda: len(recorder), args.verbose
+    )
+    recorder.metadata['results'] = results
+    bid2x_cassette.stop()
+
+  for result in results:
+    print(
+        f'{result["case"]:<24} {result["api_calls_per_run"]:g} API calls '
+        'per run recorded'
+    )
+  print(f'Recorded {len(recorder)} requests to {args.record}.')
+  return 0
+
+
+def replay(args: argparse.Namespace, directory: str) -> int:
+  """Replays a cassette through the cases recorded and checks the calls."""
+  bid2x_cassette.configure(replay=args.cassette, latency=args.replay_latency)
+  player = bid2x_cassette.player()
+  recorded = {
+      result['case']: result
+      for result in player.metadata.get('results', [])
+  }
+  workload = player.metadata.get('workload')
+  if not workload or not recorded:
+    print(f'{args.cassette} was not recorded by this benchmark.')
+    return 1
+
+  bid2x_var.API_ENDPOINT = None
+  regressions = []
+  try:
+    apps = build_apps(
+        configs(workload, directory, 'https://oauth2.googleapis.com'),
+        directory,
+    )
+    results = run_cases(
+        apps, player.metadata['cases'], player.metadata['repeat'],
+        lambda: player.played, args.verbose
+    )
+  except bid2x_cassette.CassetteMissError as e:
+    print(f'Regression: {e}')
+    return 1
+  finally:
+    bid2x_cassette.stop()
+
+  for result in results:
+    print(
+        f'{result["case"]:<24} {result["median_seconds"] * 1000:9.1f} ms'
+        f'  (min {result["min_seconds"] * 1000:.1f} ms, '
+        f'{result["api_calls_per_run"]:g} API calls per run, '
+        f'{result["requests_per_second"]:.0f} requests/s)'
+    )
+    expected = recorded[result['case']]['api_calls_per_run']
+    if result['api_calls_per_run'] != expected:
+      regressions.append(
+          f'{result["case"]}: {result["api_calls_per_run"]:g} API calls '
+          f'per run, recorded {expected:g}'
+      )
+  if player.remaining():
+    regressions.append(
+        f'{player.remaining()} recorded requests were never made'
+    )
+
+  output = {
+      'python': sys.version.split()[0],
+      'workload': dict(workload, replay_latency=args.replay_latency),
+      'results': results,
+  }
+  for filename in (args.json_file, args.save_baseline):
+    if filename:
+      with open(filename, 'w') as f:
+        json.dump(output, f, indent=2)
+
+  if args.baseline:
+    with open(args.baseline, 'r') as f:
+      regressions += end_to_end.compare(
+          results, output['workload'], json.load(f), args.tolerance
+      )
+  for regression in regressions:
+    print(f'Regression: {regression}')
+  if regressions:
+    return 1
+
+  print(f'No regressions replaying {args.cassette}.')
+  return 0
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument(
+      'cassette', nargs='?',
+      help='The cassette to replay.'
+  )
+  parser.add_argument(
+      '--record',
+      help='Record a cassette to this file instead of replaying one.'
+  )
+  parser.add_argument(
+      '-z', '--zones', type=int, default=5,
+      help='Zones per config when recording (default: %(default)s).'
+  )
+  parser.add_argument(
+      '-l', '--line_items', type=int, default=200,
+      help='DV360 line items per zone when recording (default: '
+      '%(default)s).'
+  )
+  parser.add_argument(
+      '-f', '--floodlights', type=int, default=4,
+      help='Floodlights per config when recording (default: %(default)s).'
+  )
+  parser.add_argument(
+      '-d', '--dimensions', type=int, default=2,
+      help='Dimensions of the GTM index tables when recording (default: '
+      '%(default)s).'
+  )
+  parser.add_argument(
+      '--index_rows', type=int, default=200,
+      help='GTM index table rows per zone when recording (default: '
+      '%(default)s).'
+  )
+  parser.add_argument(
+      '-c', '--cases', nargs='+', choices=CASES, default=CASES,
+      help='Cases to record (default: all).'
+  )
+  parser.add_argument(
+      '-r', '--repeat', type=int, default=5,
+      help='Runs per case when recording (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--latency', type=float, default=0.0,
+      help='Seconds the fake APIs add to each call when recording '
+      '(default: %(default)s).'
+  )
+  parser.add_argument(
+      '--page_size', type=int, default=bid2x_var.FAKE_API_PAGE_SIZE,
+      help='Largest page the fake APIs list when recording (default: '
+      '%(default)s).'
+  )
+  parser.add_argument(
+      '--seed', type=int, default=0,
+      help='Seed of the synthetic data when recording (default: '
+      '%(default)s).'
+  )
+  parser.add_argument(
+      '--replay_latency', choices=bid2x_cassette.LATENCIES,
+      default=bid2x_cassette.LATENCY_ZERO,
+      help='Answer after the recorded time or straight away (default: '
+      '%(default)s).'
+  )
+  parser.add_argument(
+      '--json', dest='json_file',
+      help='Also write the replay results as JSON to this file.'
+  )
+  parser.add_argument(
+      '--baseline',
+      help='Compare the replay timings to those saved in this JSON file.'
+  )
+  parser.add_argument(
+      '--save_baseline',
+      help='Save the replay timings as a baseline to this JSON file.'
+  )
+  parser.add_argument(
+      '--tolerance', type=float, default=0.25,
+      help='Fraction a median may exceed its baseline (default: '
+      '%(default)s).'
+  )
+  parser.add_argument(
+      '-v', '--verbose', action='store_true',
+      help='Show the output of the runs.'
+  )
+  args = parser.parse_args()
+  if not args.record and not args.cassette:
+    parser.error('give a cassette to replay or --record one')
+
+  endpoint = bid2x_var.API_ENDPOINT
+  try:
+    with tempfile.TemporaryDirectory() as directory:
+      if args.record:
+        return record(args, directory)
+      return replay(args, directory)
+  finally:
+    bid2x_var.API_ENDPOINT = endpoint
+
+
+if __name__ == '__main__':
+  sys.exit(main())
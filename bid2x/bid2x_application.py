@@ -27,8 +27,6 @@ import enum
 from typing import Any
 
 from auth import bid2x_auth
-from bid2x_dv import Bid2xDV
-from bid2x_gtm import Bid2xGTM
 from bid2x_spreadsheet import Bid2xSpreadsheet
 import bid2x_var
 from googleapiclient import discovery
@@ -171,11 +169,19 @@ class Bid2xApplication():
     return service_output
 
   def start_service(self) -> None:
-    """Creates the script's platform object based on the platform type."""
+    """Creates the script's platform object based on the platform type.
+
+    The platform modules are imported here so that only the configured
+    platform is loaded.
+    """
+    # pylint: disable=g-import-not-at-top
     if self.platform_type == bid2x_var.PlatformType.GTM.value:
+      from bid2x_gtm import Bid2xGTM
       self.platform_object = Bid2xGTM(self.sheet, self.debug)
     if self.platform_type == bid2x_var.PlatformType.DV.value:
+      from bid2x_dv import Bid2xDV
       self.platform_object = Bid2xDV(self.sheet, self.debug)
+    # pylint: enable=g-import-not-at-top
 
   def run_script(self) -> bool:
     """Creates new script and saves it to the appropriate platform.
@@ -214,6 +220,8 @@ class Bid2xApplication():
     self.json_auth_file = source['json_auth_file']
     self.debug = source['debug']
     self.trace = source['trace']
+    if 'discovery_cache_dir' in source:
+      self.auth.discovery_cache_dir = source['discovery_cache_dir']
 
     # Move to abstracted platform object and perform same copy of
     # key properties from source to ensure object is complete.
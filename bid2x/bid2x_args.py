@@ -67,6 +67,20 @@ def process_command_line_args() -> None:
       help='When set to true DO NOT use LI name pattern to'
       + ' set rule on/off.  Default is False.',
   )
+  parser.add_argument(
+      '--plan',
+      default=bid2x_var.PLAN,
+      action='store_true',
+      help='List the API calls a run would make and its expected time '
+      + 'instead of running',
+  )
+  parser.add_argument(
+      '--quota_wait',
+      default=bid2x_var.QUOTA_WAIT,
+      action='store_true',
+      help='Wait for room in the API quotas before each request instead '
+      + 'of only counting requests',
+  )
   parser.add_argument(
       '-vv',
       '--verbose',
@@ -111,6 +125,24 @@ def process_command_line_args() -> None:
       type=int,
       help='Change the custom bidding algorithm ID to update',
   )
+  parser.add_argument(
+      '--task_index',
+      default=bid2x_var.TASK_INDEX,
+      type=int,
+      help='Index of this task when zones are split across tasks',
+  )
+  parser.add_argument(
+      '--task_count',
+      default=bid2x_var.TASK_COUNT,
+      type=int,
+      help='Number of tasks zones are split across',
+  )
+  parser.add_argument(
+      '--time_budget',
+      default=bid2x_var.TIME_BUDGET,
+      type=float,
+      help='Seconds DV360 zone work may take; zones that won\'t fit wait',
+  )
   parser.add_argument(
       '-p',
       '--partner',
@@ -171,6 +203,73 @@ def process_command_line_args() -> None:
       help='Service account email (typically: '
       + 'name@<gcp_project>.iam.gserviceaccount.com) to use',
   )
+  parser.add_argument(
+      '--api_endpoint',
+      default=bid2x_var.API_ENDPOINT,
+      help='URL to send Google API calls to instead, e.g. bid2x_fake_api',
+  )
+  parser.add_argument(
+      '--latency_profile',
+      default=bid2x_var.PLAN_LATENCY_PROFILE,
+      help='JSON file of seconds per API call used by --plan',
+  )
+  parser.add_argument(
+      '--plan_json',
+      default=bid2x_var.PLAN_JSON_FILE,
+      help='File to also write the --plan output to as JSON',
+  )
+  parser.add_argument(
+      '--trace_spans',
+      default=bid2x_var.TRACE_SPANS,
+      help='Write timed spans to this JSON lines file, or as Cloud Logging '
+      + 'structured logs with "stdout"',
+  )
+  parser.add_argument(
+      '--record_cassette',
+      default=bid2x_var.RECORD_CASSETTE,
+      help='Record every API request and response to this cassette file',
+  )
+  parser.add_argument(
+      '--replay_cassette',
+      default=bid2x_var.REPLAY_CASSETTE,
+      help='Answer every API request from this cassette file instead of '
+      + 'the network',
+  )
+  parser.add_argument(
+      '--replay_latency',
+      default=bid2x_var.REPLAY_LATENCY,
+      choices=['original', 'zero'],
+      help='Replay responses after their recorded time (original) or '
+      + 'straight away (zero)',
+  )
+  parser.add_argument(
+      '--metrics_textfile',
+      default=bid2x_var.METRICS_TEXTFILE,
+      help='Write Prometheus metrics to this file at the end of every run',
+  )
+  parser.add_argument(
+      '--metrics_port',
+      type=int,
+      default=bid2x_var.METRICS_PORT,
+      help='Serve Prometheus metrics at /metrics on this port',
+  )
+  parser.add_argument(
+      '--profile',
+      default=bid2x_var.PROFILE,
+      choices=['cprofile', 'sampling'],
+      help='Profile the run with cProfile or a stack sampler and write '
+      + 'pstats and collapsed stack files',
+  )
+  parser.add_argument(
+      '--profile_dir',
+      default=bid2x_var.PROFILE_DIR,
+      help='Directory the --profile files are written to',
+  )
+  parser.add_argument(
+      '--config_cache_dir',
+      default=bid2x_var.CONFIG_CACHE_DIR,
+      help='Directory validated config files are cached in, pickled',
+  )
   parser.add_argument(
       '-t',
       '--tmp',
@@ -267,6 +366,23 @@ def process_command_line_args() -> None:
   bid2x_var.CB_ALGO_ID = args['algorithm']
   bid2x_var.SERVICE_ACCOUNT_EMAIL = args['service_account']
   bid2x_var.ZONES_TO_PROCESS = args['zones']
+  bid2x_var.TASK_INDEX = args['task_index']
+  bid2x_var.TASK_COUNT = args['task_count']
+  bid2x_var.TIME_BUDGET = args['time_budget']
+  bid2x_var.PLAN = args['plan']
+  bid2x_var.PLAN_LATENCY_PROFILE = args['latency_profile']
+  bid2x_var.PLAN_JSON_FILE = args['plan_json']
+  bid2x_var.API_ENDPOINT = args['api_endpoint']
+  bid2x_var.TRACE_SPANS = args['trace_spans']
+  bid2x_var.METRICS_TEXTFILE = args['metrics_textfile']
+  bid2x_var.METRICS_PORT = args['metrics_port']
+  bid2x_var.QUOTA_WAIT = args['quota_wait']
+  bid2x_var.RECORD_CASSETTE = args['record_cassette']
+  bid2x_var.REPLAY_CASSETTE = args['replay_cassette']
+  bid2x_var.REPLAY_LATENCY = args['replay_latency']
+  bid2x_var.PROFILE = args['profile']
+  bid2x_var.PROFILE_DIR = args['profile_dir']
+  bid2x_var.CONFIG_CACHE_DIR = args['config_cache_dir']
 
   # Floodlight ID list is passed as a comma separated string of integers.
   # Split the string into a list of integers.
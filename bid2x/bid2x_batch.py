@@ -0,0 +1,222 @@
+"""BidToX - Run several config files in one process.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  Running one config per invocation pays start-up, authentication and
+  discovery for every config.  This entry point runs a list of configs in a
+  single process on a bounded pool of worker threads.  Configs sharing a
+  service account key share its credentials and HTTP connections, and
+  configs sharing a spreadsheet share its handle.
+
+  Config paths may be local files, gs:// objects or glob patterns of
+  either, e.g.:
+      python bid2x_batch.py 'configs/*.json' gs://my-bucket/bid2x/dv_*.json
+
+  A summary line is printed for every config and the exit status is
+  non-zero if any config failed.
+"""
+
+import argparse
+from concurrent import futures
+import dataclasses
+import fnmatch
+import glob
+import sys
+import time
+from urllib import parse
+
+import bid2x_var
+import main as bid2x_main
+
+urlparse = parse.urlparse
+
+
+@dataclasses.dataclass
+class BatchResult:
+  """Outcome of running one config file.
+
+  Attributes:
+    config: the config file path or gs:// URI.
+    status: 'ok', 'failed' (main returned an error) or 'error' (an
+        exception was raised).
+    return_code: the value returned by run_app, None on an exception.
+    seconds: wall clock time taken by the config.
+    message: the exception raised, if any.
+  """
+
+  config: str
+  status: str
+  return_code: int | None
+  seconds: float
+  message: str = ''
+
+
+def expand_gcs_pattern(pattern: str) -> list[str]:
+  """Expands a gs:// URI holding glob characters into matching object URIs.
+
+  Args:
+    pattern: a URI such as gs://bucket/configs/dv_*.json.
+
+  Returns:
+    A sorted list of gs:// URIs of the matching objects.
+  """
+  from google.cloud import storage  # pylint: disable=g-import-not-at-top
+
+  parsed_uri = urlparse(pattern)
+  bucket_name = parsed_uri.netloc
+  object_pattern = parsed_uri.path.lstrip('/')
+
+  # List only objects sharing the pattern's literal prefix.
+  prefix = object_pattern
+  for wildcard in '*?[':
+    prefix = prefix.split(wildcard, 1)[0]
+
+  blobs = storage.Client().list_blobs(bucket_name, prefix=prefix)
+  return sorted(
+      f'gs://{bucket_name}/{blob.name}'
+      for blob in blobs
+      if fnmatch.fnmatchcase(blob.name, object_pattern)
+  )
+
+
+def expand_config_paths(patterns: list[str]) -> list[str]:
+  """Expands config paths and glob patterns into a list of config files.
+
+  Args:
+    patterns: local paths, gs:// URIs or glob patterns of either.
+
+  Returns:
+    The config files in the order given, without duplicates.  Patterns
+    matching nothing are reported and skipped.
+  """
+  config_paths = []
+  for pattern in patterns:
+    if not glob.has_magic(pattern):
+      matches = [pattern]
+    elif pattern.startswith('gs://'):
+      matches = expand_gcs_pattern(pattern)
+    else:
+      matches = sorted(glob.glob(pattern))
+
+    if not matches:
+      print(f'No config files match {pattern}')
+
+    for match in matches:
+      if match not in config_paths:
+        config_paths.append(match)
+
+  return config_paths
+
+
+def run_config(config: str) -> BatchResult:
+  """Builds (or reuses) the app for a config file and runs it.
+
+  Args:
+    config: the config file path or gs:// URI.
+
+  Returns:
+    The result of the run.  Exceptions are caught and reported in it.
+  """
+  start = time.monotonic()
+  try:
+    app = bid2x_main.get_cached_app(config)
+    return_code = bid2x_main.run_app(app)
+  except Exception as e:  # pylint: disable=broad-exception-caught
+    # One bad config must not stop the others.
+    return BatchResult(
+        config, 'error', None, time.monotonic() - start,
+        f'{type(e).__name__}: {e}'
+    )
+
+  return BatchResult(
+      config,
+      'ok' if return_code == 0 else 'failed',
+      return_code,
+      time.monotonic() - start,
+  )
+
+
+def run_batch(
+    config_paths: list[str], max_workers: int = bid2x_var.BATCH_MAX_WORKERS
+) -> list[BatchResult]:
+  """Runs config files on a bounded pool of worker threads.
+
+  Args:
+    config_paths: the config files to run.
+    max_workers: the maximum number of configs run at the same time.
+
+  Returns:
+    One result per config, in the order given.  The batch is reported and
+    recorded in the metrics as one run, which succeeded if every config did.
+  """
+  results = []
+  start_time = time.time()
+  try:
+    with futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+      results = list(pool.map(run_config, config_paths))
+  finally:
+    bid2x_main.finish_run(
+        bool(results) and all(result.status == 'ok' for result in results),
+        start_time,
+    )
+
+  return results
+
+
+def print_summary(results: list[BatchResult]) -> None:
+  """Prints one line per config run and the overall counts."""
+  print('bid2x batch summary:')
+  for result in results:
+    line = f'  {result.status:<6} {result.seconds:8.1f}s  {result.config}'
+    if result.return_code not in (0, None):
+      line += f'  (returned {result.return_code})'
+    if result.message:
+      line += f'  {result.message}'
+    print(line)
+
+  succeeded = sum(result.status == 'ok' for result in results)
+  print(f'{succeeded} of {len(results)} config(s) succeeded.')
+
+
+def main(argv: list[str]) -> int:
+  parser = argparse.ArgumentParser(
+      description='Run several bid2x config files in one process.'
+  )
+  parser.add_argument(
+      'configs', nargs='+',
+      help='Config files, gs:// URIs or glob patterns of either.'
+  )
+  parser.add_argument(
+      '-w', '--max_workers', type=int, default=bid2x_var.BATCH_MAX_WORKERS,
+      help='Configs run at the same time (default: %(default)s).'
+  )
+  args = parser.parse_args(argv[1:])
+
+  config_paths = expand_config_paths(args.configs)
+  if not config_paths:
+    print('No config files to run.')
+    return -1
+
+  results = run_batch(config_paths, args.max_workers)
+  print_summary(results)
+
+  return 0 if all(result.status == 'ok' for result in results) else -1
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
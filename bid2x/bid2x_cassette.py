@@ -0,0 +1,463 @@
+"""BidToX - HTTP cassettes: recorded API traffic replayed without a network.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  With --record_cassette (or BID2X_RECORD_CASSETTE) set, every request the
+  googleapiclient services and gspread make through bid2x's shared
+  transports (see auth/bid2x_credentials.py) is recorded with its response
+  and how long it took.  The cassette is written when the process exits,
+  as gzip compressed JSON lines: a header, then one line per request.
+
+  Cassettes are meant to be shared, so secrets are left out.  Request
+  headers, and with them the access token, are not recorded, nor are token
+  requests.  Query parameters and JSON fields that carry credentials, e.g.
+  access_token or private_key, are replaced with REDACTED.  URLs are
+  recorded relative to the API root, e.g. 'sheets/v4/spreadsheets/...',
+  so traffic recorded against the fake APIs of bid2x_fake_api replays
+  against Google's URLs and back.
+
+  With --replay_cassette (or BID2X_REPLAY_CASSETTE) set, no request leaves
+  the process: each is answered with the next recorded response to the
+  same method and URL, in recorded order, and no token is fetched.  The
+  response comes back after the recorded time with --replay_latency
+  original (the default), or straight away with --replay_latency zero.  A
+  request the cassette has no response left for raises CassetteMissError.
+
+  Example usage:
+      python main.py -i dv_config.json --record_cassette /tmp/run.cassette
+      python main.py -i dv_config.json --replay_cassette /tmp/run.cassette \
+          --replay_latency zero
+"""
+
+import atexit
+import base64
+import collections
+import datetime
+import gzip
+import http
+import json
+import os
+import re
+import threading
+import time
+from typing import Any
+from urllib import parse
+
+from auth import bid2x_discovery
+import bid2x_var
+import httplib2
+import requests
+
+CASSETTE_VERSION = 1
+
+REDACTED = 'REDACTED'
+
+# Query parameters and JSON fields whose values are never recorded.
+SECRET_NAMES = frozenset((
+    'access_token',
+    'client_secret',
+    'id_token',
+    'key',
+    'private_key',
+    'private_key_id',
+    'refresh_token',
+    'token',
+))
+
+# The only response headers recorded.  bid2x makes no resumable uploads,
+# whose location headers would tie a cassette to the host recorded from.
+RECORDED_HEADERS = ('content-type',)
+
+# Content types recorded as text.
+TEXT_CONTENT_PATTERN = re.compile(r'^(text/|application/(json|javascript))')
+
+LATENCY_ORIGINAL = 'original'
+LATENCY_ZERO = 'zero'
+LATENCIES = (LATENCY_ORIGINAL, LATENCY_ZERO)
+
+
+class CassetteMissError(Exception):
+  """A request was made that the cassette has no response for."""
+
+
+def canonical_url(url: str) -> str:
+  """Returns a URL relative to its API root with secrets redacted.
+
+  Args:
+    url: a Google API URL, or one rewritten to the endpoint override.
+
+  Returns:
+    '<api>/<path>?<query>', e.g. 'sheets/v4/spreadsheets/1?alt=json'.
+  """
+  api_name = bid2x_discovery.url_api_name(url)
+  path = bid2x_discovery.url_api_path(url)
+  path, _, query = path.partition('?')
+  if query:
+    pairs = [
+        (name, REDACTED if name in SECRET_NAMES else value)
+        for name, value in parse.parse_qsl(query, keep_blank_values=True)
+    ]
+    path += '?' + parse.urlencode(pairs)
+
+  return f'{api_name}/{path}'
+
+
+def redact(value: Any) -> Any:
+  """Returns decoded JSON with the values of secret fields redacted.
+
+  Only string values are secrets: a discovery document describes its
+  'key' and 'access_token' parameters with objects, kept as they are.
+  """
+  if isinstance(value, dict):
+    return {
+        name: (
+            REDACTED
+            if name in SECRET_NAMES and isinstance(item, str)
+            else redact(item)
+        )
+        for name, item in value.items()
+    }
+  if isinstance(value, list):
+    return [redact(item) for item in value]
+
+  return value
+
+
+class Interaction:
+  """A recorded request and its response.
+
+  Attributes:
+    method: the HTTP method, e.g. 'GET'.
+    url: the canonical URL, see canonical_url.
+    status: the HTTP status of the response.
+    headers: the recorded response headers, lower case.
+    content: the response body.
+    seconds: how long the request took.
+  """
+
+  method: str
+  url: str
+  status: int
+  headers: dict[str, str]
+  content: bytes
+  seconds: float
+
+  def __init__(
+      self,
+      method: str,
+      url: str,
+      status: int,
+      headers: dict[str, str],
+      content: bytes,
+      seconds: float,
+  ):
+    self.method = method
+    self.url = url
+    self.status = status
+    self.headers = headers
+    self.content = content
+    self.seconds = seconds
+
+  @classmethod
+  def from_response(
+      cls,
+      method: str,
+      url: str,
+      status: int,
+      headers: Any,
+      content: bytes | None,
+      seconds: float,
+  ) -> 'Interaction':
+    """Returns the interaction to record for a response, redacted."""
+    recorded_headers = {}
+    for name in RECORDED_HEADERS:
+      value = headers.get(name)
+      if value is not None:
+        recorded_headers[name] = value
+
+    content = content or b''
+    if 'json' in recorded_headers.get('content-type', ''):
+      try:
+        content = json.dumps(redact(json.loads(content))).encode('utf-8')
+      except ValueError:
+        pass  # Not JSON after all, recorded as is.
+
+    return cls(
+        method.upper(), canonical_url(url), status, recorded_headers,
+        content, seconds,
+    )
+
+  def to_json(self) -> dict[str, Any]:
+    """Returns the interaction as a cassette line."""
+    line = {
+        'method': self.method,
+        'url': self.url,
+        'status': self.status,
+        'headers': self.headers,
+        'seconds': round(self.seconds, 6),
+    }
+    if TEXT_CONTENT_PATTERN.match(self.headers.get('content-type', '')):
+      try:
+        line['body'] = self.content.decode('utf-8')
+        return line
+      except UnicodeDecodeError:
+        pass
+    line['body_base64'] = base64.b64encode(self.content).decode('ascii')
+    return line
+
+  @classmethod
+  def from_json(cls, line: dict[str, Any]) -> 'Interaction':
+    """Returns the interaction of a cassette line."""
+    if 'body_base64' in line:
+      content = base64.b64decode(line['body_base64'])
+    else:
+      content = line.get('body', '').encode('utf-8')
+
+    return cls(
+        line['method'], line['url'], line['status'], line['headers'],
+        content, line['seconds'],
+    )
+
+  def httplib2_response(self) -> tuple[httplib2.Response, bytes]:
+    """Returns the response as httplib2.Http.request() does."""
+    info = dict(self.headers)
+    info['status'] = str(self.status)
+    return httplib2.Response(info), self.content
+
+  def requests_response(self, url: str) -> requests.Response:
+    """Returns the response as requests.Session.request() does."""
+    response = requests.Response()
+    response.status_code = self.status
+    response.headers = requests.structures.CaseInsensitiveDict(self.headers)
+    response._content = self.content  # pylint: disable=protected-access
+    response.url = url
+    try:
+      response.reason = http.HTTPStatus(self.status).phrase
+    except ValueError:
+      response.reason = ''
+    return response
+
+
+class Recorder:
+  """Collects interactions and writes them to a cassette.
+
+  Attributes:
+    path: the cassette file written.
+    metadata: JSON serialisable details written in the cassette's header.
+  """
+
+  path: str
+  metadata: dict[str, Any]
+
+  def __init__(self, path: str, metadata: dict[str, Any] | None = None):
+    self.path = path
+    self.metadata = metadata or {}
+    self._interactions = []
+    self._lock = threading.Lock()
+
+  def __len__(self) -> int:
+    with self._lock:
+      return len(self._interactions)
+
+  def record(self, interaction: Interaction) -> None:
+    """Adds an interaction, in the order requests finished."""
+    with self._lock:
+      self._interactions.append(interaction)
+
+  def save(self) -> None:
+    """Writes the interactions recorded so far to the cassette."""
+    with self._lock:
+      interactions = list(self._interactions)
+
+    header = {
+        'version': CASSETTE_VERSION,
+        'recorded': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'interactions': len(interactions),
+        'metadata': self.metadata,
+    }
+    with gzip.open(self.path, 'wt', encoding='utf-8') as f:
+      f.write(json.dumps(header) + '\n')
+      for interaction in interactions:
+        f.write(json.dumps(interaction.to_json()) + '\n')
+
+
+class Player:
+  """Answers requests from a cassette.
+
+  Attributes:
+    path: the cassette file read.
+    metadata: the details recorded in the cassette's header.
+    latency: 'original' to answer after the recorded time, 'zero' to answer
+      straight away.
+    played: the number of requests answered.
+  """
+
+  path: str
+  metadata: dict[str, Any]
+  latency: str
+  played: int
+
+  def __init__(self, path: str, latency: str = LATENCY_ORIGINAL):
+    if latency not in LATENCIES:
+      raise ValueError(f'Replay latency must be one of {LATENCIES}')
+
+    self.path = path
+    self.latency = latency
+    self.played = 0
+    self._queues = collections.defaultdict(collections.deque)
+    self._lock = threading.Lock()
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+      header = json.loads(f.readline())
+      if header.get('version') != CASSETTE_VERSION:
+        raise ValueError(
+            f'{path} is a version {header.get("version")} cassette, '
+            f'expected version {CASSETTE_VERSION}'
+        )
+      self.metadata = header.get('metadata', {})
+      for line in f:
+        interaction = Interaction.from_json(json.loads(line))
+        self._queues[(interaction.method, interaction.url)].append(
+            interaction
+        )
+
+  def remaining(self) -> int:
+    """Returns the number of recorded requests not yet made."""
+    with self._lock:
+      return sum(len(queue) for queue in self._queues.values())
+
+  def play(self, method: str, url: str) -> Interaction:
+    """Returns the next recorded response to a request.
+
+    Args:
+      method: the HTTP method of the request.
+      url: the URL requested.
+
+    Returns:
+      The interaction, once the recorded time has passed if replaying with
+      the original latency.
+
+    Raises:
+      CassetteMissError: no response to the request is left.
+    """
+    key = (method.upper(), canonical_url(url))
+    with self._lock:
+      queue = self._queues.get(key)
+      if not queue:
+        raise CassetteMissError(
+            f'{self.path} has no response left for {key[0]} {key[1]}'
+        )
+      interaction = queue.popleft()
+      self.played += 1
+
+    if self.latency == LATENCY_ORIGINAL and interaction.seconds > 0:
+      time.sleep(interaction.seconds)
+
+    return interaction
+
+
+# The recorder and player, set up on first use from bid2x_var or the
+# environment.  At most one is set.
+_recorder: Recorder | None = None
+_player: Player | None = None
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure(
+    record: str | None = None,
+    replay: str | None = None,
+    latency: str | None = None,
+    metadata: dict[str, Any] | None = None,
+) -> None:
+  """Sets the cassette requests are recorded to or replayed from.
+
+  With neither given, bid2x_var.RECORD_CASSETTE and REPLAY_CASSETTE, and
+  then the environment variables they name, are read.  A recording left
+  unsaved by an earlier call is saved first.
+
+  Args:
+    record: the cassette to record requests to.
+    replay: the cassette to replay requests from.
+    latency: 'original' or 'zero', see Player.  Defaults to
+      bid2x_var.REPLAY_LATENCY, then its environment variable, then
+      'original'.
+    metadata: details to write in a recorded cassette's header.
+  """
+  global _recorder, _player, _configured
+
+  if record is None and replay is None:
+    record = bid2x_var.RECORD_CASSETTE or os.getenv(
+        bid2x_var.RECORD_CASSETTE_ENV_VAR
+    )
+    replay = bid2x_var.REPLAY_CASSETTE or os.getenv(
+        bid2x_var.REPLAY_CASSETTE_ENV_VAR
+    )
+  if record and replay:
+    raise ValueError('Only one of record and replay cassettes can be set')
+  if latency is None:
+    latency = (
+        bid2x_var.REPLAY_LATENCY
+        or os.getenv(bid2x_var.REPLAY_LATENCY_ENV_VAR)
+        or LATENCY_ORIGINAL
+    )
+
+  with _configure_lock:
+    if _recorder is not None:
+      _recorder.save()
+    _recorder = Recorder(record, metadata) if record else None
+    _player = Player(replay, latency) if replay else None
+    _configured = True
+
+
+def recorder() -> Recorder | None:
+  """Returns the recorder, None if requests aren't being recorded."""
+  if not _configured:
+    configure()
+
+  return _recorder
+
+
+def player() -> Player | None:
+  """Returns the player, None if requests aren't being replayed."""
+  if not _configured:
+    configure()
+
+  return _player
+
+
+def save() -> None:
+  """Writes the cassette being recorded, if any."""
+  with _configure_lock:
+    if _recorder is not None:
+      _recorder.save()
+
+
+def stop() -> None:
+  """Writes the cassette being recorded, if any, and stops using cassettes.
+  """
+  global _recorder, _player, _configured
+
+  with _configure_lock:
+    if _recorder is not None:
+      _recorder.save()
+    _recorder = None
+    _player = None
+    _configured = True
+
+
+atexit.register(save)
@@ -0,0 +1,503 @@
+"""BidToX - Config file schema, validation and cache.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  The fields of a config file, their types and whether they are required
+  are described here, per platform (see the Configuration File Reference in
+  the README).  validate() checks a decoded config against them in one pass
+  and returns every problem found, so a config with several mistakes is
+  fixed in one go rather than one KeyError at a time.  Fields the schema
+  does not know are allowed, as save_config writes more than is read.
+
+  load() reads a config file, decodes and validates it and returns it as a
+  dict, raising ConfigError listing all the problems if it is not valid.
+  Validated configs are kept pickled, keyed by the SHA-256 of their content
+  and SCHEMA_VERSION: in memory for the life of the process, and in
+  --config_cache_dir (or BID2X_CONFIG_CACHE_DIR) if set, so that warm
+  instances and batch runs loading an unchanged config only unpickle it.
+  Every load unpickles its own copy, so apps built from the same config
+  share no lists or dicts.  Only set the cache directory to one that no
+  one but bid2x writes to, as its files are unpickled.
+
+  Example usage:
+      try:
+        config = bid2x_config.load('dv_config.json')
+      except bid2x_config.ConfigError as e:
+        print(e)
+"""
+
+import dataclasses
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from typing import Any
+
+import bid2x_util
+import bid2x_var
+
+# Part of every cache key; change it whenever the schema changes so that
+# configs validated against an older schema are validated again.
+SCHEMA_VERSION = '2'
+
+CACHE_FILE_PREFIX = 'bid2x-config-'
+CACHE_FILE_SUFFIX = '.pickle'
+
+# The Python types of each JSON type a field can have, for error messages.
+TYPE_NAMES = {
+    bool: 'boolean',
+    int: 'integer',
+    float: 'number',
+    str: 'string',
+    list: 'list',
+    dict: 'object',
+    type(None): 'null',
+}
+
+# IDs are normally integers, but the APIs take them as strings too.
+ID = (int, str)
+NUMBER = (int, float)
+
+
+class ConfigError(ValueError):
+  """A config file is not valid.
+
+  Attributes:
+    source: the config file path or GCS URI.
+    errors: every problem found, each '<field path>: <problem>'.
+  """
+
+  def __init__(self, source: str, errors: list[str]):
+    self.source = source
+    self.errors = errors
+    lines = '\n'.join(f'  {error}' for error in errors)
+    super().__init__(
+        f'Config {source} has {len(errors)} error(s):\n{lines}'
+    )
+
+
+@dataclasses.dataclass(frozen=True)
+class Field:
+  """A field of a config object.
+
+  Attributes:
+    name: the field's key.
+    types: the Python types its decoded value may have.
+    required: whether the field must be present.
+    items: for lists, the types its items may have, None for any.
+    choices: the values it may have, None for any.
+    fields: for objects (or lists of objects), their fields.
+    closed: for objects, whether fields not in fields are problems.
+  """
+
+  name: str
+  types: tuple[type, ...]
+  required: bool = True
+  items: tuple[type, ...] | None = None
+  choices: tuple[Any, ...] | None = None
+  fields: tuple['Field', ...] | None = None
+  closed: bool = False
+
+
+def enum_values(enum: Any) -> tuple[str, ...]:
+  """Returns the values of an Enum of bid2x_var."""
+  return tuple(member.value for member in enum)
+
+
+SHEET_FIELDS = (
+    Field('sheet_id', (str,)),
+    Field('sheet_url', (str,)),
+    Field('json_auth_file', (str,)),
+)
+
+DV_SHEET_FIELDS = SHEET_FIELDS + (
+    Field('column_status', (str,)),
+    Field('column_lineitem_id', (str,)),
+    Field('column_lineitem_name', (str,)),
+    Field('column_lineitem_type', (str,)),
+    Field('column_campaign_id', (str,)),
+    Field('column_advertiser_id', (str,)),
+    Field('column_custom_bidding', (str,)),
+    Field('debug', (bool,)),
+    Field('clear_onoff', (bool,)),
+)
+
+# The sheet rows and columns a zone writes its scripts to.  A zone with no
+# row writes none.
+ZONE_CELL_FIELDS = (
+    Field('update_row', (int, type(None))),
+    Field('update_col', (int, type(None))),
+    Field('test_row', (int, type(None))),
+    Field('test_col', (int, type(None))),
+)
+
+DV_ZONE_FIELDS = (
+    Field('name', (str,)),
+    Field('campaign_id', ID),
+    Field('advertiser_id', ID),
+    Field('algorithm_id', ID),
+    Field('debug', (bool,)),
+    Field('cb_algorithm', (str,), required=False),
+) + ZONE_CELL_FIELDS
+
+GTM_ZONE_FIELDS = (
+    Field('name', (str,)),
+    Field('account_id', ID),
+    Field('container_id', ID),
+    Field('workspace_id', ID),
+    Field('variable_id', ID),
+) + ZONE_CELL_FIELDS
+
+# Passed to bid2x_gtm.GTMFloodlight as keyword arguments, so the list's
+# objects may have no other fields.
+FLOODLIGHT_FIELDS = (
+    Field('floodlight_name', (str,)),
+    Field('per_row_condition', (str,)),
+    Field('total_var', (str,)),
+    Field('floodlight_condition', (str, type(None)), required=False),
+    Field('hit_rate_weight', NUMBER + (type(None),), required=False),
+)
+
+COMMON_FIELDS = (
+    Field('scopes', (list,), items=(str,)),
+    Field('api_name', (str,)),
+    Field('api_version', (str,)),
+    Field('service_account_email', (str,)),
+    Field('json_auth_file', (str,)),
+    Field('debug', (bool,)),
+    Field('trace', (bool,)),
+    Field('discovery_cache_dir', (str,), required=False),
+)
+
+DV_FIELDS = COMMON_FIELDS + (
+    Field('sheet', (dict,), fields=DV_SHEET_FIELDS),
+    Field('zone_array', (list,), required=False, fields=DV_ZONE_FIELDS),
+    Field('action_list_algos', (bool,)),
+    Field('action_list_scripts', (bool,)),
+    Field('action_create_algorithm', (bool,)),
+    Field('action_update_spreadsheet', (bool,)),
+    Field('action_remove_algorithm', (bool,)),
+    Field('action_update_scripts', (bool,)),
+    Field('action_test', (bool,)),
+    Field('clear_onoff', (bool,)),
+    Field('defer_pattern', (bool,)),
+    Field('alternate_algorithm', (bool,)),
+    Field('new_algo_name', (str,)),
+    Field('new_algo_display_name', (str,)),
+    Field('line_item_name_pattern', (str,)),
+    Field('cb_tmp_file_prefix', (str,)),
+    Field('cb_last_update_file_prefix', (str,)),
+    Field('partner_id', ID),
+    Field('advertiser_id', ID),
+    Field('cb_algo_id', ID),
+    Field('floodlight_id_list', (list,), items=ID),
+    Field('zones_to_process', (str,)),
+    Field('attr_model_id', ID),
+    Field('bidding_factor_high', NUMBER),
+    Field('bidding_factor_low', NUMBER),
+    Field('dv_max_workers', (int,), required=False),
+    Field('journal_path', (str, type(None)), required=False),
+    Field('time_budget', NUMBER + (type(None),), required=False),
+    Field(
+        'zone_order',
+        (str,),
+        required=False,
+        choices=enum_values(bid2x_var.ZoneOrder),
+    ),
+)
+
+GTM_FIELDS = COMMON_FIELDS + (
+    Field('sheet', (dict,), fields=SHEET_FIELDS),
+    Field('zone_array', (list,), required=False, fields=GTM_ZONE_FIELDS),
+    Field(
+        'gtm_floodlight_list', (list,), fields=FLOODLIGHT_FIELDS, closed=True
+    ),
+    Field('gtm_preprocessing_script', (str,), required=False),
+    Field('gtm_postprocessing_script', (str,), required=False),
+    Field('value_adjustment_column_name', (str,), required=False),
+    Field('index_low_column_name', (str,), required=False),
+    Field('index_high_column_name', (str,), required=False),
+    Field('action_update_scripts', (bool,), required=False),
+    Field('action_test', (bool,), required=False),
+    Field('gtm_batch_by_container', (bool,), required=False),
+    Field(
+        'gtm_change_detection',
+        (str,),
+        required=False,
+        choices=enum_values(bid2x_var.GTMChangeDetection),
+    ),
+    Field('gtm_state_file', (str,), required=False),
+    Field(
+        'gtm_workspace_mode',
+        (str,),
+        required=False,
+        choices=enum_values(bid2x_var.GTMWorkspaceMode),
+    ),
+    Field('gtm_workspace_name', (str,), required=False),
+    Field('gtm_delete_stale_workspaces', (bool,), required=False),
+    Field('gtm_stale_workspace_age_hours', NUMBER, required=False),
+    Field('gtm_max_workers', (int,), required=False),
+    Field('gtm_min_call_interval', NUMBER, required=False),
+    Field(
+        'gtm_emission_mode',
+        (str,),
+        required=False,
+        choices=enum_values(bid2x_var.GTMEmissionMode),
+    ),
+    Field('zones_to_process', (str,), required=False),
+)
+
+PLATFORM_FIELDS = {
+    bid2x_var.PlatformType.DV.value: DV_FIELDS,
+    bid2x_var.PlatformType.GTM.value: GTM_FIELDS,
+}
+
+
+def type_names(types: tuple[type, ...]) -> str:
+  """Returns the JSON names of types, e.g. 'integer or string'."""
+  return ' or '.join(dict.fromkeys(TYPE_NAMES[t] for t in types))
+
+
+def has_type(value: Any, types: tuple[type, ...]) -> bool:
+  """Returns True if a decoded JSON value has one of the types.
+
+  JSON true and false are not numbers, even though Python bools are ints.
+  """
+  if isinstance(value, bool):
+    return bool in types
+  return isinstance(value, types)
+
+
+def validate_object(
+    value: dict[str, Any],
+    fields: tuple[Field, ...],
+    path: str,
+    errors: list[str],
+    closed: bool = False,
+) -> None:
+  """Checks an object's fields, adding a message per problem to errors.
+
+  Args:
+    value: the decoded object.
+    fields: its fields.
+    path: where the object is in the config, '' for the top level.
+    errors: the problems found so far.
+    closed: whether fields not in fields are problems.
+  """
+  prefix = f'{path}.' if path else ''
+  for field in fields:
+    field_path = f'{prefix}{field.name}'
+    if field.name not in value:
+      if field.required:
+        errors.append(f'{field_path}: missing required field')
+      continue
+
+    field_value = value[field.name]
+    if not has_type(field_value, field.types):
+      errors.append(
+          f'{field_path}: expected {type_names(field.types)}, '
+          f'got {type_names((type(field_value),))}'
+      )
+      continue
+
+    if field.choices is not None and field_value not in field.choices:
+      choices = ', '.join(repr(choice) for choice in field.choices)
+      errors.append(
+          f'{field_path}: {field_value!r} is not one of {choices}'
+      )
+
+    if isinstance(field_value, list):
+      for index, item in enumerate(field_value):
+        item_path = f'{field_path}[{index}]'
+        if field.fields is not None:
+          if not isinstance(item, dict):
+            errors.append(
+                f'{item_path}: expected object, '
+                f'got {type_names((type(item),))}'
+            )
+          else:
+            validate_object(
+                item, field.fields, item_path, errors, field.closed
+            )
+        elif field.items is not None and not has_type(item, field.items):
+          errors.append(
+              f'{item_path}: expected {type_names(field.items)}, '
+              f'got {type_names((type(item),))}'
+          )
+    elif isinstance(field_value, dict) and field.fields is not None:
+      validate_object(
+          field_value, field.fields, field_path, errors, field.closed
+      )
+
+  if closed:
+    known = {field.name for field in fields}
+    for name in value:
+      if name not in known:
+        errors.append(f'{prefix}{name}: unknown field')
+
+
+def validate(config: Any) -> list[str]:
+  """Checks a decoded config against the schema of its platform.
+
+  Args:
+    config: the decoded config file.
+
+  Returns:
+    Every problem found, each '<field path>: <problem>'; empty if the
+    config is valid.
+  """
+  if not isinstance(config, dict):
+    return [f'expected an object, got {type_names((type(config),))}']
+
+  platform_type = config.get('platform_type')
+  if 'platform_type' not in config:
+    return ['platform_type: missing required field']
+  if (
+      not isinstance(platform_type, str)
+      or platform_type.upper() not in PLATFORM_FIELDS
+  ):
+    platforms = ', '.join(repr(platform) for platform in PLATFORM_FIELDS)
+    return [f'platform_type: {platform_type!r} is not one of {platforms}']
+
+  errors = []
+  validate_object(config, PLATFORM_FIELDS[platform_type.upper()], '', errors)
+  return errors
+
+
+def cache_key(content: str) -> str:
+  """Returns the cache key of a config's content."""
+  digest = hashlib.sha256(SCHEMA_VERSION.encode())
+  digest.update(b'\0')
+  digest.update(content.encode())
+  return digest.hexdigest()
+
+
+def cache_dir() -> str | None:
+  """Returns the directory validated configs are cached in, if any."""
+  return bid2x_var.CONFIG_CACHE_DIR or os.getenv(
+      bid2x_var.CONFIG_CACHE_DIR_ENV_VAR
+  )
+
+
+def cache_path(directory: str, key: str) -> str:
+  """Returns the cache file of a key in a directory."""
+  return os.path.join(
+      directory, f'{CACHE_FILE_PREFIX}{key}{CACHE_FILE_SUFFIX}'
+  )
+
+
+def read_cache_file(directory: str, key: str) -> bytes | None:
+  """Returns a pickled config from the cache directory, None if absent."""
+  try:
+    with open(cache_path(directory, key), 'rb') as f:
+      return f.read()
+  except OSError:
+    return None
+
+
+def write_cache_file(directory: str, key: str, pickled: bytes) -> None:
+  """Writes a pickled config to the cache directory.
+
+  The file is written to a temporary file and renamed, so processes
+  sharing the directory never read part of one.  A cache that cannot be
+  written is reported and otherwise ignored.
+  """
+  try:
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+      f.write(pickled)
+    os.replace(tmp_path, cache_path(directory, key))
+  except OSError as e:
+    print(f'Unable to cache config in {directory}: {e}')
+
+
+# Validated configs, pickled, by cache key.
+_cache: dict[str, bytes] = {}
+_cache_lock = threading.Lock()
+
+
+def parse(content: str, source: str = '<string>') -> dict[str, Any]:
+  """Decodes and validates a config's content, or takes it from the cache.
+
+  Args:
+    content: the config file's JSON.
+    source: where the content came from, for error messages.
+
+  Returns:
+    The config, a fresh copy for every call.
+
+  Raises:
+    ConfigError: If the content is not JSON or does not fit the schema.
+  """
+  key = cache_key(content)
+  with _cache_lock:
+    pickled = _cache.get(key)
+
+  directory = cache_dir()
+  if pickled is None and directory:
+    pickled = read_cache_file(directory, key)
+    if pickled is not None:
+      try:
+        config = pickle.loads(pickled)
+      except Exception as e:  # pylint: disable=broad-exception-caught
+        print(f'Ignoring unreadable cached config for {source}: {e}')
+        pickled = None
+      else:
+        with _cache_lock:
+          _cache[key] = pickled
+        return config
+
+  if pickled is not None:
+    return pickle.loads(pickled)
+
+  try:
+    config = json.loads(content)
+  except json.JSONDecodeError as e:
+    raise ConfigError(source, [f'not valid JSON: {e}']) from e
+
+  errors = validate(config)
+  if errors:
+    raise ConfigError(source, errors)
+
+  pickled = pickle.dumps(config, protocol=pickle.HIGHEST_PROTOCOL)
+  with _cache_lock:
+    _cache[key] = pickled
+  if directory:
+    write_cache_file(directory, key, pickled)
+
+  return config
+
+
+def load(filename: str) -> dict[str, Any]:
+  """Reads, decodes and validates a config file.
+
+  Args:
+    filename: the path or GCS URI of the config file.
+
+  Returns:
+    The config.
+
+  Raises:
+    ConfigError: If the config is not JSON or does not fit the schema.
+    FileNotFoundError: If the local file doesn't exist.
+    google.cloud.exceptions.NotFound: If the GCS object doesn't exist.
+  """
+  return parse(bid2x_util.read_config_text(filename), filename)
@@ -25,19 +25,26 @@
 
 import inspect
 import json
+import time
 
-from typing import Any
+from typing import Any, TYPE_CHECKING
 
+import bid2x_journal
+import bid2x_metrics
+import bid2x_pipeline
 from bid2x_platform import Platform
+import bid2x_scheduler
 from bid2x_spreadsheet import Bid2xSpreadsheet
+import bid2x_trace
 import bid2x_util
 import bid2x_var
 from googleapiclient import errors
 import gspread
-import pandas
+
+if TYPE_CHECKING:
+  from pandas import DataFrame
 
 HttpError = errors.HttpError
-DataFrame = pandas.DataFrame
 
 
 class Bid2xDV(Platform):
@@ -78,6 +85,10 @@ class Bid2xDV(Platform):
     attr_model_id(int): Attribution Model ID for Floodlights.
     bidding_factor_high(int): Max bidding factor.
     bidding_factor_low(int): Min bidding factor.
+    dv_max_workers(int): Pipeline stages run at the same time.
+    journal_path(str): Run journal file or gs:// object, None for none.
+    time_budget(float): Seconds the zones' work may take, None for no limit.
+    zone_order(str): Order zones are started in, see ZoneOrder.
 
   Methods:
     list_partner_algo_scripts (self,
@@ -166,10 +177,16 @@ class Bid2xDV(Platform):
         Generate a Custom Bidding script based on Max conversion
         counts across a single sales zone.
 
-    process_script(self, service):
+    generate_cb_script_from_records (self, list_of_dicts):
+        Generate the same script from a sales zone's rows already
+        read from the spreadsheet.
+
+    process_script(self, service, zone_array):
         This function orchestrates the custom bidding change in DV360
         that adjusts bid multipliers for different line items by way
         of a new custom bidding script that is created and saved.
+        Updates, tests and spreadsheet updates run as a pipeline of
+        per zone stages, see bid2x_pipeline.
 
     top_level_copy(self, source): Copies all variable settings
         from config file to the object.
@@ -208,6 +225,10 @@ class Bid2xDV(Platform):
   attr_model_id: int  # Attribution Model ID for Floodlights.
   bidding_factor_high: int  # Max bidding factor.
   bidding_factor_low: int  # Min bidding factor.
+  dv_max_workers: int  # Pipeline stages run at the same time.
+  journal_path: str | None  # Run journal file or gs:// object.
+  time_budget: float | None  # Seconds the zones' work may take.
+  zone_order: str  # Order zones are started in, see ZoneOrder.
 
   def __init__(self, sheet: Bid2xSpreadsheet, debug: bool) -> None:
     self.sheet = sheet
@@ -251,6 +272,10 @@ class Bid2xDV(Platform):
 
     self.bidding_factor_high = bid2x_var.BIDDING_FACTOR_HIGH
     self.bidding_factor_low = bid2x_var.BIDDING_FACTOR_LOW
+    self.dv_max_workers = bid2x_var.DV_MAX_WORKERS
+    self.journal_path = bid2x_var.JOURNAL_PATH
+    self.time_budget = bid2x_var.TIME_BUDGET
+    self.zone_order = bid2x_var.ZONE_ORDER
 
   def __str__(self) -> str:
     """Override str method to return a sensible string.
@@ -287,6 +312,10 @@ class Bid2xDV(Platform):
         f'attr_model_id: {self.attr_model_id}\n'
         f'bidding_factor_high: {self.bidding_factor_high}\n'
         f'bidding_factor_low: {self.bidding_factor_low}\n'
+        f'dv_max_workers: {self.dv_max_workers}\n'
+        f'journal_path: {self.journal_path}\n'
+        f'time_budget: {self.time_budget}\n'
+        f'zone_order: {self.zone_order}\n'
         '------------------------\n'
         'Zones:\n'
     )
@@ -813,7 +842,7 @@ class Bid2xDV(Platform):
 
     return True
 
-  def print_data_frame(self, input_df: DataFrame) -> None:
+  def print_data_frame(self, input_df: 'DataFrame') -> None:
     """Converts a dataframe to a string and prints it to stdout.
 
     Args:
@@ -843,9 +872,12 @@ class Bid2xDV(Platform):
     list_of_dicts = []
 
     try:
-      ref = self.sheet.gc.open_by_key(self.sheet.sheet_id
-                                     ).worksheet(zone_string)
-      list_of_dicts = ref.get_all_records()
+      with bid2x_trace.span('sheets.read_zone', zone=zone_string) as span:
+        ref = self.sheet.open_worksheet(zone_string)
+        self.sheet.reserve_quota('spreadsheets.values.get')
+        list_of_dicts = ref.get_all_records()
+        span.add('rows', len(list_of_dicts))
+      bid2x_metrics.SHEET_ROWS_READ.inc(len(list_of_dicts), tab='zone')
     except gspread.exceptions.SpreadsheetNotFound:
       print('Error: Spreadsheet not found while.')
     except gspread.exceptions.WorksheetNotFound:
@@ -863,6 +895,22 @@ class Bid2xDV(Platform):
       )
       raise  # Reraise the exception.
 
+    return self.generate_cb_script_from_records(list_of_dicts)
+
+  @bid2x_trace.traced('dv.generate_script')
+  def generate_cb_script_from_records(
+      self, list_of_dicts: list[dict[str, Any]]
+  ) -> str:
+    """Generate a Custom Bidding script from rows already read from a zone.
+
+    Args:
+        list_of_dicts: the rows of the sales zone's tab, keyed by column
+        heading, as returned by gspread's get_all_records().
+
+    Returns:
+        A fully formed custom bidding script suitable for upload to DV360.
+    """
+
     if not self.alternate_algorithm:
       # If we are not using the alternate algorithm then we need to
       # create a function that uses max_aggregate.
@@ -966,21 +1014,42 @@ class Bid2xDV(Platform):
     if not processed_line_items:
       cust_bidding_function_string = 'return 0;'
 
+    bid2x_trace.annotate(
+        rows=len(list_of_dicts),
+        script_bytes=len(cust_bidding_function_string),
+    )
+    bid2x_metrics.SCRIPT_BYTES.observe(
+        len(cust_bidding_function_string), platform='dv'
+    )
     return cust_bidding_function_string
 
-  def process_script(self, service: Any) -> bool:
+  def process_script(
+      self,
+      service: Any,
+      zone_array: list[Any] | None = None,
+      shared_actions: bool = True,
+  ) -> bool:
     """Orchestrates the custom bidding change in DV360.
 
     Args:
       service: a service object previously opened with the DV360 API.
+      zone_array: the Bid2xModel objects of the zones to process.  Defaults
+        to this object's zone_array.
+      shared_actions: whether to run the actions not tied to a zone
+        (listing and removing algorithms).  Only one of the tasks sharing
+        a config's zones runs them.
 
     Returns:
       True if process is a success, False otherwise.
     """
+    # The time budget starts here, so it also covers the actions below.
+    start = time.monotonic()
+    if zone_array is None:
+      zone_array = self.zone_array
 
     if self.action_list_scripts:
       # Show advertiser level scripts for each initialized zone
-      for zone in self.zone_array:
+      for zone in zone_array:
         print(
             f'Custom bidding scripts for zone {zone.name}',
             f' advertiser_id = {zone.advertiser_id}'
@@ -993,7 +1062,7 @@ class Bid2xDV(Platform):
         json_pretty_print = json.dumps(response, indent=2)
         print(f'{json_pretty_print}')
 
-    if self.action_list_algos:
+    if self.action_list_algos and shared_actions:
       # Show advertiser level algorithms for each initialized zone
       print(
           'Advertiser level algorithms for advertiser ID ',
@@ -1007,7 +1076,7 @@ class Bid2xDV(Platform):
       # Create a new custom bidding algorithm from Partner level.
       print('Create new custom bidding algorithm for zone(s):')
 
-      for zone in self.zone_array:
+      for zone in zone_array:
         # Create CB Algorithm at the Advertiser level.
         algorithm_name = self.new_algo_name + '_' + zone.name
         display_name = self.new_algo_display_name + '_' + zone.name
@@ -1022,7 +1091,7 @@ class Bid2xDV(Platform):
               'New custom bidding algorithm ', f'response = {json_pretty_print}'
           )
 
-    if self.action_remove_algorithm:
+    if self.action_remove_algorithm and shared_actions:
       # Remove an advertiser custom bidding algorithm by ID.
       print(
           f'Custom bidding algorithm id {self.cb_algo_id} will ',
@@ -1034,112 +1103,38 @@ class Bid2xDV(Platform):
 
       print(f'result of deletion attempt: {response}')
 
-    if self.action_update_scripts:
-      # Update the custom bidding scripts in DV360.
-
-      # Create custom bidding script string for DV360, per sales zone.
-      for zone in self.zone_array:
-        # Go into Google Sheets and generate CB function per sales zone.
-        custom_bidding_function_string = (
-            self.generate_cb_script_max_of_conversion_counts(zone.name)
-        )
-
-        if self.trace:
-          # Show the generated custom bidding script.
-          print(
-              'custom_bidding_function_string:\n',
-              f'{custom_bidding_function_string}\n',
-          )
-
-        # Get a list of line items this will affect.
-        line_item_array = self.sheet.get_affected_line_items_from_sheet(
-            zone.name
-        )
-        # Get the current algorithm directly from DV360.
-        custom_bidding_current_script = self.read_cb_algorithm_by_id(
-            service, self.advertiser_id, zone.algorithm_id
-        )
-
-        # Updating custom bidding scripts deals with Media objects -
-        # similar to the handling of creatives.  These are typically
-        # files on a local file system and it's easier to deal with
-        # the uploading of a custom bidding script by placing it in
-        # a temp file.  Build the tmp filename using the custom budding
-        # (cb) tmp file prefix an underscore and then the zone name
-        # along with a '.txt' suffix.  Once we check that the new CB
-        # script is actually new the contents of the script will be
-        # written to this filename.
-        filename = self.cb_tmp_file_prefix + '_' + zone.name + '.txt'
-
-        # Compare the new script and the previously uploaded script.
-        if (
-            str(custom_bidding_function_string).strip() ==
-            str(custom_bidding_current_script).strip()
-        ):
-
-          # The new script is the same as the old script, don't
-          # write to file and don't upload.  Just return False from
-          # this function.
-          print(
-              f'New script for {zone.name} is the same as the existing script;'
-              ' not uploading'
-          )
-          return False
-
-        else:
-          print(
-              f'New script for {zone.name} is different from last ',
-              'uploaded script; uploading new version',
-          )
-
-          # Write new script to tmp filename.  Upload is from a tmp file.
-          self.write_last_upload_file(filename, custom_bidding_function_string)
-
-          # Make call to update script in DV360 passing in filename containing
-          # new script.
-          update_result = zone.update_custom_bidding_scripts(
-              service, zone.advertiser_id, zone.algorithm_id, filename,
-              line_item_array
-          )
-
-          if not update_result:
-            print(f'Update of C.B. Script for zone {zone.name} failed.')
-          else:
-            print(f'Update of C.B. Script for zone {zone.name} succeeded.')
-
-            # Update of C.B. script was successful, update the Google
-            # Sheets spreadsheet tab named 'CB_Scripts'
-            self.sheet.update_cb_scripts_tab(
-                zone, custom_bidding_function_string, test_run=False
-            )
-
-    if self.action_test:
-      for zone in self.zone_array:
-        # Generate the Custom Bidding Script.
-        custom_bidding_string = (
-            self.generate_cb_script_max_of_conversion_counts(zone.name)
-        )
-
-        # Print the value of the script to the console.
-        if self.trace:
-          print(
-              f"""rules for zone {zone.name}:\n
-                {custom_bidding_string}"""
+    # Updating scripts, testing and updating the spreadsheet run as one
+    # pipeline of per zone stages sharing a single read of each zone's tab.
+    stages = bid2x_pipeline.stages_for_actions(
+        update_scripts=self.action_update_scripts,
+        test=self.action_test,
+        update_spreadsheet=self.action_update_spreadsheet,
+    )
+    if stages:
+      journal = None
+      if self.journal_path:
+        journal = bid2x_journal.open_journal(self.journal_path)
+      try:
+        scheduler = None
+        if (self.time_budget is not None
+            or self.zone_order != bid2x_var.ZoneOrder.CONFIGURED.value):
+          scheduler = bid2x_scheduler.ZoneScheduler(
+              self.time_budget, journal, str(self.sheet.sheet_id),
+              [stage.name for stage in stages], self.zone_order, start,
           )
+          zone_array = scheduler.order_zones(zone_array)
 
-        # Write the Test Run out to the test column in the associated
-        # Google Sheet in the tab 'CB_Scripts' (by default).
-        self.sheet.update_status_tab(
-            bid2x_var.DV_STATUS_TAB, zone, custom_bidding_string, test_run=True
+        bid2x_pipeline.run_pipeline(
+            self, service, zone_array, stages, self.dv_max_workers,
+            journal=journal, scope=str(self.sheet.sheet_id),
+            scheduler=scheduler,
         )
-
-    if self.action_update_spreadsheet:
-      self.sheet.read_dv_line_items(
-          service,
-          self.line_item_name_pattern,
-          self.zone_array,
-          self.defer_pattern,
-      )
+        # Deferred zones are left untouched for a later run, not failed.
+        if scheduler is not None:
+          scheduler.report()
+      finally:
+        if journal is not None:
+          journal.close()
 
     return True
 
@@ -1193,3 +1188,12 @@ class Bid2xDV(Platform):
 
     self.bidding_factor_high = source['bidding_factor_high']
     self.bidding_factor_low = source['bidding_factor_low']
+
+    if 'dv_max_workers' in source:
+      self.dv_max_workers = source['dv_max_workers']
+    if 'journal_path' in source:
+      self.journal_path = source['journal_path']
+    if 'time_budget' in source:
+      self.time_budget = source['time_budget']
+    if 'zone_order' in source:
+      self.zone_order = source['zone_order']
@@ -115,3 +115,49 @@ def process_environment_vars() -> None:
     'DEFAULT_CB_SCRIPT_COL_UPDATE',bid2x_var.DEFAULT_CB_SCRIPT_COL_UPDATE)
   bid2x_var.DEFAULT_CB_SCRIPT_COL_TEST = os.getenv(
     'DEFAULT_CB_SCRIPT_COL_TEST',bid2x_var.DEFAULT_CB_SCRIPT_COL_TEST)
+
+  # Read in profiling environment variables.
+  bid2x_var.PROFILE = os.getenv(
+    bid2x_var.PROFILE_ENV_VAR, bid2x_var.PROFILE)
+  bid2x_var.PROFILE_DIR = os.getenv(
+    bid2x_var.PROFILE_DIR_ENV_VAR, bid2x_var.PROFILE_DIR)
+
+  # Read in the config cache directory.
+  bid2x_var.CONFIG_CACHE_DIR = os.getenv(
+    bid2x_var.CONFIG_CACHE_DIR_ENV_VAR, bid2x_var.CONFIG_CACHE_DIR)
+
+  # Read in whether requests wait for room in the API quotas.
+  bid2x_var.QUOTA_WAIT = env_flag(
+    bid2x_var.QUOTA_WAIT_ENV_VAR, bid2x_var.QUOTA_WAIT)
+
+  # Read in the task sharding variables of Cloud Run jobs.
+  process_task_environment_vars()
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+  """Returns a Boolean environment variable, parsed with strtobool.
+
+  Args:
+    name: the name of the environment variable.
+    default: the value when the variable is unset or empty.
+
+  Returns:
+    The value of the variable, so 'false', 'no' and '0' are False.
+
+  Raises:
+    ValueError: if the value isn't one strtobool accepts.
+  """
+  value = os.getenv(name)
+  return bool(strtobool(value)) if value else default
+
+
+def process_task_environment_vars() -> None:
+  """Reads the task index and count Cloud Run sets for each task of a job.
+
+  Outside Cloud Run jobs the variables are absent and the defaults in
+  bid2x_var (a single task) are kept.
+  """
+  bid2x_var.TASK_INDEX = int(os.getenv(
+    'CLOUD_RUN_TASK_INDEX', bid2x_var.TASK_INDEX))
+  bid2x_var.TASK_COUNT = int(os.getenv(
+    'CLOUD_RUN_TASK_COUNT', bid2x_var.TASK_COUNT))
@@ -0,0 +1,1880 @@
+"""BidToX - Local fake of the DV360, GTM and Sheets APIs.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  Load testing bid2x against the real APIs uses up production quotas.  This
+  module serves an in-memory fake of the calls bid2x makes on localhost:
+
+    DV360:  advertisers.lineItems list (paged, with partial responses
+            limited by a fields parameter) and bulkUpdate,
+            customBiddingAlgorithms list, create, patch and uploadScript,
+            customBiddingAlgorithms.scripts list, get and create, and media
+            upload and download.
+    GTM:    workspaces create, list, sync and delete (also batched),
+            workspace variables get and update, create_version (which
+            syncs the workspace and replaces it with a new one), and
+            versions publish and live.  A variable changed both in a
+            workspace and in a version created since is a merge conflict.
+    Sheets: spreadsheet metadata, and values get, update and batchClear.
+    Cloud Storage: object media download and multipart upload, with
+            ifGenerationMatch preconditions, as used by the gs:// run
+            journal (see bid2x_journal).  Only an object's latest
+            generation is kept.
+
+  It also serves the OAuth token endpoint and the APIs' discovery documents.
+  A displayvideo version with no discovery document available offline
+  (e.g. v3) is described by the v2 document, which has the same calls.
+
+  Every API call is delayed by a latency, plus random jitter, and fails at
+  a given rate with a 429, 500 or 503.  Lists return at most page_size
+  items per page.  Latencies can be set per call in the latency profile
+  format of bid2x_plan, e.g. {"dv360.advertisers.lineItems.list": 1.8}.
+
+  The fake's data is seeded from bid2x configs: a spreadsheet with a tab
+  per zone, line items and a custom bidding algorithm per DV360 zone, and a
+  custom JavaScript variable per GTM zone.
+
+  Any bid2x entry point runs against the fake once API_ENDPOINT or the
+  BID2X_API_ENDPOINT environment variable holds its URL (see
+  bid2x_discovery).  Access tokens are then also requested from the fake,
+  so any service account key file will do.  From the bid2x directory:
+
+      python bid2x_fake_api.py -i dv_config.json --latency 0.2 \\
+          --key_file /tmp/fake_key.json
+      BID2X_API_ENDPOINT=http://127.0.0.1:8089 python main.py -i ...
+
+  or in process:
+
+      with FakeApiServer(FakeApi(FakeApiConfig(error_rate=0.01))) as fake:
+        fake.api.seed_from_config(config)
+        bid2x_var.API_ENDPOINT = fake.url
+        ...
+"""
+
+import argparse
+import collections
+import copy
+import dataclasses
+import email
+import itertools
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http import server
+from typing import Any, Callable
+from urllib import parse
+
+from auth import bid2x_discovery
+import bid2x_plan
+import bid2x_util
+import bid2x_var
+from googleapiclient import discovery_cache
+
+# The google.rpc status reported along with each HTTP error status.
+ERROR_STATUS_NAMES = {
+    400: 'INVALID_ARGUMENT',
+    401: 'UNAUTHENTICATED',
+    404: 'NOT_FOUND',
+    409: 'ABORTED',
+    412: 'FAILED_PRECONDITION',
+    429: 'RESOURCE_EXHAUSTED',
+    500: 'INTERNAL',
+    503: 'UNAVAILABLE',
+}
+
+# First IDs handed out to the resources the fake creates.
+FIRST_LINE_ITEM_ID = 10000000
+FIRST_ALGORITHM_ID = 20000000
+FIRST_SCRIPT_ID = 30000000
+
+# Matches the spreadsheet key in a Sheets URL.
+SHEET_URL_KEY_PATTERN = re.compile(r'/d/([a-zA-Z0-9-_]+)')
+# Matches an A1 cell reference, either part of which may be missing.
+A1_CELL_PATTERN = re.compile(r'^([A-Za-z]*)(\d*)$')
+# The value column of GTM lookup tables, see generate_javascript_function.
+GTM_LOOKUP_VALUE_COLUMN = 'Index'
+# Matches a '#column#' reference of a GTM per_row_condition.
+GTM_COLUMN_REFERENCE_PATTERN = re.compile(r'#([^#]+)#')
+# Matches a term of a DV360 list filter, e.g. campaignId="123".
+DV_FILTER_TERM_PATTERN = re.compile(r'^\s*(\w+)\s*=\s*"?([^"]*?)"?\s*$')
+
+
+class FakeApiError(Exception):
+  """An error response of the fake APIs."""
+
+  def __init__(self, status: int, message: str):
+    super().__init__(message)
+    self.status = status
+    self.message = message
+
+
+@dataclasses.dataclass
+class FakeApiConfig:
+  """How the fake APIs behave.
+
+  Attributes:
+    latency: seconds every API call is delayed by.
+    latency_jitter: up to this many more seconds are added at random.
+    latency_profile: seconds per call keyed by '<api>.<method>' or '<api>',
+        as read by bid2x_plan.load_latency_profile, overriding latency.
+    error_rate: the share of API calls failed, from 0 to 1.
+    error_statuses: the HTTP statuses failed calls return, one at random.
+    page_size: the most items a list call returns per page.
+    seed: seeds the random latencies, errors and seeded data.
+  """
+
+  latency: float = bid2x_var.FAKE_API_LATENCY
+  latency_jitter: float = bid2x_var.FAKE_API_LATENCY_JITTER
+  latency_profile: dict[str, float] = dataclasses.field(default_factory=dict)
+  error_rate: float = bid2x_var.FAKE_API_ERROR_RATE
+  error_statuses: tuple[int, ...] = bid2x_var.FAKE_API_ERROR_STATUSES
+  page_size: int = bid2x_var.FAKE_API_PAGE_SIZE
+  seed: int | None = None
+
+
+@dataclasses.dataclass
+class FakeRequest:
+  """A request to the fake APIs.
+
+  Attributes:
+    method: the HTTP method.
+    path: the URL path, without the leading '/'.
+    params: the path parameters matched by the request's route.
+    query: the URL query parameters, the last value of each.
+    headers: the request headers, keyed in lower case.
+    body: the request body.
+  """
+
+  method: str
+  path: str
+  params: tuple[str, ...]
+  query: dict[str, str]
+  headers: dict[str, str]
+  body: bytes
+
+  def json(self) -> Any:
+    """Returns the body decoded from JSON, an empty dict if none."""
+    return json.loads(self.body) if self.body else {}
+
+
+@dataclasses.dataclass
+class FakeResponse:
+  """A response of the fake APIs."""
+
+  status: int
+  content: bytes
+  content_type: str = 'application/json'
+  headers: dict[str, str] = dataclasses.field(default_factory=dict)
+
+
+def json_response(payload: Any, status: int = 200) -> FakeResponse:
+  """Returns a response with a JSON body."""
+  return FakeResponse(status, json.dumps(payload).encode('utf-8'))
+
+
+def error_response(status: int, message: str) -> FakeResponse:
+  """Returns a Google API style error response."""
+  return json_response(
+      {
+          'error': {
+              'code': status,
+              'message': message,
+              'status': ERROR_STATUS_NAMES.get(status, 'UNKNOWN'),
+          }
+      },
+      status,
+  )
+
+
+def column_index(letters: str) -> int:
+  """Returns the 0 based index of a column from its letters, e.g. 'B'."""
+  index = 0
+  for letter in letters.upper():
+    index = index * 26 + ord(letter) - ord('A') + 1
+
+  return index - 1
+
+
+def column_letters(index: int) -> str:
+  """Returns the letters of a column from its 0 based index."""
+  letters = ''
+  index += 1
+  while index:
+    index, remainder = divmod(index - 1, 26)
+    letters = chr(ord('A') + remainder) + letters
+
+  return letters
+
+
+def parse_a1_range(
+    range_name: str,
+) -> tuple[str, int, int, int | None, int | None]:
+  """Splits an A1 range such as 'Tab'!A2:F into its tab and bounds.
+
+  Args:
+    range_name: a range naming its tab, e.g. "'CB_Scripts'!B3" or "C1".
+
+  Returns:
+    The tab title, the first row and column, and the row and column after
+    the last, None where the range is open ended.  Rows and columns are 0
+    based.
+
+  Raises:
+    FakeApiError: If the cell references can't be parsed.
+  """
+  title, _, cells = range_name.rpartition('!')
+  if not title:
+    title, cells = range_name, ''
+  if len(title) > 1 and title.startswith("'") and title.endswith("'"):
+    title = title[1:-1].replace("''", "'")
+  if not cells:
+    return title, 0, 0, None, None
+
+  start, _, end = cells.partition(':')
+  start_match = A1_CELL_PATTERN.match(start)
+  end_match = A1_CELL_PATTERN.match(end or start)
+  if not start_match or not end_match:
+    raise FakeApiError(400, f'Unable to parse range: {range_name}')
+
+  start_col, start_row = start_match.groups()
+  end_col, end_row = end_match.groups()
+  return (
+      title,
+      int(start_row) - 1 if start_row else 0,
+      column_index(start_col) if start_col else 0,
+      int(end_row) if end_row else None,
+      column_index(end_col) + 1 if end_col else None,
+  )
+
+
+def format_cell(value: Any) -> Any:
+  """Returns a cell value as Sheets formats it, e.g. 2.0 as '2'."""
+  if isinstance(value, bool):
+    return 'TRUE' if value else 'FALSE'
+  if isinstance(value, float) and value.is_integer():
+    return str(int(value))
+
+  return str(value)
+
+
+def parse_user_entered(value: Any) -> Any:
+  """Returns a value as Sheets stores it when entered by a user."""
+  if not isinstance(value, str):
+    return value
+  try:
+    number = float(value)
+  except ValueError:
+    return value
+
+  return int(number) if number.is_integer() and '.' not in value else number
+
+
+def page_of(
+    items: list[Any], page_token: str | None, page_size: int
+) -> tuple[list[Any], str | None]:
+  """Returns a page of a list and the token of the next page.
+
+  Args:
+    items: the whole list.
+    page_token: the token returned with the previous page, if any.
+    page_size: the most items to return.
+
+  Returns:
+    The page's items and the next page's token, None on the last page.
+
+  Raises:
+    FakeApiError: If the page token is not one the fake returned.
+  """
+  try:
+    start = int(page_token) if page_token else 0
+  except ValueError as e:
+    raise FakeApiError(400, f'Invalid page token: {page_token}') from e
+
+  end = start + max(1, page_size)
+  return items[start:end], str(end) if end < len(items) else None
+
+
+def parse_fields(fields: str) -> dict[str, Any]:
+  """Parses a partial response fields parameter.
+
+  Args:
+    fields: e.g. 'nextPageToken,lineItems(lineItemId,displayName)'.
+
+  Returns:
+    The fields selected, each mapped to the fields selected of it or None
+    for all of them, e.g. {'nextPageToken': None, 'lineItems':
+    {'lineItemId': None, 'displayName': None}}.
+
+  Raises:
+    FakeApiError: the parentheses of the fields don't balance.
+  """
+  selected = {}
+  stack = [selected]
+  name = ''
+  for char in fields + ',':
+    if char in ',()':
+      if name.strip():
+        stack[-1][name.strip()] = None
+      if char == '(':
+        if not name.strip():
+          raise FakeApiError(400, f'Invalid fields: {fields}')
+        stack[-1][name.strip()] = {}
+        stack.append(stack[-1][name.strip()])
+      elif char == ')':
+        if len(stack) == 1:
+          raise FakeApiError(400, f'Invalid fields: {fields}')
+        stack.pop()
+      name = ''
+    else:
+      name += char
+  if len(stack) != 1:
+    raise FakeApiError(400, f'Invalid fields: {fields}')
+
+  return selected
+
+
+def select_fields(value: Any, selected: dict[str, Any] | None) -> Any:
+  """Returns the fields of a response selected by parse_fields()."""
+  if selected is None:
+    return value
+  if isinstance(value, list):
+    return [select_fields(item, selected) for item in value]
+  if not isinstance(value, dict):
+    return value
+
+  return {
+      name: select_fields(value[name], nested)
+      for name, nested in selected.items()
+      if name in value
+  }
+
+
+def multipart_parts(
+    content_type: str, body: bytes
+) -> list[email.message.Message]:
+  """Splits a multipart body into its parts."""
+  message = email.message_from_bytes(
+      f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8') + body
+  )
+  if not message.is_multipart():
+    raise FakeApiError(400, 'Expected a multipart body')
+
+  return message.get_payload()
+
+
+def sheet_key(sheet: dict[str, Any]) -> str:
+  """Returns the spreadsheet key of a config's 'sheet' section."""
+  if sheet.get('sheet_id'):
+    return str(sheet['sheet_id'])
+
+  match = SHEET_URL_KEY_PATTERN.search(sheet.get('sheet_url', ''))
+  if not match:
+    raise ValueError('The config names no spreadsheet')
+
+  return match.group(1)
+
+
+def gtm_index_columns(config: dict[str, Any]) -> list[str]:
+  """Returns the columns a GTM config reads from its zones' index tabs.
+
+  Args:
+    config: a GTM config.
+
+  Returns:
+    The dimension columns named in the floodlights' per_row_condition,
+    either as 'lookup#<column>#<column>' or '#<column>#' references,
+    followed by the value column.
+  """
+  columns = []
+  for floodlight in config.get('gtm_floodlight_list', []):
+    condition = floodlight.get('per_row_condition', '')
+    parts = condition.split('#')
+    if parts[0] == 'lookup':
+      columns.extend(parts[1:])
+    else:
+      columns.extend(GTM_COLUMN_REFERENCE_PATTERN.findall(condition))
+
+  columns.append(
+      config.get('value_adjustment_column_name', GTM_LOOKUP_VALUE_COLUMN)
+  )
+  columns.append(GTM_LOOKUP_VALUE_COLUMN)
+  return list(dict.fromkeys(column for column in columns if column))
+
+
+def displayvideo_document(api_version: str) -> str | None:
+  """Returns the v2 displayvideo discovery document relabelled as a version.
+
+  Args:
+    api_version: the displayvideo version wanted, e.g. 'v3'.
+
+  Returns:
+    The discovery document as a JSON string or None if the v2 document
+    isn't available.
+  """
+  content = discovery_cache.get_static_doc('displayvideo', 'v2')
+  if not content:
+    return None
+
+  def relabel(node: Any) -> None:
+    if isinstance(node, dict):
+      for key, value in node.items():
+        if key in ('path', 'flatPath') and isinstance(value, str):
+          if value.startswith('v2/'):
+            node[key] = f'{api_version}/{value[3:]}'
+        else:
+          relabel(value)
+    elif isinstance(node, list):
+      for value in node:
+        relabel(value)
+
+  document = json.loads(content)
+  relabel(document['resources'])
+  document['version'] = api_version
+  document['id'] = f'displayvideo:{api_version}'
+  return json.dumps(document)
+
+
+def write_service_account_key(path: str, url: str) -> None:
+  """Writes a throwaway service account key using the fake's token endpoint.
+
+  Args:
+    path: the key file to write.
+    url: the URL the fake APIs are served at.
+  """
+  # pylint: disable=g-import-not-at-top
+  from cryptography.hazmat.primitives import serialization
+  from cryptography.hazmat.primitives.asymmetric import rsa
+  # pylint: enable=g-import-not-at-top
+
+  private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+  private_key_pem = private_key.private_bytes(
+      serialization.Encoding.PEM,
+      serialization.PrivateFormat.PKCS8,
+      serialization.NoEncryption(),
+  ).decode('utf-8')
+  key_info = {
+      'type': 'service_account',
+      'project_id': 'bid2x-fake',
+      'private_key_id': 'bid2x-fake',
+      'private_key': private_key_pem,
+      'client_email': 'bid2x-fake@bid2x-fake.iam.gserviceaccount.com',
+      'client_id': '0',
+      'token_uri': f'{url}/token',
+  }
+  with open(path, 'w') as f:
+    json.dump(key_info, f, indent=2)
+
+
+class FakeApi:
+  """The in-memory state and request handling of the fake APIs.
+
+  Attributes:
+    config: how the fake behaves.
+    calls: the number of API calls handled, keyed by '<api>.<method>'.
+    errors: the number of API calls failed on purpose, keyed the same.
+  """
+
+  config: FakeApiConfig
+  calls: collections.Counter
+  errors: collections.Counter
+
+  def __init__(self, config: FakeApiConfig | None = None):
+    self.config = config or FakeApiConfig()
+    self.calls = collections.Counter()
+    self.errors = collections.Counter()
+    self._lock = threading.RLock()
+    self._random = random.Random(self.config.seed)
+    self._ids = itertools.count(1)
+    self._line_item_ids = itertools.count(FIRST_LINE_ITEM_ID)
+    self._algorithm_ids = itertools.count(FIRST_ALGORITHM_ID)
+    self._script_ids = itertools.count(FIRST_SCRIPT_ID)
+    self._tokens = itertools.count(1)
+    # DV360 line items by advertiser ID, in creation order.
+    self._line_items = collections.defaultdict(list)
+    self._algorithms = {}
+    # Uploaded scripts by algorithm ID, newest last.
+    self._scripts = collections.defaultdict(list)
+    self._media = {}
+    # GTM containers by (account ID, container ID).
+    self._containers = {}
+    # Spreadsheets by key, each a dict of tab title to rows of cells.
+    self._spreadsheets = {}
+    # Cloud Storage objects by (bucket, name), each (generation, content).
+    self._objects = {}
+    self._generations = itertools.count(1)
+    self._routes = self.build_routes()
+
+  def build_routes(
+      self,
+  ) -> list[tuple[str, re.Pattern[str], Callable[..., FakeResponse], str]]:
+    """Returns the (HTTP method, path pattern, handler, call name) routes."""
+    dv = r'displayvideo/v\d+/'
+    algorithm = dv + r'customBiddingAlgorithms/(\d+)'
+    container = r'tagmanager/tagmanager/v2/accounts/(\d+)/containers/(\d+)/'
+    workspace = container + r'workspaces/(\d+)'
+    spreadsheet = r'sheets/v4/spreadsheets/([^/:]+)'
+    bucket = r'storage/v1/b/([^/]+)/o'
+    routes = [
+        ('GET', dv + r'advertisers/(\d+)/lineItems', self.list_line_items,
+         'dv360.advertisers.lineItems.list'),
+        ('POST', dv + r'advertisers/(\d+)/lineItems:bulkUpdate',
+         self.bulk_update_line_items,
+         'dv360.advertisers.lineItems.bulkUpdate'),
+        ('GET', dv + r'customBiddingAlgorithms', self.list_algorithms,
+         'dv360.customBiddingAlgorithms.list'),
+        ('POST', dv + r'customBiddingAlgorithms', self.create_algorithm,
+         'dv360.customBiddingAlgorithms.create'),
+        ('PATCH', algorithm, self.patch_algorithm,
+         'dv360.customBiddingAlgorithms.patch'),
+        ('GET', algorithm + r':uploadScript', self.upload_script,
+         'dv360.customBiddingAlgorithms.uploadScript'),
+        ('GET', algorithm + r'/scripts', self.list_scripts,
+         'dv360.customBiddingAlgorithms.scripts.list'),
+        ('POST', algorithm + r'/scripts', self.create_script,
+         'dv360.customBiddingAlgorithms.scripts.create'),
+        ('GET', algorithm + r'/scripts/(\d+)', self.get_script,
+         'dv360.customBiddingAlgorithms.scripts.get'),
+        ('POST', r'displayvideo/upload/media/(.+)', self.upload_media,
+         'dv360.media.upload'),
+        ('GET', r'displayvideo/download/(.+)', self.download_media,
+         'dv360.media.download'),
+        ('POST', container + r'workspaces', self.create_workspace,
+         'gtm.accounts.containers.workspaces.create'),
+        ('GET', container + r'workspaces', self.list_workspaces,
+         'gtm.accounts.containers.workspaces.list'),
+        ('POST', workspace + r':sync', self.sync_workspace,
+         'gtm.accounts.containers.workspaces.sync'),
+        ('DELETE', workspace, self.delete_workspace,
+         'gtm.accounts.containers.workspaces.delete'),
+        ('GET', workspace + r'/variables/(\d+)', self.get_variable,
+         'gtm.accounts.containers.workspaces.variables.get'),
+        ('PUT', workspace + r'/variables/(\d+)', self.update_variable,
+         'gtm.accounts.containers.workspaces.variables.update'),
+        ('POST', workspace + r':create_version', self.create_version,
+         'gtm.accounts.containers.workspaces.create_version'),
+        ('POST', container + r'versions/(\d+):publish', self.publish_version,
+         'gtm.accounts.containers.versions.publish'),
+        ('GET', container + r'versions:live', self.live_version,
+         'gtm.accounts.containers.versions.live'),
+        ('GET', spreadsheet, self.get_spreadsheet,
+         'sheets.spreadsheets.get'),
+        ('GET', spreadsheet + r'/values/(.+)', self.get_values,
+         'sheets.spreadsheets.values.get'),
+        ('PUT', spreadsheet + r'/values/(.+)', self.update_values,
+         'sheets.spreadsheets.values.update'),
+        ('POST', spreadsheet + r'/values:batchClear', self.batch_clear_values,
+         'sheets.spreadsheets.values.batchClear'),
+        ('GET', r'download/' + bucket + r'/(.+)', self.download_object,
+         'storage.objects.get'),
+        ('POST', r'upload/' + bucket, self.upload_object,
+         'storage.objects.insert'),
+    ]
+    return [
+        (method, re.compile(pattern), handler, name)
+        for method, pattern, handler, name in routes
+    ]
+
+  # Request handling.
+
+  def handle(
+      self,
+      method: str,
+      target: str,
+      headers: dict[str, str],
+      body: bytes,
+  ) -> FakeResponse:
+    """Handles an HTTP request.
+
+    Args:
+      method: the HTTP method.
+      target: the request target, the path and query of the URL.
+      headers: the request headers, keyed in lower case.
+      body: the request body.
+
+    Returns:
+      The response.
+    """
+    url = parse.urlsplit(target)
+    path = url.path.lstrip('/')
+    query = dict(parse.parse_qsl(url.query, keep_blank_values=True))
+
+    if method == 'POST' and path == 'token':
+      return self.issue_token()
+    if method == 'GET' and path.endswith('/$discovery/rest'):
+      return self.discovery(path.split('/')[0], query.get('version', ''))
+    if not headers.get('authorization', '').startswith('Bearer '):
+      return error_response(401, 'Request is missing an access token.')
+
+    if method == 'POST' and re.fullmatch(r'\w+/batch', path):
+      self.delay('batch')
+      return self.batch(headers.get('content-type', ''), body)
+
+    return self.call(method, path, query, headers, body)
+
+  def call(
+      self,
+      method: str,
+      path: str,
+      query: dict[str, str],
+      headers: dict[str, str],
+      body: bytes,
+      delay: bool = True,
+  ) -> FakeResponse:
+    """Handles an API call, failing it at the configured error rate.
+
+    Args:
+      method: the HTTP method.
+      path: the URL path, without the leading '/'.
+      query: the URL query parameters.
+      headers: the request headers, keyed in lower case.
+      body: the request body.
+      delay: whether to add the call's latency, False within a batch.
+
+    Returns:
+      The response.
+    """
+    for route_method, pattern, handler, name in self._routes:
+      match = pattern.fullmatch(path)
+      if match and route_method == method:
+        break
+    else:
+      return error_response(404, f'No fake for {method} /{path}')
+
+    if delay:
+      self.delay(name)
+
+    with self._lock:
+      self.calls[name] += 1
+      failed = self._random.random() < self.config.error_rate
+      if failed:
+        self.errors[name] += 1
+        status = self._random.choice(self.config.error_statuses)
+    if failed:
+      return error_response(status, f'Injected error calling {name}')
+
+    request = FakeRequest(
+        method,
+        path,
+        tuple(parse.unquote(param) for param in match.groups()),
+        query,
+        headers,
+        body,
+    )
+    try:
+      with self._lock:
+        return handler(request)
+    except FakeApiError as e:
+      return error_response(e.status, e.message)
+    except (ValueError, KeyError, TypeError) as e:
+      return error_response(400, f'Invalid request to {name}: {e}')
+
+  def delay(self, name: str) -> None:
+    """Sleeps for the latency of a call."""
+    api = name.split('.')[0]
+    latency = self.config.latency_profile.get(
+        name, self.config.latency_profile.get(api, self.config.latency)
+    )
+    if self.config.latency_jitter:
+      with self._lock:
+        latency += self._random.uniform(0, self.config.latency_jitter)
+    if latency > 0:
+      time.sleep(latency)
+
+  def stats(self) -> dict[str, Any]:
+    """Returns the calls and injected errors per API call so far."""
+    with self._lock:
+      return {
+          'calls': dict(sorted(self.calls.items())),
+          'errors': dict(sorted(self.errors.items())),
+          'total_calls': sum(self.calls.values()),
+          'total_errors': sum(self.errors.values()),
+      }
+
+  def issue_token(self) -> FakeResponse:
+    """Returns an access token, as an OAuth token endpoint would."""
+    with self._lock:
+      token = f'fake-token-{next(self._tokens)}'
+
+    return json_response(
+        {'access_token': token, 'expires_in': 3600, 'token_type': 'Bearer'}
+    )
+
+  def discovery(self, api_name: str, api_version: str) -> FakeResponse:
+    """Returns an API's discovery document."""
+    doc_name = bid2x_discovery.discovery_doc_name(api_name, api_version)
+    content = bid2x_discovery.read_doc_file(
+        os.path.join(bid2x_discovery.BUNDLED_DOC_DIR, doc_name)
+    ) or discovery_cache.get_static_doc(api_name, api_version)
+    if not content and api_name == 'displayvideo':
+      content = displayvideo_document(api_version)
+    if not content:
+      return error_response(
+          404, f'No discovery document for {api_name} {api_version}'
+      )
+
+    return FakeResponse(200, content.encode('utf-8'))
+
+  def batch(self, content_type: str, body: bytes) -> FakeResponse:
+    """Handles a multipart/mixed batch of API calls."""
+    try:
+      parts = multipart_parts(content_type, body)
+    except FakeApiError as e:
+      return error_response(e.status, e.message)
+
+    boundary = f'batch_fake_{next(self._ids)}'
+    responses = []
+    for part in parts:
+      request_line, _, rest = part.get_payload(decode=True).partition(b'\r\n')
+      if not rest:
+        request_line, _, rest = request_line.partition(b'\n')
+      method, target, _ = request_line.decode('utf-8').split(' ', 2)
+      header_block, _, sub_body = rest.replace(b'\r\n', b'\n').partition(
+          b'\n\n'
+      )
+      sub_headers = {}
+      for line in header_block.decode('utf-8').splitlines():
+        key, _, value = line.partition(':')
+        sub_headers[key.strip().lower()] = value.strip()
+      url = parse.urlsplit(target)
+      response = self.call(
+          method,
+          url.path.lstrip('/'),
+          dict(parse.parse_qsl(url.query, keep_blank_values=True)),
+          sub_headers,
+          sub_body,
+          delay=False,
+      )
+      # Long Content-IDs arrive folded over several lines.
+      content_id = re.sub(
+          r'\r?\n', '', part.get('Content-ID', '<0 + 0>')
+      ).strip('<>')
+      responses.append(
+          f'--{boundary}\r\n'
+          'Content-Type: application/http\r\n'
+          f'Content-ID: <response-{content_id}>\r\n\r\n'
+          f'HTTP/1.1 {response.status} '
+          f'{ERROR_STATUS_NAMES.get(response.status, "OK")}\r\n'
+          f'Content-Type: {response.content_type}\r\n'
+          f'Content-Length: {len(response.content)}\r\n\r\n'
+          f'{response.content.decode("utf-8")}\r\n'
+      )
+    responses.append(f'--{boundary}--\r\n')
+
+    return FakeResponse(
+        200,
+        ''.join(responses).encode('utf-8'),
+        f'multipart/mixed; boundary={boundary}',
+    )
+
+  # Seeding.
+
+  def add_line_items(
+      self,
+      advertiser_id: int,
+      campaign_id: int,
+      count: int,
+      name_pattern: str = '',
+  ) -> list[dict[str, Any]]:
+    """Adds line items to a campaign.
+
+    Args:
+      advertiser_id: the advertiser owning the campaign.
+      campaign_id: the campaign.
+      count: the number of line items to add.
+      name_pattern: included in the line items' display names.
+
+    Returns:
+      The line items added.
+    """
+    line_items = []
+    with self._lock:
+      insertion_order_id = next(self._ids)
+      for index in range(count):
+        line_item_id = next(self._line_item_ids)
+        line_items.append({
+            'name': f'advertisers/{advertiser_id}/lineItems/{line_item_id}',
+            'advertiserId': str(advertiser_id),
+            'campaignId': str(campaign_id),
+            'insertionOrderId': str(insertion_order_id),
+            'lineItemId': str(line_item_id),
+            'displayName': f'{name_pattern} {campaign_id} {index}'.strip(),
+            'lineItemType': 'LINE_ITEM_TYPE_DISPLAY_DEFAULT',
+            'entityStatus': 'ENTITY_STATUS_ACTIVE',
+            'updateTime': '2025-01-01T00:00:00Z',
+            'partnerCosts': [],
+            'flight': {
+                'flightDateType': 'LINE_ITEM_FLIGHT_DATE_TYPE_INHERITED',
+            },
+            'budget': {
+                'budgetAllocationType':
+                    'LINE_ITEM_BUDGET_ALLOCATION_TYPE_FIXED',
+                'budgetUnit': 'BUDGET_UNIT_CURRENCY',
+                'maxAmount': '1000000000',
+            },
+            'pacing': {
+                'pacingPeriod': 'PACING_PERIOD_FLIGHT',
+                'pacingType': 'PACING_TYPE_EVEN',
+            },
+            'frequencyCap': {'unlimited': True},
+            'partnerRevenueModel': {
+                'markupType':
+                    'PARTNER_REVENUE_MODEL_MARKUP_TYPE_TOTAL_MEDIA_COST_MARKUP',
+            },
+            'conversionCounting': {'postViewCountPercentageMillis': '100000'},
+            'bidStrategy': {
+                'fixedBid': {'bidAmountMicros': '1000000'},
+            },
+            'integrationDetails': {},
+            'reservationType': 'RESERVATION_TYPE_NOT_GUARANTEED',
+        })
+      self._line_items[str(advertiser_id)].extend(line_items)
+
+    return line_items
+
+  def add_algorithm(
+      self,
+      algorithm_id: int | None = None,
+      advertiser_id: int | None = None,
+      partner_id: int | None = None,
+      display_name: str = 'bid2x',
+  ) -> dict[str, Any]:
+    """Adds a script based custom bidding algorithm.
+
+    Args:
+      algorithm_id: the algorithm's ID, a new one if None.
+      advertiser_id: the advertiser owning the algorithm, if any.
+      partner_id: the partner owning the algorithm, if any.
+      display_name: the algorithm's display name.
+
+    Returns:
+      The algorithm.
+    """
+    with self._lock:
+      if algorithm_id is None:
+        algorithm_id = next(self._algorithm_ids)
+      algorithm = {
+          'name': f'customBiddingAlgorithms/{algorithm_id}',
+          'customBiddingAlgorithmId': str(algorithm_id),
+          'displayName': display_name,
+          'entityStatus': 'ENTITY_STATUS_ACTIVE',
+          'customBiddingAlgorithmType': 'SCRIPT_BASED',
+      }
+      if advertiser_id is not None:
+        algorithm['advertiserId'] = str(advertiser_id)
+      if partner_id is not None:
+        algorithm['partnerId'] = str(partner_id)
+      self._algorithms[str(algorithm_id)] = algorithm
+
+    return algorithm
+
+  def add_gtm_variable(
+      self,
+      account_id: int,
+      container_id: int,
+      variable_id: int,
+      javascript: str = 'function() {\n  return 0;\n}',
+  ) -> dict[str, Any]:
+    """Adds a custom JavaScript variable to a container's live version.
+
+    Args:
+      account_id: the GTM account owning the container.
+      container_id: the GTM container.
+      variable_id: the variable's ID.
+      javascript: the variable's function.
+
+    Returns:
+      The variable.
+    """
+    with self._lock:
+      container = self.container(account_id, container_id, create=True)
+      variable = {
+          'accountId': str(account_id),
+          'containerId': str(container_id),
+          'variableId': str(variable_id),
+          'name': f'bid2x variable {variable_id}',
+          'type': 'jsm',
+          'parameter': [
+              {'type': 'template', 'key': 'javascript', 'value': javascript}
+          ],
+          'fingerprint': str(next(self._ids)),
+      }
+      live = container['versions'][container['live']]
+      live['variable'] = [
+          v for v in live['variable'] if v['variableId'] != str(variable_id)
+      ] + [variable]
+
+    return variable
+
+  def add_spreadsheet(
+      self, key: str, tabs: dict[str, list[list[Any]]] | None = None
+  ) -> None:
+    """Adds a spreadsheet, or tabs to an existing one.
+
+    Args:
+      key: the spreadsheet's key.
+      tabs: rows of cells by tab title.  Existing tabs are replaced.
+    """
+    with self._lock:
+      spreadsheet = self._spreadsheets.setdefault(key, {})
+      for title, rows in (tabs or {}).items():
+        spreadsheet[title] = [list(row) for row in rows]
+
+  def seed_from_config(
+      self,
+      config: dict[str, Any],
+      line_items: int = bid2x_var.FAKE_API_LINE_ITEMS,
+      index_rows: int = bid2x_var.FAKE_API_INDEX_ROWS,
+  ) -> None:
+    """Adds the data a config's runs read.
+
+    Args:
+      config: a bid2x config as loaded from its JSON file.
+      line_items: the line items of each DV360 zone.
+      index_rows: the index table rows of each GTM zone.
+    """
+    if config.get('platform_type') == bid2x_var.PlatformType.GTM.value:
+      self.seed_gtm_config(config, index_rows)
+    else:
+      self.seed_dv_config(config, line_items)
+
+  def seed_dv_config(self, config: dict[str, Any], line_items: int) -> None:
+    """Adds a DV360 config's line items, algorithms and zone tabs."""
+    sheet = config.get('sheet', {})
+    columns = {
+        sheet.get('column_status', bid2x_var.COLUMN_STATUS): 'Status',
+        sheet.get('column_lineitem_id', bid2x_var.COLUMN_LINEITEMID):
+            'Line Item ID',
+        sheet.get('column_lineitem_name', bid2x_var.COLUMN_LINEITEMNAME):
+            'Line Item Name',
+        sheet.get('column_lineitem_type', bid2x_var.COLUMN_LINEITEMTYPE):
+            'Line Item Type',
+        sheet.get('column_campaign_id', bid2x_var.COLUMN_CAMPAIGNID):
+            'Campaign ID',
+        sheet.get('column_advertiser_id', bid2x_var.COLUMN_ADVERTISERID):
+            'Advertiser ID',
+        sheet.get('column_custom_bidding', bid2x_var.COLUMN_CUSTOMBIDDING):
+            'Generate Custom Bidding',
+    }
+    indexes = {column_index(letter): name for letter, name in columns.items()}
+    # The bidding factor goes in the first column not written by bid2x.
+    factor_index = next(i for i in itertools.count() if i not in indexes)
+    indexes[factor_index] = 'Bidding Factor'
+    header = [
+        indexes.get(index, f'Column {column_letters(index)}')
+        for index in range(max(indexes) + 1)
+    ]
+
+    pattern = config.get('line_item_name_pattern', '')
+    tabs = {bid2x_var.DV_STATUS_TAB: [['Zone', 'Script', 'Updated']]}
+    for zone in config.get('zone_array', []):
+      zone_line_items = self.add_line_items(
+          zone['advertiser_id'], zone['campaign_id'], line_items, pattern
+      )
+      self.add_algorithm(
+          zone.get('algorithm_id'), advertiser_id=zone['advertiser_id']
+      )
+      rows = [header]
+      for line_item in zone_line_items:
+        values = {
+            'Status': line_item['entityStatus'],
+            'Line Item ID': int(line_item['lineItemId']),
+            'Line Item Name': line_item['displayName'],
+            'Line Item Type': line_item['lineItemType'],
+            'Campaign ID': int(line_item['campaignId']),
+            'Advertiser ID': int(line_item['advertiserId']),
+            'Generate Custom Bidding': 'Yes',
+            'Bidding Factor': round(self._random.uniform(0.5, 3.0), 2),
+        }
+        rows.append([values.get(name, '') for name in header])
+      tabs[zone['name']] = rows
+
+    self.add_spreadsheet(sheet_key(sheet), tabs)
+
+  def seed_gtm_config(self, config: dict[str, Any], index_rows: int) -> None:
+    """Adds a GTM config's variables and index tabs."""
+    columns = gtm_index_columns(config)
+    dimensions = [
+        column for column in columns
+        if column not in (
+            config.get('value_adjustment_column_name'),
+            GTM_LOOKUP_VALUE_COLUMN,
+        )
+    ]
+    # Enough values per dimension for every row to be a distinct key.
+    per_dimension = max(
+        2, math.ceil(index_rows ** (1 / max(1, len(dimensions))))
+    )
+
+    tabs = {bid2x_var.GTM_STATUS_TAB: [['Zone', 'Script', 'Updated']]}
+    for zone in config.get('zone_array', []):
+      self.add_gtm_variable(
+          zone['account_id'], zone['container_id'], zone['variable_id']
+      )
+      rows = [columns]
+      for row in range(index_rows):
+        values = {
+            dimension: (
+                f'{dimension}_'
+                f'{row // per_dimension ** position % per_dimension}'
+            )
+            for position, dimension in enumerate(reversed(dimensions))
+        }
+        index = round(self._random.uniform(0.5, 2.0), 3)
+        rows.append([values.get(column, index) for column in columns])
+      tabs[zone['name']] = rows
+
+    self.add_spreadsheet(sheet_key(config.get('sheet', {})), tabs)
+
+  # DV360.
+
+  def line_items(self, advertiser_id: int) -> list[dict[str, Any]]:
+    """Returns a copy of an advertiser's line items."""
+    with self._lock:
+      return copy.deepcopy(self._line_items[str(advertiser_id)])
+
+  def list_line_items(self, request: FakeRequest) -> FakeResponse:
+    """advertisers.lineItems.list, filtered on field=value terms."""
+    terms = []
+    filter_string = request.query.get('filter', '').strip()
+    if filter_string:
+      for term in re.split(r'\s+AND\s+', filter_string):
+        match = DV_FILTER_TERM_PATTERN.match(term)
+        if not match:
+          raise FakeApiError(400, f'Unsupported filter: {filter_string}')
+        terms.append(match.groups())
+
+    line_items = [
+        line_item for line_item in self._line_items[request.params[0]]
+        if all(str(line_item.get(field)) == value for field, value in terms)
+    ]
+    page_size = min(
+        int(request.query.get('pageSize') or self.config.page_size),
+        self.config.page_size,
+    )
+    page, next_page_token = page_of(
+        line_items, request.query.get('pageToken'), page_size
+    )
+    response = {'lineItems': page} if page else {}
+    if next_page_token:
+      response['nextPageToken'] = next_page_token
+    if request.query.get('fields'):
+      response = select_fields(
+          response, parse_fields(request.query['fields'])
+      )
+
+    return json_response(response)
+
+  def bulk_update_line_items(self, request: FakeRequest) -> FakeResponse:
+    """advertisers.lineItems.bulkUpdate of the fields in updateMask."""
+    body = request.json()
+    line_item_ids = []
+    for line_item_id in body.get('lineItemIds', []):
+      # Nested lists of IDs are accepted as well.
+      if isinstance(line_item_id, list):
+        line_item_ids.extend(line_item_id)
+      else:
+        line_item_ids.append(line_item_id)
+
+    target = body.get('targetLineItem', {})
+    fields = [
+        field.strip() for field in body.get('updateMask', '').split(',')
+        if field.strip()
+    ]
+    line_items = {
+        line_item['lineItemId']: line_item
+        for line_item in self._line_items[request.params[0]]
+    }
+    updated, failed = [], []
+    for line_item_id in map(str, line_item_ids):
+      line_item = line_items.get(line_item_id)
+      if line_item is None:
+        failed.append(line_item_id)
+        continue
+      for field in fields:
+        if field in target:
+          line_item[field] = copy.deepcopy(target[field])
+      updated.append(line_item_id)
+
+    return json_response(
+        {'updatedLineItemIds': updated, 'failedLineItemIds': failed}
+    )
+
+  def algorithm(self, algorithm_id: str) -> dict[str, Any]:
+    """Returns an algorithm or raises a 404 FakeApiError."""
+    algorithm = self._algorithms.get(algorithm_id)
+    if algorithm is None:
+      raise FakeApiError(
+          404, f'Custom bidding algorithm {algorithm_id} not found.'
+      )
+
+    return algorithm
+
+  def list_algorithms(self, request: FakeRequest) -> FakeResponse:
+    """customBiddingAlgorithms.list of an advertiser or partner."""
+    owner = [
+        (key, request.query[key])
+        for key in ('advertiserId', 'partnerId') if key in request.query
+    ]
+    algorithms = [
+        algorithm for algorithm in self._algorithms.values()
+        if all(algorithm.get(key) == value for key, value in owner)
+    ]
+    page, next_page_token = page_of(
+        algorithms, request.query.get('pageToken'), self.config.page_size
+    )
+    response = {'customBiddingAlgorithms': page} if page else {}
+    if next_page_token:
+      response['nextPageToken'] = next_page_token
+
+    return json_response(response)
+
+  def create_algorithm(self, request: FakeRequest) -> FakeResponse:
+    """customBiddingAlgorithms.create."""
+    body = request.json()
+    algorithm = self.add_algorithm(
+        advertiser_id=body.get('advertiserId'),
+        partner_id=body.get('partnerId'),
+        display_name=body.get('displayName', ''),
+    )
+    for key, value in body.items():
+      algorithm.setdefault(key, value)
+
+    return json_response(algorithm)
+
+  def patch_algorithm(self, request: FakeRequest) -> FakeResponse:
+    """customBiddingAlgorithms.patch of the fields in updateMask."""
+    algorithm = self.algorithm(request.params[0])
+    body = request.json()
+    for field in request.query.get('updateMask', '').split(','):
+      if field.strip() in body:
+        algorithm[field.strip()] = body[field.strip()]
+
+    return json_response(algorithm)
+
+  def upload_script(self, request: FakeRequest) -> FakeResponse:
+    """customBiddingAlgorithms.uploadScript, a reference to upload to."""
+    algorithm_id = self.algorithm(request.params[0])['customBiddingAlgorithmId']
+    return json_response({
+        'resourceName': (
+            f'customBiddingAlgorithms/{algorithm_id}/'
+            f'scriptRef/{next(self._ids)}'
+        )
+    })
+
+  def upload_media(self, request: FakeRequest) -> FakeResponse:
+    """media.upload, simple or multipart."""
+    resource_name = request.params[0]
+    content = request.body
+    if request.query.get('uploadType') == 'multipart':
+      parts = multipart_parts(request.headers.get('content-type', ''), content)
+      content = parts[-1].get_payload(decode=True)
+    self._media[resource_name] = content
+
+    return json_response({'resourceName': resource_name})
+
+  def download_media(self, request: FakeRequest) -> FakeResponse:
+    """media.download, the media itself with alt=media."""
+    resource_name = request.params[0]
+    if resource_name not in self._media:
+      raise FakeApiError(404, f'Media {resource_name} not found.')
+    if request.query.get('alt') != 'media':
+      return json_response({'resourceName': resource_name})
+
+    return FakeResponse(
+        200, self._media[resource_name], 'application/octet-stream'
+    )
+
+  def list_scripts(self, request: FakeRequest) -> FakeResponse:
+    """customBiddingAlgorithms.scripts.list, newest first."""
+    algorithm_id = self.algorithm(request.params[0])['customBiddingAlgorithmId']
+    scripts = self._scripts[algorithm_id][::-1]
+    page, next_page_token = page_of(
+        scripts, request.query.get('pageToken'), self.config.page_size
+    )
+    response = {'customBiddingScripts': page} if page else {}
+    if next_page_token:
+      response['nextPageToken'] = next_page_token
+
+    return json_response(response)
+
+  def create_script(self, request: FakeRequest) -> FakeResponse:
+    """customBiddingAlgorithms.scripts.create from uploaded media."""
+    algorithm_id = self.algorithm(request.params[0])['customBiddingAlgorithmId']
+    reference = request.json().get('script', {})
+    if reference.get('resourceName') not in self._media:
+      raise FakeApiError(400, 'No script was uploaded to the reference.')
+
+    script_id = str(next(self._script_ids))
+    script = {
+        'name': (
+            f'customBiddingAlgorithms/{algorithm_id}/'
+            f'scripts/{script_id}'
+        ),
+        'customBiddingAlgorithmId': algorithm_id,
+        'customBiddingScriptId': script_id,
+        'createTime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'active': True,
+        'state': 'ACCEPTED',
+        'script': {'resourceName': reference['resourceName']},
+    }
+    for earlier in self._scripts[algorithm_id]:
+      earlier['active'] = False
+    self._scripts[algorithm_id].append(script)
+
+    return json_response(script)
+
+  def get_script(self, request: FakeRequest) -> FakeResponse:
+    """customBiddingAlgorithms.scripts.get."""
+    algorithm_id = self.algorithm(request.params[0])['customBiddingAlgorithmId']
+    for script in self._scripts[algorithm_id]:
+      if script['customBiddingScriptId'] == request.params[1]:
+        return json_response(script)
+
+    raise FakeApiError(404, f'Script {request.params[1]} not found.')
+
+  # GTM.
+
+  def container(
+      self, account_id: Any, container_id: Any, create: bool = False
+  ) -> dict[str, Any]:
+    """Returns a GTM container, raising a 404 FakeApiError if missing."""
+    key = (str(account_id), str(container_id))
+    if key not in self._containers:
+      if not create:
+        raise FakeApiError(404, f'Container {container_id} not found.')
+      self._containers[key] = {
+          'accountId': key[0],
+          'containerId': key[1],
+          'workspaces': {},
+          'versions': {
+              '1': {
+                  'accountId': key[0],
+                  'containerId': key[1],
+                  'containerVersionId': '1',
+                  'path': (
+                      f'accounts/{key[0]}/containers/{key[1]}/versions/1'
+                  ),
+                  'variable': [],
+              }
+          },
+          'live': '1',
+      }
+
+    return self._containers[key]
+
+  def workspace(self, request: FakeRequest) -> dict[str, Any]:
+    """Returns the workspace a request is for, or raises a 404."""
+    container = self.container(request.params[0], request.params[1])
+    workspace = container['workspaces'].get(request.params[2])
+    if workspace is None:
+      raise FakeApiError(404, f'Workspace {request.params[2]} not found.')
+
+    return workspace
+
+  def add_workspace(
+      self, container: dict[str, Any], name: str, notes: str = ''
+  ) -> dict[str, Any]:
+    """Adds a workspace holding the latest version's variables.
+
+    Args:
+      container: the GTM container, see container().
+      name: the workspace's name.
+      notes: the workspace's notes.
+
+    Returns:
+      The workspace as the API returns it, without its variables.
+    """
+    workspace_id = str(next(self._ids))
+    latest_id = max(container['versions'], key=int)
+    latest = container['versions'][latest_id]
+    workspace = {
+        'path': (
+            f'accounts/{container["accountId"]}/'
+            f'containers/{container["containerId"]}/'
+            f'workspaces/{workspace_id}'
+        ),
+        'accountId': container['accountId'],
+        'containerId': container['containerId'],
+        'workspaceId': workspace_id,
+        'name': name,
+        'notes': notes,
+        'fingerprint': str(next(self._ids)),
+    }
+    container['workspaces'][workspace_id] = dict(
+        workspace,
+        variables={
+            variable['variableId']: copy.deepcopy(variable)
+            for variable in latest['variable']
+        },
+        base=latest_id,
+    )
+
+    return workspace
+
+  def create_workspace(self, request: FakeRequest) -> FakeResponse:
+    """workspaces.create, holding the latest version's variables."""
+    container = self.container(request.params[0], request.params[1])
+    body = request.json()
+    return json_response(
+        self.add_workspace(
+            container, body.get('name', ''), body.get('notes', '')
+        )
+    )
+
+  def list_workspaces(self, request: FakeRequest) -> FakeResponse:
+    """workspaces.list."""
+    container = self.container(request.params[0], request.params[1])
+    workspaces = [
+        {
+            key: value for key, value in workspace.items()
+            if key not in ('variables', 'base')
+        }
+        for workspace in container['workspaces'].values()
+    ]
+    page, next_page_token = page_of(
+        workspaces, request.query.get('pageToken'), self.config.page_size
+    )
+    response = {'workspace': page} if page else {}
+    if next_page_token:
+      response['nextPageToken'] = next_page_token
+
+    return json_response(response)
+
+  def merge_workspace(
+      self, container: dict[str, Any], workspace: dict[str, Any]
+  ) -> bool:
+    """Brings a workspace up to the latest version of its container.
+
+    Variables changed only in versions created since the workspace's base
+    version are taken from the latest version.
+
+    Args:
+      container: the GTM container, see container().
+      workspace: one of the container's workspaces.
+
+    Returns:
+      True if it was merged, False on a merge conflict, a variable changed
+      both in the workspace and since its base version, leaving the
+      workspace unchanged.
+    """
+    def content(variable: dict[str, Any] | None) -> Any:
+      if variable is None:
+        return None
+      return {
+          key: value for key, value in variable.items()
+          if key != 'fingerprint'
+      }
+
+    def variables(version_id: str) -> dict[str, dict[str, Any]]:
+      return {
+          variable['variableId']: variable
+          for variable in container['versions'][version_id]['variable']
+      }
+
+    latest_id = max(container['versions'], key=int)
+    base = variables(workspace['base'])
+    latest = variables(latest_id)
+    merged = dict(workspace['variables'])
+    for variable_id in set(base) | set(latest) | set(merged):
+      ours = content(merged.get(variable_id))
+      theirs = content(latest.get(variable_id))
+      original = content(base.get(variable_id))
+      if theirs == original or ours == theirs:
+        continue
+      if ours != original:
+        return False
+      if variable_id in latest:
+        merged[variable_id] = copy.deepcopy(latest[variable_id])
+      else:
+        del merged[variable_id]
+
+    workspace['variables'] = merged
+    workspace['base'] = latest_id
+    return True
+
+  def sync_workspace(self, request: FakeRequest) -> FakeResponse:
+    """workspaces.sync."""
+    workspace = self.workspace(request)
+    container = self.container(request.params[0], request.params[1])
+    merged = self.merge_workspace(container, workspace)
+    return json_response(
+        {'syncStatus': {'mergeConflict': not merged, 'syncError': False}}
+    )
+
+  def delete_workspace(self, request: FakeRequest) -> FakeResponse:
+    """workspaces.delete."""
+    self.workspace(request)
+    container = self.container(request.params[0], request.params[1])
+    del container['workspaces'][request.params[2]]
+
+    return FakeResponse(204, b'')
+
+  def get_variable(self, request: FakeRequest) -> FakeResponse:
+    """workspaces.variables.get."""
+    variable = self.workspace(request)['variables'].get(request.params[3])
+    if variable is None:
+      raise FakeApiError(404, f'Variable {request.params[3]} not found.')
+
+    return json_response(variable)
+
+  def update_variable(self, request: FakeRequest) -> FakeResponse:
+    """workspaces.variables.update, checking the fingerprint if given."""
+    variables = self.workspace(request)['variables']
+    variable = variables.get(request.params[3])
+    if variable is None:
+      raise FakeApiError(404, f'Variable {request.params[3]} not found.')
+    fingerprint = request.query.get('fingerprint')
+    if fingerprint and fingerprint != variable['fingerprint']:
+      raise FakeApiError(409, 'Fingerprint mismatch.')
+
+    updated = dict(
+        request.json(),
+        variableId=variable['variableId'],
+        fingerprint=str(next(self._ids)),
+    )
+    variables[request.params[3]] = updated
+
+    return json_response(updated)
+
+  def create_version(self, request: FakeRequest) -> FakeResponse:
+    """workspaces.create_version, replacing the workspace with a new one.
+
+    The workspace is first synced; a merge conflict creates no version.
+    """
+    workspace = self.workspace(request)
+    container = self.container(request.params[0], request.params[1])
+    body = request.json()
+    if not self.merge_workspace(container, workspace):
+      return json_response(
+          {'syncStatus': {'mergeConflict': True, 'syncError': False}}
+      )
+    version_id = str(max(map(int, container['versions'])) + 1)
+    version = {
+        'accountId': container['accountId'],
+        'containerId': container['containerId'],
+        'containerVersionId': version_id,
+        'path': (
+            f'accounts/{container["accountId"]}/'
+            f'containers/{container["containerId"]}/versions/{version_id}'
+        ),
+        'name': body.get('name', ''),
+        'description': body.get('notes', ''),
+        'variable': list(workspace['variables'].values()),
+        'fingerprint': str(next(self._ids)),
+    }
+    container['versions'][version_id] = version
+    del container['workspaces'][request.params[2]]
+    new_workspace = self.add_workspace(container, 'Default Workspace')
+
+    return json_response({
+        'containerVersion': version,
+        'compilerError': False,
+        'syncStatus': {'mergeConflict': False, 'syncError': False},
+        'newWorkspacePath': new_workspace['path'],
+    })
+
+  def publish_version(self, request: FakeRequest) -> FakeResponse:
+    """versions.publish."""
+    container = self.container(request.params[0], request.params[1])
+    version = container['versions'].get(request.params[2])
+    if version is None:
+      raise FakeApiError(404, f'Version {request.params[2]} not found.')
+    container['live'] = request.params[2]
+
+    return json_response({'containerVersion': version, 'compilerError': False})
+
+  def live_version(self, request: FakeRequest) -> FakeResponse:
+    """versions.live."""
+    container = self.container(request.params[0], request.params[1])
+    return json_response(container['versions'][container['live']])
+
+  # Sheets.
+
+  def spreadsheet(self, key: str) -> dict[str, list[list[Any]]]:
+    """Returns a spreadsheet's tabs or raises a 404 FakeApiError."""
+    spreadsheet = self._spreadsheets.get(key)
+    if spreadsheet is None:
+      raise FakeApiError(404, f'Requested entity was not found: {key}')
+
+    return spreadsheet
+
+  def tab(self, key: str, title: str) -> list[list[Any]]:
+    """Returns the rows of a spreadsheet's tab or raises a 400."""
+    spreadsheet = self.spreadsheet(key)
+    if title not in spreadsheet:
+      raise FakeApiError(400, f'Unable to parse range: {title}')
+
+    return spreadsheet[title]
+
+  def get_spreadsheet(self, request: FakeRequest) -> FakeResponse:
+    """spreadsheets.get of the spreadsheet's properties."""
+    key = request.params[0]
+    sheets = []
+    for index, (title, rows) in enumerate(self.spreadsheet(key).items()):
+      sheets.append({
+          'properties': {
+              'sheetId': index,
+              'title': title,
+              'index': index,
+              'sheetType': 'GRID',
+              'gridProperties': {
+                  'rowCount': max(1000, len(rows)),
+                  'columnCount': max([26] + [len(row) for row in rows]),
+              },
+          }
+      })
+
+    return json_response({
+        'spreadsheetId': key,
+        'properties': {
+            'title': f'bid2x fake {key}',
+            'locale': 'en_US',
+            'timeZone': 'Etc/GMT',
+        },
+        'sheets': sheets,
+        'spreadsheetUrl': f'https://docs.google.com/spreadsheets/d/{key}/edit',
+    })
+
+  def get_values(self, request: FakeRequest) -> FakeResponse:
+    """spreadsheets.values.get."""
+    key, range_name = request.params
+    title, first_row, first_col, end_row, end_col = parse_a1_range(range_name)
+    formatted = request.query.get(
+        'valueRenderOption', 'FORMATTED_VALUE'
+    ) == 'FORMATTED_VALUE'
+
+    values = []
+    for row in self.tab(key, title)[first_row:end_row]:
+      cells = row[first_col:end_col]
+      while cells and cells[-1] == '':
+        cells = cells[:-1]
+      values.append([format_cell(c) if formatted else c for c in cells])
+    while values and not values[-1]:
+      values.pop()
+
+    if request.query.get('majorDimension') == 'COLUMNS':
+      values = [
+          list(column)
+          for column in itertools.zip_longest(*values, fillvalue='')
+      ]
+    response = {'range': range_name, 'majorDimension': 'ROWS'}
+    if values:
+      response['values'] = values
+
+    return json_response(response)
+
+  def update_values(self, request: FakeRequest) -> FakeResponse:
+    """spreadsheets.values.update."""
+    key, range_name = request.params
+    title, first_row, first_col, _, _ = parse_a1_range(range_name)
+    rows = self.tab(key, title)
+    body = request.json()
+    values = body.get('values', [])
+    if body.get('majorDimension') == 'COLUMNS':
+      values = [
+          list(row) for row in itertools.zip_longest(*values, fillvalue='')
+      ]
+    user_entered = request.query.get('valueInputOption') == 'USER_ENTERED'
+
+    for row_offset, row_values in enumerate(values):
+      row_index = first_row + row_offset
+      while len(rows) <= row_index:
+        rows.append([])
+      row = rows[row_index]
+      end = first_col + len(row_values)
+      if len(row) < end:
+        row.extend([''] * (end - len(row)))
+      row[first_col:end] = [
+          parse_user_entered(value) if user_entered else value
+          for value in row_values
+      ]
+
+    columns = max([0] + [len(row) for row in values])
+    return json_response({
+        'spreadsheetId': key,
+        'updatedRange': range_name,
+        'updatedRows': len(values),
+        'updatedColumns': columns,
+        'updatedCells': sum(len(row) for row in values),
+    })
+
+  def batch_clear_values(self, request: FakeRequest) -> FakeResponse:
+    """spreadsheets.values.batchClear."""
+    key = request.params[0]
+    ranges = request.json().get('ranges', [])
+    for range_name in ranges:
+      title, first_row, first_col, end_row, end_col = parse_a1_range(
+          range_name
+      )
+      for row in self.tab(key, title)[first_row:end_row]:
+        for index in range(first_col, min(len(row), end_col or len(row))):
+          row[index] = ''
+
+    return json_response({'spreadsheetId': key, 'clearedRanges': ranges})
+
+
+  # Cloud Storage.
+
+  def generation_matches(
+      self, request: FakeRequest, key: tuple[str, str]
+  ) -> bool:
+    """Returns True if an object meets a request's ifGenerationMatch."""
+    if 'ifGenerationMatch' not in request.query:
+      return True
+    generation = self._objects.get(key, (0, b''))[0]
+    return int(request.query['ifGenerationMatch']) == generation
+
+  def download_object(self, request: FakeRequest) -> FakeResponse:
+    """objects.get with alt=media, of the latest or a given generation."""
+    key = request.params
+    if key not in self._objects:
+      raise FakeApiError(404, f'No such object: {"/".join(key)}')
+    generation, content = self._objects[key]
+    if int(request.query.get('generation', generation)) != generation:
+      raise FakeApiError(404, f'No such object: {"/".join(key)}')
+    if not self.generation_matches(request, key):
+      raise FakeApiError(412, 'At least one of the pre-conditions you '
+                         'specified did not hold.')
+
+    return FakeResponse(
+        200, content, 'application/octet-stream',
+        {'X-Goog-Generation': str(generation)},
+    )
+
+  def upload_object(self, request: FakeRequest) -> FakeResponse:
+    """objects.insert with uploadType=multipart."""
+    if request.query.get('uploadType') != 'multipart':
+      raise FakeApiError(400, 'Only multipart uploads are faked.')
+    parts = multipart_parts(request.headers.get('content-type', ''),
+                            request.body)
+    metadata = json.loads(parts[0].get_payload(decode=True))
+    key = (request.params[0], request.query.get('name', metadata['name']))
+    if not self.generation_matches(request, key):
+      raise FakeApiError(412, 'At least one of the pre-conditions you '
+                         'specified did not hold.')
+
+    generation = next(self._generations)
+    content = parts[-1].get_payload(decode=True)
+    self._objects[key] = (generation, content)
+    return json_response({
+        'kind': 'storage#object',
+        'bucket': key[0],
+        'name': key[1],
+        'generation': str(generation),
+        'metageneration': '1',
+        'size': str(len(content)),
+    })
+
+
+class FakeApiRequestHandler(server.BaseHTTPRequestHandler):
+  """Passes the requests of a FakeApiServer on to its FakeApi."""
+
+  # Keep-alive connections, as the Google APIs allow.  Without TCP_NODELAY
+  # a response's headers and body, written separately, wait on the
+  # client's delayed ACK and every call takes an extra 40ms or so.
+  protocol_version = 'HTTP/1.1'
+  disable_nagle_algorithm = True
+
+  def handle_method(self) -> None:
+    length = int(self.headers.get('Content-Length') or 0)
+    body = self.rfile.read(length) if length else b''
+    headers = {key.lower(): value for key, value in self.headers.items()}
+    response = self.server.api.handle(self.command, self.path, headers, body)
+
+    self.send_response(response.status)
+    self.send_header('Content-Type', response.content_type)
+    self.send_header('Content-Length', str(len(response.content)))
+    for name, value in response.headers.items():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(response.content)
+
+  do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_method
+
+  # pylint: disable-next=redefined-builtin
+  def log_message(self, format: str, *args: Any) -> None:
+    if self.server.verbose:
+      super().log_message(format, *args)
+
+
+class FakeApiServer:
+  """Serves a FakeApi over HTTP from a background thread.
+
+  Attributes:
+    api: the fake APIs served.
+    url: the URL the fake is served at, e.g. http://127.0.0.1:8089.
+  """
+
+  api: FakeApi
+  url: str
+
+  def __init__(
+      self,
+      api: FakeApi | None = None,
+      host: str = '127.0.0.1',
+      port: int = 0,
+      verbose: bool = False,
+  ):
+    """Binds the server.
+
+    Args:
+      api: the fake APIs to serve, a new FakeApi by default.
+      host: the address to listen on.
+      port: the port to listen on, any free port if 0.
+      verbose: whether to log every request.
+    """
+    self.api = api or FakeApi()
+    self._server = server.ThreadingHTTPServer(
+        (host, port), FakeApiRequestHandler
+    )
+    self._server.daemon_threads = True
+    self._server.api = self.api
+    self._server.verbose = verbose
+    self._thread = None
+    bound_host, bound_port = self._server.server_address[:2]
+    self.url = f'http://{bound_host}:{bound_port}'
+
+  def start(self) -> 'FakeApiServer':
+    """Starts serving in a background thread."""
+    self._thread = threading.Thread(
+        target=self._server.serve_forever, name='bid2x-fake-api', daemon=True
+    )
+    self._thread.start()
+    return self
+
+  def serve_forever(self) -> None:
+    """Serves from the calling thread until interrupted."""
+    self._server.serve_forever()
+
+  def stop(self) -> None:
+    """Stops serving and closes the listening socket."""
+    if self._thread is not None:
+      self._server.shutdown()
+      self._thread.join()
+      self._thread = None
+    self._server.server_close()
+
+  def __enter__(self) -> 'FakeApiServer':
+    return self.start()
+
+  def __exit__(self, *exc_info: Any) -> None:
+    self.stop()
+
+
+def main(argv: list[str]) -> int:
+  parser = argparse.ArgumentParser(
+      description='Serve fake DV360, GTM and Sheets APIs for bid2x runs.'
+  )
+  parser.add_argument(
+      '-i', '--input_file', action='append', default=[],
+      help='Config file to seed the fake with, may be repeated.'
+  )
+  parser.add_argument('--host', default='127.0.0.1', help='Address to bind.')
+  parser.add_argument(
+      '--port', type=int, default=bid2x_var.FAKE_API_PORT,
+      help='Port to listen on, 0 for any (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--latency', type=float, default=bid2x_var.FAKE_API_LATENCY,
+      help='Seconds added to every API call (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--latency_jitter', type=float,
+      default=bid2x_var.FAKE_API_LATENCY_JITTER,
+      help='Up to this many seconds more at random (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--latency_profile',
+      help='JSON file of seconds per API call, as used by --plan.'
+  )
+  parser.add_argument(
+      '--error_rate', type=float, default=bid2x_var.FAKE_API_ERROR_RATE,
+      help='Share of API calls failed, 0 to 1 (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--error_statuses',
+      default=','.join(map(str, bid2x_var.FAKE_API_ERROR_STATUSES)),
+      help='Comma separated statuses of failed calls (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--page_size', type=int, default=bid2x_var.FAKE_API_PAGE_SIZE,
+      help='Most items per listed page (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--line_items', type=int, default=bid2x_var.FAKE_API_LINE_ITEMS,
+      help='Line items per DV360 zone (default: %(default)s).'
+  )
+  parser.add_argument(
+      '--index_rows', type=int, default=bid2x_var.FAKE_API_INDEX_ROWS,
+      help='Index table rows per GTM zone (default: %(default)s).'
+  )
+  parser.add_argument('--seed', type=int, help='Seed of the random choices.')
+  parser.add_argument(
+      '--key_file',
+      help='Write a service account key for runs against the fake here.'
+  )
+  parser.add_argument(
+      '-v', '--verbose', action='store_true', help='Log every request.'
+  )
+  args = parser.parse_args(argv[1:])
+
+  config = FakeApiConfig(
+      latency=args.latency,
+      latency_jitter=args.latency_jitter,
+      latency_profile=(
+          bid2x_plan.load_latency_profile(args.latency_profile)
+          if args.latency_profile else {}
+      ),
+      error_rate=args.error_rate,
+      error_statuses=tuple(
+          int(status) for status in args.error_statuses.split(',') if status
+      ),
+      page_size=args.page_size,
+      seed=args.seed,
+  )
+  fake = FakeApiServer(
+      FakeApi(config), args.host, args.port, verbose=args.verbose
+  )
+  for input_file in args.input_file:
+    fake.api.seed_from_config(
+        bid2x_util.read_config(input_file), args.line_items, args.index_rows
+    )
+  if args.key_file:
+    write_service_account_key(args.key_file, fake.url)
+    print(f'Wrote service account key {args.key_file}')
+
+  print(f'Serving fake APIs at {fake.url}, run bid2x with:')
+  print(f'  {bid2x_var.API_ENDPOINT_ENV_VAR}={fake.url}')
+  try:
+    fake.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    fake.stop()
+    print(json.dumps(fake.api.stats(), indent=2))
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
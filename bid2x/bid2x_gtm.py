@@ -21,20 +21,81 @@
   the GTM platform.
 """
 
+from concurrent import futures
 import datetime
 import functools
+import hashlib
 import json
 import re
-from typing import Any, Sequence
+import threading
+from typing import Any, Callable, Sequence
 
 from bid2x_gtm_model import Bid2xGTMModel
+import bid2x_metrics
 from bid2x_platform import Platform
+import bid2x_profile
+import bid2x_quota
 from bid2x_spreadsheet import Bid2xSpreadsheet
+import bid2x_trace
+from bid2x_util import api_call_name
+from bid2x_util import RateLimiter
 import bid2x_var
+from googleapiclient import errors
 import pandas as pd
 
+HttpError = errors.HttpError
+
 partial = functools.partial
 
+# Per-thread state (the rate limiter of the container being processed), the
+# lock serialising spreadsheet access when containers run in parallel and
+# the one guarding the workspaces recorded for reuse.
+_thread_state = threading.local()
+_sheet_lock = threading.Lock()
+_workspace_lock = threading.Lock()
+
+# Ends the GTM state file keys of the workspaces reused in 'persistent'
+# workspace mode, see gtm_workspace_state_key.
+GTM_WORKSPACE_STATE_SUFFIX = '/workspace'
+
+# Name and notes prefixes of the workspaces create_gtm_workspace makes by
+# default.  Used to recognise stale workspaces left by earlier runs.
+GTM_AUTO_WORKSPACE_NAME_PREFIX = 'Copy of production '
+GTM_AUTO_WORKSPACE_NOTES_PREFIX = (
+    'Auto-generated workspace - made in GTM API - '
+)
+# Format of the local creation time that follows the notes prefix.
+GTM_AUTO_WORKSPACE_NOTES_TIME_FORMAT = '%d/%m/%Y %H:%M:%S'
+
+
+def auto_workspace_created_at(
+    workspace: dict[str, Any],
+) -> datetime.datetime | None:
+  """Returns when create_gtm_workspace auto-created a workspace.
+
+  Args:
+    workspace: a GTM workspace resource.
+
+  Returns:
+    The local time written to the workspace's notes, or None if the
+    workspace doesn't carry both the auto-generated name and notes or the
+    time can't be read.
+  """
+  name = workspace.get('name', '')
+  notes = workspace.get('notes', '')
+  if not name.startswith(GTM_AUTO_WORKSPACE_NAME_PREFIX) or not (
+      notes.startswith(GTM_AUTO_WORKSPACE_NOTES_PREFIX)
+  ):
+    return None
+
+  try:
+    return datetime.datetime.strptime(
+        notes[len(GTM_AUTO_WORKSPACE_NOTES_PREFIX):],
+        GTM_AUTO_WORKSPACE_NOTES_TIME_FORMAT,
+    )
+  except ValueError:
+    return None
+
 
 class GTMFloodlight:
   """GTM Floodlight object.
@@ -44,11 +105,23 @@ class GTMFloodlight:
       per_row_condition(str): Condition to be met for the row.
       total_var(str): Variable name for the total value.
       floodlight_condition(str): Condition to identify the floodlight.
+      hit_rate_weight(float): Optional relative frequency of the floodlight,
+          used to order its condition in 'dispatch' emission mode.
   """
+
+  __slots__ = (
+      'floodlight_name',
+      'per_row_condition',
+      'total_var',
+      'floodlight_condition',
+      'hit_rate_weight',
+  )
+
   floodlight_name: str
   per_row_condition: str
   total_var: str
   floodlight_condition: str
+  hit_rate_weight: float | None
 
   def __init__(
       self,
@@ -56,11 +129,13 @@ class GTMFloodlight:
       per_row_condition: str,
       total_var: str,
       floodlight_condition: str | None = None,
+      hit_rate_weight: float | None = None,
   ) -> None:
     self.floodlight_name = floodlight_name
     self.per_row_condition = per_row_condition
     self.total_var = total_var
     self.floodlight_condition = floodlight_condition
+    self.hit_rate_weight = hit_rate_weight
 
   def __str__(self) -> str:
     return_str = (
@@ -68,11 +143,126 @@ class GTMFloodlight:
         f'per_row_condition: {self.per_row_condition}\n'
         f'total_var: {self.total_var}\n'
         f'floodlight_condition: {self.floodlight_condition}\n'
+        f'hit_rate_weight: {self.hit_rate_weight}\n'
     )
 
     return return_str
 
 
+def gtm_container_key(zone: Bid2xGTMModel) -> tuple[int, int]:
+  """Returns the (account_id, container_id) pair identifying a zone's container.
+
+  Args:
+    zone: the zone object.
+
+  Returns:
+    A tuple of the zone's GTM account id and container id.
+  """
+  return (zone.account_id, zone.container_id)
+
+
+def gtm_variable_path(zone: Bid2xGTMModel) -> str:
+  """Returns a workspace independent path identifying a zone's variable.
+
+  Args:
+    zone: the zone object.
+
+  Returns:
+    A string of the form 'accounts/<a>/containers/<c>/variables/<v>'.
+  """
+  return (
+      f'accounts/{zone.account_id}/containers/{zone.container_id}/'
+      f'variables/{zone.variable_id}'
+  )
+
+
+def gtm_workspace_state_key(account_id: int, container_id: int) -> str:
+  """Returns the GTM state file key of a container's reusable workspace.
+
+  Args:
+    account_id: the GTM account id owning the container.
+    container_id: the GTM container id.
+
+  Returns:
+    A string of the form 'accounts/<a>/containers/<c>/workspace'.
+  """
+  return (
+      f'accounts/{account_id}/containers/{container_id}'
+      f'{GTM_WORKSPACE_STATE_SUFFIX}'
+  )
+
+
+def gtm_workspace_paths(state: dict[str, str]) -> dict[str, str]:
+  """Returns the reusable workspaces held in the GTM state file.
+
+  Args:
+    state: the GTM state file's content, see Bid2xGTM.read_gtm_state.
+
+  Returns:
+    A dict of gtm_workspace_state_key to workspace path.
+  """
+  return {
+      key: path for key, path in state.items()
+      if key.endswith(GTM_WORKSPACE_STATE_SUFFIX)
+  }
+
+
+def gtm_function_hash(js_function: str) -> str:
+  """Returns the content hash used to detect unchanged GTM functions.
+
+  Args:
+    js_function: a JavaScript function as a string.
+
+  Returns:
+    The hex SHA-256 digest of the function with surrounding whitespace
+    removed.
+  """
+  return hashlib.sha256(js_function.strip().encode('utf-8')).hexdigest()
+
+
+def gtm_variable_javascript(gtm_var: dict[str, Any]) -> str | None:
+  """Returns the JavaScript held by a GTM custom JavaScript variable.
+
+  Args:
+    gtm_var: a GTM variable resource as returned by the API.
+
+  Returns:
+    The value of the 'javascript' parameter, falling back to the first
+    parameter, or None if the variable has no parameters.
+  """
+  parameters = gtm_var.get('parameter', [])
+  for parameter in parameters:
+    if parameter.get('key') == 'javascript':
+      return parameter.get('value')
+
+  return parameters[0].get('value') if parameters else None
+
+
+# Matches a floodlight_condition that only compares {{Event}} to a string
+# literal, capturing the event name.  Names holding quotes or backslashes
+# are left to the if / else if chain.
+GTM_EVENT_CONDITION_PATTERN = re.compile(
+    r"""^\s*\{\{Event\}\}\s*===?\s*(['"])([^'"\\]*)\1\s*$"""
+)
+
+
+def gtm_event_condition_name(conditional: str | None) -> str | None:
+  """Returns the event name a plain {{Event}} comparison tests for.
+
+  Args:
+    conditional: a floodlight condition, e.g. " {{Event}} == 'Lead' ".
+
+  Returns:
+    The event name compared against, or None if the condition is anything
+    other than {{Event}} compared (== or ===) with a string literal.
+  """
+  if not conditional:
+    return None
+
+  match = GTM_EVENT_CONDITION_PATTERN.match(conditional)
+  return match.group(2) if match else None
+
+
 class Bid2xGTM(Platform):
   """GTM object for custom variable template bidding script.
 
@@ -88,6 +278,28 @@ class Bid2xGTM(Platform):
       container_id(str): GTM container id of the script.
       workspace_id(str): GTM workspace id of the script.
       variable_id(str): GTM variable id of the script.
+      gtm_batch_by_container(bool): Flag to update all zones sharing a
+          container in one workspace and publish once per container.
+      gtm_change_detection(str): How to detect unchanged functions and skip
+          their publish: 'off', 'live' or 'local'.
+      gtm_state_file(str): Path of the local store of published function
+          hashes used by 'local' change detection, and of the workspaces
+          reused in 'persistent' workspace mode.
+      gtm_workspace_mode(str): 'new' to create a workspace per update or
+          'persistent' to reuse one named workspace per container.
+      gtm_workspace_name(str): Name of the persistent bid2x workspace.
+      gtm_workspace_paths(dict): Workspaces GTM made when bid2x last
+          published each container, reused in 'persistent' mode, keyed by
+          gtm_workspace_state_key.
+      gtm_delete_stale_workspaces(bool): Flag to delete workspaces
+          auto-created by earlier runs before updating a container.
+      gtm_stale_workspace_age_hours(float): Hours after which an
+          auto-created workspace is old enough to delete.
+      gtm_max_workers(int): Number of containers processed in parallel.
+      gtm_min_call_interval(float): Minimum seconds between GTM API calls
+          made for one container.
+      gtm_emission_mode(str): How the generated function selects the
+          floodlight; 'chain' or 'dispatch'.
 
   Methods:
       print_dataframe(self, input_df):
@@ -103,10 +315,15 @@ class Bid2xGTM(Platform):
       update_gtm_variable(self, service, new_function):
           This function updates a variable within the Google Tag Manager
           using the value in the 'new_function' parameter.
+      update_gtm_container(self, service, zone_functions):
+          This function updates the variables of several zones sharing a
+          container within one workspace and publishes it once.
       process_script(self, service):
           This function orchestrates the custom variable change in GTM
           that adjusts bid multipliers for different routes by way of a
           custom script that is saved into the custom variable.
+      process_zones(self, service, zone_array, test_flag, known_hashes):
+          Serially generates and publishes the functions of some zones.
       top_level_copy(self, source): Copies all variable settings
       from config file to the object.
   """
@@ -123,6 +340,17 @@ class Bid2xGTM(Platform):
   index_high_column_name: str
   action_update_scripts: bool
   action_test: bool
+  gtm_batch_by_container: bool  # One workspace and publish per container.
+  gtm_change_detection: str  # Skip unchanged functions: off, live or local.
+  gtm_state_file: str  # Local store of hashes and reusable workspaces.
+  gtm_workspace_mode: str  # Workspace per update (new) or reused.
+  gtm_workspace_name: str  # Name of the reused bid2x workspace.
+  gtm_workspace_paths: dict[str, str]  # Workspaces to reuse, by container.
+  gtm_delete_stale_workspaces: bool  # Remove auto-created workspaces.
+  gtm_stale_workspace_age_hours: float  # Minimum age of those removed.
+  gtm_max_workers: int  # Containers processed in parallel.
+  gtm_min_call_interval: float  # Seconds between calls per container.
+  gtm_emission_mode: str  # 'chain' or 'dispatch' floodlight selection.
   zones_to_process: str  # Zones involved in the bidding script.
 
   def __init__(self, sheet: Bid2xSpreadsheet, debug: bool) -> None:
@@ -133,6 +361,20 @@ class Bid2xGTM(Platform):
     self.trace = False
     self.action_update_scripts = False
     self.action_test = True
+    self.gtm_batch_by_container = bid2x_var.GTM_BATCH_BY_CONTAINER
+    self.gtm_change_detection = bid2x_var.GTM_CHANGE_DETECTION
+    self.gtm_state_file = bid2x_var.GTM_STATE_FILE
+    self.gtm_workspace_mode = bid2x_var.GTM_WORKSPACE_MODE
+    self.gtm_workspace_name = bid2x_var.GTM_WORKSPACE_NAME
+    self.gtm_workspace_paths = {}
+    self._workspace_paths_changed = False
+    self.gtm_delete_stale_workspaces = bid2x_var.GTM_DELETE_STALE_WORKSPACES
+    self.gtm_stale_workspace_age_hours = (
+        bid2x_var.GTM_STALE_WORKSPACE_AGE_HOURS
+    )
+    self.gtm_max_workers = bid2x_var.GTM_MAX_WORKERS
+    self.gtm_min_call_interval = bid2x_var.GTM_MIN_CALL_INTERVAL
+    self.gtm_emission_mode = bid2x_var.GTM_EMISSION_MODE
     self.gtm_floodlight_list = bid2x_var.GTM_FLOODLIGHT_LIST
     self.gtm_preprocessing_script = bid2x_var.GTM_PREPROCESSING_SCRIPT
     self.gtm_postprocessing_script = bid2x_var.GTM_POSTPROCESSING_SCRIPT
@@ -165,6 +407,18 @@ class Bid2xGTM(Platform):
         f'index_high_column_name: {self.index_high_column_name}\n'
         f'action_update_scripts: {self.action_update_scripts}\n'
         f'action_test: {self.action_test}\n'
+        f'gtm_batch_by_container: {self.gtm_batch_by_container}\n'
+        f'gtm_change_detection: {self.gtm_change_detection}\n'
+        f'gtm_state_file: {self.gtm_state_file}\n'
+        f'gtm_workspace_mode: {self.gtm_workspace_mode}\n'
+        f'gtm_workspace_name: {self.gtm_workspace_name}\n'
+        'gtm_delete_stale_workspaces: '
+        f'{self.gtm_delete_stale_workspaces}\n'
+        'gtm_stale_workspace_age_hours: '
+        f'{self.gtm_stale_workspace_age_hours}\n'
+        f'gtm_max_workers: {self.gtm_max_workers}\n'
+        f'gtm_min_call_interval: {self.gtm_min_call_interval}\n'
+        f'gtm_emission_mode: {self.gtm_emission_mode}\n'
         '----------------------\n'
     )
 
@@ -194,6 +448,7 @@ class Bid2xGTM(Platform):
 
   # Function to automate data imports, data processing, mapping
   # and opportunity calculation.
+  @bid2x_trace.traced('sheets.read_index')
   def read_sheets_data(self, zone: Bid2xGTMModel) -> pd.DataFrame:
     """Read sheet data for access to index info.
 
@@ -206,14 +461,15 @@ class Bid2xGTM(Platform):
     """
 
     # Open associated spreadsheet.
-    spreadsheet = self.sheet.gc.open_by_url(self.sheet.sheet_url)
-
     # Load the index data file tab for this zone.
-    index_tab = spreadsheet.worksheet(zone.name)
+    index_tab = self.sheet.open_worksheet(zone.name, self.sheet.sheet_url)
 
     # Get all the values from the index data tab and convert into a Dataframe.
+    self.sheet.reserve_quota('spreadsheets.values.get')
     index_data = index_tab.get_all_values()
     index_df = pd.DataFrame(index_data[1:], columns=index_data[0])
+    bid2x_trace.annotate(zone=zone.name, rows=len(index_df))
+    bid2x_metrics.SHEET_ROWS_READ.inc(len(index_df), tab='index')
 
     if self.trace:
       print(f'Index DataFrame as read in from tab {zone.name}:')
@@ -391,6 +647,239 @@ class Bid2xGTM(Platform):
       # match (e.g., #getRegion#).
       return match.group(0)
 
+  def floodlight_conditional(self, floodlight_obj: GTMFloodlight) -> str:
+    """Returns the JavaScript condition identifying a floodlight.
+
+    Args:
+        floodlight_obj: the floodlight to identify.
+
+    Returns:
+        The configured floodlight_condition or, when the floodlight has
+        none, a comparison of {{Event}} against the floodlight name.
+    """
+    # The dictionary for the gtm_floodlight_list contains a
+    # 'floodlight_name', 'per_row_condition', 'total_var', and
+    # optionally a 'floodlight_condition'.
+    # If floodlight_condition exists then use it as the conditional statement
+    # to identify a specific floodlight in the JavaScript fn being generated.
+    # If it doesn't exist then assume the name of the {{Event}} will be the
+    # same as the given name of the floodlight.
+    if hasattr(floodlight_obj, 'floodlight_condition'):
+      return floodlight_obj.floodlight_condition
+
+    floodlight_name = floodlight_obj.floodlight_name
+    return ' {{Event}} == ' + f'"{floodlight_name}" '
+
+  def write_floodlight_body(
+      self,
+      floodlight_obj: GTMFloodlight,
+      input_df: pd.DataFrame,
+      use_lookup: bool,
+      indent: str = '  ',
+  ) -> str:
+    """Creates the statements run once a floodlight has been identified.
+
+    Args:
+        floodlight_obj: the floodlight the statements are for.
+        input_df: dataframe from loading client supplied index file.
+        use_lookup: True when a lookup table applies the multipliers, in
+            which case only the default conversion value is assigned.
+        indent: the indentation of the enclosing block.
+
+    Returns:
+        A string of JavaScript statements.
+    """
+    js_body = []
+    # Once inside the conditional the very first thing is to assign
+    # conversion_value to the configured total_var.  This ensures
+    # we have a default value for the conversion even if none of the
+    # 'per_row_condition' statements fail to match.
+    js_body.append(f'{indent}  conversion_value = parseFloat(')
+    js_body.append('{{')
+    # The default action is to use the total_var as a GTM varaiable to
+    # evaluate in the JavaScript.  If it is not provided then use the
+    # floodlight name.
+    if hasattr(floodlight_obj, 'total_var'):
+      js_body.append(f'{floodlight_obj.total_var}')
+    else:
+      js_body.append(f'{floodlight_obj.floodlight_name}')
+    js_body.append('}});\n')
+
+    # If NOT using a lookup table then use the 'per_row_condition' as
+    # the mechanism by which to write the innder conditional.
+    if not use_lookup:
+      # Extract variables to be used from 'per_row_condition' line.
+      replacement_pattern = re.compile(r'#([^#]+)#')
+
+      for _, row_data in input_df.iterrows():
+        # Create a partial function with row_data "frozen"
+        replace_match_partial = partial(self.replace_match, row_data=row_data)
+        if hasattr(floodlight_obj, 'per_row_condition'):
+          substituted_condition = replacement_pattern.sub(
+              replace_match_partial, floodlight_obj.per_row_condition
+          )
+        else:
+          print(
+              'per_row_condition key not defined for this ', 'floodlight: ',
+              floodlight_obj, ' cannot continue.'
+          )
+          exit(-2)
+
+        # Define the column being referenced for adjustments to
+        # the conversion value.
+        adjustment = row_data[self.value_adjustment_column_name]
+
+        js_body.append(f'{indent}  if (')
+        js_body.append(substituted_condition)
+        js_body.append(' ) {\n')
+        js_body.append(f'{indent}    conversion_value *= ')
+        # This is the index adjustment/multiplier
+        # to the default conv. value.
+        js_body.append(f'{adjustment}; ')
+        js_body.append('  }\n')
+
+    return ''.join(js_body)
+
+  def write_floodlight_chain(
+      self,
+      floodlight_list: list[GTMFloodlight],
+      input_df: pd.DataFrame,
+      use_lookup: bool,
+      indent: str = '  ',
+  ) -> str:
+    """Creates an if / else if chain testing each floodlight in turn.
+
+    Args:
+        floodlight_list: the floodlights in the order they are tested.
+        input_df: dataframe from loading client supplied index file.
+        use_lookup: True when a lookup table applies the multipliers.
+        indent: the indentation of the chain.
+
+    Returns:
+        A string of JavaScript statements.
+    """
+    js_chain = []
+
+    # Run a loop for the list of floodlight names passed.
+    for fl_iter, floodlight_obj in enumerate(floodlight_list):
+
+      # Determine clause prefix.
+      if fl_iter > 0:
+        fl_clause_prefix = 'else '
+      else:
+        fl_clause_prefix = ''
+
+      conditional = self.floodlight_conditional(floodlight_obj)
+
+      js_chain.append(f'{indent}{fl_clause_prefix}')
+      js_chain.append(f'if ( {conditional} ) ')
+      js_chain.append('{\n')
+      js_chain.append(
+          self.write_floodlight_body(
+              floodlight_obj, input_df, use_lookup, indent=indent
+          )
+      )
+      js_chain.append(f'{indent}}}\n')
+
+    return ''.join(js_chain)
+
+  def write_floodlight_dispatch(
+      self, input_df: pd.DataFrame, use_lookup: bool
+  ) -> str:
+    """Creates an event dispatch table selecting the floodlight to run.
+
+    Floodlights identified by a plain {{Event}} comparison are looked up
+    by event name in a table mapping it to a handler number, and the
+    handler is picked with a switch.  Only one lookup is made whatever
+    the number of floodlights, in place of one comparison per floodlight.
+
+    The remaining floodlights are tested with an if / else if chain when
+    no handler matches.  Without hit_rate_weight settings the chain keeps
+    the configured order, and only the event comparisons that come before
+    the first other condition are put in the table so the first match
+    wins exactly as in 'chain' mode.  When any floodlight has a
+    hit_rate_weight the floodlight conditions are taken to be mutually
+    exclusive: every event comparison goes in the table and the other
+    conditions are tested most frequent (highest weight) first.
+
+    Args:
+        input_df: dataframe from loading client supplied index file.
+        use_lookup: True when a lookup table applies the multipliers.
+
+    Returns:
+        A string of JavaScript statements.
+    """
+    weighted = any(
+        getattr(floodlight_obj, 'hit_rate_weight', None) is not None
+        for floodlight_obj in self.gtm_floodlight_list
+    )
+
+    handlers = {}  # Event name to floodlight, first one configured wins.
+    remaining = []
+    for floodlight_obj in self.gtm_floodlight_list:
+      event_name = gtm_event_condition_name(
+          self.floodlight_conditional(floodlight_obj)
+      )
+      if event_name is not None and (weighted or not remaining):
+        handlers.setdefault(event_name, floodlight_obj)
+      elif event_name is None or event_name not in handlers:
+        remaining.append(floodlight_obj)
+
+    if weighted:
+      # sorted() is stable so equally weighted floodlights keep their order.
+      remaining = sorted(
+          remaining,
+          key=lambda fl: -(getattr(fl, 'hit_rate_weight', None) or 0.0),
+      )
+
+    if not handlers:
+      return self.write_floodlight_chain(
+          remaining, input_df, use_lookup, indent='  '
+      )
+
+    js_dispatch = []
+    js_dispatch.append('  var floodlight_handlers = {\n')
+    js_dispatch.append(
+        ',\n'.join(
+            f'    {json.dumps(event_name)}: {handler_id}'
+            for handler_id, event_name in enumerate(handlers, start=1)
+        )
+    )
+    js_dispatch.append('\n  };\n')
+    js_dispatch.append('  var floodlight_event = {{Event}};\n')
+    js_dispatch.append('  var floodlight_handler = 0;\n')
+    js_dispatch.append(
+        "  if (typeof floodlight_event === 'string' && "
+        'Object.prototype.hasOwnProperty.call(floodlight_handlers, '
+        'floodlight_event)) {\n'
+    )
+    js_dispatch.append(
+        '    floodlight_handler = floodlight_handlers[floodlight_event];\n'
+    )
+    js_dispatch.append('  }\n')
+    js_dispatch.append('  switch (floodlight_handler) {\n')
+    for handler_id, floodlight_obj in enumerate(handlers.values(), start=1):
+      js_dispatch.append(f'    case {handler_id}: {{\n')
+      js_dispatch.append(
+          self.write_floodlight_body(
+              floodlight_obj, input_df, use_lookup, indent='    '
+          )
+      )
+      js_dispatch.append('      break;\n')
+      js_dispatch.append('    }\n')
+    if remaining:
+      js_dispatch.append('    default: {\n')
+      js_dispatch.append(
+          self.write_floodlight_chain(
+              remaining, input_df, use_lookup, indent='      '
+          )
+      )
+      js_dispatch.append('    }\n')
+    js_dispatch.append('  }\n')
+
+    return ''.join(js_dispatch)
+
+  @bid2x_trace.traced('gtm.generate_function')
   def write_javascript_function(self, input_df: pd.DataFrame) -> str:
     """Creates a string containing a JavaScript function for use in GTM.
 
@@ -439,92 +928,16 @@ class Bid2xGTM(Platform):
       js_function_string_start.append(js_output_explicit)
       js_function_string_start.append('\n')
 
-    fl_iter = 0
-
-    # Run a loop for the list of floodlight names passed.
-    for floodlight_obj in self.gtm_floodlight_list:
-
-      # Determine clause prefix.
-      if fl_iter > 0:
-        fl_clause_prefix = 'else '
-      else:
-        fl_clause_prefix = ''
-
-      # The dictionary for the gtm_floodlight_list contains a
-      # 'floodlight_name', 'per_row_condition', 'total_var', and
-      # optionally a 'floodlight_condition'.
-      # If floodlight_condition exists then use it as the conditional statement
-      # to identify a specific floodlight in the JavaScript fn being generated.
-      # If it doesn't exist then assume the name of the {{Event}} will be the
-      # same as the given name of the floodlight.
-      if hasattr(floodlight_obj, 'floodlight_condition'):
-        conditional = floodlight_obj.floodlight_condition
-      else:
-        floodlight_name = floodlight_obj.floodlight_name
-        conditional = ' {{Event}} == ' + f'"{floodlight_name}" '
-
-      js_function_string_start.append(f'  {fl_clause_prefix}')
-      js_function_string_start.append(f'if ( {conditional} ) ')
-      js_function_string_start.append('{\n')
-      # Once inside the conditional the very first thing is to assign
-      # conversion_value to the configured total_var.  This ensures
-      # we have a default value for the conversion even if none of the
-      # 'per_row_condition' statements fail to match.
-      js_function_string_start.append('    conversion_value = parseFloat(')
-      js_function_string_start.append('{{')
-      # The default action is to use the total_var as a GTM varaiable to
-      # evaluate in the JavaScript.  If it is not provided then use the
-      # floodlight name.
-      if hasattr(floodlight_obj, 'total_var'):
-        js_function_string_start.append(f'{floodlight_obj.total_var}')
-      else:
-        js_function_string_start.append(f'{floodlight_obj.floodlight_name}')
-      js_function_string_start.append('}});\n')
-
-      # Advance the floodlight counter.
-      fl_iter = fl_iter + 1
-
-      # Create the repeating part of the function string by
-      # starting with a blank list.
-      js_function_string_middle = []
-
-      # If NOT using a lookup table then use the 'per_row_condition' as
-      # the mechanism by which to write the innder conditional.
-      if not use_lookup:
-        # Extract variables to be used from 'per_row_condition' line.
-        replacement_pattern = re.compile(r'#([^#]+)#')
-
-        for _, row_data in input_df.iterrows():
-          # Create a partial function with row_data "frozen"
-          replace_match_partial = partial(self.replace_match, row_data=row_data)
-          if hasattr(floodlight_obj, 'per_row_condition'):
-            substituted_condition = replacement_pattern.sub(
-                replace_match_partial, floodlight_obj.per_row_condition
-            )
-          else:
-            print(
-                'per_row_condition key not defined for this ', 'floodlight: ',
-                floodlight_obj, ' cannot continue.'
-            )
-            exit(-2)
-
-          # Define the column being referenced for adjustments to
-          # the conversion value.
-          adjustment = row_data[self.value_adjustment_column_name]
-
-          js_function_string_middle.append('    if (')
-          js_function_string_middle.append(substituted_condition)
-          js_function_string_middle.append(' ) {\n')
-          js_function_string_middle.append('      conversion_value *= ')
-          # This is the index adjustment/multiplier
-          # to the default conv. value.
-          js_function_string_middle.append(f'{adjustment}; ')
-          js_function_string_middle.append('  }\n')
-
-      # Last statement in floodlight loop - append all from this iteration
-      # of the loop to the start start list.
-      js_function_string_start.append(''.join(js_function_string_middle))
-      js_function_string_start.append('  }\n')
+    if self.gtm_emission_mode == bid2x_var.GTMEmissionMode.DISPATCH.value:
+      js_function_string_start.append(
+          self.write_floodlight_dispatch(input_df, use_lookup)
+      )
+    else:
+      js_function_string_start.append(
+          self.write_floodlight_chain(
+              self.gtm_floodlight_list, input_df, use_lookup, indent='  '
+          )
+      )
 
     # Define the end of the JavaScript function.
     if use_lookup:
@@ -539,75 +952,317 @@ class Bid2xGTM(Platform):
     # Assemble the JavaScript function - join the start to the end
     js_function_string = ''.join(js_function_string_start)
     js_function_string += js_function_string_end
+    bid2x_trace.annotate(
+        rows=len(input_df), script_bytes=len(js_function_string)
+    )
+    bid2x_metrics.SCRIPT_BYTES.observe(len(js_function_string), platform='gtm')
 
     # Return the finalized JavaScript function for use in GTM.
     return js_function_string
 
-  # Update the variable using GTM API.
-  def update_gtm_variable(
-      self, service: Any, new_function: str, zone: Bid2xGTMModel
-  ) -> bool:
-    """Update Google Tag Manager variable with new JavaScript function.
+  def gtm_execute(self, request: Any, cost: int = 1) -> Any:
+    """Executes a GTM API request, honouring the thread's rate limiter.
+
+    Args:
+        request: a prepared GTM API request (or batch request).
+        cost: the number of requests counted against the API quota, e.g.
+          the requests in a batch.
+
+    Returns:
+        The response from the API call.
+    """
+    name = api_call_name('gtm', request)
+    with bid2x_trace.span(name) as span:
+      rate_limiter = getattr(_thread_state, 'rate_limiter', None)
+      if rate_limiter:
+        wait = rate_limiter.wait()
+        span.set(rate_limit_wait=wait)
+        bid2x_metrics.RATE_LIMIT_WAIT_SECONDS.inc(wait, api='gtm')
+      quota_wait = bid2x_quota.reserve(name, cost=cost)
+      if quota_wait:
+        span.set(quota_wait=quota_wait)
+
+      return bid2x_metrics.execute(name, request)
+
+  def create_gtm_workspace(
+      self,
+      service: Any,
+      account_id: int,
+      container_id: int,
+      name: str | None = None,
+  ) -> str | None:
+    """Create a new workspace in a GTM container to operate on.
 
     Args:
         service: a service object previously opened with the GTM API.
-        new_function: a string containing the value to update within the
-          variable_id.
-        zone: the zone object.
+        account_id: the GTM account id owning the container.
+        container_id: the GTM container id to create the workspace in.
+        name: the workspace name.  By default a timestamped
+          'Copy of production' name is used.
 
     Returns:
-        The function returns True upon successful update or False if
-        it was unable to update the variable.
+        The path of the new workspace or None if it could not be created.
     """
-    # Create a new workspace version to operate on.
-    prod_workspace_path = (
-        f'accounts/{zone.account_id}/containers/{zone.container_id}'
-    )
+    prod_workspace_path = f'accounts/{account_id}/containers/{container_id}'
 
     now = datetime.datetime.now()
-    datetime_string = now.strftime('%d/%m/%Y %H:%M:%S')
+    datetime_string = now.strftime(GTM_AUTO_WORKSPACE_NOTES_TIME_FORMAT)
     datetime_string_simplified = now.strftime('%Y%m%d%H%M%S')
 
-    gtm_body_name = f'Copy of production {datetime_string_simplified}'
-    gtm_body_notes = (
-        f'Auto-generated workspace - made in GTM API - {datetime_string}'
-    )
+    if name:
+      gtm_body_name = name
+    else:
+      gtm_body_name = (
+          f'{GTM_AUTO_WORKSPACE_NAME_PREFIX}{datetime_string_simplified}'
+      )
+    gtm_body_notes = f'{GTM_AUTO_WORKSPACE_NOTES_PREFIX}{datetime_string}'
     gtm_new_workspace_body = {'name': gtm_body_name, 'notes': gtm_body_notes}
 
     if self.trace:
       print(f'gtm_new_workspace_body: {gtm_new_workspace_body}')
       print(f'prod_workspace_path: {prod_workspace_path}')
 
-    gtm_new_workspace = (
-        service.accounts().containers().workspaces().create(
-            parent=prod_workspace_path, body=gtm_new_workspace_body
-        ).execute()
+    request = service.accounts().containers().workspaces().create(
+        parent=prod_workspace_path, body=gtm_new_workspace_body
     )
+    gtm_new_workspace = self.gtm_execute(request)
 
-    # Return value of call to create new workspace gives new ids - assign
-    # these values.
-    if gtm_new_workspace and gtm_new_workspace['fingerprint']:
-      account_id = gtm_new_workspace['accountId']
-      container_id = gtm_new_workspace['containerId']
-      workspace_id = gtm_new_workspace['workspaceId']
-      if self.trace:
-        print(f'gtm_new_workspace return value: {gtm_new_workspace}')
-    else:
-      return False
+    # Return value of call to create new workspace gives new ids - use
+    # these values to build the path of the workspace.
+    if not gtm_new_workspace or not gtm_new_workspace['fingerprint']:
+      return None
+
+    if self.trace:
+      print(f'gtm_new_workspace return value: {gtm_new_workspace}')
 
-    # Build the path for getting / updating the variable
-    # using the passed args.
-    var_req = (
-        f'accounts/{account_id}/containers/{container_id}/'
-        f'workspaces/{workspace_id}/variables/{zone.variable_id}'
+    return (
+        f'accounts/{gtm_new_workspace["accountId"]}/'
+        f'containers/{gtm_new_workspace["containerId"]}/'
+        f'workspaces/{gtm_new_workspace["workspaceId"]}'
     )
 
+  def list_gtm_workspaces(
+      self, service: Any, account_id: int, container_id: int
+  ) -> list[dict[str, Any]]:
+    """List all workspaces in a GTM container.
+
+    Args:
+        service: a service object previously opened with the GTM API.
+        account_id: the GTM account id owning the container.
+        container_id: the GTM container id to list the workspaces of.
+
+    Returns:
+        A list of GTM workspace resources.
+    """
+    container_path = f'accounts/{account_id}/containers/{container_id}'
+    workspaces = []
+    next_page_token = None
+
+    while True:
+      request = service.accounts().containers().workspaces().list(
+          parent=container_path, pageToken=next_page_token
+      )
+      response = self.gtm_execute(request)
+      workspaces.extend(response.get('workspace', []))
+      next_page_token = response.get('nextPageToken')
+      if not next_page_token:
+        break
+
+    return workspaces
+
+  def delete_stale_gtm_workspaces(
+      self, service: Any, workspaces: list[dict[str, Any]]
+  ) -> int:
+    """Delete workspaces auto-created by earlier bid2x runs in one batch.
+
+    Only workspaces carrying both the auto-generated name and notes written
+    by create_gtm_workspace, and created more than
+    gtm_stale_workspace_age_hours ago, are considered stale.  Younger ones
+    may belong to a run that is still in progress.
+
+    Args:
+        service: a service object previously opened with the GTM API.
+        workspaces: the container's workspaces as returned by
+          list_gtm_workspaces.
+
+    Returns:
+        The number of workspaces deleted.
+    """
+    # The notes hold the local time of creation, as does now().
+    cutoff = datetime.datetime.now() - datetime.timedelta(
+        hours=self.gtm_stale_workspace_age_hours
+    )
+    stale_paths = []
+    for workspace in workspaces:
+      created_at = auto_workspace_created_at(workspace)
+      if created_at is not None and created_at < cutoff:
+        stale_paths.append(workspace['path'])
+    if not stale_paths:
+      return 0
+
+    deleted = []
+
+    def delete_callback(request_id: str, response: Any, exception: Any):
+      del response  # Deletes return an empty body.
+      if exception is not None:
+        print(f'Error deleting stale GTM workspace {request_id}: {exception}')
+      else:
+        deleted.append(request_id)
+
+    batch = service.new_batch_http_request(callback=delete_callback)
+    for path in stale_paths:
+      batch.add(
+          service.accounts().containers().workspaces().delete(path=path),
+          request_id=path,
+      )
+    # Every request in a batch counts against the GTM quota.
+    self.gtm_execute(batch, cost=len(stale_paths))
+
+    if self.debug:
+      print(f'Deleted {len(deleted)} stale GTM workspace(s): {deleted}')
+
+    return len(deleted)
+
+  def get_gtm_workspace(
+      self, service: Any, account_id: int, container_id: int
+  ) -> str | None:
+    """Returns the workspace to make this run's changes in.
+
+    In 'new' workspace mode a fresh workspace is created.  In 'persistent'
+    mode the workspace GTM made when bid2x last published the container is
+    reused without any call; creating the next version syncs it.  Without
+    one, the container's workspace named gtm_workspace_name is reused and
+    synced to the latest container version, and only created when it does
+    not exist.
+
+    Args:
+        service: a service object previously opened with the GTM API.
+        account_id: the GTM account id owning the container.
+        container_id: the GTM container id.
+
+    Returns:
+        The path of the workspace or None if none could be obtained.
+    """
+    persistent = (
+        self.gtm_workspace_mode == bid2x_var.GTMWorkspaceMode.PERSISTENT.value
+    )
+    if not persistent and not self.gtm_delete_stale_workspaces:
+      return self.create_gtm_workspace(service, account_id, container_id)
+
+    recorded_path = self.recorded_gtm_workspace(account_id, container_id)
+    if recorded_path and not self.gtm_delete_stale_workspaces:
+      return recorded_path
+
+    workspaces = self.list_gtm_workspaces(service, account_id, container_id)
+
+    if self.gtm_delete_stale_workspaces:
+      self.delete_stale_gtm_workspaces(service, workspaces)
+
+    if not persistent:
+      return self.create_gtm_workspace(service, account_id, container_id)
+
+    if any(w.get('path') == recorded_path for w in workspaces):
+      return recorded_path
+
+    workspace = next(
+        (w for w in workspaces if w.get('name') == self.gtm_workspace_name),
+        None,
+    )
+    if workspace is None:
+      return self.create_gtm_workspace(
+          service, account_id, container_id, name=self.gtm_workspace_name
+      )
+
+    # Bring the reused workspace up to date with the latest container
+    # version before changing it.
+    request = service.accounts().containers().workspaces().sync(
+        path=workspace['path']
+    )
+    sync_response = self.gtm_execute(request)
+    sync_status = sync_response.get('syncStatus', {})
+
+    if self.trace:
+      print(f'GTM workspace sync response: {sync_response}')
+
+    if sync_status.get('mergeConflict') or sync_status.get('syncError'):
+      # A conflicted workspace can't be versioned safely; start over.
+      print(
+          f'GTM workspace {workspace["path"]} could not be synced; ',
+          'recreating it.',
+      )
+      request = service.accounts().containers().workspaces().delete(
+          path=workspace['path']
+      )
+      self.gtm_execute(request)
+      return self.create_gtm_workspace(
+          service, account_id, container_id, name=self.gtm_workspace_name
+      )
+
+    return workspace['path']
+
+  def recorded_gtm_workspace(
+      self, account_id: int, container_id: int
+  ) -> str | None:
+    """Returns the workspace GTM made when bid2x last published a container.
+
+    Args:
+        account_id: the GTM account id owning the container.
+        container_id: the GTM container id.
+
+    Returns:
+        The path of the workspace, or None if there is none or the
+        workspace mode isn't 'persistent'.
+    """
+    if self.gtm_workspace_mode != bid2x_var.GTMWorkspaceMode.PERSISTENT.value:
+      return None
+
+    with _workspace_lock:
+      return self.gtm_workspace_paths.get(
+          gtm_workspace_state_key(account_id, container_id)
+      )
+
+  def record_gtm_workspace(
+      self, account_id: Any, container_id: Any, workspace_path: str | None
+  ) -> None:
+    """Records the workspace to reuse for a container, None to forget it.
+
+    Args:
+        account_id: the GTM account id owning the container.
+        container_id: the GTM container id.
+        workspace_path: the path of the workspace or None.
+    """
+    key = gtm_workspace_state_key(account_id, container_id)
+    with _workspace_lock:
+      if workspace_path:
+        self.gtm_workspace_paths[key] = workspace_path
+      else:
+        self.gtm_workspace_paths.pop(key, None)
+      self._workspace_paths_changed = True
+
+  def update_workspace_variable(
+      self, service: Any, workspace_path: str, variable_id: int,
+      new_function: str
+  ) -> bool:
+    """Update a single variable within a workspace with a new function.
+
+    Args:
+        service: a service object previously opened with the GTM API.
+        workspace_path: the path of the workspace holding the variable.
+        variable_id: the GTM variable id to update.
+        new_function: a string containing the value to update within the
+          variable_id.
+
+    Returns:
+        True if the variable was updated, False otherwise.
+    """
+    # Build the path for getting / updating the variable.
+    var_req = f'{workspace_path}/variables/{variable_id}'
+
     # Get the current value of the variable in GTM.
-    gtm_var = (
-        service.accounts().containers().workspaces().variables().get(
-            path=var_req
-        ).execute()
+    request = service.accounts().containers().workspaces().variables().get(
+        path=var_req
     )
+    gtm_var = self.gtm_execute(request)
 
     if self.trace:
       print(f'GTM var is: {gtm_var}')
@@ -621,31 +1276,45 @@ class Bid2xGTM(Platform):
       print(f'Proposed internal function is{gtm_var["parameter"][0]["value"]}')
 
     # Update GTM with the new version of gtm_var that has been updated
-    # with the new JavaScript function.
-    gtm_updated = (
-        service.accounts().containers().workspaces().variables().update(
-            path=var_req, body=gtm_var
-        ).execute()
-    )
+    # with the new JavaScript function.  The fingerprint read above makes
+    # the update fail rather than overwrite a concurrent change.
+    try:
+      request = service.accounts().containers().workspaces().variables().update(
+          path=var_req, body=gtm_var, fingerprint=gtm_var.get('fingerprint')
+      )
+      gtm_updated = self.gtm_execute(request)
+    except HttpError as err:
+      print(f'Error updating GTM variable {var_req}: {err}')
+      return False
 
     if self.trace:
       print(f'return value from update on GTM is: {gtm_updated}')
 
     # Check to see if the value returned for the variable's value is the
     # same as what it was passed.  This indicates a successful update.
-    if gtm_updated['parameter'][0]['value'] == gtm_var['parameter'][0]['value']:
-      if self.trace:
-        print('Update variable success')
-
-    else:
-      # Not a good return value, return from function.
+    if gtm_updated['parameter'][0]['value'] != gtm_var['parameter'][0]['value']:
       return False
 
+    if self.trace:
+      print('Update variable success')
+
+    return True
+
+  def publish_gtm_workspace(self, service: Any, workspace_path: str) -> bool:
+    """Create a container version from a workspace and publish it.
+
+    Args:
+        service: a service object previously opened with the GTM API.
+        workspace_path: the path of the workspace to version and publish.
+
+    Returns:
+        True if the new version was published, False otherwise.
+    """
+    now = datetime.datetime.now()
+    datetime_string = now.strftime('%d/%m/%Y %H:%M:%S')
+    datetime_string_simplified = now.strftime('%Y%m%d%H%M%S')
+
     # Prep for versioned workspace.
-    gtm_path = (
-        f'accounts/{account_id}/containers/{container_id}/'
-        f'workspaces/{workspace_id}'
-    )
     gtm_name = f'Auto-versioned container {datetime_string_simplified}'
     gtm_notes = (
         f'This container auto-versioned on {datetime_string} using GTM API'
@@ -654,98 +1323,495 @@ class Bid2xGTM(Platform):
 
     if self.trace:
       print('Create_version()... ')
-      print(f'gtm_path = {gtm_path}')
+      print(f'gtm_path = {workspace_path}')
       print(f'gtm_versioned_workspace_body = {gtm_versioned_workspace_body}')
 
     # Created versioned workspace.
-    gtm_versioned_workspace = (
-        service.accounts().containers().workspaces().create_version(
-            path=gtm_path, body=gtm_versioned_workspace_body
-        ).execute()
+    request = service.accounts().containers().workspaces().create_version(
+        path=workspace_path, body=gtm_versioned_workspace_body
     )
+    gtm_versioned_workspace = self.gtm_execute(request)
 
-    if gtm_versioned_workspace:
-      # Get version ID here and save to variable for use with publish.
-      version_id = gtm_versioned_workspace['containerVersion'][
-          'containerVersionId']
+    if not gtm_versioned_workspace:
+      return False
 
-      if self.trace:
-        print(f'gtm_versioned_workspace: {gtm_versioned_workspace}')
-        print('new version success')
-    else:
+    # Creating a version first syncs the workspace to the latest container
+    # version, and creates none if that finds a conflict.
+    sync_status = gtm_versioned_workspace.get('syncStatus', {})
+    if (
+        'containerVersion' not in gtm_versioned_workspace
+        or sync_status.get('mergeConflict')
+        or sync_status.get('syncError')
+    ):
+      print(
+          f'Unable to create a version from GTM workspace {workspace_path}:'
+          f' {sync_status}'
+      )
       return False
 
-    # Prep for publish command.
+    # Get version path here for use with publish.
+    container_version = gtm_versioned_workspace['containerVersion']
     gtm_publish_path = (
-        f'accounts/{account_id}/containers/{container_id}/versions/{version_id}'
+        f'accounts/{container_version["accountId"]}/'
+        f'containers/{container_version["containerId"]}/'
+        f'versions/{container_version["containerVersionId"]}'
     )
-    gtm_published = (
-        service.accounts().containers().versions().publish(
-            path=gtm_publish_path,
-        ).execute()
+
+    # GTM removes the workspace and makes a new one from the version, which
+    # the next update of the container reuses in 'persistent' mode.
+    if self.gtm_workspace_mode == bid2x_var.GTMWorkspaceMode.PERSISTENT.value:
+      self.record_gtm_workspace(
+          container_version['accountId'],
+          container_version['containerId'],
+          gtm_versioned_workspace.get('newWorkspacePath'),
+      )
+
+    if self.trace:
+      print(f'gtm_versioned_workspace: {gtm_versioned_workspace}')
+      print('new version success')
+
+    # Publish the new version.
+    request = service.accounts().containers().versions().publish(
+        path=gtm_publish_path,
     )
+    gtm_published = self.gtm_execute(request)
+
+    return bool(gtm_published)
+
+  def read_live_variable_hashes(
+      self, service: Any, account_id: int, container_id: int
+  ) -> dict[str, str]:
+    """Hash the JavaScript of every variable in a container's live version.
+
+    Args:
+        service: a service object previously opened with the GTM API.
+        account_id: the GTM account id owning the container.
+        container_id: the GTM container id to read the live version of.
+
+    Returns:
+        A dict of variable id (as a string) to the content hash of the
+        variable's JavaScript.  Empty if the live version can't be read.
+    """
+    container_path = f'accounts/{account_id}/containers/{container_id}'
+
+    try:
+      request = service.accounts().containers().versions().live(
+          parent=container_path
+      )
+      live_version = self.gtm_execute(request)
+    except HttpError as err:
+      print(f'Unable to read live version of {container_path}: {err}')
+      return {}
+
+    live_hashes = {}
+    for variable in live_version.get('variable', []):
+      value = gtm_variable_javascript(variable)
+      if value is not None:
+        live_hashes[str(variable['variableId'])] = gtm_function_hash(value)
+
+    if self.trace:
+      print(f'Live variable hashes for {container_path}: {live_hashes}')
+
+    return live_hashes
+
+  def read_gtm_state(self) -> dict[str, str]:
+    """Reads the local store of last published function hashes.
+
+    Args:
+        None.
+
+    Returns:
+        A dict of variable path to content hash, along with the workspaces
+        to reuse keyed by gtm_workspace_state_key.  Empty if the state file
+        does not exist or can't be read.
+    """
+    try:
+      with open(self.gtm_state_file, 'r') as f:
+        return json.load(f)
+    except FileNotFoundError:
+      return {}
+    except (OSError, ValueError) as e:
+      print(f'Error reading GTM state file {self.gtm_state_file}: {e}')
+      return {}
+
+  def write_gtm_state(self, state: dict[str, str]) -> bool:
+    """Writes the local store of last published function hashes.
+
+    Args:
+        state: a dict of variable path to content hash, along with the
+          workspaces to reuse keyed by gtm_workspace_state_key.
+
+    Returns:
+        True on success, False otherwise.
+    """
+    try:
+      with open(self.gtm_state_file, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    except OSError as e:
+      print(f'Error writing GTM state file {self.gtm_state_file}: {e}')
+      return False
+
+    return True
 
-    # Check return value of gtm_publish_path.
-    if gtm_published:
-      if self.debug:
-        print(f'GTM variable: {var_req} successfully published.')
+  def is_gtm_variable_unchanged(
+      self,
+      service: Any,
+      zone: Bid2xGTMModel,
+      js_function: str,
+      known_hashes: dict[Any, dict[str, str]],
+  ) -> bool:
+    """Checks whether a zone's generated function matches what is live.
+
+    Args:
+        service: a service object previously opened with the GTM API.
+        zone: the zone object.
+        js_function: the newly generated JavaScript function.
+        known_hashes: a per-run cache of hashes.  For 'live' detection it
+          is keyed by (account_id, container_id), for 'local' detection it
+          holds the loaded state under the key 'local'.
+
+    Returns:
+        True if the function is identical to the live (or last published)
+        one and the update can be skipped, False otherwise.
+    """
+    new_hash = gtm_function_hash(js_function)
+
+    if self.gtm_change_detection == bid2x_var.GTMChangeDetection.LIVE.value:
+      container_key = gtm_container_key(zone)
+      if container_key not in known_hashes:
+        known_hashes[container_key] = self.read_live_variable_hashes(
+            service, zone.account_id, zone.container_id
+        )
+      current_hash = known_hashes[container_key].get(str(zone.variable_id))
+    elif self.gtm_change_detection == bid2x_var.GTMChangeDetection.LOCAL.value:
+      if 'local' not in known_hashes:
+        known_hashes['local'] = self.read_gtm_state()
+      current_hash = known_hashes['local'].get(gtm_variable_path(zone))
     else:
       return False
 
+    if self.trace:
+      print(f'Zone {zone.name} new hash {new_hash}, current {current_hash}')
+
+    return current_hash == new_hash
+
+  # Update the variable using GTM API.
+  @bid2x_trace.traced('gtm.update_variable')
+  def update_gtm_variable(
+      self, service: Any, new_function: str, zone: Bid2xGTMModel
+  ) -> bool:
+    """Update Google Tag Manager variable with new JavaScript function.
+
+    Args:
+        service: a service object previously opened with the GTM API.
+        new_function: a string containing the value to update within the
+          variable_id.
+        zone: the zone object.
+
+    Returns:
+        The function returns True upon successful update or False if
+        it was unable to update the variable.
+    """
+    return self.update_gtm_container(service, [(zone, new_function)])
+
+  @bid2x_trace.traced('gtm.update_container')
+  def update_gtm_container(
+      self,
+      service: Any,
+      zone_functions: list[tuple[Bid2xGTMModel, str]],
+  ) -> bool:
+    """Update the variables of several zones in one container and publish.
+
+    All zones passed must live in the same GTM account and container.  A
+    single workspace is created, every zone's variable is updated within it
+    and the workspace is then versioned and published once.
+
+    Args:
+        service: a service object previously opened with the GTM API.
+        zone_functions: a list of (zone, new_function) tuples sharing one
+          account_id and container_id.
+
+    Returns:
+        True if all variables were updated and the container published,
+        False otherwise.  Nothing is published if any variable fails.
+    """
+    if not zone_functions:
+      return True
+
+    account_id, container_id = gtm_container_key(zone_functions[0][0])
+
+    recorded_path = self.recorded_gtm_workspace(account_id, container_id)
+    workspace_path = self.get_gtm_workspace(service, account_id, container_id)
+    if not workspace_path:
+      return False
+
+    published = self.publish_workspace_variables(
+        service, workspace_path, zone_functions
+    )
+    if not published and workspace_path == recorded_path:
+      # The reused workspace may have been removed, or changed by another
+      # publish in a way that can't be merged; start from a fresh one.
+      print(
+          f'Unable to publish from GTM workspace {workspace_path}; '
+          'obtaining a new workspace.'
+      )
+      self.record_gtm_workspace(account_id, container_id, None)
+      workspace_path = self.get_gtm_workspace(
+          service, account_id, container_id
+      )
+      if not workspace_path:
+        return False
+      published = self.publish_workspace_variables(
+          service, workspace_path, zone_functions
+      )
+
+    if not published:
+      return False
+
+    if self.debug:
+      for zone, _ in zone_functions:
+        print(
+            f'GTM variable: {workspace_path}/variables/{zone.variable_id} '
+            'successfully published.'
+        )
+
     return True
 
+  def publish_workspace_variables(
+      self,
+      service: Any,
+      workspace_path: str,
+      zone_functions: list[tuple[Bid2xGTMModel, str]],
+  ) -> bool:
+    """Updates zones' variables in a workspace, then versions and publishes.
+
+    Args:
+        service: a service object previously opened with the GTM API.
+        workspace_path: the path of the workspace to make the changes in.
+        zone_functions: a list of (zone, new_function) tuples whose
+          variables live in the workspace's container.
+
+    Returns:
+        True if every variable was updated and the version published,
+        False otherwise.  Nothing is published if any variable fails.
+    """
+    try:
+      for zone, new_function in zone_functions:
+        if not self.update_workspace_variable(
+            service, workspace_path, zone.variable_id, new_function
+        ):
+          print(f'Error updating GTM variable for zone {zone.name}.')
+          return False
+
+      return self.publish_gtm_workspace(service, workspace_path)
+    except HttpError as err:
+      print(f'Error publishing GTM workspace {workspace_path}: {err}')
+      return False
+
   # Starts the data reading and custom bidding process.
   def process_script(
       self,
       service: Any,
       zone_array: list[Bid2xGTMModel],
-      test_flag: bool = False  # By default it's not a test.
+      test_flag: bool = False,  # By default it's not a test.
+      service_factory: Callable[[], Any] | None = None,
   ) -> bool:
     """Orchestrates the variable change in GTM.
 
+    When gtm_max_workers is above one and a service_factory is passed, the
+    zones are partitioned by container and the containers are processed in
+    parallel, each with its own API client and rate limiter.  Zones within
+    a container are always processed serially.
+
     Args:
       service: A service object previously opened with the GTM API.
       zone_array: A list of Bid2xGTMModel objects to walk and publish.
       test_flag: Boolean that determine whether this is a test.  A test
             does not write to GTM but goes through the other actions.
+      service_factory: Optional callable returning a new GTM service
+            object.  Required to process containers in parallel.
 
     Returns:
       True if process is a success.  False otherwise.
     """
-
+    # Hashes of the live or last published functions, loaded on first use.
+    known_hashes = {}
+    if self.gtm_change_detection == bid2x_var.GTMChangeDetection.LOCAL.value:
+      known_hashes['local'] = self.read_gtm_state()
+    if self.gtm_workspace_mode == bid2x_var.GTMWorkspaceMode.PERSISTENT.value:
+      with _workspace_lock:
+        self.gtm_workspace_paths = gtm_workspace_paths(
+            known_hashes.get('local') or self.read_gtm_state()
+        )
+        self._workspace_paths_changed = False
+
+    zones_by_container = {}
     for zone in zone_array:
-      # Read the index data from a spreadsheet into a Dataframe.
-      index_df = self.read_sheets_data(zone)
-      js_function = self.write_javascript_function(index_df)
-
-      # Write the new function out to the test column in the associated
-      # Google Sheet in the tab 'JS_Scripts' (by default).
-      self.sheet.update_status_tab(
-          bid2x_var.GTM_STATUS_TAB, zone, js_function, test_run=test_flag
+      zones_by_container.setdefault(gtm_container_key(zone), []).append(zone)
+
+    if (
+        self.gtm_max_workers > 1
+        and service_factory is not None
+        and len(zones_by_container) > 1
+    ):
+      # Clients are built here, one per container, as the underlying HTTP
+      # transport is not safe to share between threads.
+      container_services = [
+          service_factory() if service else None for _ in zones_by_container
+      ]
+      with futures.ThreadPoolExecutor(
+          max_workers=self.gtm_max_workers
+      ) as executor:
+        container_futures = [
+            executor.submit(
+                self.process_zones,
+                container_service,
+                container_zones,
+                test_flag,
+                dict(known_hashes),
+            ) for container_service, container_zones in zip(
+                container_services, zones_by_container.values()
+            )
+        ]
+        published_hashes = {}
+        for container_future in container_futures:
+          published_hashes.update(container_future.result())
+    else:
+      published_hashes = self.process_zones(
+          service, zone_array, test_flag, known_hashes
       )
 
-      if self.debug:
-        print('Generated JS function returned:')
-        print(js_function)
+    # Remember what was published so the next run can skip unchanged zones,
+    # and the workspaces GTM made on publishing for the next run to reuse.
+    save_hashes = bool(published_hashes) and 'local' in known_hashes
+    if save_hashes or self._workspace_paths_changed:
+      state = self.read_gtm_state()
+      if save_hashes:
+        state.update(published_hashes)
+      if self._workspace_paths_changed:
+        state = {
+            key: value for key, value in state.items()
+            if key not in gtm_workspace_paths(state)
+        }
+        state.update(self.gtm_workspace_paths)
+      self.write_gtm_state(state)
 
-      # If there's a good service and a good function and this
-      # is NOT a test then update the GTM variable.
-      if service and js_function and not test_flag:
-        ret_val = self.update_gtm_variable(service, js_function, zone)
+    return True
 
-        if ret_val:
-          print(
-              f'Success updating zone {zone.name} GTM variable to new',
-              f'value of:{chr(10)}{js_function}',
+  def process_zones(
+      self,
+      service: Any,
+      zone_array: list[Bid2xGTMModel],
+      test_flag: bool,
+      known_hashes: dict[Any, dict[str, str]],
+  ) -> dict[str, str]:
+    """Generates, records and publishes the GTM functions of some zones.
+
+    Args:
+      service: A service object previously opened with the GTM API.  Calls
+            made through it are spaced out by a rate limiter owned by the
+            calling thread.
+      zone_array: A list of Bid2xGTMModel objects to walk and publish.
+      test_flag: Boolean that determine whether this is a test.
+      known_hashes: Per-run cache of live or last published hashes used
+            for change detection.
+
+    Returns:
+      A dict of variable path to content hash for each variable published.
+    """
+    _thread_state.rate_limiter = RateLimiter(self.gtm_min_call_interval)
+
+    # When batching by container, zones are held here keyed by their
+    # (account_id, container_id) until all functions are generated.
+    pending_by_container = {}
+
+    # Hashes of functions published during this run, for the local store.
+    published_hashes = {}
+
+    for zone in zone_array:
+      with bid2x_trace.span('gtm.zone', zone=zone.name), bid2x_profile.zone(
+          zone.name
+      ):
+        # Sheet access is serialised so parallel containers don't interleave
+        # reads and writes on the shared spreadsheet client; generating the
+        # function needs no lock.
+        with _sheet_lock:
+          # Read the index data from a spreadsheet into a Dataframe.
+          index_df = self.read_sheets_data(zone)
+
+        js_function = self.write_javascript_function(index_df)
+
+        with _sheet_lock:
+          # Write the new function out to the test column in the associated
+          # Google Sheet in the tab 'JS_Scripts' (by default).
+          self.sheet.update_status_tab(
+              bid2x_var.GTM_STATUS_TAB, zone, js_function, test_run=test_flag
           )
+
+        if self.debug:
+          print('Generated JS function returned:')
+          print(js_function)
+
+        # If there's a good service and a good function and this
+        # is NOT a test then update the GTM variable.
+        if service and js_function and not test_flag:
+          if self.is_gtm_variable_unchanged(
+              service, zone, js_function, known_hashes
+          ):
+            print(
+                f'GTM variable for zone {zone.name} is unchanged; '
+                'not publishing'
+            )
+            bid2x_metrics.record_zone('gtm', 'completed', 'unchanged')
+            continue  # Process next loop.
+
+          if self.gtm_batch_by_container:
+            pending_by_container.setdefault(gtm_container_key(zone), []).append(
+                (zone, js_function)
+            )
+            continue  # Published below, once per container.
+
+          ret_val = self.update_gtm_variable(service, js_function, zone)
+
+          if ret_val:
+            print(
+                f'Success updating zone {zone.name} GTM variable to new',
+                f'value of:{chr(10)}{js_function}',
+            )
+            published_hashes[gtm_variable_path(zone)] = gtm_function_hash(
+                js_function
+            )
+            bid2x_metrics.record_zone('gtm', 'completed', 'uploaded')
+          else:
+            print('Error updating GTM variable with function.')
+            bid2x_metrics.record_zone('gtm', 'failed')
+            continue  # Process next loop.
         else:
-          print('Error updating GTM variable with function.')
+          print('No GTM service, no valid function, or this is a test.')
+          bid2x_metrics.record_zone('gtm', 'completed')
           continue  # Process next loop.
+
+    for container_key, zone_functions in pending_by_container.items():
+      zone_names = ', '.join(zone.name for zone, _ in zone_functions)
+      if self.update_gtm_container(service, zone_functions):
+        print(
+            f'Success updating GTM container {container_key[1]} variables',
+            f'for zone(s): {zone_names}',
+        )
+        for zone, js_function in zone_functions:
+          published_hashes[gtm_variable_path(zone)] = gtm_function_hash(
+              js_function
+          )
+          bid2x_metrics.record_zone('gtm', 'completed', 'uploaded')
       else:
-        print('No GTM service, no valid function, or this is a test.')
-        continue  # Process next loop.
+        print(
+            f'Error updating GTM container {container_key[1]} variables',
+            f'for zone(s): {zone_names}',
+        )
+        for _ in zone_functions:
+          bid2x_metrics.record_zone('gtm', 'failed')
 
-    return True
+    return published_hashes
 
   def top_level_copy(self, source: Any) -> None:
     """Copy all config file GTM settings to this object.
@@ -766,6 +1832,16 @@ class Bid2xGTM(Platform):
         'index_high_column_name',
         'action_update_scripts',
         'action_test',
+        'gtm_batch_by_container',
+        'gtm_change_detection',
+        'gtm_state_file',
+        'gtm_workspace_mode',
+        'gtm_workspace_name',
+        'gtm_delete_stale_workspaces',
+        'gtm_stale_workspace_age_hours',
+        'gtm_max_workers',
+        'gtm_min_call_interval',
+        'gtm_emission_mode',
         'zones_to_process',
     ]
 
@@ -72,6 +72,23 @@ class Bid2xGTMModel():
 
   """
 
+  # Zones are held for every config of a batch run, so they keep their
+  # properties in slots rather than a __dict__.
+  __slots__ = (
+      'name',
+      'account_id',
+      'container_id',
+      'workspace_id',
+      'variable_id',
+      'debug',
+      'trace',
+      'update_row',
+      'update_col',
+      'test_row',
+      'test_col',
+      'cb_algorithm',
+  )
+
   # Set properties of this class.
   name: str
   account_id: int
@@ -0,0 +1,363 @@
+"""BidToX - Run journal of completed zone stages.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  The journal records every zone stage the DV360 pipeline completes (see
+  bid2x_pipeline) along with a fingerprint, a content hash of what the stage
+  acted on, e.g. the script uploaded and the line items it was assigned to.
+  When a run fails part way, for example on a Cloud Run job timeout, the
+  next run skips the stages whose fingerprint matches the journal and so
+  resumes at the first unit of work not proven done.
+
+  The journal is kept in a local SQLite database or, for a path starting
+  with gs://, in a JSON object in Cloud Storage.  Only the latest
+  completion of each zone and stage is kept.
+
+  Stages with no content of their own to hash (e.g. refreshing a zone's tab
+  from DV360) are fingerprinted with the run ID, so they are only skipped
+  when a failed run is retried.  The run ID is read from the BID2X_RUN_ID
+  environment variable, or CLOUD_RUN_EXECUTION which Cloud Run keeps the
+  same across the retries of a job execution.
+"""
+
+import abc
+import dataclasses
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+from urllib import parse
+
+from auth import bid2x_discovery
+import bid2x_var
+
+urlparse = parse.urlparse
+
+
+@dataclasses.dataclass
+class JournalEntry:
+  """The latest completion of a stage for a zone.
+
+  Attributes:
+    stage: the name of the stage.
+    fingerprint: content hash of what the stage acted on, or None if the
+        stage can not be proven done.
+    completed_at: when the stage completed, in seconds since the epoch.
+    seconds: how long the stage took.
+    line_items: the number of line items in the zone at the time.
+    run_id: the run that completed the stage, if known.
+    previous_line_items: the line item count recorded for the stage by the
+        last earlier run, kept by the journal when a run replaces it.
+  """
+
+  stage: str
+  fingerprint: str | None
+  completed_at: float
+  seconds: float
+  line_items: int = 0
+  run_id: str | None = None
+  previous_line_items: int = 0
+
+
+def previous_line_items(
+    earlier: dict[str, Any] | None, entry: JournalEntry
+) -> int:
+  """Returns the previous_line_items of an entry replacing another.
+
+  The count only moves back when a new run replaces an entry, so retries
+  and late tasks of a run all see the count the run started with.
+
+  Args:
+    earlier: the entry being replaced, as a dict, or None.
+    entry: the new entry.
+  """
+  if earlier is None:
+    return 0
+  if earlier.get('run_id') == entry.run_id:
+    return earlier.get('previous_line_items', 0)
+  return earlier.get('line_items', 0)
+
+
+def run_id() -> str | None:
+  """Returns the ID shared by a run and its retries, None if unknown."""
+  for name in bid2x_var.JOURNAL_RUN_ID_ENV_VARS:
+    value = os.getenv(name)
+    if value:
+      return value
+
+  return None
+
+
+def fingerprint(*parts: Any) -> str:
+  """Returns a content hash of some values.
+
+  Args:
+    *parts: JSON serialisable values, hashed in order.
+
+  Returns:
+    A 'sha256:' prefixed hex digest.
+  """
+  content = json.dumps(parts, sort_keys=True, default=str)
+  return 'sha256:' + hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class RunJournal(abc.ABC):
+  """Base class of the journal backends.
+
+  Entries are grouped by a scope (the spreadsheet the zones are read from)
+  so configs sharing a journal don't mix up zones of the same name.
+  """
+
+  path: str
+
+  def __init__(self, path: str):
+    self.path = path
+    self._lock = threading.Lock()
+
+  def __str__(self) -> str:
+    return f'{type(self).__name__}({self.path})'
+
+  @abc.abstractmethod
+  def completed(self, scope: str, zone: str) -> dict[str, JournalEntry]:
+    """Returns the latest completion of each stage of a zone.
+
+    Args:
+      scope: the group the zone belongs to.
+      zone: the name of the zone.
+
+    Returns:
+      A dict of stage name to JournalEntry.
+    """
+
+  @abc.abstractmethod
+  def record(
+      self, scope: str, zone: str, entry: JournalEntry, flush: bool = False
+  ) -> None:
+    """Records the completion of a stage, replacing any earlier one.
+
+    Args:
+      scope: the group the zone belongs to.
+      zone: the name of the zone.
+      entry: the completed stage.
+      flush: whether the entry must be written before this returns, for
+          stages a run killed straight after could not otherwise resume.
+    """
+
+  def close(self) -> None:
+    """Writes anything outstanding and releases the journal."""
+
+
+class SqliteJournal(RunJournal):
+  """A journal kept in a local SQLite database."""
+
+  def __init__(self, path: str):
+    super().__init__(path)
+    directory = os.path.dirname(path)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+
+    # Stages complete on pool threads; the lock serialises access.
+    self._connection = sqlite3.connect(path, check_same_thread=False)
+    with self._lock, self._connection:
+      self._connection.execute(
+          'CREATE TABLE IF NOT EXISTS journal ('
+          ' scope TEXT NOT NULL,'
+          ' zone TEXT NOT NULL,'
+          ' stage TEXT NOT NULL,'
+          ' fingerprint TEXT,'
+          ' completed_at REAL NOT NULL,'
+          ' seconds REAL NOT NULL,'
+          ' line_items INTEGER NOT NULL DEFAULT 0,'
+          ' run_id TEXT,'
+          ' previous_line_items INTEGER NOT NULL DEFAULT 0,'
+          ' PRIMARY KEY (scope, zone, stage))'
+      )
+
+  def completed(self, scope: str, zone: str) -> dict[str, JournalEntry]:
+    with self._lock:
+      rows = self._connection.execute(
+          'SELECT stage, fingerprint, completed_at, seconds, line_items,'
+          ' run_id, previous_line_items FROM journal'
+          ' WHERE scope = ? AND zone = ?',
+          (scope, zone),
+      ).fetchall()
+
+    return {row[0]: JournalEntry(*row) for row in rows}
+
+  def record(
+      self, scope: str, zone: str, entry: JournalEntry, flush: bool = False
+  ) -> None:
+    # Always committed straight away so a run killed on a timeout keeps it.
+    del flush  # Unused.
+    with self._lock, self._connection:
+      row = self._connection.execute(
+          'SELECT line_items, run_id, previous_line_items FROM journal'
+          ' WHERE scope = ? AND zone = ? AND stage = ?',
+          (scope, zone, entry.stage),
+      ).fetchone()
+      earlier = None
+      if row is not None:
+        earlier = dict(
+            zip(('line_items', 'run_id', 'previous_line_items'), row)
+        )
+      self._connection.execute(
+          'INSERT OR REPLACE INTO journal (scope, zone, stage, fingerprint,'
+          ' completed_at, seconds, line_items, run_id, previous_line_items)'
+          ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+          (
+              scope, zone, entry.stage, entry.fingerprint,
+              entry.completed_at, entry.seconds, entry.line_items,
+              entry.run_id, previous_line_items(earlier, entry),
+          ),
+      )
+
+  def close(self) -> None:
+    with self._lock:
+      self._connection.close()
+
+
+class GcsJournal(RunJournal):
+  """A journal kept in a JSON object in Cloud Storage.
+
+  The object is read once and rewritten as stages complete, at most once
+  every JOURNAL_GCS_WRITE_INTERVAL seconds (Cloud Storage limits writes to
+  a single object) and on close.  Entries recorded with flush are written
+  straight away whatever the interval.  Writes only succeed against the
+  object generation last read, otherwise the entries are merged and
+  retried, so several tasks can share one journal.
+  """
+
+  def __init__(self, path: str, client: Any = None):
+    """Opens the journal.
+
+    Args:
+      path: the gs://bucket/object URI of the journal.
+      client: optional google.cloud.storage Client, by default one with
+          the environment's credentials, calling the API endpoint bid2x's
+          calls are redirected to if one is set.
+    """
+    super().__init__(path)
+    if client is None:
+      # pylint: disable-next=g-import-not-at-top
+      from google.cloud import storage
+
+      client_options = None
+      endpoint = bid2x_discovery.api_endpoint()
+      if endpoint:
+        client_options = {'api_endpoint': endpoint}
+      client = storage.Client(client_options=client_options)
+
+    parsed_uri = urlparse(path)
+    self._bucket = client.bucket(parsed_uri.netloc)
+    self._object_name = parsed_uri.path.lstrip('/')
+    self._entries = {}
+    # Entries recorded since the object was last written.
+    self._unwritten = {}
+    self._generation = 0
+    self._last_write = 0.0
+    with self._lock:
+      self._load()
+
+  def _load(self) -> None:
+    """Reads the object, keeping the entries not yet written over it."""
+    # pylint: disable-next=g-import-not-at-top
+    from google.api_core import exceptions
+
+    # A new Blob every time: one that has been read or written since
+    # requests that generation, not the latest.
+    blob = self._bucket.blob(self._object_name)
+    try:
+      content = blob.download_as_text()
+      self._generation = blob.generation
+    except exceptions.NotFound:
+      self._generation = 0
+      return
+
+    self._entries = json.loads(content)
+    self._entries.update(self._unwritten)
+
+  def _write(self) -> None:
+    """Writes the entries, merging in concurrent writers' ones first."""
+    # pylint: disable-next=g-import-not-at-top
+    from google.api_core import exceptions
+
+    while True:
+      blob = self._bucket.blob(self._object_name)
+      try:
+        blob.upload_from_string(
+            json.dumps(self._entries, sort_keys=True),
+            content_type='application/json',
+            if_generation_match=self._generation,
+        )
+        break
+      except exceptions.PreconditionFailed:
+        self._load()
+
+    self._generation = blob.generation
+    self._unwritten = {}
+    self._last_write = time.monotonic()
+
+  @staticmethod
+  def entry_key(scope: str, zone: str, stage: str) -> str:
+    return json.dumps([scope, zone, stage])
+
+  def completed(self, scope: str, zone: str) -> dict[str, JournalEntry]:
+    with self._lock:
+      entries = [
+          entry for key, entry in self._entries.items()
+          if json.loads(key)[:2] == [scope, zone]
+      ]
+
+    return {entry['stage']: JournalEntry(**entry) for entry in entries}
+
+  def record(
+      self, scope: str, zone: str, entry: JournalEntry, flush: bool = False
+  ) -> None:
+    with self._lock:
+      key = self.entry_key(scope, zone, entry.stage)
+      stored = dataclasses.asdict(entry)
+      stored['previous_line_items'] = previous_line_items(
+          self._entries.get(key), entry
+      )
+      self._entries[key] = self._unwritten[key] = stored
+      interval = time.monotonic() - self._last_write
+      if flush or interval >= bid2x_var.JOURNAL_GCS_WRITE_INTERVAL:
+        self._write()
+
+  def close(self) -> None:
+    with self._lock:
+      if self._unwritten:
+        self._write()
+
+
+def open_journal(path: str) -> RunJournal:
+  """Opens the journal at a local path or gs:// URI.
+
+  Args:
+    path: a local SQLite file or a gs://bucket/object URI.
+
+  Returns:
+    The journal, created if it does not exist.
+  """
+  if path.startswith('gs://'):
+    return GcsJournal(path)
+
+  return SqliteJournal(path)
@@ -0,0 +1,151 @@
+"""BidToX - Columnar DV360 line item table.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  A zone's tab lists a row per DV360 line item: its status, ID, name,
+  type, campaign and advertiser (see bid2x_var.LINE_ITEM_FIELDS).  Held as
+  a list of lists, every row costs a list and a string per field, which
+  adds up over the tens of thousands of line items of a batch run.
+
+  LineItemTable keeps the rows column by column instead: the IDs in int64
+  arrays and the status, type and name strings interned, so the few
+  distinct statuses and types, and names read again by later runs of the
+  process, are stored once.  It gives back the rows exactly as DV360
+  returned them, IDs as decimal strings, when the tab is written.
+
+  Example usage:
+      table = bid2x_line_items.LineItemTable()
+      for line_item in page['lineItems']:
+        table.append(line_item_row(line_item))
+      tab.update(values=table.rows(), range_name='A2')
+"""
+
+import array
+import sys
+from typing import Any, Iterator, Sequence
+
+import bid2x_var
+
+# An ID missing from a line item, stored in place of it.
+MISSING_ID = -1
+
+# Where each field is in a row, see bid2x_var.LINE_ITEM_FIELDS.
+STATUS_INDEX = bid2x_var.LINE_ITEM_FIELDS.index('entityStatus')
+LINE_ITEM_ID_INDEX = bid2x_var.LINE_ITEM_FIELDS.index('lineItemId')
+NAME_INDEX = bid2x_var.LINE_ITEM_FIELDS.index('displayName')
+TYPE_INDEX = bid2x_var.LINE_ITEM_FIELDS.index('lineItemType')
+CAMPAIGN_ID_INDEX = bid2x_var.LINE_ITEM_FIELDS.index('campaignId')
+ADVERTISER_ID_INDEX = bid2x_var.LINE_ITEM_FIELDS.index('advertiserId')
+
+
+def intern(value: Any) -> Any:
+  """Returns a string interned, anything else as is."""
+  return sys.intern(value) if isinstance(value, str) else value
+
+
+def id_value(value: Any) -> int:
+  """Returns an ID as stored in an int64 column."""
+  return MISSING_ID if value is None or value == '' else int(value)
+
+
+def id_text(value: int) -> str | None:
+  """Returns an ID stored in an int64 column as DV360 returns it."""
+  return None if value == MISSING_ID else str(value)
+
+
+class LineItemTable:
+  """DV360 line items held column by column.
+
+  Attributes:
+    statuses: the entity statuses, interned.
+    line_item_ids: the line item IDs.
+    display_names: the display names, interned.
+    line_item_types: the line item types, interned.
+    campaign_ids: the campaign IDs.
+    advertiser_ids: the advertiser IDs.
+    auto_ons: 1 for the line items turned on for custom bidding, else 0.
+  """
+
+  __slots__ = (
+      'statuses',
+      'line_item_ids',
+      'display_names',
+      'line_item_types',
+      'campaign_ids',
+      'advertiser_ids',
+      'auto_ons',
+  )
+
+  statuses: list[str | None]
+  line_item_ids: array.array
+  display_names: list[str | None]
+  line_item_types: list[str | None]
+  campaign_ids: array.array
+  advertiser_ids: array.array
+  auto_ons: array.array
+
+  def __init__(self):
+    self.statuses = []
+    self.line_item_ids = array.array('q')
+    self.display_names = []
+    self.line_item_types = []
+    self.campaign_ids = array.array('q')
+    self.advertiser_ids = array.array('q')
+    self.auto_ons = array.array('b')
+
+  def __len__(self) -> int:
+    return len(self.line_item_ids)
+
+  def append(self, row: Sequence[Any], auto_on: bool = True) -> None:
+    """Adds a line item.
+
+    Args:
+      row: the line item's fields in bid2x_var.LINE_ITEM_FIELDS order.
+      auto_on: whether the line item is turned on for custom bidding.
+    """
+    self.statuses.append(intern(row[STATUS_INDEX]))
+    self.line_item_ids.append(id_value(row[LINE_ITEM_ID_INDEX]))
+    self.display_names.append(intern(row[NAME_INDEX]))
+    self.line_item_types.append(intern(row[TYPE_INDEX]))
+    self.campaign_ids.append(id_value(row[CAMPAIGN_ID_INDEX]))
+    self.advertiser_ids.append(id_value(row[ADVERTISER_ID_INDEX]))
+    self.auto_ons.append(1 if auto_on else 0)
+
+  def row(self, index: int) -> list[Any]:
+    """Returns a line item's row in a zone's tab."""
+    row = [None] * len(bid2x_var.LINE_ITEM_FIELDS)
+    row[STATUS_INDEX] = self.statuses[index]
+    row[LINE_ITEM_ID_INDEX] = id_text(self.line_item_ids[index])
+    row[NAME_INDEX] = self.display_names[index]
+    row[TYPE_INDEX] = self.line_item_types[index]
+    row[CAMPAIGN_ID_INDEX] = id_text(self.campaign_ids[index])
+    row[ADVERTISER_ID_INDEX] = id_text(self.advertiser_ids[index])
+    return row
+
+  def iter_rows(self) -> Iterator[list[Any]]:
+    """Yields the line items' rows in a zone's tab."""
+    for index in range(len(self)):
+      yield self.row(index)
+
+  def rows(self) -> list[list[Any]]:
+    """Returns the line items' rows in a zone's tab, to write it."""
+    return list(self.iter_rows())
+
+  def auto_on_rows(self) -> list[list[str]]:
+    """Returns the rows of the tab's custom bidding column, to write it."""
+    return [['Yes' if auto_on else 'No'] for auto_on in self.auto_ons]
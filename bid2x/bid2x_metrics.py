@@ -0,0 +1,557 @@
+"""BidToX - Metrics registry and Prometheus exporter.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  bid2x keeps counters, gauges and histograms of its work for the life of
+  the process:
+
+    bid2x_api_calls_total             API calls by api, method and status
+                                      ('ok' or the HTTP error status).
+    bid2x_http_requests_total         HTTP requests by api and status.
+    bid2x_http_request_seconds        HTTP request latency by api.
+    bid2x_api_retries_total           Retries of failed calls by api.
+    bid2x_backoff_sleep_seconds_total Seconds slept before retrying by api.
+    bid2x_rate_limit_wait_seconds_total
+                                      Seconds calls waited to be rate limited.
+    bid2x_zones_processed_total       Zones by platform and outcome
+                                      (completed, failed, deferred or
+                                      aborted).
+    bid2x_scripts_total               Scripts by platform and result
+                                      (uploaded or skipped as unchanged).
+    bid2x_script_bytes                Generated script sizes by platform.
+    bid2x_sheet_rows_read_total       Sheet rows read by kind of tab.
+    bid2x_sheet_rows_written_total    Sheet rows written by kind of tab.
+    bid2x_runs_total                  Runs by result.
+    bid2x_last_run_timestamp_seconds  When the last run finished.
+    bid2x_last_run_duration_seconds   How long the last run took.
+
+  They are exported in the Prometheus text format, either written at the
+  end of every run to a file for node_exporter's textfile collector
+  (--metrics_textfile or BID2X_METRICS_TEXTFILE), or served at /metrics on
+  a port (--metrics_port or BID2X_METRICS_PORT) for deployments that stay
+  up between runs.  Neither is done by default.
+"""
+
+import bisect
+import math
+import os
+import threading
+from typing import Any, Sequence
+
+import bid2x_trace
+import bid2x_var
+
+# Histogram buckets, upper bounds.
+SECONDS_BUCKETS = (
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+BYTES_BUCKETS = (
+    1000, 5000, 10000, 50000, 100000, 250000, 500000, 1000000, 5000000
+)
+
+# The content type of the Prometheus text format.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_value(value: float) -> str:
+  """Formats a sample value as the Prometheus text format expects."""
+  if math.isinf(value):
+    return '+Inf' if value > 0 else '-Inf'
+  if float(value).is_integer():
+    return str(int(value))
+
+  return repr(float(value))
+
+
+def format_labels(labels: Sequence[tuple[str, str]]) -> str:
+  """Formats label pairs as {name="value",...}, escaping the values."""
+  if not labels:
+    return ''
+
+  pairs = []
+  for name, value in labels:
+    escaped = (
+        str(value).replace('\\', r'\\').replace('"', r'\"')
+        .replace('\n', r'\n')
+    )
+    pairs.append(f'{name}="{escaped}"')
+
+  return '{' + ','.join(pairs) + '}'
+
+
+class Metric:
+  """A named family of samples, one per combination of label values.
+
+  Attributes:
+    name: the metric name, e.g. 'bid2x_api_calls_total'.
+    help: a description of the metric.
+    label_names: the names of the metric's labels, in order.
+  """
+
+  kind = 'untyped'
+
+  name: str
+  help: str
+  label_names: tuple[str, ...]
+
+  def __init__(self, name: str, help_text: str, label_names: Sequence[str]):
+    self.name = name
+    self.help = help_text
+    self.label_names = tuple(label_names)
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+    """Returns the label values of a sample in label_names order."""
+    if set(labels) != set(self.label_names):
+      raise ValueError(
+          f'{self.name} takes labels {self.label_names}, '
+          f'got {sorted(labels)}'
+      )
+
+    return tuple(str(labels[name]) for name in self.label_names)
+
+  def snapshot(self, value: Any) -> Any:
+    """Returns a copy of a sample's value safe to read without the lock."""
+    return value
+
+  def value(self, **labels: Any) -> Any:
+    """Returns a sample's current value, None if never set."""
+    key = self.key(labels)
+    with self._lock:
+      value = self._values.get(key)
+      return None if value is None else self.snapshot(value)
+
+  def lines(self) -> list[str]:
+    """Returns the metric in the Prometheus text format."""
+    with self._lock:
+      values = sorted(
+          (key, self.snapshot(value)) for key, value in self._values.items()
+      )
+
+    lines = [
+        f'# HELP {self.name} {self.help}',
+        f'# TYPE {self.name} {self.kind}',
+    ]
+    for key, value in values:
+      lines.extend(self.sample_lines(list(zip(self.label_names, key)), value))
+
+    return lines
+
+  def sample_lines(
+      self, labels: list[tuple[str, str]], value: Any
+  ) -> list[str]:
+    """Returns the lines of a single sample."""
+    return [f'{self.name}{format_labels(labels)} {format_value(value)}']
+
+
+class Counter(Metric):
+  """A value that only goes up, e.g. the number of API calls made."""
+
+  kind = 'counter'
+
+  def inc(self, amount: float = 1, **labels: Any) -> None:
+    """Adds to the counter of the given labels."""
+    key = self.key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+  """A value that can go up and down, e.g. when the last run finished."""
+
+  kind = 'gauge'
+
+  def set(self, value: float, **labels: Any) -> None:
+    """Sets the gauge of the given labels."""
+    key = self.key(labels)
+    with self._lock:
+      self._values[key] = value
+
+
+class Histogram(Metric):
+  """Counts of observed values in buckets, e.g. of request latencies.
+
+  Attributes:
+    buckets: the upper bounds of the buckets, in increasing order.
+  """
+
+  kind = 'histogram'
+
+  buckets: tuple[float, ...]
+
+  def __init__(
+      self,
+      name: str,
+      help_text: str,
+      label_names: Sequence[str],
+      buckets: Sequence[float] = SECONDS_BUCKETS,
+  ):
+    super().__init__(name, help_text, label_names)
+    self.buckets = tuple(sorted(buckets))
+
+  def observe(self, value: float, **labels: Any) -> None:
+    """Records an observed value under the given labels."""
+    key = self.key(labels)
+    index = bisect.bisect_left(self.buckets, value)
+    with self._lock:
+      sample = self._values.get(key)
+      if sample is None:
+        sample = {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0}
+        self._values[key] = sample
+      if index < len(self.buckets):
+        sample['buckets'][index] += 1
+      sample['count'] += 1
+      sample['sum'] += value
+
+  def snapshot(self, value: Any) -> Any:
+    return dict(value, buckets=list(value['buckets']))
+
+  def sample_lines(
+      self, labels: list[tuple[str, str]], value: Any
+  ) -> list[str]:
+    lines = []
+    cumulative = 0
+    for bound, bucket_count in zip(self.buckets, value['buckets']):
+      cumulative += bucket_count
+      bucket_labels = labels + [('le', format_value(bound))]
+      lines.append(
+          f'{self.name}_bucket{format_labels(bucket_labels)} {cumulative}'
+      )
+    lines.append(
+        f'{self.name}_bucket{format_labels(labels + [("le", "+Inf")])} '
+        f'{value["count"]}'
+    )
+    lines.append(
+        f'{self.name}_sum{format_labels(labels)} '
+        f'{format_value(value["sum"])}'
+    )
+    lines.append(f'{self.name}_count{format_labels(labels)} {value["count"]}')
+    return lines
+
+
+class Registry:
+  """The metrics of a process, exported together."""
+
+  def __init__(self):
+    self._metrics = {}
+    self._lock = threading.Lock()
+
+  def register(self, metric: Metric) -> Metric:
+    """Adds a metric, returning the one already registered by its name."""
+    with self._lock:
+      return self._metrics.setdefault(metric.name, metric)
+
+  def counter(
+      self, name: str, help_text: str, label_names: Sequence[str] = ()
+  ) -> Counter:
+    """Returns the counter of a name, registering it on first use."""
+    return self.register(Counter(name, help_text, label_names))
+
+  def gauge(
+      self, name: str, help_text: str, label_names: Sequence[str] = ()
+  ) -> Gauge:
+    """Returns the gauge of a name, registering it on first use."""
+    return self.register(Gauge(name, help_text, label_names))
+
+  def histogram(
+      self,
+      name: str,
+      help_text: str,
+      label_names: Sequence[str] = (),
+      buckets: Sequence[float] = SECONDS_BUCKETS,
+  ) -> Histogram:
+    """Returns the histogram of a name, registering it on first use."""
+    return self.register(Histogram(name, help_text, label_names, buckets))
+
+  def exposition(self) -> str:
+    """Returns every metric in the Prometheus text format."""
+    with self._lock:
+      metrics = list(self._metrics.values())
+
+    lines = []
+    for metric in metrics:
+      lines.extend(metric.lines())
+
+    return '\n'.join(lines) + '\n'
+
+  def write_textfile(self, path: str) -> None:
+    """Writes the metrics for node_exporter's textfile collector.
+
+    The file is replaced atomically so the collector never reads half of
+    it.
+
+    Args:
+      path: the .prom file to write.
+    """
+    # pylint: disable-next=g-import-not-at-top
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(
+        dir=directory, prefix='.bid2x_metrics', suffix='.tmp'
+    )
+    try:
+      with os.fdopen(handle, 'w') as f:
+        f.write(self.exposition())
+      os.replace(temp_path, path)
+    except BaseException:
+      os.unlink(temp_path)
+      raise
+
+
+REGISTRY = Registry()
+
+API_CALLS = REGISTRY.counter(
+    'bid2x_api_calls_total',
+    'API calls made, by API, method and status (ok or the HTTP error).',
+    ('api', 'method', 'status'),
+)
+HTTP_REQUESTS = REGISTRY.counter(
+    'bid2x_http_requests_total',
+    'HTTP requests made to the Google APIs, by API and HTTP status.',
+    ('api', 'status'),
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'bid2x_http_request_seconds',
+    'Seconds HTTP requests to the Google APIs took, by API.',
+    ('api',),
+)
+API_RETRIES = REGISTRY.counter(
+    'bid2x_api_retries_total',
+    'Failed calls retried, by API.',
+    ('api',),
+)
+BACKOFF_SLEEP_SECONDS = REGISTRY.counter(
+    'bid2x_backoff_sleep_seconds_total',
+    'Seconds slept before retrying failed calls, by API.',
+    ('api',),
+)
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.counter(
+    'bid2x_rate_limit_wait_seconds_total',
+    'Seconds calls waited on a rate limiter, by API.',
+    ('api',),
+)
+ZONES_PROCESSED = REGISTRY.counter(
+    'bid2x_zones_processed_total',
+    'Zones processed, by platform and outcome.',
+    ('platform', 'outcome'),
+)
+SCRIPTS = REGISTRY.counter(
+    'bid2x_scripts_total',
+    'Generated scripts uploaded or skipped as unchanged, by platform.',
+    ('platform', 'result'),
+)
+SCRIPT_BYTES = REGISTRY.histogram(
+    'bid2x_script_bytes',
+    'Sizes of generated scripts in bytes, by platform.',
+    ('platform',),
+    BYTES_BUCKETS,
+)
+SHEET_ROWS_READ = REGISTRY.counter(
+    'bid2x_sheet_rows_read_total',
+    'Spreadsheet rows read, by kind of tab.',
+    ('tab',),
+)
+SHEET_ROWS_WRITTEN = REGISTRY.counter(
+    'bid2x_sheet_rows_written_total',
+    'Spreadsheet rows written, by kind of tab.',
+    ('tab',),
+)
+RUNS = REGISTRY.counter(
+    'bid2x_runs_total',
+    'Runs of main() or batches of bid2x_batch, by result.',
+    ('result',),
+)
+LAST_RUN_TIMESTAMP = REGISTRY.gauge(
+    'bid2x_last_run_timestamp_seconds',
+    'When the last run of main() finished, in seconds since the epoch.',
+)
+LAST_RUN_DURATION = REGISTRY.gauge(
+    'bid2x_last_run_duration_seconds',
+    'Seconds the last run of main() took.',
+)
+
+
+def execute(name: str, request: Any) -> Any:
+  """Executes a googleapiclient request, counting it in API_CALLS.
+
+  Args:
+    name: the call's '<api>.<method>' name, see bid2x_util.api_call_name.
+    request: a googleapiclient request or batch request.
+
+  Returns:
+    The response from the API call.
+  """
+  api, method = name.split('.', 1)
+  try:
+    response = request.execute()
+  except Exception as e:
+    # HttpError carries the response, other errors never got one.
+    status = getattr(getattr(e, 'resp', None), 'status', 'error')
+    API_CALLS.inc(api=api, method=method, status=status)
+    raise
+
+  API_CALLS.inc(api=api, method=method, status='ok')
+  return response
+
+
+def record_http(api: str, status: int | str, seconds: float) -> None:
+  """Records an HTTP request to a Google API.
+
+  Args:
+    api: the API named by its URL, see bid2x_discovery.url_api_name.
+    status: the HTTP status of the response, 'error' if none came back.
+    seconds: how long the request took.
+  """
+  HTTP_REQUESTS.inc(api=api, status=status)
+  HTTP_REQUEST_SECONDS.observe(seconds, api=api)
+
+
+def record_zone(
+    platform: str, outcome: str, script_result: str | None = None
+) -> None:
+  """Records how a zone's run ended.
+
+  Args:
+    platform: 'dv' or 'gtm'.
+    outcome: 'completed', 'failed', 'deferred' for lack of time, or
+      'aborted' when another zone's failure stopped it.
+    script_result: 'uploaded' or 'unchanged' if the zone's script was
+      compared with the live one, else None.
+  """
+  ZONES_PROCESSED.inc(platform=platform, outcome=outcome)
+  if script_result:
+    SCRIPTS.inc(platform=platform, result=script_result)
+
+
+def record_retry(api: str, backoff_seconds: float) -> None:
+  """Records a failed call about to be retried after a backoff sleep.
+
+  The retry is also added to the span open in this thread, if any (see
+  bid2x_trace).
+
+  Args:
+    api: 'dv360', 'sheets' or 'gtm'.
+    backoff_seconds: the seconds slept before the retry.
+  """
+  API_RETRIES.inc(api=api)
+  BACKOFF_SLEEP_SECONDS.inc(backoff_seconds, api=api)
+  bid2x_trace.add('retries')
+
+
+def record_run(succeeded: bool, start_time: float, end_time: float) -> None:
+  """Records a finished run or batch and writes the textfile, if set.
+
+  Args:
+    succeeded: whether the run succeeded.
+    start_time: when the run started, in seconds since the epoch.
+    end_time: when the run finished, in seconds since the epoch.
+  """
+  RUNS.inc(result='success' if succeeded else 'failure')
+  LAST_RUN_TIMESTAMP.set(end_time)
+  LAST_RUN_DURATION.set(end_time - start_time)
+
+  path = bid2x_var.METRICS_TEXTFILE or os.getenv(
+      bid2x_var.METRICS_TEXTFILE_ENV_VAR
+  )
+  if path:
+    try:
+      REGISTRY.write_textfile(path)
+    except OSError as e:
+      print(f'Unable to write metrics to {path}: {e}')
+
+
+def handle_scrape(handler: Any) -> None:
+  """Answers a GET request made to the /metrics server.
+
+  Args:
+    handler: the http.server request handler of the request.
+  """
+  if handler.path.split('?', 1)[0] != '/metrics':
+    handler.send_error(404)
+    return
+
+  content = REGISTRY.exposition().encode('utf-8')
+  handler.send_response(200)
+  handler.send_header('Content-Type', CONTENT_TYPE)
+  handler.send_header('Content-Length', str(len(content)))
+  handler.end_headers()
+  handler.wfile.write(content)
+
+
+# The /metrics server, started at most once per process.
+_server: Any = None
+_server_lock = threading.Lock()
+
+
+def serve(port: int | None = None, host: str = '') -> int | None:
+  """Serves /metrics from a background thread, if a port is set.
+
+  Calling again once serving does nothing, so every entry point can call
+  this at start-up.
+
+  Args:
+    port: the port to listen on, 0 for any free port.  Defaults to
+      bid2x_var.METRICS_PORT or the environment variable named by
+      bid2x_var.METRICS_PORT_ENV_VAR.
+    host: the address to listen on, all addresses by default.
+
+  Returns:
+    The port served on, None if no port is set.
+  """
+  global _server
+
+  if port is None:
+    port = bid2x_var.METRICS_PORT
+    if port is None and os.getenv(bid2x_var.METRICS_PORT_ENV_VAR):
+      port = int(os.getenv(bid2x_var.METRICS_PORT_ENV_VAR))
+  if port is None:
+    return None
+
+  # Only processes that stay up serve metrics, so other runs don't pay for
+  # importing the HTTP server on a cold start.
+  # pylint: disable-next=g-import-not-at-top
+  from http import server
+
+  class MetricsRequestHandler(server.BaseHTTPRequestHandler):
+    """Serves the registry at /metrics."""
+
+    do_GET = handle_scrape  # pylint: disable=invalid-name
+
+    # pylint: disable-next=redefined-builtin
+    def log_message(self, format: str, *args: Any) -> None:
+      del format, args  # Scrapes are not logged.
+
+  with _server_lock:
+    if _server is None:
+      try:
+        _server = server.ThreadingHTTPServer(
+            (host, port), MetricsRequestHandler
+        )
+      except OSError as e:
+        print(f'Unable to serve metrics on port {port}: {e}')
+        return None
+      _server.daemon_threads = True
+      threading.Thread(
+          target=_server.serve_forever, name='bid2x-metrics', daemon=True
+      ).start()
+      print(f'Serving metrics at http://{host or "0.0.0.0"}:'
+            f'{_server.server_address[1]}/metrics')
+
+    return _server.server_address[1]
@@ -58,9 +58,26 @@ class Bid2xModel():
       set_spreadsheet_row_col:
       set_cb_algorithm:
       update_custom_bidding_scripts:
+      upload_custom_bidding_script:
+      bind_line_items:
 
   """
 
+  # Zones are held for every config of a batch run, so they keep their
+  # properties in slots rather than a __dict__.
+  __slots__ = (
+      'name',
+      'campaign_id',
+      'advertiser_id',
+      'algorithm_id',
+      'cb_algorithm',
+      'debug',
+      'update_row',
+      'update_col',
+      'test_row',
+      'test_col',
+  )
+
   # Set up properties of this class.
   name: str
   campaign_id: int
@@ -167,6 +184,30 @@ class Bid2xModel():
     Returns:
       true on completion of function
     """
+    self.upload_custom_bidding_script(
+        service, advertiser_id, algorithm_id, script_path
+    )
+    self.bind_line_items(service, advertiser_id, algorithm_id, line_item_array)
+
+    return True
+
+  def upload_custom_bidding_script(
+      self, service: Any, advertiser_id: int, algorithm_id: int,
+      script_path: str
+  ) -> dict[str, Any]:
+    """Upload a new script to an EXISTING custom bidding algorithm.
+
+    Args:
+      service: an active service connection object to DV360
+      advertiser_id: the advertiser ID to upload c.b algorithm for
+      algorithm_id: the custom bidding algorithm the script will be
+                  uploaded to.
+      script_path: a string containing the path within the local filesystem
+                  where the script can be loaded from.
+
+    Returns:
+      The custom bidding script object created in DV360.
+    """
     # Part 1 - upload script and get a reference ID.
     # Retrieve a usable custom bidding script reference object.
     create_script_ref_request = service.customBiddingAlgorithms().uploadScript(
@@ -219,6 +260,24 @@ class Bid2xModel():
           f'{create_cb_scrpt_response}',
       )
 
+    return create_cb_scrpt_response
+
+  def bind_line_items(
+      self, service: Any, advertiser_id: int, algorithm_id: int,
+      line_item_array: list[int]
+  ) -> dict[str, Any]:
+    """Assign a custom bidding algorithm to line items.
+
+    Args:
+      service: an active service connection object to DV360
+      advertiser_id: the advertiser ID the line items belong to.
+      algorithm_id: the custom bidding algorithm to bid with.
+      line_item_array: a list of line item ids to apply the
+      custom bidding algorithm to.
+
+    Returns:
+      The response of the line item bulk update.
+    """
     # Part 4 - Assign script to a custom bidding algorithm.
     # Create the new bid strategy object.
     bidding_strategy = {
@@ -261,4 +320,4 @@ class Bid2xModel():
           f'{li_update_response["updatedLineItemIds"]}'
       )
 
-    return True
+    return li_update_response
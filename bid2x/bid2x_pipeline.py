@@ -0,0 +1,639 @@
+"""BidToX - DV360 zone pipeline.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  The update, test and update spreadsheet actions of a DV360 run are broken
+  into stages run once per zone.  Each stage reads what it needs from, and
+  writes what it produces to, the zone's ZoneRecord:
+
+    fetch_sheet        reads the zone's tab, once for all other stages.
+    fetch_live_script  downloads the script the zone's algorithm uses.
+    generate           builds the new script and its line items.
+    diff               compares the new script with the live one.
+    upload             uploads a changed script.
+    bind_line_items    assigns the algorithm to the zone's line items.
+    report             records the uploaded script in the status tab.
+    report_test        records a test run in the status tab.
+    refresh_sheet      rewrites the zone's tab from DV360's line items.
+
+  A stage starts once the stages it requires have completed, so on a pool
+  of more than one worker a zone's two fetches overlap and later zones start
+  while earlier ones finish.  Earlier zones are always preferred.  A stage
+  returning False, e.g. diff for an unchanged script, skips the stages that
+  depend on it for that zone only.  The first exception raised stops new
+  stages from starting and is re-raised once the running ones finish.
+
+  Given a run journal (see bid2x_journal) every completed stage is recorded
+  with a fingerprint of what it acted on, and a stage whose fingerprint
+  matches the journal is skipped, so a run restarted after a failure
+  resumes with the first unit of work not proven done.  An unchanged
+  script is taken as uploaded only if the journal shows bid2x uploaded it,
+  in which case the zone's line items and status tab are brought up to
+  date if the failed run did not get that far.
+
+  Given a scheduler (see bid2x_scheduler) a zone's first stage only starts
+  if the scheduler expects the zone to finish in the time left; otherwise
+  the whole zone is deferred.  A zone once started is never cut short.
+
+  With tracing on (see bid2x_trace) every stage run is timed as a
+  'dv.stage.<name>' span carrying the zone's name.  Once the stages finish
+  each zone's outcome, and whether its script was uploaded or unchanged, is
+  counted in bid2x_metrics.
+"""
+
+from concurrent import futures
+import dataclasses
+import time
+from typing import Any, Callable, TYPE_CHECKING
+
+import bid2x_journal
+import bid2x_metrics
+import bid2x_profile
+import bid2x_trace
+import bid2x_var
+
+if TYPE_CHECKING:
+  from bid2x_dv import Bid2xDV
+  from bid2x_scheduler import ZoneScheduler
+
+
+@dataclasses.dataclass
+class ZoneRecord:
+  """The data handed from stage to stage for a single zone.
+
+  Attributes:
+    zone: the Bid2xModel of the zone.
+    records: the rows of the zone's tab, keyed by column heading.
+    live_script: the script the zone's algorithm currently uses.
+    script: the newly generated script.
+    line_items: the IDs of the line items the script applies to.
+    changed: whether the new script differs from the live one.
+    script_path: the file the new script was uploaded from.
+    uploaded_script: the custom bidding script object created in DV360.
+    completed: names of the stages that ran, in completion order.
+    skipped: names of the stages that were skipped or that asked for the
+        stages depending on them to be skipped.
+    resumed: names of the completed stages skipped as the journal shows
+        them done.
+    journal_entries: the zone's stages recorded in the journal by earlier
+        runs, keyed by stage name.
+    deferred: whether the zone was not started for lack of time.
+    failed: whether one of the zone's stages raised an exception.
+  """
+
+  zone: Any
+  records: list[dict[str, Any]] | None = None
+  live_script: str | None = None
+  script: str | None = None
+  line_items: list[int] = dataclasses.field(default_factory=list)
+  changed: bool | None = None
+  script_path: str | None = None
+  uploaded_script: dict[str, Any] | None = None
+  completed: list[str] = dataclasses.field(default_factory=list)
+  skipped: list[str] = dataclasses.field(default_factory=list)
+  resumed: list[str] = dataclasses.field(default_factory=list)
+  journal_entries: dict[str, bid2x_journal.JournalEntry] = (
+      dataclasses.field(default_factory=dict)
+  )
+  deferred: bool = False
+  failed: bool = False
+
+
+StageFunction = Callable[['Bid2xDV', Any, ZoneRecord], bool]
+FingerprintFunction = Callable[['Bid2xDV', ZoneRecord], str | None]
+
+
+@dataclasses.dataclass(frozen=True)
+class Stage:
+  """A unit of work run once per zone.
+
+  Attributes:
+    name: the name of the stage.
+    run: called with the Bid2xDV object, the DV360 service and the zone's
+        record.  Returns False to skip the stages depending on it.
+    requires: names of the stages that must complete first.  Stages that
+        are not part of the pipeline being run are ignored.
+    fingerprint: optional, called before the stage runs to hash what it is
+        about to act on.  None if it can not be proven done.
+    resumable: whether a journal entry with the same fingerprint proves the
+        stage done.  If not the fingerprint is only recorded.
+    durable: whether the stage's journal entry is written before the stages
+        depending on it start, rather than when the journal next writes.
+  """
+
+  name: str
+  run: StageFunction
+  requires: tuple[str, ...] = ()
+  fingerprint: FingerprintFunction | None = None
+  resumable: bool = True
+  durable: bool = False
+
+
+def upload_fingerprint(dv: 'Bid2xDV', record: ZoneRecord) -> str:
+  """Hashes the script uploaded and the algorithm it was uploaded to."""
+  del dv  # Unused.
+  zone = record.zone
+  return bid2x_journal.fingerprint(
+      zone.advertiser_id, zone.algorithm_id, record.script
+  )
+
+
+def bind_line_items_fingerprint(dv: 'Bid2xDV', record: ZoneRecord) -> str:
+  """Hashes the script and the line items it is assigned to."""
+  del dv  # Unused.
+  zone = record.zone
+  return bid2x_journal.fingerprint(
+      zone.advertiser_id, zone.algorithm_id, record.script,
+      sorted(record.line_items),
+  )
+
+
+def report_fingerprint(dv: 'Bid2xDV', record: ZoneRecord) -> str:
+  """Hashes the script and where it is written in the status tab."""
+  del dv  # Unused.
+  zone = record.zone
+  return bid2x_journal.fingerprint(
+      record.script, zone.update_row, zone.update_col
+  )
+
+
+def report_test_fingerprint(
+    dv: 'Bid2xDV', record: ZoneRecord
+) -> str | None:
+  """Hashes a test run's script, only within a run and its retries."""
+  del dv  # Unused.
+  run_id = bid2x_journal.run_id()
+  if not run_id:
+    return None
+
+  zone = record.zone
+  return bid2x_journal.fingerprint(
+      run_id, record.script, zone.test_row, zone.test_col
+  )
+
+
+def refresh_sheet_fingerprint(
+    dv: 'Bid2xDV', record: ZoneRecord
+) -> str | None:
+  """Hashes a tab refresh's settings, only within a run and its retries."""
+  run_id = bid2x_journal.run_id()
+  if not run_id:
+    return None
+
+  zone = record.zone
+  return bid2x_journal.fingerprint(
+      run_id, zone.advertiser_id, zone.campaign_id,
+      dv.line_item_name_pattern, dv.defer_pattern,
+  )
+
+
+def fetch_sheet(dv: 'Bid2xDV', service: Any, record: ZoneRecord) -> bool:
+  """Reads the zone's tab."""
+  del service  # Unused.
+  record.records = dv.sheet.read_zone_records(record.zone.name)
+  return True
+
+
+def fetch_live_script(
+    dv: 'Bid2xDV', service: Any, record: ZoneRecord
+) -> bool:
+  """Downloads the script the zone's algorithm currently uses."""
+  record.live_script = dv.read_cb_algorithm_by_id(
+      service, record.zone.advertiser_id, record.zone.algorithm_id
+  )
+  return True
+
+
+def generate(dv: 'Bid2xDV', service: Any, record: ZoneRecord) -> bool:
+  """Builds the zone's script and its line items from the tab's rows."""
+  del service  # Unused.
+  record.script = dv.generate_cb_script_from_records(record.records)
+  record.line_items = dv.sheet.affected_line_items_from_records(
+      record.records
+  )
+
+  if dv.trace:
+    # Show the generated custom bidding script.
+    print(
+        f'custom_bidding_function_string for zone {record.zone.name}:\n',
+        f'{record.script}\n',
+    )
+  return True
+
+
+def diff(dv: 'Bid2xDV', service: Any, record: ZoneRecord) -> bool:
+  """Compares the new script with the live one, stopping if unchanged."""
+  del service  # Unused.
+  zone_name = record.zone.name
+  if dv.trace:
+    print(f'new c.b.script:***{record.script}***')
+    print(f'current script:***{record.live_script}***')
+
+  record.changed = (
+      str(record.script).strip() != str(record.live_script).strip()
+  )
+  if not record.changed:
+    uploaded = record.journal_entries.get(UPLOAD.name)
+    if uploaded and uploaded.fingerprint == upload_fingerprint(dv, record):
+      # Uploaded by bid2x, which may have stopped before finishing the zone.
+      print(
+          f'New script for {zone_name} is the same as the existing script;'
+          ' not uploading, finishing any stages an earlier run did not'
+      )
+      return True
+
+    print(
+        f'New script for {zone_name} is the same as the existing script;'
+        ' not uploading'
+    )
+    return False
+
+  print(
+      f'New script for {zone_name} is different from last ',
+      'uploaded script; uploading new version.',
+  )
+  return True
+
+
+def upload(dv: 'Bid2xDV', service: Any, record: ZoneRecord) -> bool:
+  """Uploads the new script to the zone's algorithm."""
+  zone = record.zone
+  if not record.changed:
+    # Resuming a zone whose script is already live.
+    return True
+
+  # Custom bidding scripts are uploaded as media objects, from a file named
+  # [cb_tmp_file_prefix]_[zone name].txt.
+  record.script_path = f'{dv.cb_tmp_file_prefix}_{zone.name}.txt'
+  dv.write_last_upload_file(record.script_path, record.script)
+
+  record.uploaded_script = zone.upload_custom_bidding_script(
+      service, zone.advertiser_id, zone.algorithm_id, record.script_path
+  )
+  return True
+
+
+def bind_line_items(
+    dv: 'Bid2xDV', service: Any, record: ZoneRecord
+) -> bool:
+  """Assigns the zone's algorithm to the line items marked in its tab."""
+  del dv  # Unused.
+  zone = record.zone
+  zone.bind_line_items(
+      service, zone.advertiser_id, zone.algorithm_id, record.line_items
+  )
+  return True
+
+
+def report(dv: 'Bid2xDV', service: Any, record: ZoneRecord) -> bool:
+  """Records the uploaded script in the 'CB_Scripts' tab."""
+  del service  # Unused.
+  print(f'Update of C.B. Script for zone {record.zone.name} succeeded.')
+  dv.sheet.update_cb_scripts_tab(record.zone, record.script, test_run=False)
+  return True
+
+
+def report_test(dv: 'Bid2xDV', service: Any, record: ZoneRecord) -> bool:
+  """Records a test run's script in the status tab."""
+  del service  # Unused.
+  if dv.trace:
+    print(
+        f"""rules for zone {record.zone.name}:\n
+          {record.script}"""
+    )
+
+  dv.sheet.update_status_tab(
+      bid2x_var.DV_STATUS_TAB, record.zone, record.script, test_run=True
+  )
+  return True
+
+
+def refresh_sheet(dv: 'Bid2xDV', service: Any, record: ZoneRecord) -> bool:
+  """Rewrites the zone's tab with the line items currently in DV360."""
+  return dv.sheet.read_dv_line_items(
+      service, dv.line_item_name_pattern, [record.zone], dv.defer_pattern
+  )
+
+
+FETCH_SHEET = Stage('fetch_sheet', fetch_sheet)
+FETCH_LIVE_SCRIPT = Stage('fetch_live_script', fetch_live_script)
+GENERATE = Stage('generate', generate, ('fetch_sheet',))
+DIFF = Stage('diff', diff, ('generate', 'fetch_live_script'))
+# Whether an upload is needed is proven by the live script, not the journal.
+# Once uploaded the live script matches the new one, so diff only lets a
+# restart bind the line items if the journal already holds the upload.
+UPLOAD = Stage(
+    'upload', upload, ('diff',), upload_fingerprint, resumable=False,
+    durable=True,
+)
+BIND_LINE_ITEMS = Stage(
+    'bind_line_items', bind_line_items, ('upload',),
+    bind_line_items_fingerprint,
+)
+REPORT = Stage('report', report, ('bind_line_items',), report_fingerprint)
+REPORT_TEST = Stage(
+    'report_test', report_test, ('generate',), report_test_fingerprint
+)
+# The tab is only rewritten once the other stages have read it.
+REFRESH_SHEET = Stage(
+    'refresh_sheet', refresh_sheet, ('fetch_sheet',),
+    refresh_sheet_fingerprint,
+)
+
+UPDATE_STAGES = (
+    FETCH_SHEET, FETCH_LIVE_SCRIPT, GENERATE, DIFF, UPLOAD, BIND_LINE_ITEMS,
+    REPORT,
+)
+TEST_STAGES = (FETCH_SHEET, GENERATE, REPORT_TEST)
+UPDATE_SPREADSHEET_STAGES = (REFRESH_SHEET,)
+
+# Every stage, in the order a zone's stages are preferred.
+ALL_STAGES = (
+    FETCH_SHEET, FETCH_LIVE_SCRIPT, GENERATE, DIFF, UPLOAD, BIND_LINE_ITEMS,
+    REPORT, REPORT_TEST, REFRESH_SHEET,
+)
+
+
+def stages_for_actions(
+    update_scripts: bool, test: bool, update_spreadsheet: bool
+) -> list[Stage]:
+  """Returns the stages needed by a combination of actions.
+
+  Stages shared by several actions, e.g. fetch_sheet and generate for both
+  an update and a test, are run once.
+
+  Args:
+    update_scripts: whether scripts are generated and uploaded.
+    test: whether scripts are generated and written to the status tab.
+    update_spreadsheet: whether the zones' tabs are refreshed from DV360.
+
+  Returns:
+    The stages to run, in preferred order.
+  """
+  wanted = set()
+  if update_scripts:
+    wanted.update(UPDATE_STAGES)
+  if test:
+    wanted.update(TEST_STAGES)
+  if update_spreadsheet:
+    wanted.update(UPDATE_SPREADSHEET_STAGES)
+
+  return [stage for stage in ALL_STAGES if stage in wanted]
+
+
+def next_ready_units(
+    pending: list[tuple[ZoneRecord, Stage]], stage_names: set[str]
+) -> list[tuple[ZoneRecord, Stage]]:
+  """Returns the pending units whose required stages have all completed.
+
+  Units depending on a skipped stage are marked skipped and removed from
+  pending as a side effect.
+
+  Args:
+    pending: the (record, stage) units not yet started, in preferred order.
+    stage_names: the names of the stages in the pipeline.
+
+  Returns:
+    The units ready to start, in preferred order.
+  """
+  ready = []
+  for unit in list(pending):
+    record, stage = unit
+    requires = [name for name in stage.requires if name in stage_names]
+    if any(name in record.skipped for name in requires):
+      record.skipped.append(stage.name)
+      pending.remove(unit)
+    elif all(name in record.completed for name in requires):
+      ready.append(unit)
+
+  return ready
+
+
+def journal_proves_done(
+    record: ZoneRecord, stage: Stage, unit_fingerprint: str | None
+) -> bool:
+  """Returns True if the journal shows a stage done on the same content."""
+  if not stage.resumable or unit_fingerprint is None:
+    return False
+
+  entry = record.journal_entries.get(stage.name)
+  return entry is not None and entry.fingerprint == unit_fingerprint
+
+
+def record_completion(
+    journal: bid2x_journal.RunJournal | None,
+    scope: str,
+    record: ZoneRecord,
+    stage: Stage,
+    unit_fingerprint: str | None,
+    seconds: float,
+) -> None:
+  """Records a completed stage in the journal, if there is one."""
+  if journal is None:
+    return
+
+  entry = bid2x_journal.JournalEntry(
+      stage.name, unit_fingerprint, time.time(), seconds,
+      len(record.line_items), bid2x_journal.run_id(),
+  )
+  try:
+    journal.record(scope, record.zone.name, entry, flush=stage.durable)
+  except Exception as e:  # pylint: disable=broad-exception-caught
+    # Losing an entry only means the stage is redone by a restart.
+    print(f'Unable to record {stage.name} for zone {record.zone.name}: {e}')
+
+
+def run_stage(
+    stage: Stage,
+    dv: 'Bid2xDV',
+    service: Any,
+    record: ZoneRecord,
+    parent: bid2x_trace.Span | None,
+) -> bool:
+  """Runs a stage for a zone in a span of the thread that started it."""
+  with bid2x_trace.span(
+      f'dv.stage.{stage.name}', parent=parent, zone=record.zone.name
+  ), bid2x_profile.zone(record.zone.name):
+    return stage.run(dv, service, record)
+
+
+def zone_outcome(record: ZoneRecord, stage_names: set[str]) -> str:
+  """Returns how a zone's run ended, as counted in bid2x_metrics.
+
+  Args:
+    record: the zone's record once the pipeline has finished.
+    stage_names: the names of the stages run.
+
+  Returns:
+    'deferred', 'failed', 'completed', or 'aborted' if another zone's
+    failure stopped the zone's stages from starting.
+  """
+  if record.deferred:
+    return 'deferred'
+  if record.failed:
+    return 'failed'
+  if all(
+      name in record.completed or name in record.skipped
+      for name in stage_names
+  ):
+    return 'completed'
+
+  return 'aborted'
+
+
+def record_metrics(records: list[ZoneRecord], stage_names: set[str]) -> None:
+  """Counts the zones processed and the scripts uploaded or unchanged."""
+  for record in records:
+    script_result = None
+    if UPLOAD.name in stage_names:
+      if record.changed is False:
+        script_result = 'unchanged'
+      elif (UPLOAD.name in record.completed
+            and UPLOAD.name not in record.resumed):
+        script_result = 'uploaded'
+    bid2x_metrics.record_zone(
+        'dv', zone_outcome(record, stage_names), script_result
+    )
+
+
+def run_pipeline(
+    dv: 'Bid2xDV',
+    service: Any,
+    zone_array: list[Any],
+    stages: list[Stage],
+    max_workers: int = bid2x_var.DV_MAX_WORKERS,
+    journal: bid2x_journal.RunJournal | None = None,
+    scope: str = '',
+    scheduler: 'ZoneScheduler | None' = None,
+) -> list[ZoneRecord]:
+  """Runs stages for every zone on a bounded pool of worker threads.
+
+  Args:
+    dv: the Bid2xDV object holding the run's settings and spreadsheet.
+    service: a service object previously opened with the DV360 API.
+    zone_array: the Bid2xModel objects of the zones to process.
+    stages: the stages to run for each zone, see stages_for_actions.
+    max_workers: the maximum number of stages run at the same time.
+    journal: optional run journal stages are recorded in and resumed from.
+    scope: the journal scope of the zones, e.g. the spreadsheet ID.
+    scheduler: optional scheduler deciding whether a zone is started.
+
+  Returns:
+    One record per zone, in the order given.
+
+  Raises:
+    Exception: the first exception raised by a stage.
+  """
+  max_workers = max(1, max_workers)
+  stage_names = {stage.name for stage in stages}
+  records = [ZoneRecord(zone) for zone in zone_array]
+  if journal is not None:
+    for record in records:
+      record.journal_entries = journal.completed(scope, record.zone.name)
+
+  # Earlier zones come first so a zone is finished before the last zones
+  # are even started.
+  pending = [(record, stage) for record in records for stage in stages]
+  running = {}
+  started = set()
+  error = None
+
+  with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+    while pending or running:
+      # Start what is ready.  Stages the journal proves done complete
+      # straight away, which may make further stages ready.
+      resumed = error is None
+      while resumed:
+        resumed = False
+        for unit in next_ready_units(pending, stage_names):
+          if len(running) >= max_workers:
+            break
+          record, stage = unit
+          if record.deferred:
+            continue
+          if id(record) not in started:
+            if scheduler is not None and not scheduler.can_start(record.zone):
+              # Defer the whole zone so none of it is left half done.
+              pending[:] = [
+                  other for other in pending if other[0] is not record
+              ]
+              record.deferred = True
+              scheduler.defer(record.zone)
+              continue
+            started.add(id(record))
+
+          pending.remove(unit)
+          unit_fingerprint = (
+              stage.fingerprint(dv, record) if stage.fingerprint else None
+          )
+
+          if journal_proves_done(record, stage, unit_fingerprint):
+            print(
+                f'Skipping {stage.name} for zone {record.zone.name}; '
+                'done by an earlier run.'
+            )
+            record.completed.append(stage.name)
+            record.resumed.append(stage.name)
+            resumed = True
+            continue
+
+          future = executor.submit(
+              run_stage, stage, dv, service, record,
+              bid2x_trace.current_span(),
+          )
+          running[future] = (record, stage, unit_fingerprint, time.monotonic())
+
+      if error is not None:
+        # Stop starting stages; let the running ones finish.
+        pending.clear()
+
+      if not running:
+        if pending:
+          raise ValueError(
+              'Pipeline stages have unmet or circular requirements: '
+              f'{[stage.name for _, stage in pending]}'
+          )
+        break
+
+      done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+      for future in done:
+        record, stage, unit_fingerprint, start = running.pop(future)
+        try:
+          proceed = future.result()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+          print(
+              f'Stage {stage.name} failed for zone {record.zone.name}: {e}'
+          )
+          record.failed = True
+          if error is None:
+            error = e
+          continue
+
+        record.completed.append(stage.name)
+        if not proceed:
+          record.skipped.append(stage.name)
+        record_completion(
+            journal, scope, record, stage, unit_fingerprint,
+            time.monotonic() - start,
+        )
+
+  record_metrics(records, stage_names)
+  if error is not None:
+    raise error
+
+  return records
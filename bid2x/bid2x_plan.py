@@ -0,0 +1,571 @@
+"""BidToX - Dry-run planner.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  Walks the actions and zones of a config, as loaded by
+  create_objects_from_json_file, and lists the DV360, Sheets and GTM calls
+  a run would make without making any of them:
+
+      python main.py -i dv_config.json --plan
+
+  Every planned call is listed per action or pipeline stage and zone, and
+  totalled per API: reads, writes, pages and expected bytes.  The plan is
+  an upper bound: it assumes every script changed and every GTM variable
+  needs publishing.
+
+  A zone's line item count, which sets the pages of line items listed and
+  the size of its tab and script, is taken from the run journal
+  (journal_path) when an earlier run recorded it, otherwise
+  PLAN_DEFAULT_LINE_ITEMS is assumed.
+
+  Wall time is estimated from a latency profile: seconds per call keyed by
+  '<api>.<method>' or '<api>', e.g.
+      {"dv360.advertisers.lineItems.list": 1.8, "sheets": 0.4}
+  read from --latency_profile and falling back on PLAN_CALL_SECONDS.  The
+  zones of a DV360 run overlap on dv_max_workers, the containers of a GTM
+  run on gtm_max_workers.
+"""
+
+import dataclasses
+import json
+import math
+from typing import Any
+
+import bid2x_journal
+import bid2x_util
+import bid2x_var
+
+DV360 = 'dv360'
+SHEETS = 'sheets'
+GTM = 'gtm'
+APIS = (DV360, SHEETS, GTM)
+
+READ = 'read'
+WRITE = 'write'
+
+
+@dataclasses.dataclass
+class PlannedCall:
+  """An API call a run would make.
+
+  Attributes:
+    api: the API called, one of APIS.
+    method: the API method, e.g. 'advertisers.lineItems.list'.
+    kind: 'read' or 'write'.
+    step: the action or pipeline stage making the call.
+    zone: the zone the call is made for, None for calls shared by all
+        zones.
+    pages: the number of requests made, one per page.
+    bytes: the expected bytes sent and received.
+    seconds: the expected time taken by all pages.
+  """
+
+  api: str
+  method: str
+  kind: str
+  step: str
+  zone: str | None = None
+  pages: int = 1
+  bytes: int = 0
+  seconds: float = 0.0
+
+
+def load_latency_profile(path: str | None) -> dict[str, float]:
+  """Reads a latency profile, an empty one if no path is given.
+
+  Args:
+    path: a JSON file (or gs:// object) of seconds per call keyed by
+      '<api>.<method>' or '<api>'.
+
+  Returns:
+    The profile.
+  """
+  if not path:
+    return {}
+
+  return {key: float(value) for key, value in
+          bid2x_util.read_config(path).items()}
+
+
+class Plan:
+  """The calls planned for a run, with their expected cost.
+
+  Attributes:
+    title: what was planned, e.g. the config file.
+    calls: the planned calls, in the order a serial run makes them.
+    zone_line_items: the line item count assumed for each zone.
+    profile: the latency profile the calls were timed with.
+  """
+
+  title: str
+  calls: list[PlannedCall]
+  zone_line_items: dict[str, int]
+  profile: dict[str, float]
+
+  def __init__(self, title: str, profile: dict[str, float] | None = None):
+    self.title = title
+    self.calls = []
+    self.zone_line_items = {}
+    self.profile = profile or {}
+    self._max_workers = 1
+    # Zones worked on together, e.g. a GTM container's, keyed by zone name.
+    self._zone_units = {}
+
+  def call_seconds(self, api: str, method: str) -> float:
+    """Returns the expected seconds of one request to a method."""
+    for key in (f'{api}.{method}', api):
+      if key in self.profile:
+        return self.profile[key]
+
+    return bid2x_var.PLAN_CALL_SECONDS[api]
+
+  def add(
+      self,
+      api: str,
+      method: str,
+      kind: str,
+      step: str,
+      zone: str | None = None,
+      pages: int = 1,
+      payload_bytes: int = bid2x_var.PLAN_CALL_BYTES,
+  ) -> None:
+    """Plans a call.
+
+    Args:
+      api: the API called, one of APIS.
+      method: the API method.
+      kind: 'read' or 'write'.
+      step: the action or pipeline stage making the call.
+      zone: the zone the call is made for, if any.
+      pages: the number of requests made.
+      payload_bytes: the expected bytes sent and received by all pages.
+    """
+    self.calls.append(PlannedCall(
+        api, method, kind, step, zone, pages, payload_bytes,
+        pages * self.call_seconds(api, method),
+    ))
+
+  def set_max_workers(self, max_workers: int) -> None:
+    """Sets how many zones (or containers) a run works on at once."""
+    self._max_workers = max(1, max_workers)
+
+  def group_zones(self, zone_names: list[str]) -> None:
+    """Times zones worked on one after the other as one unit of work."""
+    for zone_name in zone_names:
+      self._zone_units[zone_name] = zone_names[0]
+
+  def totals(self) -> dict[str, dict[str, float]]:
+    """Returns the reads, writes, pages, bytes and seconds of each API."""
+    totals = {
+        api: {'reads': 0, 'writes': 0, 'pages': 0, 'bytes': 0, 'seconds': 0.0}
+        for api in APIS
+    }
+    for call in self.calls:
+      total = totals[call.api]
+      total['reads' if call.kind == READ else 'writes'] += 1
+      total['pages'] += call.pages
+      total['bytes'] += call.bytes
+      total['seconds'] += call.seconds
+
+    return totals
+
+  def serial_seconds(self) -> float:
+    """Returns the expected wall time of a run making one call at a time."""
+    return sum(call.seconds for call in self.calls)
+
+  def wall_seconds(self) -> float:
+    """Returns the expected wall time, zones overlapping on the workers.
+
+    Calls shared by all zones are made one at a time.  The zones' calls
+    are spread over the workers, but no faster than the slowest zone.
+    """
+    shared = 0.0
+    per_unit = {}
+    for call in self.calls:
+      if call.zone is None:
+        shared += call.seconds
+      else:
+        unit = self._zone_units.get(call.zone, call.zone)
+        per_unit[unit] = per_unit.get(unit, 0.0) + call.seconds
+
+    if not per_unit:
+      return shared
+
+    return shared + max(
+        sum(per_unit.values()) / self._max_workers, max(per_unit.values())
+    )
+
+  def as_dict(self) -> dict[str, Any]:
+    """Returns the plan as JSON serialisable values."""
+    return {
+        'title': self.title,
+        'zone_line_items': self.zone_line_items,
+        'calls': [dataclasses.asdict(call) for call in self.calls],
+        'totals': self.totals(),
+        'serial_seconds': self.serial_seconds(),
+        'wall_seconds': self.wall_seconds(),
+        'max_workers': self._max_workers,
+    }
+
+  def print_plan(self) -> None:
+    """Prints the call graph and the per API totals."""
+    print(f'bid2x plan for {self.title}')
+    step = zone = None
+    for call in self.calls:
+      if (call.step, call.zone) != (step, zone):
+        step, zone = call.step, call.zone
+        where = f'zone {zone}' if zone is not None else 'all zones'
+        print(f'  {step} ({where})')
+      pages = f' x{call.pages} pages' if call.pages > 1 else ''
+      print(
+          f'    {call.kind:<5} {call.api}.{call.method}{pages}  '
+          f'{call.bytes} bytes  {call.seconds:.2f}s'
+      )
+
+    print('Per API:')
+    print(f'  {"api":<7}{"reads":>7}{"writes":>8}{"pages":>7}'
+          f'{"bytes":>12}{"seconds":>10}')
+    for api, total in self.totals().items():
+      print(
+          f'  {api:<7}{total["reads"]:>7}{total["writes"]:>8}'
+          f'{total["pages"]:>7}{total["bytes"]:>12}'
+          f'{total["seconds"]:>10.1f}'
+      )
+    print(
+        f'Estimated wall time: {self.wall_seconds():.1f}s '
+        f'({self.serial_seconds():.1f}s serial, '
+        f'{self._max_workers} worker(s)).'
+    )
+
+
+def zone_line_items(
+    app: Any, zone_array: list[Any]
+) -> dict[str, int]:
+  """Returns each zone's expected line item count.
+
+  Args:
+    app: the Bid2xApplication being planned.
+    zone_array: the zones to count.
+
+  Returns:
+    A dict of zone name to line items, from the run journal if it holds
+    the zone, PLAN_DEFAULT_LINE_ITEMS otherwise.
+  """
+  counts = {zone.name: bid2x_var.PLAN_DEFAULT_LINE_ITEMS
+            for zone in zone_array}
+  journal_path = getattr(app.platform_object, 'journal_path', None)
+  if not journal_path:
+    return counts
+
+  # pylint: disable-next=g-import-not-at-top
+  from bid2x_shard import journal_line_items
+
+  journal = bid2x_journal.open_journal(journal_path)
+  try:
+    for zone in zone_array:
+      count = journal_line_items(journal, str(app.sheet.sheet_id), zone.name)
+      if count is not None:
+        counts[zone.name] = count
+  finally:
+    journal.close()
+
+  return counts
+
+
+def plan_sheet_read(plan: Plan, step: str, zone: Any, rows: int) -> None:
+  """Plans opening a zone's tab and reading all of it."""
+  plan.add(SHEETS, 'spreadsheets.get', READ, step, zone.name)
+  plan.add(
+      SHEETS, 'spreadsheets.values.get', READ, step, zone.name,
+      payload_bytes=rows * bid2x_var.PLAN_SHEET_ROW_BYTES,
+  )
+
+
+def plan_sheet_write(
+    plan: Plan, step: str, zone: Any, payload_bytes: int
+) -> None:
+  """Plans opening a tab and writing one range of it."""
+  plan.add(SHEETS, 'spreadsheets.get', READ, step, zone.name)
+  plan.add(
+      SHEETS, 'spreadsheets.values.update', WRITE, step, zone.name,
+      payload_bytes=payload_bytes,
+  )
+
+
+def plan_dv_stage(
+    plan: Plan, dv: Any, stage_name: str, zone: Any, line_items: int
+) -> None:
+  """Plans the calls of one DV360 pipeline stage for a zone."""
+  script_bytes = line_items * bid2x_var.PLAN_SCRIPT_BYTES_PER_LINE_ITEM
+  if stage_name == 'fetch_sheet':
+    plan_sheet_read(plan, stage_name, zone, line_items)
+  elif stage_name == 'fetch_live_script':
+    plan.add(DV360, 'customBiddingAlgorithms.scripts.list', READ,
+             stage_name, zone.name)
+    plan.add(DV360, 'customBiddingAlgorithms.scripts.get', READ,
+             stage_name, zone.name)
+    plan.add(DV360, 'media.download', READ, stage_name, zone.name,
+             payload_bytes=script_bytes)
+  elif stage_name == 'upload':
+    plan.add(DV360, 'customBiddingAlgorithms.uploadScript', WRITE,
+             stage_name, zone.name)
+    plan.add(DV360, 'media.upload', WRITE, stage_name, zone.name,
+             payload_bytes=script_bytes)
+    plan.add(DV360, 'customBiddingAlgorithms.scripts.create', WRITE,
+             stage_name, zone.name)
+  elif stage_name == 'bind_line_items':
+    # The body lists every line item ID.
+    plan.add(DV360, 'advertisers.lineItems.bulkUpdate', WRITE, stage_name,
+             zone.name, payload_bytes=line_items * 20)
+  elif stage_name in ('report', 'report_test'):
+    plan_sheet_write(plan, stage_name, zone, script_bytes)
+  elif stage_name == 'refresh_sheet':
+    # clear_sheet, then list the line items and rewrite the tab.
+    plan.add(SHEETS, 'spreadsheets.get', READ, stage_name, zone.name)
+    plan.add(SHEETS, 'spreadsheets.values.batchClear', WRITE, stage_name,
+             zone.name)
+    if dv.sheet.clear_onoff:
+      plan.add(
+          SHEETS, 'spreadsheets.values.update', WRITE, stage_name, zone.name,
+          payload_bytes=bid2x_var.SPREADSHEET_LAST_DATA_ROW * 10,
+      )
+    plan.add(
+        DV360, 'advertisers.lineItems.list', READ, stage_name, zone.name,
+        pages=max(1, math.ceil(line_items / bid2x_var.LARGE_PAGE_SIZE)),
+        payload_bytes=line_items * bid2x_var.PLAN_LINE_ITEM_BYTES,
+    )
+    plan_sheet_write(
+        plan, stage_name, zone, line_items * bid2x_var.PLAN_SHEET_ROW_BYTES
+    )
+    if not dv.defer_pattern:
+      plan.add(SHEETS, 'spreadsheets.values.update', WRITE, stage_name,
+               zone.name, payload_bytes=line_items * 10)
+
+
+def plan_dv(plan: Plan, app: Any, zone_array: list[Any]) -> None:
+  """Plans the actions of a DV360 config, mirroring process_script."""
+  # pylint: disable-next=g-import-not-at-top
+  import bid2x_pipeline
+
+  dv = app.platform_object
+  plan.set_max_workers(dv.dv_max_workers)
+
+  if dv.action_list_scripts:
+    for zone in zone_array:
+      plan.add(DV360, 'customBiddingAlgorithms.scripts.list', READ,
+               'list_scripts', zone.name)
+  if dv.action_list_algos:
+    plan.add(DV360, 'customBiddingAlgorithms.list', READ, 'list_algos')
+  if dv.action_create_algorithm:
+    for zone in zone_array:
+      plan.add(DV360, 'customBiddingAlgorithms.create', WRITE,
+               'create_algorithm', zone.name)
+  if dv.action_remove_algorithm:
+    plan.add(DV360, 'customBiddingAlgorithms.patch', WRITE,
+             'remove_algorithm')
+
+  stages = bid2x_pipeline.stages_for_actions(
+      update_scripts=dv.action_update_scripts,
+      test=dv.action_test,
+      update_spreadsheet=dv.action_update_spreadsheet,
+  )
+  if stages:
+    # The spreadsheet is opened once per process.
+    plan.add(SHEETS, 'spreadsheets.get', READ, 'open_spreadsheet')
+  for zone in zone_array:
+    for stage in stages:
+      plan_dv_stage(
+          plan, dv, stage.name, zone, plan.zone_line_items[zone.name]
+      )
+
+
+def plan_gtm(plan: Plan, app: Any, zone_array: list[Any]) -> None:
+  """Plans the actions of a GTM config, mirroring process_script."""
+  # pylint: disable-next=g-import-not-at-top
+  from bid2x_gtm import gtm_container_key
+  # pylint: disable-next=g-import-not-at-top
+  from bid2x_gtm import gtm_workspace_paths
+  # pylint: disable-next=g-import-not-at-top
+  from bid2x_gtm import gtm_workspace_state_key
+
+  gtm = app.platform_object
+  publish = gtm.action_update_scripts
+  if not publish and not gtm.action_test:
+    return
+
+  containers = {}
+  for zone in zone_array:
+    containers.setdefault(gtm_container_key(zone), []).append(zone)
+  plan.set_max_workers(gtm.gtm_max_workers)
+
+  live = gtm.gtm_change_detection == bid2x_var.GTMChangeDetection.LIVE.value
+  persistent = (
+      gtm.gtm_workspace_mode == bid2x_var.GTMWorkspaceMode.PERSISTENT.value
+  )
+  recorded = gtm_workspace_paths(gtm.read_gtm_state()) if persistent else {}
+  plan.add(SHEETS, 'spreadsheets.get', READ, 'open_spreadsheet')
+  for container_key, container_zones in containers.items():
+    # A container's zones are processed one after the other; its calls
+    # are charged to its first zone.
+    owner = container_zones[0]
+    plan.group_zones([zone.name for zone in container_zones])
+    if publish and live:
+      plan.add(GTM, 'accounts.containers.versions.live', READ,
+               'change_detection', owner.name,
+               payload_bytes=bid2x_var.PLAN_GTM_CONTAINER_BYTES)
+
+    for zone in container_zones:
+      rows = plan.zone_line_items[zone.name]
+      plan_sheet_read(plan, 'read_sheets_data', zone, rows)
+      plan_sheet_write(
+          plan, 'update_status_tab', zone,
+          rows * bid2x_var.PLAN_SCRIPT_BYTES_PER_LINE_ITEM,
+      )
+
+    if not publish:
+      continue
+
+    # Zones are published one by one or once per container.
+    batches = (
+        [container_zones] if gtm.gtm_batch_by_container
+        else [[zone] for zone in container_zones]
+    )
+    # In 'persistent' mode the workspace GTM makes on publishing is reused,
+    # as is the one recorded when the container was last published.
+    reused = gtm_workspace_state_key(*container_key) in recorded
+    for batch in batches:
+      plan_gtm_publish(plan, gtm, owner, batch, persistent and reused)
+      reused = True
+
+
+def plan_gtm_publish(
+    plan: Plan, gtm: Any, owner: Any, batch: list[Any], reused: bool = False
+) -> None:
+  """Plans obtaining a workspace, updating variables and publishing.
+
+  Args:
+    plan: the plan to add the calls to.
+    gtm: the Bid2xGTM object.
+    owner: the zone the calls are charged to.
+    batch: the zones published together.
+    reused: whether a workspace recorded in 'persistent' mode is reused.
+  """
+  persistent = (
+      gtm.gtm_workspace_mode == bid2x_var.GTMWorkspaceMode.PERSISTENT.value
+  )
+  step = 'publish'
+  if gtm.gtm_delete_stale_workspaces or (persistent and not reused):
+    plan.add(GTM, 'accounts.containers.workspaces.list', READ, step,
+             owner.name)
+  if gtm.gtm_delete_stale_workspaces:
+    plan.add(GTM, 'batch (workspaces.delete)', WRITE, step, owner.name)
+  if not persistent:
+    plan.add(GTM, 'accounts.containers.workspaces.create', WRITE, step,
+             owner.name)
+  elif not reused:
+    plan.add(GTM, 'accounts.containers.workspaces.sync', WRITE, step,
+             owner.name)
+
+  for zone in batch:
+    script_bytes = (
+        plan.zone_line_items[zone.name]
+        * bid2x_var.PLAN_SCRIPT_BYTES_PER_LINE_ITEM
+    )
+    plan.add(GTM, 'accounts.containers.workspaces.variables.get', READ,
+             step, owner.name, payload_bytes=script_bytes)
+    plan.add(GTM, 'accounts.containers.workspaces.variables.update', WRITE,
+             step, owner.name, payload_bytes=2 * script_bytes)
+
+  plan.add(GTM, 'accounts.containers.workspaces.create_version', WRITE,
+           step, owner.name)
+  plan.add(GTM, 'accounts.containers.versions.publish', WRITE, step,
+           owner.name)
+
+
+def plan_app(
+    app: Any,
+    title: str = '',
+    profile: dict[str, float] | None = None,
+    zone_array: list[Any] | None = None,
+) -> Plan:
+  """Plans the calls a run of an app would make.
+
+  Args:
+    app: the Bid2xApplication, as built by create_objects_from_json_file.
+    title: what is being planned, e.g. the config file.
+    profile: seconds per call, see load_latency_profile.
+    zone_array: the zones to plan for, the app's zones by default.
+
+  Returns:
+    The plan.
+  """
+  if zone_array is None:
+    zone_array = app.zone_array
+
+  plan = Plan(
+      f'{title or "config"} ({app.platform_type}, {len(zone_array)} zones)',
+      profile,
+  )
+  plan.zone_line_items = zone_line_items(app, zone_array)
+
+  if app.platform_type == bid2x_var.PlatformType.DV.value:
+    plan_dv(plan, app, zone_array)
+  elif app.platform_type == bid2x_var.PlatformType.GTM.value:
+    plan_gtm(plan, app, zone_array)
+
+  return plan
+
+
+def write_plan_json(plan: Plan, path: str) -> None:
+  """Writes a plan as JSON."""
+  with open(path, 'w') as f:
+    json.dump(plan.as_dict(), f, indent=2)
+
+
+def run_plan(app: Any, title: str = '') -> int:
+  """Prints (and optionally writes) the plan of a run of an app.
+
+  Args:
+    app: the Bid2xApplication, as built by create_objects_from_json_file.
+    title: what is being planned, e.g. the config file.
+
+  Returns:
+    0 if the plan was made, -1 if the app is not valid.
+  """
+  if not app:
+    print('App object not valid - nothing to plan.')
+    return -1
+
+  zone_array = app.zone_array
+  if bid2x_var.TASK_COUNT > 1:
+    # pylint: disable-next=g-import-not-at-top
+    import bid2x_shard
+    zone_array = bid2x_shard.shard_app_zones(
+        app, bid2x_var.TASK_INDEX, bid2x_var.TASK_COUNT
+    )
+    title = f'{title} task {bid2x_var.TASK_INDEX} of {bid2x_var.TASK_COUNT}'
+
+  plan = plan_app(
+      app, title, load_latency_profile(bid2x_var.PLAN_LATENCY_PROFILE),
+      zone_array,
+  )
+  plan.print_plan()
+  if bid2x_var.PLAN_JSON_FILE:
+    write_plan_json(plan, bid2x_var.PLAN_JSON_FILE)
+
+  return 0
@@ -23,11 +23,12 @@
 """
 
 import abc
-from typing import Any
+from typing import Any, TYPE_CHECKING
 
-import pandas
-
-DataFrame = pandas.DataFrame
+# pandas is only needed for annotations here; the platform modules import it
+# when they run.
+if TYPE_CHECKING:
+  from pandas import DataFrame
 abstractmethod = abc.abstractmethod
 ABC = abc.ABC
 
@@ -56,7 +57,7 @@ class Platform(ABC):
   def top_level_copy(self, source: Any) -> None:
     pass
 
-  def print_dataframe(self, debug: bool, input_df: DataFrame) -> None:
+  def print_dataframe(self, debug: bool, input_df: 'DataFrame') -> None:
     """Converts a dataframe to a string and prints it to stdout.
 
     Args:
@@ -0,0 +1,457 @@
+"""BidToX - Run profiler.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  With --profile (or BID2X_PROFILE) set, main() runs the configured
+  actions under a profiler and writes two files per run to --profile_dir:
+
+    bid2x-<time>-<pid>-<n>.pstats     Function statistics readable with
+                                      pstats or snakeviz.
+    bid2x-<time>-<pid>-<n>.collapsed  Sampled stacks in the collapsed
+                                      format of flamegraph.pl and
+                                      speedscope, one line per distinct
+                                      stack: frames from the thread down,
+                                      separated by ';', then the number of
+                                      samples.
+
+  <n> numbers the profiled runs of the process, so that runs started in the
+  same second, e.g. by a warm Cloud Function instance, don't overwrite each
+  other's files.
+
+  'cprofile' traces every call of every thread the run starts with
+  cProfile for exact call counts, at the cost of slowing Python code down
+  severalfold.  'sampling' only looks at every thread's stack every
+  PROFILE_SAMPLE_INTERVAL seconds, so it barely slows the run, and derives
+  the pstats file from the samples.  The collapsed stacks are sampled in
+  both modes; as they are sampled by wall clock time they show where
+  threads wait on the network as well as where they compute.
+
+  Memory allocations are traced with tracemalloc while profiling, and the
+  peak memory allocated while each zone was processed is reported.  Zones
+  processed in parallel share the process's memory, so then a zone's peak
+  is an upper bound that includes the other zones' allocations.
+
+  At the end of the run a report prints the time spent by library (from
+  the samples), the functions with the most cumulative time and the peak
+  memory of each zone.  Profiling is off by default and then costs
+  nothing.
+
+  Example usage:
+      python main.py -i dv_config.json --profile sampling --profile_dir /tmp
+      python -m pstats /tmp/bid2x-20250101-120000-42.pstats
+      flamegraph.pl /tmp/bid2x-20250101-120000-42.collapsed > run.svg
+"""
+
+import collections
+import contextlib
+import cProfile
+import datetime
+import itertools
+import marshal
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Iterator
+
+import bid2x_var
+
+CPROFILE = 'cprofile'
+SAMPLING = 'sampling'
+MODES = (CPROFILE, SAMPLING)
+
+# The number of functions listed in the report.
+REPORT_FUNCTIONS = 15
+
+# Numbers the profiled runs of this process, in the names of their files.
+_run_numbers = itertools.count(1)
+
+# What the leaf frame of a sample was doing, by the path of its code.  The
+# first pattern matching the file name names the sample's library.
+LIBRARY_PATTERNS = (
+    ('network', re.compile(
+        r'[/\\](ssl|socket|selectors|http[/\\]client)\.py$'
+        r'|[/\\](httplib2|urllib3|requests)[/\\]'
+    )),
+    ('waiting for threads', re.compile(
+        r'[/\\](threading|queue)\.py$|[/\\]concurrent[/\\]'
+    )),
+    ('gspread', re.compile(r'[/\\]gspread[/\\]')),
+    ('pandas', re.compile(r'[/\\](pandas|numpy)[/\\]')),
+    ('json', re.compile(r'[/\\]json[/\\]')),
+    ('google api client', re.compile(
+        r'[/\\](googleapiclient|google[/\\]auth|google_auth_httplib2)'
+    )),
+    ('bid2x', re.compile(
+        re.escape(os.path.dirname(os.path.abspath(__file__)))
+    )),
+)
+
+# Thread names differing only by a trailing worker number, e.g.
+# 'ThreadPoolExecutor-0_3', are merged in the collapsed stacks.
+THREAD_NUMBER_PATTERN = re.compile(r'_\d+$')
+
+# A pstats function key: (file name, first line, function name).
+FunctionKey = tuple[str, int, str]
+
+
+def function_key(code: Any) -> FunctionKey:
+  """Returns the pstats key of a code object."""
+  return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+def frame_label(key: FunctionKey) -> str:
+  """Returns a function's name in the collapsed stacks."""
+  filename, line, name = key
+  return f'{name} ({os.path.basename(filename)}:{line})'
+
+
+def library(filename: str) -> str:
+  """Returns the library a file belongs to, see LIBRARY_PATTERNS."""
+  for name, pattern in LIBRARY_PATTERNS:
+    if pattern.search(filename):
+      return name
+
+  return 'other'
+
+
+class Sampler:
+  """Samples the stacks of every thread but its own at an interval.
+
+  Attributes:
+    interval: the seconds between samples.
+    stacks: the number of samples of each stack, keyed by the thread name
+      and the function keys from the thread's first frame to its last.
+    samples: the number of times the threads were sampled.
+    seconds: the seconds sampled for.
+  """
+
+  interval: float
+  stacks: collections.Counter
+  samples: int
+  seconds: float
+
+  def __init__(self, interval: float):
+    self.interval = interval
+    self.stacks = collections.Counter()
+    self.samples = 0
+    self.seconds = 0.0
+    self._stop = threading.Event()
+    self._thread = None
+
+  def start(self) -> None:
+    """Starts sampling in a daemon thread."""
+    self._thread = threading.Thread(
+        target=self._run, name='bid2x-profile-sampler', daemon=True
+    )
+    self._thread.start()
+
+  def stop(self) -> None:
+    """Stops sampling and waits for the last sample."""
+    self._stop.set()
+    if self._thread is not None:
+      self._thread.join()
+
+  def sample_seconds(self) -> float:
+    """Returns the seconds each sample stands for.
+
+    Taking a sample takes time too, so samples are further apart than the
+    interval.
+    """
+    return self.seconds / self.samples if self.samples else self.interval
+
+  def _run(self) -> None:
+    own = threading.get_ident()
+    start = time.perf_counter()
+    while not self._stop.wait(self.interval):
+      names = {thread.ident: thread.name for thread in threading.enumerate()}
+      # pylint: disable-next=protected-access
+      for ident, frame in sys._current_frames().items():
+        if ident == own:
+          continue
+        stack = []
+        while frame is not None:
+          stack.append(function_key(frame.f_code))
+          frame = frame.f_back
+        stack.reverse()
+        thread = THREAD_NUMBER_PATTERN.sub('', names.get(ident, str(ident)))
+        self.stacks[(thread, tuple(stack))] += 1
+      self.samples += 1
+      self.seconds = time.perf_counter() - start
+
+  def write_collapsed(self, path: str) -> None:
+    """Writes the samples as collapsed stacks."""
+    with open(path, 'w') as f:
+      for (thread, stack), count in sorted(self.stacks.items()):
+        frames = [thread] + [frame_label(key) for key in stack]
+        f.write(f'{";".join(frames)} {count}\n')
+
+  def libraries(self) -> dict[str, float]:
+    """Returns the seconds sampled in each library, by the leaf frame."""
+    seconds = collections.Counter()
+    for (_, stack), count in self.stacks.items():
+      if stack:
+        seconds[library(stack[-1][0])] += count * self.sample_seconds()
+
+    return dict(seconds)
+
+  def stats(self) -> dict[FunctionKey, tuple[Any, ...]]:
+    """Returns the samples as the statistics a pstats file holds.
+
+    Each sample counts as a call of every function on its stack that took
+    the time between samples, so times are estimates and call counts are
+    sample counts.
+
+    Returns:
+      (primitive calls, calls, own seconds, cumulative seconds, callers)
+      by function, with callers the same four figures by calling function.
+    """
+    stats = {}
+    sample_seconds = self.sample_seconds()
+    for (_, stack), count in self.stacks.items():
+      seconds = count * sample_seconds
+      seen = set()
+      for depth, key in enumerate(stack):
+        calls, _, own, cumulative, callers = stats.get(
+            key, (0, 0, 0.0, 0.0, {})
+        )
+        leaf = depth == len(stack) - 1
+        if leaf:
+          own += seconds
+        if key not in seen:
+          seen.add(key)
+          calls += count
+          cumulative += seconds
+        if depth:
+          caller = stack[depth - 1]
+          edge = callers.get(caller, (0, 0, 0.0, 0.0))
+          callers[caller] = (
+              edge[0] + count,
+              edge[1] + count,
+              edge[2] + (seconds if leaf else 0.0),
+              edge[3] + seconds,
+          )
+        stats[key] = (calls, calls, own, cumulative, callers)
+
+    return stats
+
+
+class ZoneMemory:
+  """Tracks the peak memory traced while each zone is processed.
+
+  A zone is being processed from the start of the first of its units of
+  work (e.g. DV360 pipeline stages) to the end of the last, which may
+  overlap.  tracemalloc's peak is reset only when no zone is being
+  processed, as it is shared by the whole process.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._active = collections.Counter()
+    self._start = {}
+    self.peaks = {}
+
+  @contextlib.contextmanager
+  def zone(self, name: str) -> Iterator[None]:
+    """Counts memory allocated by a unit of work of a zone."""
+    with self._lock:
+      if not self._active:
+        tracemalloc.reset_peak()
+      if not self._active[name]:
+        self._start[name] = tracemalloc.get_traced_memory()[0]
+      self._active[name] += 1
+    try:
+      yield
+    finally:
+      with self._lock:
+        peak = tracemalloc.get_traced_memory()[1] - self._start[name]
+        self.peaks[name] = max(self.peaks.get(name, 0), peak)
+        self._active[name] -= 1
+        if not self._active[name]:
+          del self._active[name]
+
+
+class Profiler:
+  """Profiles a run and writes its pstats and collapsed stack files.
+
+  Attributes:
+    mode: 'cprofile' or 'sampling'.
+    directory: where the files are written.
+    prefix: the path of the files without their extension.
+    memory: the peak memory of each zone.
+  """
+
+  mode: str
+  directory: str
+  prefix: str
+  memory: ZoneMemory
+
+  def __init__(self, mode: str, directory: str):
+    if mode not in MODES:
+      raise ValueError(f'Profile mode must be one of {MODES}, not {mode}')
+
+    self.mode = mode
+    self.directory = directory
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    self.prefix = os.path.join(
+        directory, f'bid2x-{stamp}-{os.getpid()}-{next(_run_numbers)}'
+    )
+    self.memory = ZoneMemory()
+    self._sampler = Sampler(bid2x_var.PROFILE_SAMPLE_INTERVAL)
+    self._profiles = []
+    self._profiles_lock = threading.Lock()
+    self._tracing_memory = False
+    self._start = 0.0
+    self._seconds = 0.0
+
+  def _profile_thread(self, *args: Any) -> None:
+    """Starts a cProfile profiler in a thread the run started."""
+    del args  # Unused.
+    profile = cProfile.Profile()
+    with self._profiles_lock:
+      self._profiles.append(profile)
+    profile.enable()  # Replaces this hook for the rest of the thread.
+
+  def start(self) -> None:
+    """Starts profiling this thread and the threads it starts."""
+    self._tracing_memory = not tracemalloc.is_tracing()
+    if self._tracing_memory:
+      tracemalloc.start()
+    # The sampler's thread is started first so that it isn't profiled.
+    self._sampler.start()
+    if self.mode == CPROFILE:
+      if sys.version_info < (3, 12):
+        # cProfile only sees the thread enabling it before Python 3.12.
+        threading.setprofile(self._profile_thread)
+      profile = cProfile.Profile()
+      self._profiles.append(profile)
+      profile.enable()
+    self._start = time.perf_counter()
+
+  def stop(self) -> None:
+    """Stops profiling and writes the files."""
+    self._seconds = time.perf_counter() - self._start
+    if self.mode == CPROFILE:
+      threading.setprofile(None)
+      # Only this thread's profiler can be disabled from here; those of
+      # the run's other threads stopped with them.
+      self._profiles[0].disable()
+    self._sampler.stop()
+    if self._tracing_memory:
+      tracemalloc.stop()
+
+    os.makedirs(self.directory, exist_ok=True)
+    if self.mode == CPROFILE:
+      with self._profiles_lock:
+        profiles = list(self._profiles)
+      for profile in profiles:
+        profile.snapshot_stats()
+      pstats.Stats(*profiles).dump_stats(f'{self.prefix}.pstats')
+    else:
+      with open(f'{self.prefix}.pstats', 'wb') as f:
+        marshal.dump(self._sampler.stats(), f)
+    self._sampler.write_collapsed(f'{self.prefix}.collapsed')
+
+  def report(self) -> None:
+    """Prints where the run's time and memory went."""
+    print(f'Profile ({self.mode}) of {self._seconds:.1f}s run:')
+    sampled = self._sampler.libraries()
+    total = sum(sampled.values())
+    if total:
+      print(f'  {"library":<24} {"thread s":>9} {"share":>6}')
+      for name, seconds in sorted(
+          sampled.items(), key=lambda item: item[1], reverse=True
+      ):
+        print(f'  {name:<24} {seconds:>9.2f} {seconds / total:>6.0%}')
+
+    stats = pstats.Stats(f'{self.prefix}.pstats')
+    functions = sorted(
+        stats.stats.items(), key=lambda item: item[1][3], reverse=True
+    )
+    print(f'  {"function":<60} {"calls":>8} {"own s":>8} {"cum s":>8}')
+    for key, (_, calls, own, cumulative, _) in functions[:REPORT_FUNCTIONS]:
+      print(
+          f'  {frame_label(key)[:60]:<60} {calls:>8} {own:>8.2f} '
+          f'{cumulative:>8.2f}'
+      )
+
+    if self.memory.peaks:
+      print(f'  {"zone":<24} {"peak MiB":>9}')
+      for zone, peak in sorted(self.memory.peaks.items()):
+        print(f'  {zone:<24} {peak / 2**20:>9.1f}')
+    print(f'  Wrote {self.prefix}.pstats and {self.prefix}.collapsed')
+
+
+# The profiler of the run in progress, if any.
+_profiler: Profiler | None = None
+
+
+def mode() -> str | None:
+  """Returns the profile mode set, None if profiling is off."""
+  return bid2x_var.PROFILE or os.getenv(bid2x_var.PROFILE_ENV_VAR) or None
+
+
+@contextlib.contextmanager
+def profiled() -> Iterator[Profiler | None]:
+  """Profiles the work done in the block if a profile mode is set.
+
+  The files are written and the report printed when the block exits,
+  whether or not it raised.
+
+  Yields:
+    The profiler, None if profiling is off.
+  """
+  global _profiler
+
+  profile_mode = mode()
+  if not profile_mode:
+    yield None
+    return
+
+  directory = (
+      bid2x_var.PROFILE_DIR
+      or os.getenv(bid2x_var.PROFILE_DIR_ENV_VAR)
+      or bid2x_var.PROFILE_DEFAULT_DIR
+  )
+  _profiler = Profiler(profile_mode, directory)
+  _profiler.start()
+  try:
+    yield _profiler
+  finally:
+    profiler, _profiler = _profiler, None
+    try:
+      profiler.stop()
+      profiler.report()
+    except OSError as e:
+      print(f'Unable to write the profile to {profiler.prefix}: {e}')
+
+
+@contextlib.contextmanager
+def zone(name: str) -> Iterator[None]:
+  """Counts the memory allocated by a unit of work of a zone if profiling.
+  """
+  profiler = _profiler
+  if profiler is None:
+    yield
+    return
+
+  with profiler.memory.zone(name):
+    yield
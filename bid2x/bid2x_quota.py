@@ -0,0 +1,363 @@
+"""BidToX - API quota ledger.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  Sheets limits the read and write requests a project makes per minute and
+  DV360 the requests per project and the writes per advertiser.  Going over
+  either fails calls with 429s that are then retried after long backoffs.
+
+  The ledger counts every DV360, Sheets and GTM request bid2x makes, by
+  '<api>.<method>' name and scope, in sliding windows matching the limits
+  in bid2x_var.QUOTA_LIMITS.  A scope is 'project', or 'advertiser/<id>'
+  for DV360 requests made for an advertiser.  Every request is counted
+  against the project, so project limits count all of a process's calls
+  even when configs using several projects share it.
+
+  Callers reserve capacity before each request with reserve().  With
+  --quota_wait (or BID2X_QUOTA_WAIT) set a reservation blocks until every
+  limit it counts against has room; otherwise it is recorded straight away
+  and the ledger only reports.  headroom() gives the requests left in the
+  current windows.
+
+  report() prints the peak utilisation of each limit and scope since the
+  last report, and the time spent waiting for capacity.  main() prints one
+  at the end of every run.
+
+  Example usage:
+      bid2x_quota.reserve('dv360.advertisers.lineItems.list', advertiser_id)
+      response = request.execute()
+"""
+
+import collections
+import dataclasses
+import re
+import threading
+import time
+from typing import Any
+
+import bid2x_env
+import bid2x_metrics
+import bid2x_var
+
+READ = 'read'
+WRITE = 'write'
+ALL = 'all'
+
+PROJECT = 'project'
+ADVERTISER = 'advertiser'
+
+# The last part of the method names of requests that only read.
+READ_VERBS = ('get', 'list', 'batchGet', 'download', 'live')
+
+# Where a DV360 request's URI names its advertiser.
+ADVERTISER_PATTERN = re.compile(r'/advertisers/(\d+)|[?&]advertiserId=(\d+)')
+
+QUOTA_PEAK_UTILISATION = bid2x_metrics.REGISTRY.gauge(
+    'bid2x_quota_peak_utilisation_ratio',
+    'Peak share of an API quota used in a window, by limit and scope.',
+    ('limit', 'scope'),
+)
+QUOTA_WAIT_SECONDS = bid2x_metrics.REGISTRY.counter(
+    'bid2x_quota_wait_seconds_total',
+    'Seconds requests waited for quota, by API.',
+    ('api',),
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class QuotaLimit:
+  """A limit on the requests made in a sliding window.
+
+  Attributes:
+    api: the API limited: 'dv360', 'sheets' or 'gtm'.
+    kind: the requests counted: 'read', 'write' or 'all'.
+    scope: what the limit applies to: 'project' or 'advertiser'.
+    requests: the requests allowed per window.
+    seconds: the length of the window.
+  """
+
+  api: str
+  kind: str
+  scope: str
+  requests: int
+  seconds: float
+
+  @property
+  def name(self) -> str:
+    """Returns the limit's name, e.g. 'sheets.write per 60s'."""
+    return f'{self.api}.{self.kind} per {self.seconds:g}s'
+
+  def counts(self, api: str, kind: str) -> bool:
+    """Returns True if a request of an API and kind counts against this."""
+    return self.api == api and self.kind in (ALL, kind)
+
+
+class Window:
+  """The requests counted against a limit and scope in its last window.
+
+  Attributes:
+    limit: the limit counted against.
+    used: the requests in the window.
+    peak: the most requests in any window since the last report.
+  """
+
+  limit: QuotaLimit
+  used: int
+  peak: int
+
+  def __init__(self, limit: QuotaLimit):
+    self.limit = limit
+    self.used = 0
+    self.peak = 0
+    self._requests = collections.deque()
+
+  def expire(self, now: float) -> None:
+    """Drops the requests made before the window."""
+    start = now - self.limit.seconds
+    while self._requests and self._requests[0][0] <= start:
+      self.used -= self._requests.popleft()[1]
+
+  def wait_for(self, cost: int, now: float) -> float:
+    """Returns the seconds until a request of a cost fits, 0 if it does."""
+    if self.used + cost <= self.limit.requests or not self._requests:
+      return 0.0
+
+    # Wait for the oldest requests to leave the window until enough have.
+    freed = 0
+    for made, made_cost in self._requests:
+      freed += made_cost
+      if self.used - freed + cost <= self.limit.requests:
+        return max(0.0, made + self.limit.seconds - now)
+
+    return max(0.0, self._requests[-1][0] + self.limit.seconds - now)
+
+  def add(self, cost: int, now: float) -> None:
+    """Counts a request made now."""
+    self._requests.append((now, cost))
+    self.used += cost
+    self.peak = max(self.peak, self.used)
+
+
+def method_kind(name: str) -> str:
+  """Returns 'read' or 'write' for a '<api>.<method>' name."""
+  return READ if name.rsplit('.', 1)[-1] in READ_VERBS else WRITE
+
+
+def request_advertiser_id(request: Any) -> str | None:
+  """Returns the advertiser a googleapiclient DV360 request is made for."""
+  match = ADVERTISER_PATTERN.search(getattr(request, 'uri', '') or '')
+  if not match:
+    return None
+
+  return match.group(1) or match.group(2)
+
+
+class QuotaLedger:
+  """Counts requests in sliding windows and hands out capacity.
+
+  Attributes:
+    limits: the limits requests are counted against.
+    wait: whether reserve() blocks until a request fits every limit.
+  """
+
+  limits: tuple[QuotaLimit, ...]
+  wait: bool
+
+  def __init__(self, limits: tuple[QuotaLimit, ...], wait: bool):
+    self.limits = limits
+    self.wait = wait
+    self._windows = {}
+    self._calls = collections.Counter()
+    self._waited = collections.Counter()
+    self._lock = threading.Lock()
+
+  def windows(self, name: str, advertiser_id: Any = None) -> list[Window]:
+    """Returns the windows a request counts against, creating them."""
+    api = name.split('.', 1)[0]
+    kind = method_kind(name)
+    windows = []
+    for limit in self.limits:
+      if not limit.counts(api, kind):
+        continue
+      if limit.scope == ADVERTISER:
+        if advertiser_id is None:
+          continue
+        scope = f'{ADVERTISER}/{advertiser_id}'
+      else:
+        scope = PROJECT
+      window = self._windows.get((limit, scope))
+      if window is None:
+        window = self._windows[(limit, scope)] = Window(limit)
+      windows.append(window)
+
+    return windows
+
+  def reserve(
+      self, name: str, advertiser_id: Any = None, cost: int = 1
+  ) -> float:
+    """Records a request about to be made, first waiting for room if set.
+
+    Args:
+      name: the request's '<api>.<method>' name, see
+        bid2x_util.api_call_name.
+      advertiser_id: the DV360 advertiser the request is made for, if any.
+      cost: the number of requests, e.g. of a batch.
+
+    Returns:
+      The seconds waited for capacity.
+    """
+    scope = PROJECT
+    if advertiser_id is not None:
+      scope = f'{ADVERTISER}/{advertiser_id}'
+    waited = 0.0
+    while True:
+      with self._lock:
+        now = time.monotonic()
+        windows = self.windows(name, advertiser_id)
+        delay = 0.0
+        for window in windows:
+          window.expire(now)
+          if self.wait:
+            delay = max(delay, window.wait_for(cost, now))
+        if delay <= 0:
+          for window in windows:
+            window.add(cost, now)
+          self._calls[(name, scope)] += cost
+          if waited:
+            self._waited[name] += waited
+          return waited
+
+      time.sleep(delay)
+      waited += delay
+      QUOTA_WAIT_SECONDS.inc(delay, api=name.split('.', 1)[0])
+
+  def headroom(self, name: str, advertiser_id: Any = None) -> int | None:
+    """Returns the requests of a name that fit in the current windows.
+
+    Args:
+      name: the requests' '<api>.<method>' name.
+      advertiser_id: the DV360 advertiser the requests are made for, if any.
+
+    Returns:
+      The requests left, None if no limit applies to them.
+    """
+    with self._lock:
+      now = time.monotonic()
+      remaining = []
+      for window in self.windows(name, advertiser_id):
+        window.expire(now)
+        remaining.append(window.limit.requests - window.used)
+
+    return max(0, min(remaining)) if remaining else None
+
+  def calls(self) -> dict[tuple[str, str], int]:
+    """Returns the requests counted since the last report.
+
+    Returns:
+      The requests by '<api>.<method>' name and scope.
+    """
+    with self._lock:
+      return dict(self._calls)
+
+  def take_report(
+      self,
+  ) -> tuple[list[tuple[QuotaLimit, str, int]], dict[str, float]]:
+    """Returns the peaks and waits since the last call, then resets them.
+
+    Returns:
+      The (limit, scope, peak requests) of every window used and the
+      seconds waited for capacity by '<api>.<method>' name.
+    """
+    with self._lock:
+      peaks = [
+          (window.limit, scope, window.peak)
+          for (_, scope), window in self._windows.items()
+          if window.peak
+      ]
+      for window in self._windows.values():
+        window.peak = window.used
+      waited = dict(self._waited)
+      self._calls.clear()
+      self._waited.clear()
+
+    return peaks, waited
+
+
+def default_limits() -> tuple[QuotaLimit, ...]:
+  """Returns the limits in bid2x_var.QUOTA_LIMITS."""
+  return tuple(QuotaLimit(*limit) for limit in bid2x_var.QUOTA_LIMITS)
+
+
+# The ledger, created on first use from bid2x_var and the environment.
+_ledger: QuotaLedger | None = None
+_ledger_lock = threading.Lock()
+
+
+def ledger() -> QuotaLedger:
+  """Returns the process wide ledger."""
+  global _ledger
+
+  if _ledger is None:
+    with _ledger_lock:
+      if _ledger is None:
+        wait = bid2x_var.QUOTA_WAIT or bid2x_env.env_flag(
+            bid2x_var.QUOTA_WAIT_ENV_VAR
+        )
+        _ledger = QuotaLedger(default_limits(), wait)
+
+  return _ledger
+
+
+def reserve(name: str, advertiser_id: Any = None, cost: int = 1) -> float:
+  """Reserves capacity for a request in the process wide ledger.
+
+  See QuotaLedger.reserve.
+  """
+  return ledger().reserve(name, advertiser_id, cost)
+
+
+def headroom(name: str, advertiser_id: Any = None) -> int | None:
+  """Returns the requests of a name that fit in the current windows.
+
+  See QuotaLedger.headroom.
+  """
+  return ledger().headroom(name, advertiser_id)
+
+
+def report() -> None:
+  """Prints the peak utilisation of every limit since the last report."""
+  if _ledger is None:
+    return
+
+  peaks, waited = _ledger.take_report()
+  if not peaks:
+    return
+
+  print('Quota peak utilisation:')
+  print(f'  {"limit":<24} {"scope":<24} {"peak":>6} {"limit":>6} {"used":>6}')
+  for limit, scope, peak in sorted(
+      peaks, key=lambda item: item[2] / item[0].requests, reverse=True
+  ):
+    utilisation = peak / limit.requests
+    QUOTA_PEAK_UTILISATION.set(utilisation, limit=limit.name, scope=scope)
+    print(
+        f'  {limit.name:<24} {scope:<24} {peak:>6} {limit.requests:>6} '
+        f'{utilisation:>6.0%}'
+    )
+  for name, seconds in sorted(waited.items()):
+    print(f'  {name} waited {seconds:.1f}s for quota')
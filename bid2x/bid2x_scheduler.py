@@ -0,0 +1,213 @@
+"""BidToX - Deadline-aware zone scheduler.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  Cloud Functions and Cloud Run jobs are killed when they reach their
+  timeout.  A DV360 run killed between uploading a zone's script and
+  assigning it to the zone's line items leaves the zone half updated.
+
+  Given a time budget the scheduler only lets the pipeline (see
+  bid2x_pipeline) start a zone whose estimated cost fits in the time left.
+  A zone once started runs all its stages; a zone that doesn't fit is
+  deferred whole.  Later, cheaper zones may still be started.
+
+  A zone's cost is the sum of the seconds its stages took when last
+  recorded in the run journal (see bid2x_journal).  A stage with no
+  recorded timing is expected to take the median of the other zones'
+  timings of that stage, or SCHEDULER_DEFAULT_STAGE_SECONDS.  Stages
+  already completed by the current run's earlier attempt are resumed from
+  the journal and cost nothing.
+
+  Zones are started in their configured order, which is their priority,
+  or with zone_order 'stalest' the zones least recently brought up to date
+  first, zones never completed before all others.  Deferred zones are
+  recorded in the journal as a 'deferred' entry and listed at the end of
+  the run.
+"""
+
+import statistics
+import time
+from typing import Any, Callable
+
+import bid2x_journal
+import bid2x_var
+
+# The journal stage name deferred zones are recorded under.
+DEFERRED_STAGE = 'deferred'
+
+
+class ZoneScheduler:
+  """Decides which zones a time limited run starts.
+
+  Attributes:
+    time_budget: the seconds the zones' work may take, None for no limit.
+    journal: the run journal holding the zones' past timings, if any.
+    scope: the journal scope of the zones.
+    stage_names: the names of the stages run for each zone.
+    zone_order: a bid2x_var.ZoneOrder value.
+    deferred: the names of the zones deferred, in order.
+  """
+
+  time_budget: float | None
+  journal: bid2x_journal.RunJournal | None
+  scope: str
+  stage_names: list[str]
+  zone_order: str
+  deferred: list[str]
+
+  def __init__(
+      self,
+      time_budget: float | None,
+      journal: bid2x_journal.RunJournal | None,
+      scope: str,
+      stage_names: list[str],
+      zone_order: str = bid2x_var.ZoneOrder.CONFIGURED.value,
+      start: float | None = None,
+      clock: Callable[[], float] = time.monotonic,
+  ) -> None:
+    """Starts the clock on the time budget.
+
+    Args:
+      time_budget: the seconds the zones' work may take, None for no limit.
+      journal: the run journal holding the zones' past timings, if any.
+      scope: the journal scope of the zones.
+      stage_names: the names of the stages run for each zone.
+      zone_order: a bid2x_var.ZoneOrder value.
+      start: when the budget started, as returned by clock.  Defaults to
+        now.
+      clock: returns the current time in seconds.
+    """
+    self.time_budget = time_budget
+    self.journal = journal
+    self.scope = scope
+    self.stage_names = list(stage_names)
+    self.zone_order = zone_order
+    self.deferred = []
+    self._clock = clock
+    self._start = clock() if start is None else start
+    self._entries = {}
+
+  def journal_entries(
+      self, zone_name: str
+  ) -> dict[str, bid2x_journal.JournalEntry]:
+    """Returns a zone's journal entries, read once per zone."""
+    if zone_name not in self._entries:
+      self._entries[zone_name] = (
+          self.journal.completed(self.scope, zone_name)
+          if self.journal is not None else {}
+      )
+
+    return self._entries[zone_name]
+
+  def last_completed(self, zone_name: str) -> float | None:
+    """Returns when a zone last completed a stage, None if it never has."""
+    times = [
+        entry.completed_at
+        for stage, entry in self.journal_entries(zone_name).items()
+        if stage != DEFERRED_STAGE
+    ]
+    return max(times) if times else None
+
+  def order_zones(self, zone_array: list[Any]) -> list[Any]:
+    """Returns the zones in the order they should be started.
+
+    Args:
+      zone_array: the Bid2xModel objects of the zones, in configured order.
+
+    Returns:
+      The zones reordered according to zone_order.
+    """
+    # Read every zone's timings up front for typical_seconds.
+    for zone in zone_array:
+      self.journal_entries(zone.name)
+
+    if self.zone_order != bid2x_var.ZoneOrder.STALEST.value:
+      return list(zone_array)
+
+    def staleness(zone: Any) -> tuple[bool, float]:
+      last = self.last_completed(zone.name)
+      return (last is not None, last or 0.0)
+
+    # sorted is stable, so ties keep their configured order.
+    return sorted(zone_array, key=staleness)
+
+  def estimate(self, zone_name: str) -> float:
+    """Returns the estimated seconds of a zone's remaining stages."""
+    current_run = bid2x_journal.run_id()
+    entries = self.journal_entries(zone_name)
+    seconds = 0.0
+    for stage in self.stage_names:
+      entry = entries.get(stage)
+      if entry is None:
+        seconds += self.typical_seconds(stage)
+      elif current_run is None or entry.run_id != current_run:
+        seconds += entry.seconds
+
+    return seconds
+
+  def typical_seconds(self, stage: str) -> float:
+    """Returns the median timing of a stage across the zones ordered."""
+    timings = [
+        entries[stage].seconds
+        for entries in self._entries.values() if stage in entries
+    ]
+    if not timings:
+      return bid2x_var.SCHEDULER_DEFAULT_STAGE_SECONDS
+
+    return statistics.median(timings)
+
+  def remaining(self) -> float | None:
+    """Returns the seconds left in the budget, None for no limit."""
+    if self.time_budget is None:
+      return None
+
+    return self.time_budget - (self._clock() - self._start)
+
+  def can_start(self, zone: Any) -> bool:
+    """Returns True if a zone is expected to finish within the budget."""
+    remaining = self.remaining()
+    return remaining is None or self.estimate(zone.name) <= remaining
+
+  def defer(self, zone: Any) -> None:
+    """Records that a zone was not started for lack of time."""
+    remaining = self.remaining()
+    estimate = self.estimate(zone.name)
+    print(
+        f'Deferring zone {zone.name}: estimated {estimate:.1f}s, '
+        f'{max(remaining or 0.0, 0.0):.1f}s of the time budget left.'
+    )
+    self.deferred.append(zone.name)
+    if self.journal is None:
+      return
+
+    entry = bid2x_journal.JournalEntry(
+        DEFERRED_STAGE, None, time.time(), estimate, 0,
+        bid2x_journal.run_id(),
+    )
+    try:
+      self.journal.record(self.scope, zone.name, entry)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+      print(f'Unable to record deferral of zone {zone.name}: {e}')
+
+  def report(self) -> None:
+    """Prints the zones deferred to a later run, if any."""
+    if self.deferred:
+      print(
+          f'{len(self.deferred)} zone(s) deferred to a later run: '
+          f'{", ".join(self.deferred)}'
+      )
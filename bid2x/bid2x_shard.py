@@ -0,0 +1,198 @@
+"""BidToX - Split zones across the tasks of a Cloud Run job.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  A Cloud Run job started with several tasks runs main.py once per task,
+  each with its own CLOUD_RUN_TASK_INDEX (or --task_index).  Every task
+  computes the same split of the config's zones and processes only its
+  share.
+
+  Zones are weighted by their expected work: the line item count recorded
+  in the run journal by earlier runs plus a fixed cost per zone.  Zones
+  with no history get the median weight of the others.  The heaviest zones
+  are placed first, each on the least loaded task (longest processing time
+  first), ties broken by name so the split is the same in every task.
+  Tasks start at different times and other tasks (or an earlier attempt
+  of the same task) may already have replaced a zone's entries, so for
+  entries of the current run the count they replaced is used instead.
+
+  Zones sharing a spreadsheet tab (DV360) or a GTM container are kept in one
+  task, so no two tasks write the same tab or publish the same container.
+  Every zone writes its status to its own cells of the status tab.
+"""
+
+import heapq
+import statistics
+from typing import Any, Callable, Hashable
+
+import bid2x_journal
+import bid2x_var
+
+
+def assign_groups(
+    weights: dict[Hashable, float], task_count: int
+) -> list[list[Hashable]]:
+  """Splits weighted groups across tasks, heaviest first.
+
+  Args:
+    weights: the expected work of each group.
+    task_count: the number of tasks.
+
+  Returns:
+    The groups assigned to each task, one list per task.
+  """
+  tasks = [[] for _ in range(max(1, task_count))]
+  # Heap of (load, task index); the index breaks ties deterministically.
+  loads = [(0.0, index) for index in range(len(tasks))]
+
+  for group in sorted(weights, key=lambda group: (-weights[group], str(group))):
+    load, index = heapq.heappop(loads)
+    tasks[index].append(group)
+    heapq.heappush(loads, (load + weights[group], index))
+
+  return tasks
+
+
+def journal_line_items(
+    journal: bid2x_journal.RunJournal | None, scope: str, zone_name: str
+) -> int | None:
+  """Returns a zone's line item count recorded by earlier runs, if any."""
+  if journal is None:
+    return None
+
+  current_run = bid2x_journal.run_id()
+  counts = []
+  for entry in journal.completed(scope, zone_name).values():
+    if current_run is not None and entry.run_id == current_run:
+      counts.append(entry.previous_line_items)
+    else:
+      counts.append(entry.line_items)
+  counts = [count for count in counts if count]
+  return max(counts) if counts else None
+
+
+def zone_weights(
+    zone_array: list[Any],
+    journal: bid2x_journal.RunJournal | None = None,
+    scope: str = '',
+) -> dict[str, float]:
+  """Returns the expected work of each zone, keyed by zone name.
+
+  Args:
+    zone_array: the zones to weigh.
+    journal: optional run journal holding earlier runs' line item counts.
+    scope: the journal scope of the zones.
+
+  Returns:
+    A dict of zone name to weight.
+  """
+  line_items = {
+      zone.name: journal_line_items(journal, scope, zone.name)
+      for zone in zone_array
+  }
+  known = [count for count in line_items.values() if count is not None]
+  default = statistics.median(known) if known else 0
+
+  return {
+      name: bid2x_var.SHARD_ZONE_WEIGHT + (
+          default if count is None else count
+      )
+      for name, count in line_items.items()
+  }
+
+
+def zones_for_task(
+    zone_array: list[Any],
+    task_index: int,
+    task_count: int,
+    weights: dict[str, float] | None = None,
+    group_key: Callable[[Any], Hashable] | None = None,
+) -> list[Any]:
+  """Returns the zones a task processes.
+
+  Args:
+    zone_array: every zone of the config.
+    task_index: the index of this task, from 0.
+    task_count: the number of tasks.
+    weights: optional expected work per zone name, 1 each if missing.
+    group_key: optional function returning the group a zone belongs to;
+        groups are never split.  Defaults to the zone's name.
+
+  Returns:
+    This task's zones, in their configured order.
+  """
+  if task_count <= 1:
+    return list(zone_array)
+
+  if not 0 <= task_index < task_count:
+    raise ValueError(
+        f'Task index {task_index} is outside the {task_count} tasks'
+    )
+
+  if group_key is None:
+    group_key = lambda zone: zone.name
+  if weights is None:
+    weights = {}
+
+  group_weights = {}
+  for zone in zone_array:
+    group = group_key(zone)
+    group_weights[group] = (
+        group_weights.get(group, 0) + weights.get(zone.name, 1)
+    )
+
+  task_groups = set(assign_groups(group_weights, task_count)[task_index])
+  return [zone for zone in zone_array if group_key(zone) in task_groups]
+
+
+def shard_app_zones(
+    app: Any, task_index: int, task_count: int
+) -> list[Any]:
+  """Returns the share of an app's zones a task processes.
+
+  Args:
+    app: the Bid2xApplication being run.
+    task_index: the index of this task, from 0.
+    task_count: the number of tasks.
+
+  Returns:
+    This task's zones, in their configured order.
+  """
+  if task_count <= 1:
+    return list(app.zone_array)
+
+  if app.platform_type == bid2x_var.PlatformType.GTM.value:
+    # pylint: disable-next=g-import-not-at-top
+    from bid2x_gtm import gtm_container_key
+
+    # A container is published once for all its zones when batching.
+    return zones_for_task(
+        app.zone_array, task_index, task_count, group_key=gtm_container_key
+    )
+
+  journal = None
+  journal_path = getattr(app.platform_object, 'journal_path', None)
+  if journal_path:
+    journal = bid2x_journal.open_journal(journal_path)
+  try:
+    weights = zone_weights(app.zone_array, journal, str(app.sheet.sheet_id))
+  finally:
+    if journal is not None:
+      journal.close()
+
+  return zones_for_task(app.zone_array, task_index, task_count, weights)
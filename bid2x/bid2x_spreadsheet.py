@@ -25,10 +25,21 @@
 """
 
 import datetime
+import os
+import threading
 import time
 from typing import Any, List
 
+from auth import bid2x_credentials
+from bid2x_line_items import LineItemTable
+from bid2x_line_items import NAME_INDEX
+from bid2x_line_items import TYPE_INDEX
+import bid2x_metrics
+import bid2x_quota
+import bid2x_trace
 from bid2x_util import is_recoverable_http_error
+from bid2x_util import partial_response_fields
+from bid2x_util import streaming_list_postproc
 import bid2x_var
 from google.api_core import exceptions
 from googleapiclient import errors
@@ -37,6 +48,26 @@ import gspread
 HttpError = errors.HttpError
 GoogleAPICallError = exceptions.GoogleAPICallError
 
+# Spreadsheet handles shared by every Bid2xSpreadsheet in the process, keyed
+# by (key file, spreadsheet id), so configs using the same spreadsheet only
+# open it once.
+_spreadsheets: dict[tuple[str, str], gspread.Spreadsheet] = {}
+_spreadsheets_lock = threading.Lock()
+# Serialises building Bid2xSpreadsheet.gc on first use.
+_gc_lock = threading.Lock()
+
+# Line item types never listed in a zone's tab.
+YOUTUBE_LINE_ITEM_TYPES = (
+    'LINE_ITEM_TYPE_YOUTUBE_AND_PARTNERS_NON_SKIPPABLE',
+    'LINE_ITEM_TYPE_YOUTUBE_AND_PARTNERS_REACH',
+    'LINE_ITEM_TYPE_YOUTUBE_AND_PARTNERS_ACTION',
+)
+
+
+def line_item_row(line_item: dict[str, Any]) -> List[Any]:
+  """Returns a DV360 line item's row in a zone's tab."""
+  return [line_item.get(field) for field in bid2x_var.LINE_ITEM_FIELDS]
+
 
 class Bid2xSpreadsheet:
   """Spreadsheet class for the bid2x application.
@@ -57,11 +88,18 @@ class Bid2xSpreadsheet:
       debug: The debug flag.
       trace: The trace flag.
       clear_onoff: The clear on/off flag.
-      gc: The gspread object.
+      gc: The gspread object, built from json_auth_file on first use so
+          that objects never calling the Sheets API (e.g. for --plan) need
+          no credentials.
       COLUMN_OFFSET: The column offset.
       MAX_RETRIES: The maximum number of retries.
 
   Methods:
+      open_spreadsheet(self, spreadsheet_id): Returns a gspread handle to
+      the spreadsheet, shared process wide so each sheet is opened once.
+      open_worksheet(self, tab_name, spreadsheet_id): Returns a gspread
+      handle to a tab of the spreadsheet.
+      reserve_quota(self, method): Reserves Sheets quota for a request.
       read_dv_line_items(self, service, line_item_name_pattern,
       zone_array, defer_pattern): Reads DV360 line items and
       populates the associated spreadsheet's tabs with information
@@ -70,6 +108,10 @@ class Bid2xSpreadsheet:
       the data from a single tab within the linked spreadsheet and
       returns all rows where the spreadsheet is marked 'Yes' to
       generate the custom bidding script for that Line Item.
+      read_zone_records(self, zone_string): Reads every row of a
+      single tab within the linked spreadsheet.
+      affected_line_items_from_records(list_of_dicts): Returns the
+      line items of the rows marked 'Yes'.
       get_line_item_data_from_sheet(self, zone_string): Gets the
       data from a single tab within the linked spreadsheet and
       returns all rows where the spreadsheet is marked 'Yes' to
@@ -96,7 +138,7 @@ class Bid2xSpreadsheet:
   debug: bool
   trace: bool
   clear_onoff: bool
-  gc: gspread
+  _gc: gspread.Client | None
   COLUMN_OFFSET = 64  # Add to column # to get actual column letter.
   MAX_RETRIES = 5  # Number of retries when API calls fail.
 
@@ -116,7 +158,22 @@ class Bid2xSpreadsheet:
     self.debug = False
     self.trace = False
     self.clear_onoff = True
-    self.gc = gspread.service_account(filename=auth_filename)
+    self._gc = None
+
+  @property
+  def gc(self) -> gspread.Client:
+    """The gspread client, built from json_auth_file on first use."""
+    with _gc_lock:
+      if self._gc is None:
+        self._gc = bid2x_credentials.get_credential_manager(
+            self.json_auth_file
+        ).gspread_client(gspread.auth.DEFAULT_SCOPES)
+
+      return self._gc
+
+  @gc.setter
+  def gc(self, client: gspread.Client) -> None:
+    self._gc = client
 
   def __str__(self) -> str:
     """Override str method to return a sensible string.
@@ -131,7 +188,7 @@ class Bid2xSpreadsheet:
         f'sheet_id: {self.sheet_id}\n'
         f'sheet_url: {self.sheet_url}\n'
         f'json_auth_file: {self.json_auth_file}\n'
-        f'gc (link to sheet): {self.gc}\n'
+        f'gc (link to sheet): {self._gc}\n'
         f'debug: {self.debug}\n'
         f'trace: {self.trace}\n'
     )
@@ -152,12 +209,69 @@ class Bid2xSpreadsheet:
 
     return return_str
 
+  def open_spreadsheet(
+      self, spreadsheet_id: str | None = None
+  ) -> gspread.Spreadsheet:
+    """Returns a handle to a spreadsheet, opening it once per process.
+
+    Args:
+        spreadsheet_id: the key or URL of the spreadsheet, this object's
+            sheet_id by default.
+
+    Returns:
+        The gspread Spreadsheet.  gspread exceptions from opening it are
+        passed on and nothing is cached.
+    """
+    if not spreadsheet_id:
+      spreadsheet_id = self.sheet_id
+    elif spreadsheet_id.startswith('https://'):
+      spreadsheet_id = gspread.utils.extract_id_from_url(spreadsheet_id)
+
+    key = (os.path.realpath(self.json_auth_file), spreadsheet_id)
+    with _spreadsheets_lock:
+      spreadsheet = _spreadsheets.get(key)
+    if spreadsheet is None:
+      self.reserve_quota('spreadsheets.get')
+      spreadsheet = self.gc.open_by_key(spreadsheet_id)
+      with _spreadsheets_lock:
+        spreadsheet = _spreadsheets.setdefault(key, spreadsheet)
+
+    return spreadsheet
+
+  def open_worksheet(
+      self, tab_name: str, spreadsheet_id: str | None = None
+  ) -> gspread.Worksheet:
+    """Returns a handle to a tab, read afresh from the spreadsheet.
+
+    Args:
+        tab_name: the name of the tab.
+        spreadsheet_id: the key or URL of the spreadsheet, this object's
+            sheet_id by default.
+
+    Returns:
+        The gspread Worksheet.  gspread exceptions are passed on.
+    """
+    spreadsheet = self.open_spreadsheet(spreadsheet_id)
+    # gspread reads the spreadsheet's tabs to find the one named.
+    self.reserve_quota('spreadsheets.get')
+    return spreadsheet.worksheet(tab_name)
+
+  def reserve_quota(self, method: str) -> None:
+    """Reserves Sheets quota for a request about to be made.
+
+    Args:
+        method: the Sheets API method called, e.g.
+            'spreadsheets.values.update'.  See bid2x_quota.
+    """
+    bid2x_quota.reserve(f'sheets.{method}')
+
   def __getstate__(self):
     state = self.__dict__.copy()  # Start with all attributes.
-    del state['gc']  # Remove the gc attribute.
+    state['_gc'] = None  # Drop the gspread client, rebuilt on use.
     del state['sheets_service']  # Remove the sheets_service attribute.
     return state  # Return the modified state dictionary.
 
+  @bid2x_trace.traced('sheets.read_dv_line_items')
   def read_dv_line_items(
       self,
       service: Any,
@@ -219,9 +333,12 @@ class Bid2xSpreadsheet:
       filter_string = f'campaignId={zone.campaign_id}'
 
       # Ask DV360 for a list of line items for this advertiser where
-      # the campaignId = the value for this loop.
+      # the campaignId = the value for this loop.  Pages are turned into
+      # sheet rows as they arrive, so only the rows are kept, column by
+      # column.
 
-      all_line_items_for_zone = []
+      line_items_fetched = 0
+      line_items_for_sheet = LineItemTable()
       next_page_token = None
 
       # Section 1 - Get matching DV line items from DV360 API.
@@ -246,7 +363,9 @@ class Bid2xSpreadsheet:
                   f'{zone.advertiser_id} with page token: {next_page_token}',
               )
 
-            # Use LARGE_PAGE_SIZE to speed up transfers.
+            # Use LARGE_PAGE_SIZE to speed up transfers.  Only the fields
+            # of the sheet's columns are asked for, and each line item is
+            # decoded and cut down to them as the page is read.
             request_line_items = (
                 service.advertisers()
                 .lineItems()
@@ -255,9 +374,26 @@ class Bid2xSpreadsheet:
                     pageSize=bid2x_var.LARGE_PAGE_SIZE,
                     filter=filter_string,
                     pageToken=next_page_token,
+                    fields=partial_response_fields(
+                        'lineItems', bid2x_var.LINE_ITEM_FIELDS
+                    ),
                 )
             )
-            current_page_response = request_line_items.execute()
+            request_line_items.postproc = streaming_list_postproc(
+                request_line_items.postproc, 'lineItems', line_item_row
+            )
+            with bid2x_trace.span(
+                'dv360.advertisers.lineItems.list', zone=zone.name
+            ) as span:
+              bid2x_quota.reserve(
+                  'dv360.advertisers.lineItems.list', zone.advertiser_id
+              )
+              current_page_response = bid2x_metrics.execute(
+                  'dv360.advertisers.lineItems.list', request_line_items
+              )
+              span.add(
+                  'rows', len(current_page_response.get('lineItems', []))
+              )
             break  # Success, exit retry loop.
 
           except HttpError as e:
@@ -268,6 +404,7 @@ class Bid2xSpreadsheet:
             if is_recoverable_http_error(e.resp.status):
               print(f'Retrying in {delay} seconds...')
               time.sleep(delay)
+              bid2x_metrics.record_retry('dv360', delay)
               retry_count += 1
               delay *= 2
               if retry_count == Bid2xSpreadsheet.MAX_RETRIES:
@@ -301,13 +438,33 @@ class Bid2xSpreadsheet:
 
         # Download of page of line items is complete.  Process it.
         if current_page_response and 'lineItems' in current_page_response:
-          all_line_items_for_zone.extend(current_page_response['lineItems'])
+          page_rows = current_page_response['lineItems']
+          line_items_fetched += len(page_rows)
           if self.debug:
             print(
-                f'Fetched {len(current_page_response["lineItems"])} items on',
+                f'Fetched {len(page_rows)} items on',
                 f' page {page_num}. Total fetched so far for this zone:',
-                f'{len(all_line_items_for_zone)}',
+                f'{line_items_fetched}',
             )
+
+          # Section 2:  Walk results and prep an array for Google Sheets
+          # update.
+          for row in page_rows:
+            # Keep the rows of line item data for transfer to Google
+            # Sheets except do not allow line item types that are YouTube
+            # related.
+            display_name = row[NAME_INDEX]
+            if (
+                row[TYPE_INDEX] not in YOUTUBE_LINE_ITEM_TYPES
+                # Note here for terwilleger@google.com:
+                # as discussed, an empty string ('') is still 'in' the
+                # displayName.
+                and line_item_name_pattern in display_name
+            ):
+              # Keep the row along with its optional auto_on.
+              line_items_for_sheet.append(
+                  row, auto_on=line_item_name_pattern in display_name
+              )
         else:
           if self.debug:
             print(
@@ -322,13 +479,13 @@ class Bid2xSpreadsheet:
           if self.debug:
             print(
                 'No nextPageToken found. Finished fetching all ',
-                f'{len(all_line_items_for_zone)} line items for ',
+                f'{line_items_fetched} line items for ',
                 f'advertiser {zone.advertiser_id}.',
             )
           break  # Exit pagination loop.
         page_num += 1
 
-      if not all_line_items_for_zone:
+      if not line_items_fetched:
         if self.debug:
           print(
               'No line items found or fetched for zone ',
@@ -337,48 +494,10 @@ class Bid2xSpreadsheet:
       else:
         if self.debug:
           print(
-              f'Processing a total of {len(all_line_items_for_zone)} ',
+              f'Processed a total of {line_items_fetched} ',
               f'line items for zone {zone.name}.',
           )
 
-      # Section 2:  Walk results and prep an array for Google Sheets update.
-
-      line_items_data_for_sheet: List[List[Any]] = []
-      auto_ons_data_for_sheet: List[List[str]] = []
-
-      for line_item in all_line_items_for_zone:
-        # Generate the rows of line item data for transfer to Google
-        # Sheets except do not allow line item types that are YouTube
-        # related.
-        if (
-            line_item.get('lineItemType')
-            not in (
-                'LINE_ITEM_TYPE_YOUTUBE_AND_PARTNERS_NON_SKIPPABLE',
-                'LINE_ITEM_TYPE_YOUTUBE_AND_PARTNERS_REACH',
-                'LINE_ITEM_TYPE_YOUTUBE_AND_PARTNERS_ACTION',
-            )
-            # Note here for terwilleger@google.com:
-            # as discussed, an empty string ('') is still 'in' the displayName.
-            and line_item_name_pattern in line_item['displayName']
-        ):
-
-          line_items_data_for_sheet.append(
-              [
-                  line_item.get('entityStatus'),
-                  line_item.get('lineItemId'),
-                  line_item.get('displayName'),
-                  line_item.get('lineItemType'),
-                  line_item.get('campaignId'),
-                  line_item.get('advertiserId'),
-              ]
-          )
-
-          # Build array for optional auto_on.
-          if line_item_name_pattern in line_item.get('displayName'):
-            auto_ons_data_for_sheet.append(['Yes'])
-          else:
-            auto_ons_data_for_sheet.append(['No'])
-
       # Section 3 - Connect to spreadsheet to the tab representing the
       #             current zone.
 
@@ -390,7 +509,7 @@ class Bid2xSpreadsheet:
         # Spreadsheet tab name should be the name of the bid2x_model.
         # item (.name).
         try:
-          current_tab = self.gc.open_by_key(spreadsheet_id).worksheet(zone.name)
+          current_tab = self.open_worksheet(zone.name, spreadsheet_id)
           break  # Success, exit retry loop.
         except gspread.exceptions.SpreadsheetNotFound:
           print(
@@ -429,6 +548,7 @@ class Bid2xSpreadsheet:
           if is_recoverable_http_error(err.resp.status):
             print(f'Retrying in {delay} seconds...')
             time.sleep(delay)
+            bid2x_metrics.record_retry('sheets', delay)
             retry_count += 1
             delay *= 2
 
@@ -452,9 +572,18 @@ class Bid2xSpreadsheet:
       ):
         try:
           # Update starting from A2 (row 2).
-          current_tab.update(
-              values=line_items_data_for_sheet,
-              range_name=f'{self.column_status}2',
+          with bid2x_trace.span(
+              'sheets.write_zone',
+              zone=zone.name,
+              rows=len(line_items_for_sheet),
+          ):
+            self.reserve_quota('spreadsheets.values.update')
+            current_tab.update(
+                values=line_items_for_sheet.rows(),
+                range_name=f'{self.column_status}2',
+            )
+          bid2x_metrics.SHEET_ROWS_WRITTEN.inc(
+              len(line_items_for_sheet), tab='zone'
           )
           break  # Success, exit retry loop.
         except gspread.exceptions.APIError as e:
@@ -478,6 +607,7 @@ class Bid2xSpreadsheet:
           if is_recoverable_http_error(err.resp.status):
             print(f'Retrying in {delay} seconds...')
             time.sleep(delay)
+            bid2x_metrics.record_retry('sheets', delay)
             retry_count += 1
             delay *= 2
 
@@ -499,9 +629,18 @@ class Bid2xSpreadsheet:
 
         try:
           # Update starting from K2 (row 2).
-          current_tab.update(
-              values=auto_ons_data_for_sheet,
-              range_name=f'{self.column_custom_bidding}2',
+          with bid2x_trace.span(
+              'sheets.write_zone',
+              zone=zone.name,
+              rows=len(line_items_for_sheet),
+          ):
+            self.reserve_quota('spreadsheets.values.update')
+            current_tab.update(
+                values=line_items_for_sheet.auto_on_rows(),
+                range_name=f'{self.column_custom_bidding}2',
+            )
+          bid2x_metrics.SHEET_ROWS_WRITTEN.inc(
+              len(line_items_for_sheet), tab='zone'
           )
         except gspread.exceptions.APIError as e:
           print(
@@ -528,6 +667,7 @@ class Bid2xSpreadsheet:
           if is_recoverable_http_error(err.resp.status):
             print(f'Retrying in {delay} seconds...')
             time.sleep(delay)
+            bid2x_metrics.record_retry('sheets', delay)
             retry_count += 1
             delay *= 2
 
@@ -553,6 +693,22 @@ class Bid2xSpreadsheet:
     Returns:
       A list of line items that need to be included in the custom bidding.
     """
+    return self.affected_line_items_from_records(
+        self.read_zone_records(zone_string)
+    )
+
+  @bid2x_trace.traced('sheets.read_zone')
+  def read_zone_records(self, zone_string: str) -> list[dict[str, Any]]:
+    """Reads every row of a zone's tab, retrying recoverable errors.
+
+    Args:
+      zone_string: a string corresponding to the label on a tab in the
+        Google sheet.
+
+    Returns:
+      The rows of the tab as dicts keyed by column heading, or an empty list
+      if the tab could not be read.
+    """
     # Get reference to already connected Sheets.
     spreadsheet_id = self.sheet_id
     # Open the spreadsheet tab name that is the passed zone string.
@@ -564,7 +720,7 @@ class Bid2xSpreadsheet:
 
     while retry_count < Bid2xSpreadsheet.MAX_RETRIES:
       try:
-        current_tab = self.gc.open_by_key(spreadsheet_id).worksheet(zone_string)
+        current_tab = self.open_worksheet(zone_string, spreadsheet_id)
         break
       except gspread.exceptions.SpreadsheetNotFound:
         print(
@@ -602,6 +758,7 @@ class Bid2xSpreadsheet:
         if is_recoverable_http_error(err.resp.status):
           print(f'Retrying in {delay} seconds...')
           time.sleep(delay)
+          bid2x_metrics.record_retry('sheets', delay)
           retry_count += 1
           delay *= 2
 
@@ -630,7 +787,10 @@ class Bid2xSpreadsheet:
     while retry_count < Bid2xSpreadsheet.MAX_RETRIES:
       # Get list of all records on the opened spreadsheet.
       try:
+        self.reserve_quota('spreadsheets.values.get')
         list_of_dicts = current_tab.get_all_records()
+        bid2x_trace.annotate(zone=zone_string, rows=len(list_of_dicts))
+        bid2x_metrics.SHEET_ROWS_READ.inc(len(list_of_dicts), tab='zone')
         break  # Success, exit retry loop.
       except gspread.exceptions.GSpreadException as e:
         print(
@@ -650,6 +810,7 @@ class Bid2xSpreadsheet:
         if is_recoverable_http_error(err.resp.status):
           print(f'Retrying in {delay} seconds...')
           time.sleep(delay)
+          bid2x_metrics.record_retry('sheets', delay)
           retry_count += 1
           delay *= 2
 
@@ -667,6 +828,20 @@ class Bid2xSpreadsheet:
       print('current_tab is None - cannot proceed')
       return []
 
+    return list_of_dicts
+
+  @staticmethod
+  def affected_line_items_from_records(
+      list_of_dicts: list[dict[str, Any]]
+  ) -> list[int]:
+    """Returns the line items of the rows marked 'Yes', without duplicates.
+
+    Args:
+      list_of_dicts: the rows of a zone's tab, as read by read_zone_records.
+
+    Returns:
+      A list of line items that need to be included in the custom bidding.
+    """
     # Create an empty list of processed line items.
     # Some Line Items may be disabled, we are building a list of line item
     # IDs that are enabled for the custom bidding to pass back.
@@ -700,7 +875,7 @@ class Bid2xSpreadsheet:
     while retry_count < Bid2xSpreadsheet.MAX_RETRIES:
       try:
         # Spreadsheet tab name is the name of the bid2Model iteam (.name).
-        current_tab = self.gc.open_by_key(spreadsheet_id).worksheet(zone_string)
+        current_tab = self.open_worksheet(zone_string, spreadsheet_id)
         break  # Success, exit retry loop.
       except gspread.exceptions.SpreadsheetNotFound:
         print(
@@ -738,6 +913,7 @@ class Bid2xSpreadsheet:
         if is_recoverable_http_error(err.resp.status):
           print(f'Retrying in {delay} seconds...')
           time.sleep(delay)
+          bid2x_metrics.record_retry('sheets', delay)
           retry_count += 1
           delay *= 2
 
@@ -765,6 +941,7 @@ class Bid2xSpreadsheet:
     while retry_count < Bid2xSpreadsheet.MAX_RETRIES:
       # Perform batch clear operation.
       try:
+        self.reserve_quota('spreadsheets.values.batchClear')
         current_tab.batch_clear([clear_string])
         break  # Success, exit retry loop.
       except gspread.exceptions.APIError as e:
@@ -785,6 +962,7 @@ class Bid2xSpreadsheet:
         if is_recoverable_http_error(err.resp.status):
           print(f'Retrying in {delay} seconds...')
           time.sleep(delay)
+          bid2x_metrics.record_retry('sheets', delay)
           retry_count += 1
           delay *= 2
 
@@ -811,6 +989,7 @@ class Bid2xSpreadsheet:
 
       while retry_count < Bid2xSpreadsheet.MAX_RETRIES:
         try:
+          self.reserve_quota('spreadsheets.values.update')
           current_tab.update(
               values=on_off_array, range_name=f'{self.column_custom_bidding}2'
           )
@@ -835,6 +1014,7 @@ class Bid2xSpreadsheet:
           if is_recoverable_http_error(err.resp.status):
             print(f'Retrying in {delay} seconds...')
             time.sleep(delay)
+            bid2x_metrics.record_retry('sheets', delay)
             retry_count += 1
             delay *= 2
 
@@ -850,6 +1030,7 @@ class Bid2xSpreadsheet:
 
     return True
 
+  @bid2x_trace.traced('sheets.write_status')
   def update_status_tab(
       self,
       status_tab_name: str,
@@ -877,9 +1058,7 @@ class Bid2xSpreadsheet:
     # Spreadsheet tab name should match key in dict.
 
     try:
-      cbscripts_sheet = self.gc.open_by_key(self.sheet_id).worksheet(
-          status_tab_name
-      )
+      cbscripts_sheet = self.open_worksheet(status_tab_name)
     except gspread.exceptions.SpreadsheetNotFound:
       print(f'Error: Spreadsheet not found for worksheet {status_tab_name}')
       raise  # Reraises the exception.
@@ -909,9 +1088,13 @@ class Bid2xSpreadsheet:
 
     # Write the most recent custom bidding function to the right
     # place on the CB_Scripts tab.
+    bid2x_trace.annotate(zone=zone.name)
     if update_row:
+      bid2x_trace.add('rows')
+      bid2x_metrics.SHEET_ROWS_WRITTEN.inc(tab='status')
       current_datetime = datetime.datetime.now()
       try:
+        self.reserve_quota('spreadsheets.values.update')
         cbscripts_sheet.update(
             values=[[cust_bidding_function_string[:50000],
                      f'{current_datetime}']],
@@ -952,6 +1135,7 @@ class Bid2xSpreadsheet:
       self.debug = source['debug']
       self.clear_onoff = source['clear_onoff']
 
+  @bid2x_trace.traced('sheets.write_status')
   def update_cb_scripts_tab(
       self, zone: Any, cust_bidding_function_string: str, test_run: bool
   ) -> bool:
@@ -973,9 +1157,7 @@ class Bid2xSpreadsheet:
     try:
       print('custom bidding')
       print(cust_bidding_function_string)
-      cbscripts_sheet = self.gc.open_by_key(self.sheet_id).worksheet(
-          'CB_Scripts'
-      )
+      cbscripts_sheet = self.open_worksheet('CB_Scripts')
     except gspread.exceptions.SpreadsheetNotFound:
       print('Error: Spreadsheet not found for worksheet CB_Scripts.')
       raise  # Reraises the exception.
@@ -1003,9 +1185,13 @@ class Bid2xSpreadsheet:
       update_col = chr(Bid2xSpreadsheet.COLUMN_OFFSET + zone.test_col)
     # Write the most recent custom bidding function to the right
     # place on the CB_Scripts tab.
+    bid2x_trace.annotate(zone=zone.name)
     if update_row:
+      bid2x_trace.add('rows')
+      bid2x_metrics.SHEET_ROWS_WRITTEN.inc(tab='status')
       current_datetime = datetime.datetime.now()
       try:
+        self.reserve_quota('spreadsheets.values.update')
         cbscripts_sheet.update(
             values=[[cust_bidding_function_string, f'{current_datetime}']],
             range_name=f'{update_col}{update_row}',
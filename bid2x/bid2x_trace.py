@@ -0,0 +1,370 @@
+"""BidToX - Span tracer.
+
+  Copyright 2025 Google LLC
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Description:
+  ------------
+
+  A span times one unit of work: a run, a pipeline stage of a zone, an API
+  call, an HTTP request, a sheet read or write, the generation of a script.
+  It carries attributes such as the zone, the retries made, the bytes sent
+  and received and the rows read or written.  A span started while another
+  is open in the same thread, or given it as parent, is its child.
+
+  Tracing is off unless an output is set with --trace_spans or the
+  BID2X_TRACE_SPANS environment variable: 'stdout' prints every finished
+  span as a Cloud Logging structured log line, anything else is the path
+  of a JSON lines file spans are appended to.  When tracing is off span()
+  returns a shared span that does nothing, so traced code only pays for a
+  function call.
+
+  report() prints a table of the spans finished since the last report,
+  grouped by name, with their count, time and summed attributes.  main()
+  prints one at the end of every run.
+
+  Example usage:
+      with bid2x_trace.span('sheets.read', zone=zone.name) as span:
+        rows = tab.get_all_records()
+        span.add('rows', len(rows))
+
+      @bid2x_trace.traced('sheets.write_status')
+      def update_status_tab(...):
+        ...
+        bid2x_trace.annotate(zone=zone.name)
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, TextIO
+
+import bid2x_var
+
+# Numeric attributes summed per span name in the report.
+SUMMED_ATTRIBUTES = ('retries', 'bytes_sent', 'bytes_received', 'rows')
+
+# The Cloud Logging fields linking a log line to its trace and span.
+CLOUD_LOGGING_TRACE = 'logging.googleapis.com/trace'
+CLOUD_LOGGING_SPAN_ID = 'logging.googleapis.com/spanId'
+
+
+class NoopSpan:
+  """The span handed out when tracing is off; it records nothing."""
+
+  def __enter__(self) -> 'NoopSpan':
+    return self
+
+  def __exit__(self, *exc_info: Any) -> None:
+    return None
+
+  def set(self, **attributes: Any) -> None:
+    del attributes  # Unused.
+
+  def add(self, name: str, amount: float = 1) -> None:
+    del name, amount  # Unused.
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+  """A timed unit of work, written out by its tracer when it ends.
+
+  Attributes:
+    name: what the span times, e.g. 'dv360.advertisers.lineItems.list'.
+    span_id: 16 hex digits identifying the span.
+    parent: the span this one is part of, if any.
+    attributes: JSON serialisable details of the work.
+  """
+
+  name: str
+  span_id: str
+  parent: 'Span | None'
+  attributes: dict[str, Any]
+
+  def __init__(
+      self,
+      tracer: 'Tracer',
+      name: str,
+      parent: 'Span | None',
+      attributes: dict[str, Any],
+  ):
+    self.name = name
+    self.span_id = os.urandom(8).hex()
+    self.parent = parent
+    self.attributes = attributes
+    self._tracer = tracer
+    self._start = 0.0
+    self._start_time = 0.0
+    self._previous = None
+
+  def __enter__(self) -> 'Span':
+    self._previous = getattr(_local, 'span', None)
+    _local.span = self
+    self._start_time = time.time()
+    self._start = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+    seconds = time.perf_counter() - self._start
+    _local.span = self._previous
+    if exc_type is not None:
+      self.attributes['error'] = exc_type.__name__
+    self._tracer.finish(self, self._start_time, seconds)
+
+  def set(self, **attributes: Any) -> None:
+    """Sets attributes of the span."""
+    self.attributes.update(attributes)
+
+  def add(self, name: str, amount: float = 1) -> None:
+    """Adds to a numeric attribute of the span, e.g. retries or rows."""
+    self.attributes[name] = self.attributes.get(name, 0) + amount
+
+
+class Tracer:
+  """Writes finished spans out and summarises them by name.
+
+  Attributes:
+    output: 'stdout' for Cloud Logging structured log lines, otherwise the
+      path of the JSON lines file spans are appended to.
+    trace_id: 32 hex digits shared by the spans of this process.
+    project: the Google Cloud project Cloud Logging trace links are made
+      in, if known.
+  """
+
+  output: str
+  trace_id: str
+  project: str | None
+
+  def __init__(self, output: str):
+    self.output = output
+    self.trace_id = os.urandom(16).hex()
+    self.project = os.getenv('GOOGLE_CLOUD_PROJECT')
+    self._file = None
+    self._lock = threading.Lock()
+    self._summary = {}
+
+  def stream(self) -> TextIO:
+    """Returns the stream spans are written to, opened on first use."""
+    if self.output == bid2x_var.TRACE_SPANS_STDOUT:
+      return sys.stdout
+
+    if self._file is None:
+      self._file = open(self.output, 'a')
+
+    return self._file
+
+  def record(
+      self, span: Span, start_time: float, seconds: float
+  ) -> dict[str, Any]:
+    """Returns the JSON record written out for a finished span."""
+    record = {
+        'name': span.name,
+        'trace_id': self.trace_id,
+        'span_id': span.span_id,
+        'parent_id': span.parent.span_id if span.parent else None,
+        'start': start_time,
+        'seconds': seconds,
+        'thread': threading.current_thread().name,
+        'attributes': span.attributes,
+    }
+    if self.output != bid2x_var.TRACE_SPANS_STDOUT:
+      return record
+
+    # Cloud Logging keeps unknown fields as the entry's jsonPayload.
+    record['severity'] = 'ERROR' if 'error' in span.attributes else 'INFO'
+    record['message'] = f'{span.name} {seconds * 1000:.1f} ms'
+    record[CLOUD_LOGGING_SPAN_ID] = span.span_id
+    if self.project:
+      record[CLOUD_LOGGING_TRACE] = (
+          f'projects/{self.project}/traces/{self.trace_id}'
+      )
+    return record
+
+  def finish(self, span: Span, start_time: float, seconds: float) -> None:
+    """Writes out a finished span and adds it to the summary."""
+    line = json.dumps(self.record(span, start_time, seconds), default=str)
+    with self._lock:
+      try:
+        stream = self.stream()
+        stream.write(line + '\n')
+        stream.flush()
+      except OSError as e:
+        print(f'Unable to write span {span.name} to {self.output}: {e}')
+
+      summary = self._summary.setdefault(
+          span.name,
+          {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'errors': 0},
+      )
+      summary['count'] += 1
+      summary['seconds'] += seconds
+      summary['max_seconds'] = max(summary['max_seconds'], seconds)
+      if 'error' in span.attributes:
+        summary['errors'] += 1
+      for name in SUMMED_ATTRIBUTES:
+        value = span.attributes.get(name)
+        if isinstance(value, (int, float)):
+          summary[name] = summary.get(name, 0) + value
+
+  def take_summary(self) -> dict[str, dict[str, Any]]:
+    """Returns the summary of the spans finished since the last call."""
+    with self._lock:
+      summary, self._summary = self._summary, {}
+
+    return summary
+
+  def close(self) -> None:
+    """Closes the JSON lines file, if open."""
+    with self._lock:
+      if self._file is not None:
+        self._file.close()
+        self._file = None
+
+
+# The tracer, None when tracing is off.  Set up on first use from
+# bid2x_var.TRACE_SPANS or the environment.
+_tracer: Tracer | None = None
+_configured = False
+_configure_lock = threading.Lock()
+
+# The span open in each thread.
+_local = threading.local()
+
+
+def configure(output: str | None = None) -> Tracer | None:
+  """Sets where finished spans are written.
+
+  Args:
+    output: 'stdout', the path of a JSON lines file or None for no
+      tracing.  Defaults to bid2x_var.TRACE_SPANS or, if that is not set,
+      the environment variable named by bid2x_var.TRACE_SPANS_ENV_VAR.
+
+  Returns:
+    The tracer, None if tracing is off.
+  """
+  global _tracer, _configured
+
+  if output is None:
+    output = bid2x_var.TRACE_SPANS or os.getenv(
+        bid2x_var.TRACE_SPANS_ENV_VAR
+    )
+
+  with _configure_lock:
+    if _tracer is not None:
+      _tracer.close()
+    _tracer = Tracer(output) if output else None
+    _configured = True
+
+  return _tracer
+
+
+def tracer() -> Tracer | None:
+  """Returns the tracer, None if tracing is off."""
+  return _tracer if _configured else configure()
+
+
+def enabled() -> bool:
+  """Returns True if spans are being recorded."""
+  return tracer() is not None
+
+
+def current_span() -> Span | None:
+  """Returns the span open in this thread, if any."""
+  return getattr(_local, 'span', None)
+
+
+def span(
+    name: str, parent: Span | None = None, **attributes: Any
+) -> Span | NoopSpan:
+  """Returns a span to time a unit of work with.
+
+  Args:
+    name: what the span times.
+    parent: the span this one is part of.  Defaults to the span open in
+      this thread; pass it explicitly for work handed to another thread.
+    **attributes: JSON serialisable details of the work.
+
+  Returns:
+    A context manager timing the work from entry to exit.
+  """
+  active = _tracer if _configured else configure()
+  if active is None:
+    return NOOP_SPAN
+
+  return Span(active, name, parent or current_span(), attributes)
+
+
+def traced(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+  """Returns a decorator running a function in a span of the given name."""
+
+  def decorator(function: Callable[..., Any]) -> Callable[..., Any]:
+
+    @functools.wraps(function)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+      if (_tracer if _configured else configure()) is None:
+        return function(*args, **kwargs)
+
+      with span(name):
+        return function(*args, **kwargs)
+
+    return wrapper
+
+  return decorator
+
+
+def annotate(**attributes: Any) -> None:
+  """Sets attributes of the span open in this thread, if any."""
+  current = current_span()
+  if current is not None:
+    current.set(**attributes)
+
+
+def add(name: str, amount: float = 1) -> None:
+  """Adds to a numeric attribute of the span open in this thread, if any."""
+  current = current_span()
+  if current is not None:
+    current.add(name, amount)
+
+
+def report() -> None:
+  """Prints the spans finished since the last report, grouped by name."""
+  active = _tracer if _configured else None
+  if active is None:
+    return
+
+  summary = active.take_summary()
+  if not summary:
+    return
+
+  print('Span summary:')
+  print(
+      f'  {"span":<52} {"count":>6} {"total s":>9} {"mean ms":>9} '
+      f'{"max ms":>9} {"errors":>6} {"retries":>7} {"bytes":>11} '
+      f'{"rows":>7}'
+  )
+  for name, row in sorted(
+      summary.items(), key=lambda item: item[1]['seconds'], reverse=True
+  ):
+    transferred = row.get('bytes_sent', 0) + row.get('bytes_received', 0)
+    print(
+        f'  {name:<52} {row["count"]:>6} {row["seconds"]:>9.3f} '
+        f'{row["seconds"] / row["count"] * 1000:>9.1f} '
+        f'{row["max_seconds"] * 1000:>9.1f} {row["errors"]:>6} '
+        f'{row.get("retries", 0):>7g} {transferred:>11g} '
+        f'{row.get("rows", 0):>7g}'
+    )
@@ -20,17 +20,22 @@
   This module contains utility functions used by the Bid2X application.
 """
 
+import hashlib
 import http
+import json
 import logging
+import re
+import threading
 import time
-from typing import Any
+from typing import Any, Callable
 from urllib import parse
 
+import bid2x_metrics
+import bid2x_quota
+import bid2x_trace
 import bid2x_var
 from google.api_core import exceptions
-from google.cloud import storage
 from googleapiclient import errors
-import jsonpickle
 
 urlparse = parse.urlparse
 HttpError = errors.HttpError
@@ -38,6 +43,24 @@ GoogleAPICallError = exceptions.GoogleAPICallError
 HTTPStatus = http.HTTPStatus
 
 
+def api_call_name(api: str, request: Any) -> str:
+  """Returns the name of an API call as bid2x_plan and bid2x_trace use it.
+
+  Args:
+    api: 'dv360', 'sheets' or 'gtm'.
+    request: a googleapiclient request or batch request.
+
+  Returns:
+    '<api>.<method>', e.g. 'dv360.advertisers.lineItems.list', or
+    '<api>.batch' for a batch request.
+  """
+  method_id = getattr(request, 'methodId', None)
+  if not method_id:
+    return f'{api}.batch'
+
+  return f'{api}.{method_id.split(".", 1)[-1]}'
+
+
 def google_dv_call(request: Any, context: str) -> dict[Any]:
   """Make an API call to DV360 with detailed exception handling.
 
@@ -51,24 +74,31 @@ def google_dv_call(request: Any, context: str) -> dict[Any]:
 
   response = None
 
-  try:
-    response = request.execute()
-  except HttpError as err:
-    # If the error is a rate limit or connection error, wait and try again.
-    if err.resp.status in [
-        HTTPStatus.FORBIDDEN, HTTPStatus.INTERNAL_SERVER_ERROR,
-        HTTPStatus.SERVICE_UNAVAILABLE
-    ]:
-      time.sleep(bid2x_var.HTTP_RETRY_TIMEOUT)
-
-      # We have slept an amount, retry the call
-      response = request.execute()
-    else:
+  name = api_call_name('dv360', request)
+  advertiser_id = bid2x_quota.request_advertiser_id(request)
+  with bid2x_trace.span(name, context=context):
+    try:
+      bid2x_quota.reserve(name, advertiser_id)
+      response = bid2x_metrics.execute(name, request)
+    except HttpError as err:
+      # If the error is a rate limit or connection error, wait and try
+      # again.
+      if err.resp.status in [
+          HTTPStatus.FORBIDDEN, HTTPStatus.INTERNAL_SERVER_ERROR,
+          HTTPStatus.SERVICE_UNAVAILABLE
+      ]:
+        time.sleep(bid2x_var.HTTP_RETRY_TIMEOUT)
+        bid2x_metrics.record_retry('dv360', bid2x_var.HTTP_RETRY_TIMEOUT)
+
+        # We have slept an amount, retry the call
+        bid2x_quota.reserve(name, advertiser_id)
+        response = bid2x_metrics.execute(name, request)
+      else:
+        print(f'Error with DV360 in {context} call :{err}')
+        raise
+    except GoogleAPICallError as err:
+      # Handle more specific Google API errors
       print(f'Error with DV360 in {context} call :{err}')
-      raise
-  except GoogleAPICallError as err:
-    # Handle more specific Google API errors
-    print(f'Error with DV360 in {context} call :{err}')
 
   return response
 
@@ -86,6 +116,145 @@ def is_recoverable_http_error(err: HTTPStatus) -> bool:
     return False
 
 
+class RateLimiter:
+  """Spaces out calls so that one starts at most every min_interval seconds.
+
+  Attributes:
+    min_interval: the minimum number of seconds between the start of two
+      calls.  Zero or less disables the limiter.
+  """
+
+  min_interval: float
+
+  def __init__(self, min_interval: float):
+    self.min_interval = min_interval
+    self._next_call_time = 0.0
+    self._lock = threading.Lock()
+
+  def wait(self) -> float:
+    """Blocks until the next call may start.
+
+    Returns:
+      The number of seconds waited.
+    """
+    if self.min_interval <= 0:
+      return 0.0
+
+    with self._lock:
+      now = time.monotonic()
+      delay = max(0.0, self._next_call_time - now)
+      self._next_call_time = max(now, self._next_call_time) + self.min_interval
+
+    if delay:
+      time.sleep(delay)
+
+    return delay
+
+
+# The whitespace JSON allows between tokens.
+JSON_WHITESPACE_PATTERN = re.compile(r'[ \t\n\r]*')
+
+_json_decoder = json.JSONDecoder()
+
+
+def partial_response_fields(list_field: str, fields: tuple[str, ...]) -> str:
+  """Returns the fields parameter limiting a list response to some fields.
+
+  Args:
+    list_field: the response field holding the items, e.g. 'lineItems'.
+    fields: the item fields wanted.
+
+  Returns:
+    e.g. 'nextPageToken,lineItems(lineItemId,displayName)'.
+  """
+  return f'nextPageToken,{list_field}({",".join(fields)})'
+
+
+def decode_list_page(
+    content: bytes | str,
+    list_field: str,
+    project: Callable[[dict[str, Any]], Any],
+) -> dict[str, Any]:
+  """Decodes a JSON list response, projecting its items as they are read.
+
+  Only one item of the list is decoded at a time, so a page's items are
+  never all held as dicts; the page holds what project() keeps of them.
+
+  Args:
+    content: the response body, a JSON object.
+    list_field: the field holding the items, e.g. 'lineItems'.
+    project: returns what is kept of an item.
+
+  Returns:
+    The response's fields, with list_field holding project(item) for each
+    item.
+
+  Raises:
+    json.JSONDecodeError: the body is not a JSON object.
+  """
+  text = content.decode('utf-8') if isinstance(content, bytes) else content
+
+  def skip(index: int) -> int:
+    return JSON_WHITESPACE_PATTERN.match(text, index).end()
+
+  def expect(char: str, index: int) -> int:
+    if text[index:index + 1] != char:
+      raise json.JSONDecodeError(f'Expecting {char!r}', text, index)
+    return skip(index + 1)
+
+  response = {}
+  index = expect('{', skip(0))
+  if text[index:index + 1] == '}':
+    return response
+
+  while True:
+    key, index = _json_decoder.raw_decode(text, index)
+    index = expect(':', skip(index))
+    if key == list_field and text[index:index + 1] == '[':
+      items = []
+      index = skip(index + 1)
+      while text[index:index + 1] != ']':
+        if items:
+          index = expect(',', index)
+        item, index = _json_decoder.raw_decode(text, index)
+        items.append(project(item))
+        index = skip(index)
+      response[key] = items
+      index += 1
+    else:
+      response[key], index = _json_decoder.raw_decode(text, index)
+    index = skip(index)
+    if text[index:index + 1] == '}':
+      return response
+    index = expect(',', index)
+
+
+def streaming_list_postproc(
+    postproc: Callable[[Any, bytes], Any],
+    list_field: str,
+    project: Callable[[dict[str, Any]], Any],
+) -> Callable[[Any, bytes], Any]:
+  """Returns a googleapiclient postproc decoding pages with decode_list_page.
+
+  Args:
+    postproc: the request's own postproc, still used for errors and empty
+      responses.
+    list_field: the response field holding the items.
+    project: returns what is kept of an item.
+
+  Returns:
+    A function to set as a request's postproc.
+  """
+
+  def decode(resp: Any, content: bytes) -> Any:
+    if resp.status >= 300 or not content:
+      return postproc(resp, content)
+
+    return decode_list_page(content, list_field, project)
+
+  return decode
+
+
 def is_number(s: Any) -> bool:
   """Is the passed variable a number?
 
@@ -112,6 +281,8 @@ def save_config(obj: Any, filename_to_save: str) -> bool:
     True if the save is successful, False otherwise.
   """
 
+  import jsonpickle  # pylint: disable=g-import-not-at-top
+
   frozen = jsonpickle.encode(obj, indent=2, unpicklable=False)
 
   # Save the JSON string to a file
@@ -121,21 +292,20 @@ def save_config(obj: Any, filename_to_save: str) -> bool:
   return True
 
 
-def read_config(filename_to_load: str) -> Any:
-  """Load a python object from a file or CGS with gs:// prefix.
+def read_config_text(filename_to_load: str) -> str:
+  """Read the content of a file or GCS object with gs:// prefix.
 
   Args:
       filename_to_load: The path or GCS URI of the file to load.
 
   Returns:
-      The object loaded and decoded from the file content.
+      The file content.
 
   Raises:
-      ValueError: If the path format is invalid.
+      ValueError: If the path format is invalid or the file is empty.
       google.cloud.exceptions.NotFound: If the GCS object doesn't exist.
       FileNotFoundError: If the local file doesn't exist.
-      Exception: For other potential errors during file reading or JSON
-      decoding.
+      Exception: For other potential errors during file reading.
   """
 
   # --- Google Cloud Storage Handling ---
@@ -150,6 +320,9 @@ def read_config(filename_to_load: str) -> Any:
       if not bucket_name or not object_name:
         raise ValueError(f'Invalid GCS path format: {filename_to_load}')
 
+      # Only loaded for GCS paths as the storage client is slow to import.
+      from google.cloud import storage  # pylint: disable=g-import-not-at-top
+
       storage_client = storage.Client()
       bucket = storage_client.bucket(bucket_name)
       blob = bucket.blob(object_name)
@@ -174,30 +347,78 @@ def read_config(filename_to_load: str) -> Any:
       logging.error('Failed to read %s: %s', source_description, e)
       raise
 
-  # --- Decoding Step ---
-  # This now happens *after* the 'frozen' string is populated, before returning.
   if not frozen:
     # This case should ideally be caught by earlier errors, but safety check.
     raise ValueError(
         f'No content loaded from "{filename_to_load}". Cannot decode.'
     )
 
+  return frozen
+
+
+def read_config(filename_to_load: str) -> Any:
+  """Load a python object from a JSON file or CGS with gs:// prefix.
+
+  Config files are written by save_config without jsonpickle type tags,
+  so they are plain JSON.  To load a config file use bid2x_config.load,
+  which also validates and caches it.
+
+  Args:
+      filename_to_load: The path or GCS URI of the file to load.
+
+  Returns:
+      The object loaded and decoded from the file content.
+
+  Raises:
+      ValueError: If the path format is invalid or the content isn't JSON.
+      google.cloud.exceptions.NotFound: If the GCS object doesn't exist.
+      FileNotFoundError: If the local file doesn't exist.
+      Exception: For other potential errors during file reading.
+  """
+  frozen = read_config_text(filename_to_load)
   try:
-    logging.info('Attempting to decode JSON from %s', source_description)
-    # Decode the loaded JSON string using jsonpickle
-    loaded_object = jsonpickle.decode(frozen)
-    logging.info(
-        'Successfully decoded configuration from %s', source_description
-    )
-    return loaded_object  # Return the decoded Python object
-  except Exception as e:
-    # Catch potential errors during jsonpickle decoding
-    logging.error(
-        'Failed to decode JSON content from %s: %s', source_description, e
-    )
+    return json.loads(frozen)
+  except json.JSONDecodeError as e:
+    logging.error('Failed to decode JSON from %s: %s', filename_to_load, e)
     # Log the first few characters of the problematic string for debugging:
     logging.error('Content snippet (up to 100 chars): %s', frozen[:100])
-    raise  # Re-raise the decoding error
+    raise
+
+
+def config_fingerprint(filename: str) -> str:
+  """Returns a value that changes whenever a config file's content changes.
+
+  For GCS objects the object generation is used, which only needs the
+  object's metadata rather than its content.  For local files it is the
+  SHA-256 of the file content.
+
+  Args:
+      filename: The path or GCS URI of the config file.
+
+  Returns:
+      A string fingerprint of the current version of the file.
+
+  Raises:
+      ValueError: If the GCS path format is invalid.
+      FileNotFoundError: If the file or GCS object doesn't exist.
+  """
+  if filename.startswith('gs://'):
+    from google.cloud import storage  # pylint: disable=g-import-not-at-top
+
+    parsed_uri = urlparse(filename)
+    bucket_name = parsed_uri.netloc
+    object_name = parsed_uri.path.lstrip('/')
+    if not bucket_name or not object_name:
+      raise ValueError(f'Invalid GCS path format: {filename}')
+
+    blob = storage.Client().bucket(bucket_name).get_blob(object_name)
+    if blob is None:
+      raise FileNotFoundError(f'GCS object not found: {filename}')
+
+    return f'generation:{blob.generation}'
+
+  with open(filename, 'rb') as f:
+    return f'sha256:{hashlib.sha256(f.read()).hexdigest()}'
 
 
 def copy_iff_exists(src: Any, key_as_str: str, dst: Any):
@@ -32,6 +32,31 @@ class PlatformType(Enum):
   SHEETS = 'SHEETS'
 
 
+class GTMChangeDetection(Enum):
+  """Ways of detecting that a generated GTM function is unchanged."""
+  OFF = 'off'
+  LIVE = 'live'
+  LOCAL = 'local'
+
+
+class GTMWorkspaceMode(Enum):
+  """How bid2x obtains the GTM workspace it makes changes in."""
+  NEW = 'new'
+  PERSISTENT = 'persistent'
+
+
+class GTMEmissionMode(Enum):
+  """How the generated GTM function selects the floodlight being fired."""
+  CHAIN = 'chain'
+  DISPATCH = 'dispatch'
+
+
+class ZoneOrder(Enum):
+  """The order DV360 zones are started in."""
+  CONFIGURED = 'configured'
+  STALEST = 'stalest'
+
+
 class GTMColumns(Enum):
   SERVER_NAME = 'CMCL_SERV_NAME'
   INDEX_FACTOR = 'INDEX_FACTOR'
@@ -62,6 +87,30 @@ GTM_STATUS_TAB = 'JS_Scripts'
 GTM_FLOODLIGHT_LIST = []
 GTM_PREPROCESSING_SCRIPT = ''
 GTM_POSTPROCESSING_SCRIPT = ''
+# When True zones sharing a GTM container are updated in a single workspace
+# and the container is versioned and published once.
+GTM_BATCH_BY_CONTAINER = False
+# Skip the workspace/version/publish calls for zones whose generated function
+# matches the live container version ('live') or the hash recorded in a local
+# state file on the last publish ('local').  'off' always publishes.
+GTM_CHANGE_DETECTION = GTMChangeDetection.OFF.value
+GTM_STATE_FILE = '/tmp/bid2x_gtm_state.json'
+# Create a new workspace per update ('new') or reuse one named workspace per
+# container, synced to the latest version ('persistent').
+GTM_WORKSPACE_MODE = GTMWorkspaceMode.NEW.value
+GTM_WORKSPACE_NAME = 'bid2x'
+# Delete workspaces auto-created (and left behind) by earlier runs, once
+# they are older than the hours below; younger ones may belong to a run
+# still in progress.
+GTM_DELETE_STALE_WORKSPACES = False
+GTM_STALE_WORKSPACE_AGE_HOURS = 24.0
+# Number of GTM containers processed in parallel and the minimum number of
+# seconds between API calls made for any one container.
+GTM_MAX_WORKERS = 1
+GTM_MIN_CALL_INTERVAL = 0.0
+# Floodlight selection in the generated GTM function: an if / else if chain
+# or an event name dispatch table.
+GTM_EMISSION_MODE = GTMEmissionMode.CHAIN.value
 
 
 # DV360 variables.
@@ -140,10 +189,156 @@ GTM_API_SCOPES = [
 GTM_API_NAME = 'tagmanager'
 GTM_API_VERSION = 'v2'
 
+# Discovery documents not bundled with bid2x or google-api-python-client
+# are fetched and, if a directory is set, cached there for up to a week.
+DISCOVERY_CACHE_DIR = None
+DISCOVERY_CACHE_MAX_AGE = 7 * 24 * 60 * 60  # Seconds.
+DISCOVERY_FETCH_TIMEOUT = 30  # Seconds.
+
+# Shared API transport settings.  Access tokens are refreshed once they are
+# within TOKEN_REFRESH_MARGIN seconds of expiring.
+TOKEN_REFRESH_MARGIN = 300
+HTTP_TIMEOUT = 60  # Seconds.
+HTTP_POOL_SIZE = 10  # Keep-alive connections per host for gspread.
+
+# API endpoint override, e.g. the local fake APIs (see bid2x_fake_api).
+# When set, or the environment variable named below is, calls meant for
+# https://<api>.googleapis.com/ go to <endpoint>/<api>/ instead and access
+# tokens are requested from <endpoint>/token.
+API_ENDPOINT = None
+API_ENDPOINT_ENV_VAR = 'BID2X_API_ENDPOINT'
+
+# Local fake API defaults (see bid2x_fake_api): the delay added to every
+# call, the share of calls failing with one of the error statuses, the
+# largest page listed and the sizes of the data seeded per zone.
+FAKE_API_PORT = 8089
+FAKE_API_LATENCY = 0.0  # Seconds.
+FAKE_API_LATENCY_JITTER = 0.0  # Seconds, added at random to the latency.
+FAKE_API_ERROR_RATE = 0.0
+FAKE_API_ERROR_STATUSES = (429, 500, 503)
+FAKE_API_PAGE_SIZE = 200
+FAKE_API_LINE_ITEMS = 100  # DV360 line items per zone.
+FAKE_API_INDEX_ROWS = 50  # GTM index table rows per zone.
+
+# Number of config files bid2x_batch runs at the same time.
+BATCH_MAX_WORKERS = 4
+
+# Number of DV360 pipeline stages (sheet reads and API calls) run at the
+# same time, across zones.  1 runs every stage of every zone serially.
+DV_MAX_WORKERS = 1
+
+# Run journal (see bid2x_journal): a local SQLite file or a gs:// object,
+# None for no journal.  The run ID shared by a run and its retries is read
+# from the first of these environment variables that is set.  A journal in
+# Cloud Storage is rewritten at most once per interval in seconds.
+JOURNAL_PATH = None
+JOURNAL_RUN_ID_ENV_VARS = ('BID2X_RUN_ID', 'CLOUD_RUN_EXECUTION')
+JOURNAL_GCS_WRITE_INTERVAL = 1.0
+
+# Task sharding (see bid2x_shard): this task's index and the number of
+# tasks the zones are split across, normally read from Cloud Run's
+# CLOUD_RUN_TASK_INDEX and CLOUD_RUN_TASK_COUNT.  A zone's expected work is
+# its line item count from the journal plus a fixed cost per zone, in line
+# items.
+TASK_INDEX = 0
+TASK_COUNT = 1
+SHARD_ZONE_WEIGHT = 10
+
+# Deadline scheduling (see bid2x_scheduler): the seconds a DV360 run's zone
+# work may take, None for no limit, and the order zones are started in.  A
+# stage with no recorded timing is expected to take the default seconds.
+TIME_BUDGET = None
+ZONE_ORDER = ZoneOrder.CONFIGURED.value
+SCHEDULER_DEFAULT_STAGE_SECONDS = 5.0
+
+# Dry-run planning (see bid2x_plan): whether to plan instead of running, an
+# optional latency profile file, and the sizes and latencies assumed when
+# the journal or profile has nothing better.  A latency profile maps
+# '<api>.<method>' or '<api>' to seconds per call.
+PLAN = False
+PLAN_LATENCY_PROFILE = None
+PLAN_JSON_FILE = None
+PLAN_DEFAULT_LINE_ITEMS = 100
+PLAN_CALL_SECONDS = {'dv360': 0.6, 'sheets': 0.4, 'gtm': 0.5}
+PLAN_CALL_BYTES = 1000
+PLAN_LINE_ITEM_BYTES = 250  # A lineItem limited to LINE_ITEM_FIELDS.
+PLAN_SHEET_ROW_BYTES = 200  # A row of a zone's tab.
+PLAN_SCRIPT_BYTES_PER_LINE_ITEM = 150  # Generated script per tab row.
+PLAN_GTM_CONTAINER_BYTES = 100000  # A live container version.
+
+# Span tracing (see bid2x_trace): where finished spans are written, None for
+# no tracing.  TRACE_SPANS_STDOUT writes Cloud Logging structured log lines
+# to stdout, anything else is the path of a JSON lines file.  When not set
+# the environment variable named below is read.
+TRACE_SPANS = None
+TRACE_SPANS_ENV_VAR = 'BID2X_TRACE_SPANS'
+TRACE_SPANS_STDOUT = 'stdout'
+
+# Metrics (see bid2x_metrics): the file written in the Prometheus text
+# format at the end of every run and the port /metrics is served on, None
+# for neither.  When not set the environment variables named below are read.
+METRICS_TEXTFILE = None
+METRICS_TEXTFILE_ENV_VAR = 'BID2X_METRICS_TEXTFILE'
+METRICS_PORT = None
+METRICS_PORT_ENV_VAR = 'BID2X_METRICS_PORT'
+
+# API quotas (see bid2x_quota) as (api, 'read', 'write' or 'all', 'project'
+# or 'advertiser', requests, window seconds), set to Google's defaults.
+# Raise them to match a project whose quota has been raised.  With
+# QUOTA_WAIT, or the environment variable named below, set requests wait
+# for room in every window instead of only being counted.
+QUOTA_LIMITS = (
+    ('sheets', 'read', 'project', 60, 60),
+    ('sheets', 'write', 'project', 60, 60),
+    ('dv360', 'all', 'project', 1500, 60),
+    ('dv360', 'write', 'advertiser', 300, 60),
+    ('gtm', 'all', 'project', 25, 100),
+)
+QUOTA_WAIT = False
+QUOTA_WAIT_ENV_VAR = 'BID2X_QUOTA_WAIT'
+
+# HTTP cassettes (see bid2x_cassette): the file every API request and its
+# response are recorded to, or replayed from without a network, and
+# whether replies take the recorded time ('original', the default) or none
+# ('zero').  When not set the environment variables named below are read.
+RECORD_CASSETTE = None
+RECORD_CASSETTE_ENV_VAR = 'BID2X_RECORD_CASSETTE'
+REPLAY_CASSETTE = None
+REPLAY_CASSETTE_ENV_VAR = 'BID2X_REPLAY_CASSETTE'
+REPLAY_LATENCY = None
+REPLAY_LATENCY_ENV_VAR = 'BID2X_REPLAY_LATENCY'
+
+# Profiling (see bid2x_profile): 'cprofile' or 'sampling' to profile runs,
+# None for neither, the directory the pstats and collapsed stack files of
+# each run are written to and the seconds between stack samples.  When not
+# set the environment variables named below are read.
+PROFILE = None
+PROFILE_ENV_VAR = 'BID2X_PROFILE'
+PROFILE_DIR = None
+PROFILE_DIR_ENV_VAR = 'BID2X_PROFILE_DIR'
+PROFILE_DEFAULT_DIR = '/tmp'
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# Config files (see bid2x_config) are validated once per content and kept
+# pickled in memory and, if set, in this directory, to be reused by later
+# processes.  When not set the environment variable named below is read.
+CONFIG_CACHE_DIR = None
+CONFIG_CACHE_DIR_ENV_VAR = 'BID2X_CONFIG_CACHE_DIR'
+
 # Variables that have specific values that cannot be
 # set through options.
 HTTP_RETRY_TIMEOUT = 5
 LARGE_PAGE_SIZE = 200
+# The DV360 line item fields read into a zone's tab, in column order from
+# COLUMN_STATUS.  lineItems.list responses are limited to them.
+LINE_ITEM_FIELDS = (
+    'entityStatus',
+    'lineItemId',
+    'displayName',
+    'lineItemType',
+    'campaignId',
+    'advertiserId',
+)
 SPREADSHEET_FIRST_DATA_ROW = 2
 SPREADSHEET_LAST_DATA_ROW = 1000
 
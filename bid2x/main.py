@@ -36,21 +36,27 @@
 """
 
 # Import required libraries & modules
+# Only light modules are imported here.  The platform specific modules (and
+# with them pandas, gspread and the Google API clients) are imported when a
+# config file is loaded so a cold start only pays for what it uses.
 import base64
 import datetime
-import json
 import sys
-from typing import Any
-
-import bid2x_application
-from bid2x_application import Bid2xApplication
-from bid2x_args import process_command_line_args
-from bid2x_gtm_model import Bid2xGTMModel
-from bid2x_model import Bid2xModel
+import threading
+import time
+from typing import Any, TYPE_CHECKING
+
+import bid2x_config
+import bid2x_metrics
+import bid2x_profile
+import bid2x_quota
+import bid2x_trace
 import bid2x_util as util
 import bid2x_var
 import functions_framework
-import gspread
+
+if TYPE_CHECKING:
+  from bid2x_application import Bid2xApplication
 
 
 # Triggered from a message on a Cloud Pub/Sub topic.
@@ -79,12 +85,9 @@ def hello_pubsub(cloud_event: Any) -> None:
   filename = base64.b64decode(message_data).decode('utf-8')
 
   # The message passed in the Pub/Sub message is the JSON filename to
-  # load and execute.
-  app = create_objects_from_json_file(filename)
-
-  # At the moment this assumes the passed filename is a local file.
-  # This needs to be extended such that the config file can be
-  # located elsewhere.
+  # load and execute.  A warm instance reuses the app built for an earlier
+  # message with the same, unchanged, config file.
+  app = get_cached_app(filename)
 
   # Now run the main loop.
   main(sys.argv)
@@ -125,222 +128,124 @@ def main(argv: Any) -> int:
     print('No args exist, preload a known good set')
     app = create_objects_from_json_file('sample_config.json')
 
-  if app.platform_type == bid2x_var.PlatformType.DV.value:
-    # This is a DV service.
-    if not app.auth.auth_dv_service(
-        app.json_auth_file, app.service_account_email
-    ):
-      print('Failure on auth to DV')
-      return -1
-  elif app.platform_type == bid2x_var.PlatformType.GTM.value:
-    # This is a GTM/SA service.
-    if not app.auth.auth_gtm_service(
-        app.json_auth_file, app.service_account_email
-    ):
-      print('Failure on auth to GTM')
-      return -1
-
-  if not app:
-    print('App object not valid - exiting...')
-    return -1
-  else:
-    print('Start-up Configuration:')
-    print(f'{app}')
-
-  # Is this a DV360 type connection?
-  if app.platform_type == bid2x_var.PlatformType.DV.value:
-
-    if app.platform_object.action_list_scripts:
-      # Show advertiser level scripts for each initialized zone.
-      for zone in app.zone_array:
-        response = app.platform_object.list_advertiser_algo_scripts(
-            app.service, zone.advertiser_id
-        )
-        if app.debug:
-          print(
-              f'Custom bidding scripts for zone {zone.name}',
-              f' advertiser_id = {zone.advertiser_id}',
-          )
-          json_pretty_print = json.dumps(response, indent=2)
-          print(f'{json_pretty_print}')
+  # Serves /metrics if a port is set; warm instances keep the server.
+  bid2x_metrics.serve()
 
-    if app.platform_object.action_list_algos:
-      # Show advertiser level algorithms for each initialized zone.
-      response = app.platform_object.list_advertiser_algorithms(
-          app.service, app.platform_object.advertiser_id
-      )
-      if app.trace:
-        print(
-            'Advertiser level algorithms for advertiser ID ',
-            f'= {app.platform_object.advertiser_id}',
-        )
-        json_pretty_print = json.dumps(response, indent=2)
-        print(f'{json_pretty_print}')
-
-    if app.platform_object.action_create_algorithm:
-      # Create a new custom bidding algorithm from Partner level.
-      print('Create new custom bidding algorithm for zone(s):')
-
-      for zone in app.zone_array:
-        # Create CB Algorithm at the Advertiser level.
-        algorithm_name = app.platform_object.new_algo_name + '_' + zone.name
-        display_name = (
-            app.platform_object.new_algo_display_name + '_' + zone.name
-        )
-        print(f'New algorithm name: {display_name}')
-        response = app.platform_object.create_cb_algorithm_advertiser(
-            app.service, app.platform_object.advertiser_id, algorithm_name,
-            display_name
-        )
+  result = None
+  start_time = time.time()
+  try:
+    with bid2x_profile.profiled(), bid2x_trace.span(
+        'run',
+        task_index=bid2x_var.TASK_INDEX,
+        task_count=bid2x_var.TASK_COUNT,
+    ) as span:
+      result = run_app(app, bid2x_var.TASK_INDEX, bid2x_var.TASK_COUNT)
+      span.set(result=result)
+  finally:
+    finish_run(result == 0, start_time)
 
-        if app.trace:
-          json_pretty_print = json.dumps(response, indent=2)
-          print(f'new custom bidding algorithm response = {json_pretty_print}')
+  return result
 
-    if app.platform_object.action_remove_algorithm:
-      # Remove an advertiser custom bidding algorithm by ID.
-      print(
-          f'Custom bidding algorithm id {app.platform_object.cb_algo_id} ',
-          'will be attempted to be deleted.',
-      )
-      response = app.platform_object.remove_cb_algorithm_advertiser(
-          app.service,
-          app.platform_object.advertiser_id,
-          app.platform_object.cb_algo_id,
-      )
 
-      print(f'result of deletion attempt: {response}')
+def finish_run(succeeded: bool, start_time: float) -> None:
+  """Runs the end-of-run hooks of main() and bid2x_batch.
 
-    if app.platform_object.action_update_scripts:
-      # Update the custom bidding scripts in DV360.
-
-      # Create custom bidding script for DV360 as a string - per sales zone.
-      for zone in app.zone_array:
-        # Go into Google Sheets and generate CB function per sales zone.
-        custom_bidding_function_string = (
-            app.platform_object.generate_cb_script_max_of_conversion_counts(
-                zone.name
-            )
-        )
+  With tracing on, this summarises the spans of the run, including those of
+  building the app.  It also prints the quota peaks and records the run in
+  the metrics, writing the metrics textfile if one is set.
 
-        if app.trace:
-          # Show the generated custom bidding script.
-          print(
-              'custom_bidding_function_string:\n',
-              f'{custom_bidding_function_string}\n',
-          )
+  Args:
+      succeeded: whether the run succeeded.
+      start_time: when the run started, in seconds since the epoch.
+  """
+  bid2x_trace.report()
+  bid2x_quota.report()
+  bid2x_metrics.record_run(succeeded, start_time, time.time())
 
-        # Get a list of line items this will affect.
-        line_item_array = app.sheet.get_affected_line_items_from_sheet(
-            zone.name
-        )
-        # Get the current algorithm directly from DV360.
-        custom_bidding_current_script = (
-            app.platform_object.read_cb_algorithm_by_id(
-                app.service,
-                app.platform_object.advertiser_id,
-                zone.algorithm_id,
-            )
-        )
 
-        if app.trace:
-          print(f'new c.b.script:***{custom_bidding_function_string}***')
-          print(f'current script:***{custom_bidding_current_script}***')
-
-        # Updating custom bidding scripts deals with Media objects - similar
-        # to the handling of creatives.  These are typically files on a local
-        # file system and it's easier to deal with the uploading of a custom
-        # bidding script by placing it in a temp file.
-        # Build the tmp filename using the custom budding (cb) tmp file prefix
-        # an underscore and then the zone name along with a '.txt' suffix.
-        # Once we check that the new CB script is actually new the contents
-        # of the script will be written to this filename.
-        filename = (
-            app.platform_object.cb_tmp_file_prefix + '_' + zone.name + '.txt'
-        )
-        # Compare the new script and the previously uploaded script.
-        if (
-            str(custom_bidding_function_string).strip() ==
-            str(custom_bidding_current_script).strip()
-        ):
-
-          # The new script is the same as the old script, don't write to file
-          # and don't upload.  Just return False from this function.
-          print('New script is the same as the existing script; not uploading')
-
-          # Go to next item in outer loop.
-          continue
-        else:
-          print(
-              'New script is different from last ',
-              'uploaded script; uploading new version.',
-          )
+def run_app(
+    app: 'Bid2xApplication', task_index: int = 0, task_count: int = 1
+) -> int:
+  """Runs the actions configured in an app object.
 
-          # Write new script to tmp filename.  Upload is from a tmp file.
-          app.platform_object.write_last_upload_file(
-              filename, custom_bidding_function_string
-          )
+  Unlike main() this does not use the module's global app, so several
+  apps can be run side by side (see bid2x_batch).
 
-          # Make call to update script in DV360 passing in filename containing
-          # new script.
-          update_result = zone.update_custom_bidding_scripts(
-              app.service,
-              zone.advertiser_id,
-              zone.algorithm_id,
-              filename,
-              line_item_array,
-          )
+  Args:
+      app: The app object to run, as built by create_objects_from_json_file.
+      task_index: The index of this task when the zones are split across
+          the tasks of a Cloud Run job (see bid2x_shard).
+      task_count: The number of tasks the zones are split across.
+  Returns:
+      0 if the actions ran, -1 if there was an error or failure.
+  """
+  if not app:
+    print('App object not valid - exiting...')
+    return -1
 
-          if not update_result:
-            print(f'Update of C.B. Script for zone {zone.name} failed.')
-          else:
-            print(f'Update of C.B. Script for zone {zone.name} succeeded.')
-            # Update of C.B. script was successful, update the Google
-            # Sheets spreadsheet tab named 'CB_Scripts' (by default).
-            app.sheet.update_cb_scripts_tab(
-                zone, custom_bidding_function_string, test_run=False
-            )
+  # The service is normally authenticated when the app is built; only
+  # retry here if that failed.
+  if app.service:
+    pass
+  elif app.platform_type == bid2x_var.PlatformType.DV.value:
+    # This is a DV service.
+    app.service = app.auth.auth_dv_service(
+        app.json_auth_file, app.service_account_email
+    )
+    if not app.service:
+      print('Failure on auth to DV')
+      return -1
+  elif app.platform_type == bid2x_var.PlatformType.GTM.value:
+    # This is a GTM/SA service.
+    app.service = app.auth.auth_gtm_service(
+        app.json_auth_file, app.service_account_email
+    )
+    if not app.service:
+      print('Failure on auth to GTM')
+      return -1
 
-    if app.platform_object.action_test:
-      for zone in app.zone_array:
-        # Generate the Custom Bidding Script.
-        custom_bidding_string = (
-            app.platform_object.generate_cb_script_max_of_conversion_counts(
-                zone.name
-            )
-        )
-        # Write the Test Run out to the test column in the associated
-        # Google Sheet in the tab 'CB_Scripts'.
-        app.sheet.update_status_tab(
-            'CB_Scripts', zone, custom_bidding_string, test_run=True
-        )
+  print('Start-up Configuration:')
+  print(f'{app}')
+
+  zone_array = app.zone_array
+  if task_count > 1:
+    # pylint: disable-next=g-import-not-at-top
+    import bid2x_shard
+    zone_array = bid2x_shard.shard_app_zones(app, task_index, task_count)
+    print(
+        f'Task {task_index} of {task_count} processing zones: '
+        f'{[zone.name for zone in zone_array]}'
+    )
 
-        if app.trace:
-          # Print the value of the script to the console - since this runs
-          # typically as a Cloud Function then this will end up in the logs.
-          print(
-              f"""rules for zone {zone.name}:\n
-                {custom_bidding_string}"""
-          )
+  # Is this a DV360 type connection?
+  if app.platform_type == bid2x_var.PlatformType.DV.value:
 
-    if app.platform_object.action_update_spreadsheet:
-      app.sheet.read_dv_line_items(
-          app.service,
-          app.platform_object.line_item_name_pattern,
-          app.zone_array,
-          app.platform_object.defer_pattern,
-      )
+    # The DV360 actions, including the per zone update/test pipeline, live
+    # in Bid2xDV.process_script().  Actions not tied to a zone only run in
+    # the first task.
+    if not app.platform_object.process_script(
+        app.service, zone_array, shared_actions=task_index == 0
+    ):
+      return -1
 
   # Do we have a service object and are we dealing with a GTM object?
   elif app.platform_type == bid2x_var.PlatformType.GTM.value:
 
+    # Containers processed in parallel each need their own GTM client.
+    def gtm_service_factory():
+      return app.auth.auth_gtm_service(
+          app.json_auth_file, app.service_account_email
+      )
+
     if app.platform_object.action_update_scripts:
       app.platform_object.process_script(
-          app.service, app.zone_array, test_flag=False
+          app.service, zone_array, test_flag=False,
+          service_factory=gtm_service_factory
       )
     elif app.platform_object.action_test:
       app.platform_object.process_script(
-          app.service, app.zone_array, test_flag=True
+          app.service, zone_array, test_flag=True,
+          service_factory=gtm_service_factory
       )
   else:
     print('Unable to connect to service object - stopped')
@@ -351,38 +256,82 @@ def main(argv: Any) -> int:
   return 0
 
 
-def create_objects_from_json_file(filename: str) -> Bid2xApplication:
+def get_cached_app(filename: str) -> 'Bid2xApplication':
+  """Returns the app for a config file, reusing one built earlier if valid.
+
+  Apps are cached per process, keyed by config filename, along with the
+  config's fingerprint (content hash or GCS generation).  A warm instance
+  therefore keeps its authenticated services, HTTP connections and
+  spreadsheet client across messages, and rebuilds the app as soon as the
+  config file changes.
+
+  Args:
+      filename: The name of the JSON file to load.
+  Returns:
+      The app object for the config file.
+  """
+  try:
+    fingerprint = util.config_fingerprint(filename)
+  except Exception as e:  # pylint: disable=broad-exception-caught
+    # Without a fingerprint there's no telling if a cached app is stale.
+    print(f'Unable to fingerprint config {filename}, not caching: {e}')
+    return create_objects_from_json_file(filename)
+
+  # Apps for different configs can be built at the same time (see
+  # bid2x_batch); only builds of the same config wait for each other.
+  with _app_cache_lock:
+    filename_lock = _app_cache_locks.setdefault(filename, threading.Lock())
+
+  with filename_lock:
+    cached = _app_cache.get(filename)
+    if cached and cached[0] == fingerprint:
+      print(f'Reusing app built for config {filename} ({fingerprint})')
+      return cached[1]
+
+    cached_app = create_objects_from_json_file(filename)
+    # Only cache apps that authenticated; others are retried next message.
+    if cached_app and cached_app.service:
+      _app_cache[filename] = (fingerprint, cached_app)
+    else:
+      _app_cache.pop(filename, None)
+
+    return cached_app
+
+
+def create_objects_from_json_file(
+    filename: str, authenticate: bool = True
+) -> 'Bid2xApplication':
   """Create app object from a JSON file.
 
   Args:
       filename: The name of the JSON file to load.
+      authenticate: Whether to build the API service.  A dry run (see
+          bid2x_plan) makes no calls and so needs no service.
   Returns:
       The created app object.
+  Raises:
+      bid2x_config.ConfigError: If the file does not fit the config schema,
+          listing every problem found.
   """
-
-  global app
+  # pylint: disable=g-import-not-at-top
+  from bid2x_application import Bid2xApplication
+  # pylint: enable=g-import-not-at-top
 
   if filename:
     # Start with default app object.
-    # Then read input file into new object.
-    stored_app = util.read_config(filename)
-
-    # Determine what type of system this config file is for.
-    if stored_app['platform_type'] and (
-        stored_app['platform_type'].upper() in ('DV', 'GTM')
-    ):
+    # Then read input file into new object.  The file has been validated
+    # against the schema of its platform type, 'DV' or 'GTM', so every
+    # field read below is present.
+    stored_app = bid2x_config.load(filename)
 
-      app = Bid2xApplication(
-          stored_app['scopes'],
-          stored_app['api_name'],
-          stored_app['api_version'],
-          stored_app['sheet']['sheet_id'],
-          stored_app['json_auth_file'],
-          stored_app['platform_type'].upper(),
-      )
-    else:
-      print('Invalid platform type')
-      return  # Or should this be an immediate exit?
+    app = Bid2xApplication(
+        stored_app['scopes'],
+        stored_app['api_name'],
+        stored_app['api_version'],
+        stored_app['sheet']['sheet_id'],
+        stored_app['json_auth_file'],
+        stored_app['platform_type'].upper(),
+    )
 
     app.start_service()
 
@@ -401,6 +350,8 @@ def create_objects_from_json_file(filename: str) -> Bid2xApplication:
       for zone in stored_app['zone_array']:
 
         if app.platform_type == bid2x_var.PlatformType.DV.value:
+          # pylint: disable-next=g-import-not-at-top
+          from bid2x_model import Bid2xModel
           app.zone_array.append(
               Bid2xModel(
                   zone['name'],
@@ -415,6 +366,8 @@ def create_objects_from_json_file(filename: str) -> Bid2xApplication:
               )
           )
         elif app.platform_type == bid2x_var.PlatformType.GTM.value:
+          # pylint: disable-next=g-import-not-at-top
+          from bid2x_gtm_model import Bid2xGTMModel
           app.zone_array.append(
               Bid2xGTMModel(
                   zone['name'],
@@ -432,13 +385,15 @@ def create_objects_from_json_file(filename: str) -> Bid2xApplication:
     # Finally, update main app with loaded values.
     app.top_level_copy(stored_app)
 
-    if not app.authenticate_service(
-        app.json_auth_file, app.service_account_email, app.platform_type
-    ):
-      print('Failure on auth sub-service')
+    if authenticate:
+      if not app.authenticate_service(
+          app.json_auth_file, app.service_account_email, app.platform_type
+      ):
+        print('Failure on auth sub-service')
 
-    # Re-initialize gc (gspread) object (not saved in JSON).
-    app.sheet.gc = gspread.service_account(filename=app.sheet.json_auth_file)
+      # Re-initialize gc (gspread) object (not saved in JSON).  It shares
+      # the token and pooled connections of the other API clients.
+      app.sheet.gc = app.auth.gspread_client(app.sheet.json_auth_file)
 
   else:
     # This branch is used when NO input file is passed and we need to create
@@ -459,6 +414,11 @@ def create_objects_from_json_file(filename: str) -> Bid2xApplication:
       bid2x_var.ZONES_TO_PROCESS = 'c1,c2,c3,c4,c5'
     zone_list = bid2x_var.ZONES_TO_PROCESS.split(',')
 
+    # pylint: disable=g-import-not-at-top
+    from bid2x_gtm_model import Bid2xGTMModel
+    from bid2x_model import Bid2xModel
+    # pylint: enable=g-import-not-at-top
+
     # Populate the default app with the default number of zones / campaigns.
     i = 1
     for zone in zone_list:
@@ -499,16 +459,43 @@ def create_objects_from_json_file(filename: str) -> Bid2xApplication:
   return app
 
 
-# Walk sys.argv using argparse to process passed arguments.
-# The use of command line arguments is meant for development or for
-# running the system from the command line.
-process_command_line_args()
+# The app object main() runs.  Set by hello_pubsub() when running as a
+# Cloud Function or from the command line arguments below.
+app: 'Bid2xApplication' = None
 
-app: bid2x_application.Bid2xApplication = None
-# Create objects based on passed file.
-app = create_objects_from_json_file(bid2x_var.INPUT_FILE)
+# Apps built by hello_pubsub(), keyed by config filename, each stored with
+# the fingerprint of the config it was built from.
+_app_cache: dict[str, tuple[str, 'Bid2xApplication']] = {}
+_app_cache_locks: dict[str, threading.Lock] = {}
+_app_cache_lock = threading.Lock()
 
 # If our entrypoint is main then run it.  The function hello_pubsub() is
 # the entry point when called through GCP Cloud Functions.
 if __name__ == '__main__':
+  # pylint: disable=g-import-not-at-top
+  from bid2x_args import process_command_line_args
+  from bid2x_env import process_task_environment_vars
+  # pylint: enable=g-import-not-at-top
+
+  # A Cloud Run job's tasks each get their index and the task count from
+  # the environment; command line arguments override them.
+  process_task_environment_vars()
+
+  # Walk sys.argv using argparse to process passed arguments.
+  # The use of command line arguments is meant for development or for
+  # running the system from the command line.
+  process_command_line_args()
+
+  if bid2x_var.PLAN:
+    # A dry run: report the calls a run would make, make none of them.
+    # pylint: disable-next=g-import-not-at-top
+    import bid2x_plan
+    app = create_objects_from_json_file(
+        bid2x_var.INPUT_FILE, authenticate=False
+    )
+    sys.exit(bid2x_plan.run_plan(app, bid2x_var.INPUT_FILE))
+
+  # Create objects based on passed file.
+  app = create_objects_from_json_file(bid2x_var.INPUT_FILE)
+
   main(sys.argv)